@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+"""
+Budgets for the AWS calls each fab task makes. The tasks benchmarked by
+benchmarks.task_benchmark are run against the fake AWS, recording every
+operation they call, and the calls are checked against the budgets stored
+in benchmarks/call_budgets.json:
+
+    {
+        "set_active_stack": {
+            "budget": {"route53": 12, "total": 14},
+            "operations": ["route53 ListHostedZones", "route53 GetHostedZone", ...]
+        }
+    }
+
+A budget limits the total calls of a task, the calls to a service, eg
+'route53', or the calls to an operation, eg 'route53 GetHostedZone'. The
+operations are the calls the task made when the budget was recorded, and
+a task going over its budget is reported with a diff of its calls since.
+Saving records the calls made now as the budgets, keeping the operations
+limited by hand.
+
+    python -m benchmarks.call_budget
+    python -m benchmarks.call_budget --save
+"""
+import argparse
+import difflib
+import json
+import os
+import sys
+
+from benchmarks import task_benchmark
+
+BUDGETS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'call_budgets.json')
+
+
+def record_task_operations(seed=0):
+    """
+    Run the benchmarked tasks against the fake AWS, with a clock that only
+    moves on when the tasks sleep so polling tasks call the same operations
+    however fast they run
+
+    Args:
+        seed(int): Seeds the fake
+
+    Returns:
+        (dict): The operations each task called, in order, eg 'route53 GetHostedZone'
+    """
+    results = task_benchmark.run_profile('fast', seed=seed, realtime=False)
+    return dict((step, results[step]['operations']) for step in task_benchmark.STEPS)
+
+
+def load_budgets(path=BUDGETS_FILE):
+    with open(path) as budgets_file:
+        return json.load(budgets_file)
+
+
+def count_operations(operations):
+    """
+    Count calls the ways a budget can limit them
+
+    Args:
+        operations(list): The operations called, eg 'route53 GetHostedZone'
+
+    Returns:
+        (dict): The number of calls in total, to each service and to each operation
+    """
+    counts = {'total': len(operations)}
+    for operation in operations:
+        service_name = operation.split(' ', 1)[0]
+        counts[service_name] = counts.get(service_name, 0) + 1
+        counts[operation] = counts.get(operation, 0) + 1
+    return counts
+
+
+def make_budget(operations, budget=None):
+    """
+    Make the tightest budget on the total calls and the calls to each service
+
+    Args:
+        operations(list): The operations called
+        budget(dict): A previous budget, the operations it limits are kept
+
+    Returns:
+        (dict): The budget
+    """
+    counts = count_operations(operations)
+    keys = [key for key in counts if ' ' not in key] + [key for key in budget or {} if ' ' in key]
+    return dict((key, counts.get(key, 0)) for key in keys)
+
+
+def check_budget(operations, budget):
+    """
+    Check the operations a task called against its budget
+
+    Args:
+        operations(list): The operations called
+        budget(dict): The maximum calls in total, to a service or to an operation
+
+    Returns:
+        (list): (budget key, limit, calls) tuples of the limits exceeded
+    """
+    counts = count_operations(operations)
+    return [(key, limit, counts.get(key, 0)) for key, limit in sorted(budget.items())
+            if counts.get(key, 0) > limit]
+
+
+def collapse_repeats(operations):
+    """
+    Collapse runs of the same operation, so a polling loop reads as one line
+
+    Returns:
+        (list): The operations, with runs written as 'operation x count'
+    """
+    lines = []
+    previous, count = None, 0
+    for operation in operations + [None]:
+        if operation == previous:
+            count += 1
+            continue
+        if previous is not None:
+            lines.append(previous if count == 1 else '{0} x{1}'.format(previous, count))
+        previous, count = operation, 1
+    return lines
+
+
+def format_budget_failure(task_name, exceeded, baseline_operations, operations):
+    """
+    Describe a task going over its budget
+
+    Args:
+        task_name(string): The name of the task
+        exceeded(list): The limits exceeded, as returned by check_budget
+        baseline_operations(list): The operations called when the budget was recorded
+        operations(list): The operations called now
+
+    Returns:
+        (string): The limits exceeded, and a diff of the operations called
+    """
+    lines = ["{0} exceeded its AWS call budget:".format(task_name)]
+    for key, limit, count in exceeded:
+        lines.append("    {0}: {1} calls, the budget is {2}".format(key, count, limit))
+    lines.append("Calls made, compared with when the budget was recorded:")
+    lines.extend(difflib.unified_diff(collapse_repeats(baseline_operations), collapse_repeats(operations),
+                                      fromfile='budget', tofile=task_name, lineterm=''))
+    return '\n'.join(lines)
+
+
+def assert_within_budget(task_name, operations, budgets):
+    """
+    Assert a task's calls are within its budget
+
+    Args:
+        task_name(string): The name of the task, a key of budgets
+        operations(list): The operations the task called
+        budgets(dict): The budgets of each task
+
+    Raises:
+        AssertionError: The task went over its budget, described with a diff of its calls
+    """
+    exceeded = check_budget(operations, budgets[task_name]['budget'])
+    if exceeded:
+        raise AssertionError(format_budget_failure(task_name, exceeded, budgets[task_name]['operations'],
+                                                   operations))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check the AWS calls of the fab tasks against their budgets")
+    parser.add_argument('--budgets', default=BUDGETS_FILE, help="The budgets file")
+    parser.add_argument('--save', action='store_true',
+                        help="Record the calls made now as the new budgets")
+    parser.add_argument('--seed', type=int, default=0, help="Seeds the fake's ids")
+    args = parser.parse_args(argv)
+
+    task_operations = record_task_operations(seed=args.seed)
+    if args.save:
+        budgets = load_budgets(args.budgets) if os.path.exists(args.budgets) else {}
+        budgets = dict((task_name, {'budget': make_budget(operations, budgets.get(task_name, {}).get('budget')),
+                                    'operations': operations})
+                       for task_name, operations in task_operations.items())
+        with open(args.budgets, 'w') as budgets_file:
+            json.dump(budgets, budgets_file, indent=2, separators=(',', ': '), sort_keys=True)
+            budgets_file.write('\n')
+        print "Saved the budgets to {0}".format(args.budgets)
+        return 0
+
+    budgets = load_budgets(args.budgets)
+    failed = False
+    for task_name in task_benchmark.STEPS:
+        operations = task_operations[task_name]
+        try:
+            assert_within_budget(task_name, operations, budgets)
+        except AssertionError as e:
+            failed = True
+            print str(e)
+            continue
+        print "{0}: {1} calls, within budget".format(task_name, len(operations))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
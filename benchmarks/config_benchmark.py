@@ -0,0 +1,345 @@
+#!/usr/bin/env python
+"""
+Benchmark how ConfigParser.process scales with the size of the project
+config. Synthetic project YAML is generated for each scale, then loaded and
+processed a number of times, timing the loading, each section generator and
+the serialization, and measuring the peak memory of the process. The results
+are compared against a stored baseline.
+
+Runs offline, the AWS lookup of a free VPC CIDR block is stubbed out.
+
+    python -m benchmarks.config_benchmark
+    python -m benchmarks.config_benchmark --scales large --repeat 5
+    python -m benchmarks.config_benchmark --save-baseline
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+import mock
+
+import yaml
+
+from bootstrap_cfn.config import ConfigParser, ProjectConfig
+from bootstrap_cfn.tracing import Tracer
+
+# The size of the synthetic config at each scale
+SCALES = {
+    'small': {'elbs': 1, 'security_group_rules': 10, 'buckets': 1, 'include_resources': 10},
+    'medium': {'elbs': 10, 'security_group_rules': 100, 'buckets': 20, 'include_resources': 200},
+    'large': {'elbs': 50, 'security_group_rules': 500, 'buckets': 100, 'include_resources': 2000},
+}
+SCALE_ORDER = ['small', 'medium', 'large']
+
+# The sections timed, as traced by ConfigParser.process
+SECTIONS = ['load config', 'base_template', 'vpc', 'iam', 'ec2', 'elb', 'rds', 'elasticache', 's3', 'render']
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config_baseline.json')
+
+# The free VPC CIDR block and subnets returned by the stubbed lookup
+STUB_CIDR_BLOCK = ('10.0.0.0/24', ['10.0.0.0/28', '10.0.0.16/28', '10.0.0.32/28'])
+
+
+def generate_project_config(elbs, security_group_rules, buckets, include_path=None):
+    """
+    Generate a synthetic project config
+
+    Args:
+        elbs(int): The number of load balancers
+        security_group_rules(int): The number of ingress rules, spread
+            over ten security groups
+        buckets(int): The number of s3 buckets on top of the static bucket
+        include_path(string): The path of a template to include
+
+    Returns:
+        (dict): The project config, keyed by environment name
+    """
+    security_groups = {}
+    for index in range(security_group_rules):
+        rules = security_groups.setdefault('BenchSG{0}'.format(index % 10), [])
+        rules.append({
+            'IpProtocol': 'tcp',
+            'FromPort': 1000 + index,
+            'ToPort': 1000 + index,
+            'CidrIp': '10.{0}.{1}.0/24'.format(index // 256, index % 256),
+        })
+    config = {
+        'ec2': {
+            'auto_scaling': {'desired': 2, 'max': 4, 'min': 1},
+            'tags': {'Role': 'benchmark', 'Env': 'bench'},
+            'parameters': {'KeyName': 'default', 'InstanceType': 't2.micro'},
+            'block_devices': [{'DeviceName': '/dev/sda1', 'VolumeSize': 10}],
+            'security_groups': security_groups,
+        },
+        'elb': [{
+            'name': 'bench-elb-{0}'.format(index),
+            'hosted_zone': 'bench.example.com.',
+            'scheme': 'internet-facing' if index % 2 else 'internal',
+            'listeners': [
+                {'LoadBalancerPort': 80, 'InstancePort': 80, 'Protocol': 'TCP'},
+                {'LoadBalancerPort': 443, 'InstancePort': 443, 'Protocol': 'TCP'},
+            ],
+            'health_check': {
+                'HealthyThreshold': 10,
+                'Interval': 2,
+                'Target': 'HTTP:80/ping',
+                'Timeout': 1,
+                'UnhealthyThreshold': 2,
+            },
+        } for index in range(elbs)],
+        's3': {
+            'static-bucket-name': 'bench-static',
+            'buckets': [{'name': 'BenchBucket{0}'.format(index)} for index in range(buckets)],
+        },
+        'rds': {
+            'storage': 5,
+            'storage-type': 'gp2',
+            'backup-retention-period': 1,
+            'identifier': 'bench',
+            'db-name': 'bench',
+            'db-master-username': 'benchuser',
+            'db-master-password': 'benchpassword',
+            'instance-class': 'db.t2.micro',
+            'multi-az': False,
+            'db-engine': 'postgres',
+            'db-engine-version': '9.3.5',
+        },
+        'elasticache': {
+            'clusters': 3,
+            'node_type': 'cache.m1.small',
+            'port': 6379,
+        },
+    }
+    if include_path:
+        config['includes'] = [include_path]
+    return {'bench': config}
+
+
+def generate_include(resources):
+    """
+    Generate a synthetic template to include, of SNS topics and their outputs
+
+    Args:
+        resources(int): The number of resources
+
+    Returns:
+        (dict): The template
+    """
+    return {
+        'Resources': dict(('BenchTopic{0}'.format(index),
+                           {'Type': 'AWS::SNS::Topic', 'Properties': {'TopicName': 'bench-topic-{0}'.format(index)}})
+                          for index in range(resources)),
+        'Outputs': dict(('BenchTopic{0}Arn'.format(index),
+                         {'Description': 'Benchmark topic', 'Value': {'Ref': 'BenchTopic{0}'.format(index)}})
+                        for index in range(resources)),
+    }
+
+
+def write_scale_files(directory, scale):
+    """
+    Write the synthetic project YAML and include of a scale
+
+    Args:
+        directory(string): The directory to write to
+        scale(string): The name of the scale, a key of SCALES
+
+    Returns:
+        (string): The path of the project YAML
+    """
+    sizes = SCALES[scale]
+    include_path = os.path.join(directory, '{0}-include.json'.format(scale))
+    with open(include_path, 'w') as include_file:
+        json.dump(generate_include(sizes['include_resources']), include_file)
+    config_path = os.path.join(directory, '{0}.yaml'.format(scale))
+    with open(config_path, 'w') as config_file:
+        yaml.safe_dump(generate_project_config(sizes['elbs'], sizes['security_group_rules'],
+                                               sizes['buckets'], include_path),
+                       config_file, default_flow_style=False)
+    return config_path
+
+
+def run_once(config_path):
+    """
+    Load and process a project config once
+
+    Returns:
+        (dict): The seconds spent in each section, and the template size in bytes
+    """
+    tracer = Tracer()
+    tracer.start()
+    with mock.patch('bootstrap_cfn.config.TRACER', tracer), \
+            mock.patch('bootstrap_cfn.vpc.get_available_cidr_block', return_value=STUB_CIDR_BLOCK):
+        with tracer.span('load config'):
+            config = ProjectConfig(config_path, 'bench').config
+        template = ConfigParser(config, 'bench-stack-abcd1234', environment='bench',
+                                application='bench').process()
+    timings = dict((section, 0.0) for section in SECTIONS)
+    for event in tracer.events:
+        if event['name'] in timings:
+            timings[event['name']] += event['dur'] / 1000000.0
+    timings['template_bytes'] = len(template)
+    return timings
+
+
+def run_scale(config_path, repeat, results):
+    """
+    Benchmark a scale, meant to run in its own process so the peak memory
+    is that of the scale alone
+
+    Args:
+        config_path(string): The path of the project YAML
+        repeat(int): The number of times to process the config
+        results(multiprocessing.Queue): Where to put the result
+    """
+    # Keep the config warnings and notices out of the results
+    logging.disable(logging.WARNING)
+    sys.stdout = open(os.devnull, 'w')
+    runs = [run_once(config_path) for _ in range(repeat)]
+    result = {}
+    for section in SECTIONS:
+        result[section] = median([run[section] for run in runs])
+    result['total'] = sum(result[section] for section in SECTIONS)
+    result['template_bytes'] = runs[-1]['template_bytes']
+    # Kilobytes on Linux
+    result['peak_memory_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results.put(result)
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def run_benchmarks(scales, repeat=3):
+    """
+    Benchmark ConfigParser.process at a number of scales
+
+    Args:
+        scales(list): The names of the scales to run
+        repeat(int): The number of times to process each config, the
+            median time of each section is kept
+
+    Returns:
+        (dict): The results of each scale
+    """
+    directory = tempfile.mkdtemp(prefix='bootstrap-cfn-benchmark-')
+    try:
+        results = {}
+        for scale in scales:
+            config_path = write_scale_files(directory, scale)
+            queue = multiprocessing.Queue()
+            process = multiprocessing.Process(target=run_scale, args=(config_path, repeat, queue))
+            process.start()
+            results[scale] = queue.get()
+            process.join()
+        return results
+    finally:
+        shutil.rmtree(directory)
+
+
+def compare(results, baseline, tolerance=0.5, min_seconds=0.005):
+    """
+    Compare benchmark results with a baseline
+
+    Args:
+        results(dict): The results of each scale
+        baseline(dict): The baseline results of each scale
+        tolerance(float): The fraction a measure can grow by before it
+            counts as a regression
+        min_seconds(float): Timings shorter than this in both the results
+            and baseline are too noisy to compare
+
+    Returns:
+        (list): (scale, measure, baseline value, value) tuples of the regressions
+    """
+    regressions = []
+    for scale in sorted(results):
+        if scale not in baseline:
+            continue
+        for measure in SECTIONS + ['total', 'peak_memory_kb']:
+            value = results[scale].get(measure)
+            baseline_value = baseline[scale].get(measure)
+            if value is None or baseline_value is None:
+                continue
+            if measure != 'peak_memory_kb' and max(value, baseline_value) < min_seconds:
+                continue
+            if value > baseline_value * (1 + tolerance):
+                regressions.append((scale, measure, baseline_value, value))
+    return regressions
+
+
+def format_results(results, baseline=None):
+    """
+    Returns:
+        (string): A table of the milliseconds spent in each section at each scale,
+            with the baseline in brackets
+    """
+    lines = []
+    for scale in [scale for scale in SCALE_ORDER if scale in results]:
+        lines.append("{0} {1}".format(scale, json.dumps(SCALES[scale], sort_keys=True)))
+        for measure in SECTIONS + ['total', 'peak_memory_kb', 'template_bytes']:
+            value = results[scale][measure]
+            baseline_value = (baseline or {}).get(scale, {}).get(measure)
+            if measure in SECTIONS + ['total']:
+                text = "{0:10.1f} ms".format(1000 * value)
+                if baseline_value is not None:
+                    text += "  ({0:.1f} ms)".format(1000 * baseline_value)
+            else:
+                text = "{0:10d}".format(value)
+                if baseline_value is not None:
+                    text += "     ({0})".format(baseline_value)
+            lines.append("    {0:<16}{1}".format(measure, text))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark ConfigParser.process")
+    parser.add_argument('--scales', default=','.join(SCALE_ORDER),
+                        help="Comma separated scales to run, of {0}".format(', '.join(SCALE_ORDER)))
+    parser.add_argument('--repeat', type=int, default=3, help="Runs of each scale, the median is kept")
+    parser.add_argument('--baseline', default=BASELINE_FILE, help="The baseline file")
+    parser.add_argument('--save-baseline', action='store_true', help="Save the results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=0.5,
+                        help="The fraction a measure can grow by over the baseline")
+    args = parser.parse_args(argv)
+
+    scales = [scale for scale in args.scales.split(',') if scale]
+    unknown_scales = [scale for scale in scales if scale not in SCALES]
+    if unknown_scales:
+        parser.error("Unknown scales {0}".format(', '.join(unknown_scales)))
+
+    start_time = time.time()
+    results = run_benchmarks(scales, repeat=args.repeat)
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+    print format_results(results, baseline)
+    print "Benchmarked in {0:.1f}s".format(time.time() - start_time)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(dict(baseline or {}, **results), baseline_file, indent=2, sort_keys=True)
+        print "Saved the baseline to {0}".format(args.baseline)
+        return 0
+    if baseline is None:
+        print "No baseline at {0} to compare with".format(args.baseline)
+        return 0
+    regressions = compare(results, baseline, tolerance=args.tolerance)
+    for scale, measure, baseline_value, value in regressions:
+        print "REGRESSION {0} {1}: {2} over the baseline {3}".format(scale, measure, value, baseline_value)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
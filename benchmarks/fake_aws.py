@@ -0,0 +1,1750 @@
+"""
+An in-process stand-in for the AWS services bootstrap-cfn talks to, so fab
+tasks can be run and benchmarked end to end without network access.
+
+The fake implements the CloudFormation, Route53, ELB, IAM, AutoScaling and
+EC2 operations the project uses, for both the boto connections and the boto3
+clients. Calls go through the real boto3 clients, and through our rate
+limiting, retry and accounting instrumentation, only the HTTP round trip is
+replaced. Each call can be given a latency, requests can be throttled by a
+per-service rate or at random, and newly created certificates and peering
+connections can take a while to become visible, as they do on AWS.
+
+Time is simulated. Inside FakeAWS.patch time.time and time.sleep run on a
+FakeClock, so sleeps return straight away while the time reported moves on
+by the seconds slept. A task waiting twenty minutes for a stack finishes in
+well under a second, and reports the twenty minutes.
+
+    fake_aws = FakeAWS(latency=0.1, consistency_delay=5)
+    fake_aws.add_hosted_zone('example.com.')
+    with fake_aws.patch():
+        fab_tasks.cfn_create()
+    print len(fake_aws.calls)
+"""
+import datetime
+import httplib
+import json
+import random
+import re
+import threading
+import time
+import urllib
+import urlparse
+import weakref
+from contextlib import contextmanager
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+import boto.connection
+import boto.ec2.elb.listener
+import boto.route53.record
+from boto.exception import BotoServerError
+from boto.route53.exception import DNSServerError
+
+import boto3.session
+
+import mock
+
+from bootstrap_cfn import cloudformation, utils
+from bootstrap_cfn.autoscale import AUTOSCALING_GROUP_NAMES
+from bootstrap_cfn.r53 import R53
+from bootstrap_cfn.ratelimit import RATE_LIMITER, TokenBucket
+
+ACCOUNT_ID = '123456789012'
+
+# The error code each service returns for throttled requests
+THROTTLING_ERROR_CODES = {
+    'ec2': 'RequestLimitExceeded',
+    'route53': 'Throttling',
+}
+
+# The order the fake creates the resources of a stack in, so the resources
+# other resources are attached to exist first. Other types come last.
+RESOURCE_TYPE_ORDER = [
+    'AWS::EC2::VPC',
+    'AWS::EC2::InternetGateway',
+    'AWS::EC2::VPCGatewayAttachment',
+    'AWS::EC2::Subnet',
+    'AWS::EC2::RouteTable',
+    'AWS::EC2::Route',
+    'AWS::EC2::SubnetRouteTableAssociation',
+    'AWS::EC2::SecurityGroup',
+    'AWS::EC2::SecurityGroupIngress',
+    'AWS::IAM::Role',
+    'AWS::IAM::Policy',
+    'AWS::IAM::InstanceProfile',
+    'AWS::ElasticLoadBalancing::LoadBalancer',
+    'AWS::AutoScaling::LaunchConfiguration',
+    'AWS::AutoScaling::AutoScalingGroup',
+    'AWS::Route53::RecordSetGroup',
+]
+
+# The prefixes of the physical ids of EC2 resources
+EC2_ID_PREFIXES = {
+    'AWS::EC2::VPC': 'vpc',
+    'AWS::EC2::Subnet': 'subnet',
+    'AWS::EC2::InternetGateway': 'igw',
+    'AWS::EC2::RouteTable': 'rtb',
+    'AWS::EC2::SecurityGroup': 'sg',
+}
+
+# The handlers of each (service, operation), see handles
+HANDLERS = {}
+
+
+def handles(service_name, operation_name):
+    """
+    Register a FakeAWS method as the handler of an operation. Handlers take
+    the parameters of the call as the boto3 client would send them, and
+    return the result as the boto3 client would parse it.
+    """
+    def decorate(func):
+        HANDLERS[(service_name, operation_name)] = func
+        return func
+    return decorate
+
+
+class FakeAWSError(Exception):
+    """
+    An error response from the fake
+    """
+
+    def __init__(self, code, message, status=400):
+        super(FakeAWSError, self).__init__("{0}: {1}".format(code, message))
+        self.code = code
+        self.message = message
+        self.status = status
+
+    @property
+    def reason(self):
+        return httplib.responses.get(self.status, 'Error')
+
+    def to_xml(self):
+        return ("<ErrorResponse><Error><Type>Sender</Type><Code>{0}</Code><Message>{1}</Message></Error>"
+                "<RequestId>fake</RequestId></ErrorResponse>".format(escape(self.code), escape(self.message)))
+
+    def to_dict(self):
+        return {
+            'Error': {'Code': self.code, 'Message': self.message},
+            'ResponseMetadata': {'HTTPStatusCode': self.status, 'RequestId': 'fake'},
+        }
+
+
+class FakeClock(object):
+    """
+    A simulated clock. Sleeping moves the clock of the sleeping thread on
+    without waiting, while code runs in real time. Each thread keeps its
+    own time, starting from the time of the thread that started it, and
+    a thread joining another catches up with it, so threads sleeping
+    alongside each other overlap as they would.
+    """
+
+    def __init__(self, realtime=True):
+        """
+        Args:
+            realtime(bool): False to only move the clock on by sleeps, so
+                polling code makes the same calls however fast it runs
+        """
+        self.realtime = realtime
+        self.real_time = time.time
+        self.real_sleep = time.sleep
+        self.real_thread_start = threading.Thread.start
+        self.real_thread_join = threading.Thread.join
+        self.start_time = self.real_time()
+        self.lock = threading.Lock()
+        # thread: the seconds it has slept
+        self.offsets = weakref.WeakKeyDictionary()
+
+    def get_offset(self, thread=None):
+        with self.lock:
+            return self.offsets.get(thread or threading.current_thread(), 0.0)
+
+    def set_offset(self, offset, thread=None):
+        with self.lock:
+            self.offsets[thread or threading.current_thread()] = offset
+
+    def time(self):
+        if self.realtime:
+            return self.real_time() + self.get_offset()
+        return self.start_time + self.get_offset()
+
+    def sleep(self, seconds):
+        self.set_offset(self.get_offset() + max(seconds, 0))
+        # Still let the other threads run
+        self.real_sleep(0)
+
+    def elapsed(self):
+        """
+        Returns:
+            (float): The simulated seconds since the clock was created
+        """
+        return self.time() - self.start_time
+
+    @contextmanager
+    def patch(self):
+        """
+        Run time.time and time.sleep, and the threads started, on this clock
+        """
+        clock = self
+
+        def start(thread):
+            clock.set_offset(clock.get_offset(), thread)
+            return clock.real_thread_start(thread)
+
+        def join(thread, timeout=None):
+            clock.real_thread_join(thread, timeout)
+            if not thread.is_alive():
+                clock.set_offset(max(clock.get_offset(), clock.get_offset(thread)))
+
+        with mock.patch('time.time', self.time), mock.patch('time.sleep', self.sleep), \
+                mock.patch.object(threading.Thread, 'start', start), \
+                mock.patch.object(threading.Thread, 'join', join):
+            yield self
+
+
+class FakeAWS(object):
+    """
+    The state of a fake AWS account in a single region, and the handlers of
+    the operations bootstrap-cfn calls. Every call is recorded in calls.
+    """
+
+    def __init__(self,
+                 region='eu-west-1',
+                 latency=0,
+                 latencies=None,
+                 request_rates=None,
+                 throttle_probability=0,
+                 consistency_delay=0,
+                 stack_create_seconds=120,
+                 stack_delete_seconds=60,
+                 instance_launch_seconds=60,
+                 instance_terminate_seconds=30,
+                 peering_provision_seconds=2,
+                 realtime=True,
+                 seed=None):
+        """
+        Args:
+            region(string): The region of the account
+            latency(float): The seconds each call takes
+            latencies(dict): The seconds calls take by service name, or by
+                (service name, operation name), overriding latency
+            request_rates(dict): The requests per second each service allows
+                before throttling, by service name
+            throttle_probability(float): The chance of any call being throttled
+            consistency_delay(float): The seconds before newly uploaded
+                certificates and created peering connections are visible, and
+                certificates taken off a load balancer can be deleted
+            stack_create_seconds(float): The seconds a stack takes to create
+            stack_delete_seconds(float): The seconds a stack takes to delete
+            instance_launch_seconds(float): The seconds before a launched
+                instance is in service
+            instance_terminate_seconds(float): The seconds an instance takes
+                to terminate
+            peering_provision_seconds(float): The seconds an accepted peering
+                connection takes to become active
+            realtime(bool): False for the simulated clock to only move on
+                by sleeps, see FakeClock
+            seed(int): Seeds the random ids and throttling
+        """
+        self.region = region
+        self.latency = latency
+        self.latencies = dict(latencies or {})
+        self.request_buckets = dict((service_name, TokenBucket(rate))
+                                    for service_name, rate in (request_rates or {}).items())
+        self.throttle_probability = throttle_probability
+        self.consistency_delay = consistency_delay
+        self.stack_create_seconds = stack_create_seconds
+        self.stack_delete_seconds = stack_delete_seconds
+        self.instance_launch_seconds = instance_launch_seconds
+        self.instance_terminate_seconds = instance_terminate_seconds
+        self.peering_provision_seconds = peering_provision_seconds
+        self.clock = FakeClock(realtime)
+        self.random = random.Random(seed)
+        self.lock = threading.RLock()
+        # (service_name, operation_name, error_code) of every call made
+        self.calls = []
+        # The lists of calls being recorded, see recording
+        self.recordings = []
+
+        self.stacks = []
+        self.hosted_zones = {}
+        # zone id: {(name, type, set identifier): resource record set}
+        self.records = {}
+        self.load_balancers = {}
+        # name: {'metadata', 'body', 'chain', 'visible_at'}
+        self.certificates = {}
+        # certificate arn: the time it was taken off its last load balancer
+        self.certificates_released = {}
+        self.groups = {}
+        # instance id: the time it is in service or terminated by
+        self.instance_timers = {}
+        self.vpcs = {}
+        self.route_tables = {}
+        self.peering_connections = {}
+        # peering connection id: (visible_at, active_at)
+        self.peering_timers = {}
+
+    # Calls
+
+    def call(self, service_name, operation_name, params):
+        """
+        Make a call to the fake, taking the latency set for the operation
+
+        Args:
+            service_name(string): The boto3 endpoint prefix of the service, eg 'elasticloadbalancing'
+            operation_name(string): The name of the operation, eg 'DescribeLoadBalancers'
+            params(dict): The parameters of the call, as the boto3 client takes them
+
+        Returns:
+            (dict): The result, as the boto3 client returns it
+
+        Raises:
+            FakeAWSError: The call failed
+        """
+        latency = self.latencies.get((service_name, operation_name),
+                                     self.latencies.get(service_name, self.latency))
+        if latency:
+            time.sleep(latency)
+        with self.lock:
+            try:
+                self.refresh()
+                if self.is_throttled(service_name):
+                    raise FakeAWSError(THROTTLING_ERROR_CODES.get(service_name, 'Throttling'), 'Rate exceeded')
+                handler = HANDLERS.get((service_name, operation_name))
+                if handler is None:
+                    raise FakeAWSError('InvalidAction', "{0} {1} is not implemented by the fake"
+                                       .format(service_name, operation_name))
+                result = json.loads(json.dumps(handler(self, params or {}), default=str))
+            except FakeAWSError as e:
+                self.record_call((service_name, operation_name, e.code))
+                raise
+            self.record_call((service_name, operation_name, None))
+            return result
+
+    def record_call(self, call):
+        self.calls.append(call)
+        for recording in self.recordings:
+            recording.append(call)
+
+    @contextmanager
+    def recording(self):
+        """
+        Record the calls made within the context, eg by a single task
+
+            with fake_aws.recording() as calls:
+                fab_tasks.set_active_stack('blue')
+
+        Yields:
+            (list): The (service_name, operation_name, error_code) of each
+                call, filled in as they are made
+        """
+        calls = []
+        with self.lock:
+            self.recordings.append(calls)
+        try:
+            yield calls
+        finally:
+            with self.lock:
+                self.recordings.remove(calls)
+
+    def is_throttled(self, service_name):
+        bucket = self.request_buckets.get(service_name)
+        if bucket and not bucket.try_acquire():
+            return True
+        return self.throttle_probability > 0 and self.random.random() < self.throttle_probability
+
+    def get_call_counts(self):
+        """
+        Returns:
+            (dict): The number of calls made to each service
+        """
+        counts = {}
+        with self.lock:
+            for service_name, _, _ in self.calls:
+                counts[service_name] = counts.get(service_name, 0) + 1
+        return counts
+
+    def boto3_response(self, service_name, operation_model, params):
+        """
+        Make a call for a boto3 client, in place of the HTTP round trip
+
+        Returns:
+            The (success_response, exception) tuple of Endpoint._get_response
+        """
+        try:
+            parsed = self.call(service_name, operation_model.name, params)
+            parsed['ResponseMetadata'] = {'HTTPStatusCode': 200, 'RequestId': 'fake'}
+            status = 200
+        except FakeAWSError as e:
+            parsed = e.to_dict()
+            status = e.status
+        http_response = mock.Mock(status_code=status,
+                                  headers={'content-length': str(len(json.dumps(parsed, default=str)))},
+                                  content='')
+        return (http_response, parsed), None
+
+    def boto_response(self, service_name, operation_name, params):
+        """
+        Make a call for a boto connection, in place of the HTTP round trip
+
+        Returns:
+            (FakeBotoResponse): The response
+        """
+        try:
+            result = self.call(service_name, operation_name, params)
+        except FakeAWSError as e:
+            return FakeBotoResponse(e.status, e.reason, e.to_xml())
+        return FakeBotoResponse(200, 'OK', json.dumps(result), result)
+
+    # Patching
+
+    @contextmanager
+    def patch(self):
+        """
+        Point every boto connection and boto3 client bootstrap-cfn creates at
+        this fake, and run time.time and time.sleep on the simulated clock
+        """
+        # Tasks get their sessions instrumented, boto3.client and
+        # boto3.resource use the default session as they would normally
+        task_session = utils.instrument_boto3_session(FakeSession(self))
+        default_session = FakeSession(self)
+        patchers = [
+            mock.patch('bootstrap_cfn.utils.connect_to_aws', self.connect_to_aws),
+            mock.patch('bootstrap_cfn.utils.get_boto3_session', lambda instance: task_session),
+            mock.patch('boto3.DEFAULT_SESSION', default_session),
+            # The token buckets would otherwise be left with refill
+            # times in the simulated future
+            mock.patch.object(RATE_LIMITER, 'buckets', {}),
+        ]
+        cloudformation.clear_caches()
+        AUTOSCALING_GROUP_NAMES.clear()
+        with self.clock.patch():
+            for patcher in patchers:
+                patcher.start()
+            try:
+                yield self
+            finally:
+                for patcher in reversed(patchers):
+                    patcher.stop()
+                cloudformation.clear_caches()
+                AUTOSCALING_GROUP_NAMES.clear()
+
+    def connect_to_aws(self, module, instance):
+        """
+        Stands in for utils.connect_to_aws
+        """
+        connection_class = FAKE_BOTO_CONNECTIONS.get(module.__name__)
+        if connection_class is None:
+            raise NotImplementedError("The fake has no {0} connection".format(module.__name__))
+        return utils.instrument_boto_connection(connection_class(self), utils.get_boto_service_name(module))
+
+    # State
+
+    def now(self):
+        return time.time()
+
+    def timestamp(self, when=None):
+        return datetime.datetime.utcfromtimestamp(self.now() if when is None else when)
+
+    def new_id(self, prefix, length=8):
+        return '{0}-{1:0{2}x}'.format(prefix, self.random.getrandbits(4 * length), length)
+
+    def new_name(self, stack_name, logical_id):
+        suffix = ''.join(self.random.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789') for _ in range(12))
+        return '{0}-{1}-{2}'.format(stack_name, logical_id, suffix)
+
+    def refresh(self):
+        """
+        Move every stack, autoscaling group and peering connection on to
+        where it would be by now
+        """
+        now = self.now()
+        for stack in self.stacks:
+            self.refresh_stack(stack, now)
+        for group in self.groups.values():
+            self.refresh_group(group, now)
+        for peering_id, (visible_at, active_at) in self.peering_timers.items():
+            status = self.peering_connections[peering_id]['Status']
+            if active_at is not None and now >= active_at and status['Code'] == 'provisioning':
+                status.update({'Code': 'active', 'Message': 'Active'})
+
+    def add_hosted_zone(self, name):
+        """
+        Add a hosted zone to the account
+
+        Args:
+            name(string): The name of the zone, eg 'example.com.'
+
+        Returns:
+            (string): The zone id
+        """
+        with self.lock:
+            name = normalize_dns_name(name)
+            zone_id = 'Z' + self.new_id('', 13)[1:].upper()
+            self.hosted_zones[zone_id] = {
+                'Id': '/hostedzone/{0}'.format(zone_id),
+                'Name': name,
+                'CallerReference': zone_id,
+                'Config': {'PrivateZone': False},
+                'ResourceRecordSetCount': 2,
+            }
+            self.records[zone_id] = {}
+            return zone_id
+
+    def get_hosted_zone(self, zone_id):
+        zone_id = zone_id.split('/')[-1]
+        if zone_id not in self.hosted_zones:
+            raise FakeAWSError('NoSuchHostedZone', "No hosted zone found with ID: {0}".format(zone_id), 404)
+        return zone_id
+
+    def find_hosted_zone(self, name):
+        name = normalize_dns_name(name)
+        for zone_id, zone in self.hosted_zones.items():
+            if zone['Name'] == name:
+                return zone_id
+        raise FakeAWSError('NoSuchHostedZone', "No hosted zone found with name: {0}".format(name), 404)
+
+    # CloudFormation
+
+    def find_stack(self, stack_name_or_id, include_deleted=False):
+        for stack in reversed(self.stacks):
+            if stack['StackId'] == stack_name_or_id:
+                return stack
+            if (stack['StackName'] == stack_name_or_id and
+                    (include_deleted or stack['StackStatus'] != 'DELETE_COMPLETE')):
+                return stack
+        return None
+
+    def get_stack(self, stack_name_or_id):
+        stack = self.find_stack(stack_name_or_id)
+        if stack is None:
+            raise FakeAWSError('ValidationError', "Stack with id {0} does not exist".format(stack_name_or_id))
+        return stack
+
+    @handles('cloudformation', 'CreateStack')
+    def create_stack(self, params):
+        stack_name = params['StackName']
+        if self.find_stack(stack_name):
+            raise FakeAWSError('AlreadyExistsException', "Stack [{0}] already exists".format(stack_name))
+        try:
+            template = json.loads(params['TemplateBody'])
+        except (KeyError, ValueError):
+            raise FakeAWSError('ValidationError', "Template format error: JSON not well-formed")
+        stack_id = 'arn:aws:cloudformation:{0}:{1}:stack/{2}/{3}'.format(
+            self.region, ACCOUNT_ID, stack_name, self.new_id('', 32)[1:])
+        now = self.now()
+        stack = {
+            'StackId': stack_id,
+            'StackName': stack_name,
+            'StackStatus': 'CREATE_IN_PROGRESS',
+            'CreationTime': self.timestamp(now),
+            'Parameters': params.get('Parameters', []),
+            'Tags': params.get('Tags', []),
+            'Capabilities': params.get('Capabilities', []),
+            'Outputs': [],
+            'template': template,
+            'events': [],
+            'resources': [],
+            'scheduled': [],
+        }
+        self.stacks.append(stack)
+        self.add_stack_event(stack, now, stack_name, 'AWS::CloudFormation::Stack', stack_id,
+                             'CREATE_IN_PROGRESS', 'User Initiated')
+
+        # Physical ids are all assigned up front, so references resolve
+        # whatever order the resources are created in
+        stack['context'] = self.get_template_context(stack)
+        logical_ids = sorted(template.get('Resources', {}),
+                             key=lambda logical_id: (get_type_order(template['Resources'][logical_id]['Type']),
+                                                     logical_id))
+        step = self.stack_create_seconds / float(len(logical_ids) + 1)
+        for index, logical_id in enumerate(logical_ids):
+            resource = {
+                'LogicalResourceId': logical_id,
+                'PhysicalResourceId': stack['context']['refs'][logical_id],
+                'ResourceType': template['Resources'][logical_id]['Type'],
+                'ResourceStatus': None,
+            }
+            stack['resources'].append(resource)
+            stack['scheduled'].append((now + index * step, resource, 'CREATE_IN_PROGRESS'))
+            stack['scheduled'].append((now + (index + 1) * step, resource, 'CREATE_COMPLETE'))
+        stack['scheduled'].append((now + self.stack_create_seconds, None, 'CREATE_COMPLETE'))
+        return {'StackId': stack_id}
+
+    @handles('cloudformation', 'DeleteStack')
+    def delete_stack(self, params):
+        stack = self.find_stack(params['StackName'])
+        if stack is None or stack['StackStatus'].startswith('DELETE'):
+            return {}
+        now = self.now()
+        stack['StackStatus'] = 'DELETE_IN_PROGRESS'
+        self.add_stack_event(stack, now, stack['StackName'], 'AWS::CloudFormation::Stack', stack['StackId'],
+                             'DELETE_IN_PROGRESS', 'User Initiated')
+        resources = [resource for resource in reversed(stack['resources']) if resource['ResourceStatus']]
+        step = self.stack_delete_seconds / float(len(resources) + 1)
+        stack['scheduled'] = []
+        for index, resource in enumerate(resources):
+            stack['scheduled'].append((now + index * step, resource, 'DELETE_IN_PROGRESS'))
+            stack['scheduled'].append((now + (index + 1) * step, resource, 'DELETE_COMPLETE'))
+        stack['scheduled'].append((now + self.stack_delete_seconds, None, 'DELETE_COMPLETE'))
+        return {}
+
+    @handles('cloudformation', 'DescribeStacks')
+    def describe_stacks(self, params):
+        if params.get('StackName'):
+            stacks = [self.get_stack(params['StackName'])]
+        else:
+            stacks = [stack for stack in self.stacks if stack['StackStatus'] != 'DELETE_COMPLETE']
+        return {'Stacks': [dict((key, value) for key, value in stack.items() if key[0].isupper())
+                           for stack in stacks]}
+
+    @handles('cloudformation', 'DescribeStackEvents')
+    def describe_stack_events(self, params):
+        stack = self.get_stack(params['StackName'])
+        return paginate(list(reversed(stack['events'])), 'StackEvents', params.get('NextToken'), 100)
+
+    @handles('cloudformation', 'ListStacks')
+    def list_stacks(self, params):
+        statuses = params.get('StackStatusFilter')
+        summaries = [{
+            'StackId': stack['StackId'],
+            'StackName': stack['StackName'],
+            'StackStatus': stack['StackStatus'],
+            'CreationTime': stack['CreationTime'],
+        } for stack in self.stacks if not statuses or stack['StackStatus'] in statuses]
+        return paginate(summaries, 'StackSummaries', params.get('NextToken'), 100)
+
+    @handles('cloudformation', 'ListStackResources')
+    def list_stack_resources(self, params):
+        stack = self.find_stack(params['StackName'], include_deleted=True)
+        if stack is None:
+            raise FakeAWSError('ValidationError', "Stack with id {0} does not exist".format(params['StackName']))
+        summaries = [dict(resource, LastUpdatedTimestamp=resource['updated'])
+                     for resource in stack['resources'] if resource['ResourceStatus']]
+        for summary in summaries:
+            del summary['updated']
+        return paginate(summaries, 'StackResourceSummaries', params.get('NextToken'), 100)
+
+    def add_stack_event(self, stack, when, logical_id, resource_type, physical_id, status, reason=None):
+        stack['events'].append({
+            'StackId': stack['StackId'],
+            'StackName': stack['StackName'],
+            'EventId': self.new_id('event', 12),
+            'LogicalResourceId': logical_id,
+            'PhysicalResourceId': physical_id,
+            'ResourceType': resource_type,
+            'ResourceStatus': status,
+            'ResourceStatusReason': reason,
+            'Timestamp': self.timestamp(when),
+        })
+
+    def refresh_stack(self, stack, now):
+        while stack['scheduled'] and stack['scheduled'][0][0] <= now:
+            when, resource, status = stack['scheduled'].pop(0)
+            if resource is None:
+                stack['StackStatus'] = status
+                if status == 'CREATE_COMPLETE':
+                    stack['Outputs'] = [
+                        {'OutputKey': key, 'OutputValue': self.resolve(output.get('Value'), stack['context']),
+                         'Description': output.get('Description')}
+                        for key, output in sorted(stack['template'].get('Outputs', {}).items())]
+                self.add_stack_event(stack, when, stack['StackName'], 'AWS::CloudFormation::Stack',
+                                     stack['StackId'], status)
+                continue
+            if status == 'CREATE_COMPLETE':
+                self.create_resource(stack, resource)
+            elif status == 'DELETE_COMPLETE':
+                self.delete_resource(stack, resource)
+            resource['ResourceStatus'] = status
+            resource['updated'] = self.timestamp(when)
+            self.add_stack_event(stack, when, resource['LogicalResourceId'], resource['ResourceType'],
+                                 resource['PhysicalResourceId'], status)
+
+    def get_template_context(self, stack):
+        """
+        Assign the physical ids of a stacks resources, and the attributes
+        of them the templates refer to
+        """
+        template = stack['template']
+        context = {
+            'refs': {
+                'AWS::StackId': stack['StackId'],
+                'AWS::StackName': stack['StackName'],
+                'AWS::Region': self.region,
+                'AWS::AccountId': ACCOUNT_ID,
+                'AWS::NoValue': None,
+            },
+            'attributes': {},
+            'mappings': template.get('Mappings', {}),
+            'region': self.region,
+        }
+        given_parameters = dict((parameter['ParameterKey'], parameter['ParameterValue'])
+                                for parameter in stack['Parameters'])
+        for name, parameter in template.get('Parameters', {}).items():
+            context['refs'][name] = given_parameters.get(name, parameter.get('Default'))
+        for logical_id, resource in template.get('Resources', {}).items():
+            resource_type = resource['Type']
+            if resource_type in EC2_ID_PREFIXES:
+                physical_id = self.new_id(EC2_ID_PREFIXES[resource_type])
+            elif resource_type == 'AWS::ElasticLoadBalancing::LoadBalancer':
+                # Load balancer names are at most 32 characters
+                physical_id = self.new_name(stack['StackName'][:10], logical_id[:7]).strip('-')
+                context['attributes'][(logical_id, 'DNSName')] = '{0}-{1}.{2}.elb.amazonaws.com'.format(
+                    physical_id, self.random.randint(10 ** 8, 10 ** 9), self.region)
+                context['attributes'][(logical_id, 'CanonicalHostedZoneNameID')] = R53.AWS_ELB_ZONE_ID.get(
+                    self.region, 'Z3NF1Z3NOM5OY2')
+            else:
+                physical_id = self.new_name(stack['StackName'], logical_id)
+            context['refs'][logical_id] = physical_id
+        return context
+
+    def resolve(self, value, context):
+        """
+        Resolve the intrinsic functions in a template value
+        """
+        if isinstance(value, list):
+            return [self.resolve(item, context) for item in value]
+        if not isinstance(value, dict):
+            return value
+        if len(value) == 1:
+            function, args = value.items()[0]
+            if function == 'Ref':
+                return context['refs'].get(args, args)
+            if function == 'Fn::GetAtt':
+                return context['attributes'].get(tuple(args), '{0}.{1}'.format(*args))
+            if function == 'Fn::Join':
+                delimiter, values = args
+                return delimiter.join(str(item) for item in self.resolve(values, context))
+            if function == 'Fn::FindInMap':
+                mapping_name, key, name = self.resolve(args, context)
+                return context['mappings'][mapping_name][key][name]
+            if function == 'Fn::GetAZs':
+                return ['{0}{1}'.format(context['region'], zone) for zone in 'abc']
+            if function == 'Fn::Base64':
+                return self.resolve(args, context)
+            if function == 'Fn::Select':
+                index, values = self.resolve(args, context)
+                return values[int(index)]
+        return dict((key, self.resolve(item, context)) for key, item in value.items())
+
+    def get_resource_tags(self, stack, logical_id, tags=None):
+        return [
+            {'Key': 'aws:cloudformation:stack-name', 'Value': stack['StackName']},
+            {'Key': 'aws:cloudformation:stack-id', 'Value': stack['StackId']},
+            {'Key': 'aws:cloudformation:logical-id', 'Value': logical_id},
+        ] + [{'Key': tag['Key'], 'Value': str(tag['Value'])} for tag in tags or []]
+
+    def create_resource(self, stack, resource):
+        """
+        Create the AWS side of a stack resource the fake can be asked about
+        """
+        logical_id = resource['LogicalResourceId']
+        physical_id = resource['PhysicalResourceId']
+        context = stack['context']
+        properties = self.resolve(stack['template']['Resources'][logical_id].get('Properties', {}), context)
+        resource_type = resource['ResourceType']
+        if resource_type == 'AWS::EC2::VPC':
+            cidr_block = properties['CidrBlock']
+            self.vpcs[physical_id] = {
+                'VpcId': physical_id,
+                'CidrBlock': cidr_block,
+                'CidrBlockAssociationSet': [{'CidrBlock': cidr_block, 'CidrBlockState': {'State': 'associated'}}],
+                'State': 'available',
+                'IsDefault': False,
+                'InstanceTenancy': 'default',
+                'Tags': self.get_resource_tags(stack, logical_id, properties.get('Tags')),
+            }
+            main_route_table_id = self.new_id('rtb')
+            self.route_tables[main_route_table_id] = {
+                'RouteTableId': main_route_table_id,
+                'VpcId': physical_id,
+                'Routes': [get_local_route(cidr_block)],
+                'Associations': [{'RouteTableAssociationId': self.new_id('rtbassoc'),
+                                  'RouteTableId': main_route_table_id, 'Main': True}],
+                'Tags': [],
+            }
+        elif resource_type == 'AWS::EC2::RouteTable':
+            self.route_tables[physical_id] = {
+                'RouteTableId': physical_id,
+                'VpcId': properties['VpcId'],
+                'Routes': [get_local_route(self.vpcs[properties['VpcId']]['CidrBlock'])],
+                'Associations': [],
+                'Tags': self.get_resource_tags(stack, logical_id, properties.get('Tags')),
+            }
+        elif resource_type == 'AWS::EC2::Route':
+            self.route_tables[properties['RouteTableId']]['Routes'].append({
+                'DestinationCidrBlock': properties['DestinationCidrBlock'],
+                'GatewayId': properties.get('GatewayId'),
+                'State': 'active',
+                'Origin': 'CreateRoute',
+            })
+        elif resource_type == 'AWS::EC2::SubnetRouteTableAssociation':
+            self.route_tables[properties['RouteTableId']]['Associations'].append({
+                'RouteTableAssociationId': physical_id,
+                'RouteTableId': properties['RouteTableId'],
+                'SubnetId': properties['SubnetId'],
+                'Main': False,
+            })
+        elif resource_type == 'AWS::ElasticLoadBalancing::LoadBalancer':
+            self.load_balancers[physical_id] = {
+                'LoadBalancerName': physical_id,
+                'DNSName': context['attributes'][(logical_id, 'DNSName')],
+                'CanonicalHostedZoneName': context['attributes'][(logical_id, 'DNSName')],
+                'CanonicalHostedZoneNameID': context['attributes'][(logical_id, 'CanonicalHostedZoneNameID')],
+                'Scheme': properties.get('Scheme', 'internet-facing'),
+                'ListenerDescriptions': [{
+                    'Listener': dict((key, listener[key]) for key in
+                                     ['LoadBalancerPort', 'InstancePort', 'Protocol', 'InstanceProtocol',
+                                      'SSLCertificateId'] if key in listener),
+                    'PolicyNames': listener.get('PolicyNames', []),
+                } for listener in properties.get('Listeners', [])],
+                'Subnets': properties.get('Subnets', []),
+                'Instances': [],
+                'CreatedTime': self.timestamp(),
+            }
+            for description in self.load_balancers[physical_id]['ListenerDescriptions']:
+                for key in ['LoadBalancerPort', 'InstancePort']:
+                    description['Listener'][key] = int(description['Listener'][key])
+        elif resource_type == 'AWS::AutoScaling::AutoScalingGroup':
+            self.groups[physical_id] = {
+                'AutoScalingGroupName': physical_id,
+                'AutoScalingGroupARN': 'arn:aws:autoscaling:{0}:{1}:autoScalingGroup:{2}'.format(
+                    self.region, ACCOUNT_ID, physical_id),
+                'LaunchConfigurationName': properties.get('LaunchConfigurationName'),
+                'MinSize': int(properties.get('MinSize', 0)),
+                'MaxSize': int(properties.get('MaxSize', 0)),
+                'DesiredCapacity': int(properties.get('DesiredCapacity', properties.get('MinSize', 0))),
+                'DefaultCooldown': 300,
+                'AvailabilityZones': properties.get('AvailabilityZones', []),
+                'LoadBalancerNames': properties.get('LoadBalancerNames', []),
+                'HealthCheckType': properties.get('HealthCheckType', 'EC2'),
+                'HealthCheckGracePeriod': int(properties.get('HealthCheckGracePeriod', 0)),
+                'Instances': [],
+                'CreatedTime': self.timestamp(),
+                'Tags': [dict(tag, ResourceId=physical_id, ResourceType='auto-scaling-group',
+                              PropagateAtLaunch=tag.get('PropagateAtLaunch', True))
+                         for tag in self.get_resource_tags(stack, logical_id, properties.get('Tags'))],
+            }
+            # CloudFormation only finishes the group once its instances are launched
+            self.refresh_group(self.groups[physical_id], self.now(), launch_seconds=0)
+        elif resource_type == 'AWS::Route53::RecordSetGroup':
+            if properties.get('HostedZoneId'):
+                zone_id = self.get_hosted_zone(properties['HostedZoneId'])
+            else:
+                zone_id = self.find_hosted_zone(properties['HostedZoneName'])
+            for record_set in properties.get('RecordSets', []):
+                self.change_record_set(zone_id, 'UPSERT', record_set)
+
+    def delete_resource(self, stack, resource):
+        physical_id = resource['PhysicalResourceId']
+        resource_type = resource['ResourceType']
+        if resource_type == 'AWS::EC2::VPC':
+            self.vpcs.pop(physical_id, None)
+            for route_table_id, route_table in self.route_tables.items():
+                if route_table['VpcId'] == physical_id:
+                    del self.route_tables[route_table_id]
+        elif resource_type == 'AWS::EC2::RouteTable':
+            self.route_tables.pop(physical_id, None)
+        elif resource_type == 'AWS::ElasticLoadBalancing::LoadBalancer':
+            for description in self.load_balancers.pop(physical_id, {}).get('ListenerDescriptions', []):
+                if description['Listener'].get('SSLCertificateId'):
+                    self.certificates_released[description['Listener']['SSLCertificateId']] = self.now()
+        elif resource_type == 'AWS::AutoScaling::AutoScalingGroup':
+            for instance in self.groups.pop(physical_id, {}).get('Instances', []):
+                self.instance_timers.pop(instance['InstanceId'], None)
+        elif resource_type == 'AWS::Route53::RecordSetGroup':
+            properties = self.resolve(stack['template']['Resources'][resource['LogicalResourceId']].get(
+                'Properties', {}), stack['context'])
+            zone_id = self.find_hosted_zone(properties['HostedZoneName'])
+            for record_set in properties.get('RecordSets', []):
+                self.records[zone_id].pop(get_record_key(record_set), None)
+
+    # Route53
+
+    @handles('route53', 'ListHostedZones')
+    def list_hosted_zones(self, params):
+        return {
+            'HostedZones': [zone for _, zone in sorted(self.hosted_zones.items())],
+            'IsTruncated': False,
+            'MaxItems': '100',
+        }
+
+    @handles('route53', 'GetHostedZone')
+    def get_hosted_zone_description(self, params):
+        zone_id = self.get_hosted_zone(params['Id'])
+        return {
+            'HostedZone': self.hosted_zones[zone_id],
+            'DelegationSet': {'NameServers': ['ns-1.awsdns-01.org', 'ns-2.awsdns-02.co.uk']},
+        }
+
+    @handles('route53', 'ListResourceRecordSets')
+    def list_resource_record_sets(self, params):
+        zone_id = self.get_hosted_zone(params['HostedZoneId'])
+        max_items = int(params.get('MaxItems') or 100)
+        # Route53 lists records by their name with the labels reversed
+        record_sets = sorted(self.records[zone_id].values(), key=get_record_sort_key)
+        if params.get('StartRecordName'):
+            start = get_record_sort_key({'Name': params['StartRecordName'],
+                                         'Type': params.get('StartRecordType') or ''})
+            record_sets = [record_set for record_set in record_sets if get_record_sort_key(record_set) >= start]
+        result = {
+            'ResourceRecordSets': record_sets[:max_items],
+            'IsTruncated': len(record_sets) > max_items,
+            'MaxItems': str(max_items),
+        }
+        if result['IsTruncated']:
+            result['NextRecordName'] = record_sets[max_items]['Name']
+            result['NextRecordType'] = record_sets[max_items]['Type']
+        return result
+
+    @handles('route53', 'ChangeResourceRecordSets')
+    def change_resource_record_sets(self, params):
+        zone_id = self.get_hosted_zone(params['HostedZoneId'])
+        changes = params['ChangeBatch']['Changes']
+        # A batch is applied all or nothing
+        for change in changes:
+            key = get_record_key(change['ResourceRecordSet'])
+            if change['Action'] == 'CREATE' and key in self.records[zone_id]:
+                raise FakeAWSError('InvalidChangeBatch', "Tried to create resource record set {0} type {1} "
+                                   "but it already exists".format(key[0], key[1]))
+            if change['Action'] == 'DELETE' and self.records[zone_id].get(key) != normalize_record_set(
+                    change['ResourceRecordSet']):
+                raise FakeAWSError('InvalidChangeBatch', "Tried to delete resource record set {0} type {1} "
+                                   "but it was not found".format(key[0], key[1]))
+        for change in changes:
+            self.change_record_set(zone_id, change['Action'], change['ResourceRecordSet'])
+        return {'ChangeInfo': {'Id': '/change/{0}'.format(self.new_id('C', 12)),
+                               'Status': 'PENDING',
+                               'SubmittedAt': self.timestamp()}}
+
+    def change_record_set(self, zone_id, action, record_set):
+        record_set = normalize_record_set(record_set)
+        if action == 'DELETE':
+            self.records[zone_id].pop(get_record_key(record_set), None)
+        else:
+            self.records[zone_id][get_record_key(record_set)] = record_set
+
+    # ELB
+
+    def get_load_balancer(self, name):
+        if name not in self.load_balancers:
+            raise FakeAWSError('LoadBalancerNotFound', "There is no ACTIVE Load Balancer named '{0}'".format(name))
+        return self.load_balancers[name]
+
+    @handles('elasticloadbalancing', 'DescribeLoadBalancers')
+    def describe_load_balancers(self, params):
+        names = params.get('LoadBalancerNames') or sorted(self.load_balancers)
+        return {'LoadBalancerDescriptions': [self.get_load_balancer(name) for name in names]}
+
+    @handles('elasticloadbalancing', 'SetLoadBalancerListenerSSLCertificate')
+    def set_load_balancer_listener_ssl_certificate(self, params):
+        load_balancer = self.get_load_balancer(params['LoadBalancerName'])
+        arn = params['SSLCertificateId']
+        if not any(certificate['metadata']['Arn'] == arn and self.now() >= certificate['visible_at']
+                   for certificate in self.certificates.values()):
+            raise FakeAWSError('CertificateNotFound', "Server Certificate not found for the key: {0}".format(arn))
+        for description in load_balancer['ListenerDescriptions']:
+            if description['Listener']['LoadBalancerPort'] == int(params['LoadBalancerPort']):
+                previous_arn = description['Listener'].get('SSLCertificateId')
+                if previous_arn and previous_arn != arn:
+                    self.certificates_released[previous_arn] = self.now()
+                description['Listener']['SSLCertificateId'] = arn
+                return {}
+        raise FakeAWSError('ListenerNotFound', "LoadBalancer does not have a listnener configured at the "
+                           "given port.")
+
+    @handles('elasticloadbalancing', 'DescribeInstanceHealth')
+    def describe_instance_health(self, params):
+        load_balancer = self.get_load_balancer(params['LoadBalancerName'])
+        # Instances are registered with the load balancers of their group
+        # while they are running
+        registered = [instance for group in self.groups.values()
+                      if load_balancer['LoadBalancerName'] in group['LoadBalancerNames']
+                      for instance in group['Instances'] if instance['LifecycleState'] != 'Terminating']
+        instance_ids = [instance['InstanceId'] for instance in params.get('Instances') or registered]
+        in_service_ids = set(instance['InstanceId'] for instance in registered
+                             if instance['LifecycleState'] == 'InService')
+        return {'InstanceStates': [{
+            'InstanceId': instance_id,
+            'State': 'InService' if instance_id in in_service_ids else 'OutOfService',
+            'ReasonCode': 'N/A' if instance_id in in_service_ids else 'Instance',
+            'Description': 'N/A',
+        } for instance_id in instance_ids]}
+
+    # IAM
+
+    def get_certificate(self, name):
+        certificate = self.certificates.get(name)
+        if certificate is None or self.now() < certificate['visible_at']:
+            raise FakeAWSError('NoSuchEntity', "The Server Certificate with name {0} cannot be found.".format(name),
+                               404)
+        return certificate
+
+    @handles('iam', 'ListServerCertificates')
+    def list_server_certificates(self, params):
+        path_prefix = params.get('PathPrefix') or '/'
+        metadata = [certificate['metadata'] for _, certificate in sorted(self.certificates.items())
+                    if self.now() >= certificate['visible_at'] and
+                    certificate['metadata']['Path'].startswith(path_prefix)]
+        result = paginate(metadata, 'ServerCertificateMetadataList', params.get('Marker'),
+                          int(params.get('MaxItems') or 100), token_name='Marker')
+        result['IsTruncated'] = 'Marker' in result
+        return result
+
+    @handles('iam', 'GetServerCertificate')
+    def get_server_certificate(self, params):
+        certificate = self.get_certificate(params['ServerCertificateName'])
+        return {'ServerCertificate': {
+            'ServerCertificateMetadata': certificate['metadata'],
+            'CertificateBody': certificate['body'],
+            'CertificateChain': certificate['chain'],
+        }}
+
+    @handles('iam', 'UploadServerCertificate')
+    def upload_server_certificate(self, params):
+        name = params['ServerCertificateName']
+        if name in self.certificates:
+            raise FakeAWSError('EntityAlreadyExists', "The Server Certificate with name {0} already exists."
+                               .format(name), 409)
+        path = params.get('Path') or '/'
+        metadata = {
+            'Path': path,
+            'ServerCertificateName': name,
+            'ServerCertificateId': self.new_id('ASCA', 16).replace('-', '').upper(),
+            'Arn': 'arn:aws:iam::{0}:server-certificate{1}{2}'.format(ACCOUNT_ID, path, name),
+            'UploadDate': self.timestamp(),
+        }
+        self.certificates[name] = {
+            'metadata': metadata,
+            'body': params['CertificateBody'],
+            'chain': params.get('CertificateChain'),
+            'visible_at': self.now() + self.consistency_delay,
+        }
+        return {'ServerCertificateMetadata': metadata}
+
+    @handles('iam', 'DeleteServerCertificate')
+    def delete_server_certificate(self, params):
+        name = params['ServerCertificateName']
+        if name not in self.certificates:
+            raise FakeAWSError('NoSuchEntity', "The Server Certificate with name {0} cannot be found.".format(name),
+                               404)
+        arn = self.certificates[name]['metadata']['Arn']
+        in_use = any(description['Listener'].get('SSLCertificateId') == arn
+                     for load_balancer in self.load_balancers.values()
+                     for description in load_balancer['ListenerDescriptions'])
+        if in_use or self.now() < self.certificates_released.get(arn, 0) + self.consistency_delay:
+            raise FakeAWSError('DeleteConflict', "Certificate: {0} is currently in use by a load balancer."
+                               .format(self.certificates[name]['metadata']['ServerCertificateId']), 409)
+        del self.certificates[name]
+        return {}
+
+    # AutoScaling
+
+    def get_group(self, name):
+        if name not in self.groups:
+            raise FakeAWSError('ValidationError', "AutoScalingGroup name not found - {0}".format(name))
+        return self.groups[name]
+
+    def refresh_group(self, group, now, launch_seconds=None):
+        """
+        Bring a group's instances in service, finish terminating them, and
+        launch or terminate instances to meet the desired capacity
+        """
+        if launch_seconds is None:
+            launch_seconds = self.instance_launch_seconds
+        for instance in list(group['Instances']):
+            timer = self.instance_timers.get(instance['InstanceId'], now)
+            if instance['LifecycleState'] == 'Pending' and now >= timer:
+                instance['LifecycleState'] = 'InService'
+            elif instance['LifecycleState'] == 'Terminating' and now >= timer:
+                group['Instances'].remove(instance)
+                self.instance_timers.pop(instance['InstanceId'], None)
+        active = [instance for instance in group['Instances'] if instance['LifecycleState'] in ('Pending', 'InService')]
+        for _ in range(group['DesiredCapacity'] - len(active)):
+            instance_id = self.new_id('i')
+            group['Instances'].append({
+                'InstanceId': instance_id,
+                'AvailabilityZone': (group['AvailabilityZones'] or [self.region + 'a'])[
+                    len(group['Instances']) % max(len(group['AvailabilityZones']), 1)],
+                'LifecycleState': 'Pending' if launch_seconds else 'InService',
+                'HealthStatus': 'Healthy',
+                'LaunchConfigurationName': group['LaunchConfigurationName'],
+                'ProtectedFromScaleIn': False,
+            })
+            self.instance_timers[instance_id] = now + launch_seconds
+        # The oldest instances are terminated first
+        for instance in active[:max(len(active) - group['DesiredCapacity'], 0)]:
+            self.terminate_instance(instance, now)
+
+    def terminate_instance(self, instance, now):
+        instance['LifecycleState'] = 'Terminating'
+        self.instance_timers[instance['InstanceId']] = now + self.instance_terminate_seconds
+
+    @handles('autoscaling', 'DescribeAutoScalingGroups')
+    def describe_auto_scaling_groups(self, params):
+        names = params.get('AutoScalingGroupNames') or sorted(self.groups)
+        groups = [self.groups[name] for name in names if name in self.groups]
+        return paginate(groups, 'AutoScalingGroups', params.get('NextToken'), int(params.get('MaxRecords') or 50))
+
+    @handles('autoscaling', 'DescribeTags')
+    def describe_tags(self, params):
+        filters = {
+            'auto-scaling-group': lambda tag: [tag['ResourceId']],
+            'key': lambda tag: [tag['Key']],
+            'value': lambda tag: [tag['Value']],
+            'propagate-at-launch': lambda tag: [str(tag['PropagateAtLaunch']).lower()],
+        }
+        tags = [tag for _, group in sorted(self.groups.items()) for tag in group['Tags']]
+        return {'Tags': filter_items(tags, params.get('Filters'), filters)}
+
+    @handles('autoscaling', 'CreateOrUpdateTags')
+    def create_or_update_tags(self, params):
+        for tag in params['Tags']:
+            group = self.get_group(tag['ResourceId'])
+            group['Tags'] = [existing for existing in group['Tags'] if existing['Key'] != tag['Key']]
+            group['Tags'].append({
+                'ResourceId': tag['ResourceId'],
+                'ResourceType': 'auto-scaling-group',
+                'Key': tag['Key'],
+                'Value': tag.get('Value', ''),
+                'PropagateAtLaunch': tag.get('PropagateAtLaunch', False),
+            })
+        return {}
+
+    @handles('autoscaling', 'SetDesiredCapacity')
+    def set_desired_capacity(self, params):
+        group = self.get_group(params['AutoScalingGroupName'])
+        capacity = int(params['DesiredCapacity'])
+        if not group['MinSize'] <= capacity <= group['MaxSize']:
+            raise FakeAWSError('ValidationError', "New SetDesiredCapacity value {0} is outside of the range "
+                               "{1} to {2}".format(capacity, group['MinSize'], group['MaxSize']))
+        group['DesiredCapacity'] = capacity
+        self.refresh_group(group, self.now())
+        return {}
+
+    @handles('autoscaling', 'TerminateInstanceInAutoScalingGroup')
+    def terminate_instance_in_auto_scaling_group(self, params):
+        for group in self.groups.values():
+            for instance in group['Instances']:
+                if instance['InstanceId'] == params['InstanceId'] and instance['LifecycleState'] != 'Terminating':
+                    if params['ShouldDecrementDesiredCapacity']:
+                        group['DesiredCapacity'] -= 1
+                    self.terminate_instance(instance, self.now())
+                    self.refresh_group(group, self.now())
+                    return {'Activity': {
+                        'ActivityId': self.new_id('activity', 12),
+                        'AutoScalingGroupName': group['AutoScalingGroupName'],
+                        'Description': "Terminating EC2 instance: {0}".format(instance['InstanceId']),
+                        'Cause': "Instance {0} was taken out of service in response to a user request"
+                                 .format(instance['InstanceId']),
+                        'StartTime': self.timestamp(),
+                        'StatusCode': 'InProgress',
+                        'Progress': 0,
+                    }}
+        raise FakeAWSError('ValidationError', "Instance Id not found - No managed instance found for instance "
+                           "ID {0}".format(params['InstanceId']))
+
+    # EC2
+
+    def get_vpc(self, vpc_id):
+        if vpc_id not in self.vpcs:
+            raise FakeAWSError('InvalidVpcID.NotFound', "The vpc ID '{0}' does not exist".format(vpc_id))
+        return self.vpcs[vpc_id]
+
+    def get_route_table(self, route_table_id):
+        if route_table_id not in self.route_tables:
+            raise FakeAWSError('InvalidRouteTableID.NotFound', "The routeTable ID '{0}' does not exist"
+                               .format(route_table_id))
+        return self.route_tables[route_table_id]
+
+    def get_peering_connection(self, peering_id):
+        """
+        Get a peering connection, newly created ones are not found until
+        the consistency delay has passed
+        """
+        if peering_id not in self.peering_connections or self.now() < self.peering_timers[peering_id][0]:
+            raise FakeAWSError('InvalidVpcPeeringConnectionID.NotFound', "The vpcPeeringConnection ID '{0}' "
+                               "does not exist".format(peering_id))
+        return self.peering_connections[peering_id]
+
+    @handles('ec2', 'DescribeVpcs')
+    def describe_vpcs(self, params):
+        vpcs = [self.get_vpc(vpc_id) for vpc_id in params.get('VpcIds') or sorted(self.vpcs)]
+        filters = {
+            'vpc-id': lambda vpc: [vpc['VpcId']],
+            'cidr': lambda vpc: [vpc['CidrBlock']],
+            'state': lambda vpc: [vpc['State']],
+        }
+        return {'Vpcs': filter_items(vpcs, params.get('Filters'), filters)}
+
+    @handles('ec2', 'DescribeRouteTables')
+    def describe_route_tables(self, params):
+        route_tables = [self.get_route_table(route_table_id)
+                        for route_table_id in params.get('RouteTableIds') or sorted(self.route_tables)]
+        filters = {
+            'vpc-id': lambda route_table: [route_table['VpcId']],
+            'route-table-id': lambda route_table: [route_table['RouteTableId']],
+            'association.main': lambda route_table: [str(association['Main']).lower()
+                                                     for association in route_table['Associations']],
+        }
+        route_tables = filter_items(route_tables, params.get('Filters'), filters)
+        return paginate(route_tables, 'RouteTables', params.get('NextToken'), int(params.get('MaxResults') or 100))
+
+    @handles('ec2', 'DescribeVpcPeeringConnections')
+    def describe_vpc_peering_connections(self, params):
+        if params.get('VpcPeeringConnectionIds'):
+            peering_connections = [self.get_peering_connection(peering_id)
+                                   for peering_id in params['VpcPeeringConnectionIds']]
+        else:
+            peering_connections = [self.peering_connections[peering_id]
+                                   for peering_id in sorted(self.peering_connections)
+                                   if self.now() >= self.peering_timers[peering_id][0]]
+        filters = {
+            'vpc-peering-connection-id': lambda peering: [peering['VpcPeeringConnectionId']],
+            'requester-vpc-info.vpc-id': lambda peering: [peering['RequesterVpcInfo']['VpcId']],
+            'accepter-vpc-info.vpc-id': lambda peering: [peering['AccepterVpcInfo']['VpcId']],
+            'status-code': lambda peering: [peering['Status']['Code']],
+        }
+        return {'VpcPeeringConnections': filter_items(peering_connections, params.get('Filters'), filters)}
+
+    @handles('ec2', 'CreateVpcPeeringConnection')
+    def create_vpc_peering_connection(self, params):
+        vpc = self.get_vpc(params['VpcId'])
+        peer_vpc = self.get_vpc(params['PeerVpcId'])
+        peering_id = self.new_id('pcx')
+        self.peering_connections[peering_id] = {
+            'VpcPeeringConnectionId': peering_id,
+            'RequesterVpcInfo': {'VpcId': vpc['VpcId'], 'CidrBlock': vpc['CidrBlock'], 'OwnerId': ACCOUNT_ID},
+            'AccepterVpcInfo': {'VpcId': peer_vpc['VpcId'], 'CidrBlock': peer_vpc['CidrBlock'],
+                                'OwnerId': params.get('PeerOwnerId', ACCOUNT_ID)},
+            'Status': {'Code': 'pending-acceptance', 'Message': 'Pending Acceptance by {0}'.format(ACCOUNT_ID)},
+            'ExpirationTime': self.timestamp(self.now() + 7 * 24 * 3600),
+            'Tags': [],
+        }
+        self.peering_timers[peering_id] = (self.now() + self.consistency_delay, None)
+        return {'VpcPeeringConnection': self.peering_connections[peering_id]}
+
+    @handles('ec2', 'AcceptVpcPeeringConnection')
+    def accept_vpc_peering_connection(self, params):
+        peering_id = params['VpcPeeringConnectionId']
+        peering_connection = self.get_peering_connection(peering_id)
+        if peering_connection['Status']['Code'] != 'pending-acceptance':
+            raise FakeAWSError('InvalidStateTransition', "Invalid state transition for pcx {0}, attempted to "
+                               "transition from {1} to active".format(peering_id, peering_connection['Status']['Code']))
+        peering_connection['Status'] = {'Code': 'provisioning', 'Message': 'Provisioning'}
+        visible_at, _ = self.peering_timers[peering_id]
+        self.peering_timers[peering_id] = (visible_at, self.now() + self.peering_provision_seconds)
+        return {'VpcPeeringConnection': peering_connection}
+
+    @handles('ec2', 'DeleteVpcPeeringConnection')
+    def delete_vpc_peering_connection(self, params):
+        peering_connection = self.get_peering_connection(params['VpcPeeringConnectionId'])
+        peering_connection['Status'] = {'Code': 'deleted', 'Message': 'Deleted'}
+        return {'Return': True}
+
+    @handles('ec2', 'CreateRoute')
+    def create_route(self, params):
+        route_table = self.get_route_table(params['RouteTableId'])
+        if params.get('VpcPeeringConnectionId'):
+            self.get_peering_connection(params['VpcPeeringConnectionId'])
+        cidr_block = params['DestinationCidrBlock']
+        if any(route.get('DestinationCidrBlock') == cidr_block for route in route_table['Routes']):
+            raise FakeAWSError('RouteAlreadyExists', "The route identified by {0} already exists."
+                               .format(cidr_block))
+        route = {'DestinationCidrBlock': cidr_block, 'State': 'active', 'Origin': 'CreateRoute'}
+        for target in ['GatewayId', 'VpcPeeringConnectionId', 'InstanceId', 'NatGatewayId']:
+            if params.get(target):
+                route[target] = params[target]
+        route_table['Routes'].append(route)
+        return {'Return': True}
+
+    @handles('ec2', 'DeleteRoute')
+    def delete_route(self, params):
+        route_table = self.get_route_table(params['RouteTableId'])
+        cidr_block = params['DestinationCidrBlock']
+        routes = [route for route in route_table['Routes'] if route.get('DestinationCidrBlock') != cidr_block]
+        if len(routes) == len(route_table['Routes']):
+            raise FakeAWSError('InvalidRoute.NotFound', "no route with destination-cidr-block {0} in route "
+                               "table {1}".format(cidr_block, params['RouteTableId']))
+        route_table['Routes'] = routes
+        return {}
+
+
+def get_type_order(resource_type):
+    if resource_type in RESOURCE_TYPE_ORDER:
+        return RESOURCE_TYPE_ORDER.index(resource_type)
+    return len(RESOURCE_TYPE_ORDER)
+
+
+def get_local_route(cidr_block):
+    return {'DestinationCidrBlock': cidr_block, 'GatewayId': 'local', 'State': 'active',
+            'Origin': 'CreateRouteTable'}
+
+
+def normalize_dns_name(name):
+    name = name.lower()
+    return name if name.endswith('.') else name + '.'
+
+
+def normalize_record_set(record_set):
+    record_set = dict((key, value) for key, value in record_set.items() if value not in (None, [], ''))
+    record_set['Name'] = normalize_dns_name(record_set['Name'])
+    if 'TTL' in record_set:
+        record_set['TTL'] = int(record_set['TTL'])
+    if 'AliasTarget' in record_set:
+        alias_target = dict(record_set['AliasTarget'])
+        alias_target['DNSName'] = normalize_dns_name(alias_target['DNSName'])
+        alias_target['EvaluateTargetHealth'] = str(alias_target.get('EvaluateTargetHealth', False)).lower() == 'true'
+        record_set['AliasTarget'] = alias_target
+    return record_set
+
+
+def get_record_key(record_set):
+    return (normalize_dns_name(record_set['Name']), record_set['Type'], record_set.get('SetIdentifier'))
+
+
+def get_record_sort_key(record_set):
+    return (list(reversed(normalize_dns_name(record_set['Name']).split('.'))), record_set['Type'])
+
+
+def paginate(items, key, token, page_size, token_name='NextToken'):
+    """
+    Get a page of a listing
+
+    Args:
+        items(list): Everything listed
+        key(string): The key of the page in the result
+        token(string): The token of the page, None for the first page
+        page_size(int): The maximum number of items in a page
+        token_name(string): The key of the token of the next page in the result
+
+    Returns:
+        (dict): The result
+    """
+    start = int(token or 0)
+    result = {key: items[start:start + page_size]}
+    if start + page_size < len(items):
+        result[token_name] = str(start + page_size)
+    return result
+
+
+def filter_items(items, filters, getters):
+    """
+    Apply EC2 style filters to a listing
+
+    Args:
+        items(list): The items listed
+        filters(list): The {'Name', 'Values'} filters of the call
+        getters(dict): Functions getting the values of each filter name from an item
+
+    Returns:
+        (list): The items matching every filter
+    """
+    for item_filter in filters or []:
+        if item_filter['Name'] not in getters:
+            raise FakeAWSError('InvalidParameterValue', "The filter '{0}' is invalid".format(item_filter['Name']))
+        getter = getters[item_filter['Name']]
+        items = [item for item in items if set(getter(item)) & set(item_filter['Values'])]
+    return items
+
+
+# boto3
+
+
+class FakeSession(boto3.session.Session):
+    """
+    A boto3 session whose clients call a FakeAWS in place of AWS. The
+    clients are otherwise real, so parameters are validated and botocore
+    emits its events and retries as it would.
+    """
+
+    def __init__(self, fake_aws):
+        super(FakeSession, self).__init__(aws_access_key_id='fake',
+                                          aws_secret_access_key='fake',
+                                          region_name=fake_aws.region)
+        self.fake_aws = fake_aws
+        self.params = threading.local()
+        self._session.register('before-parameter-build', self.remember_params,
+                               unique_id='bootstrap-cfn-fake-aws-params')
+
+    def remember_params(self, params, **kwargs):
+        self.params.value = params
+
+    def client(self, *args, **kwargs):
+        client = super(FakeSession, self).client(*args, **kwargs)
+        endpoint_prefix = client.meta.service_model.endpoint_prefix
+
+        def get_response(request, operation_model, attempts):
+            return self.fake_aws.boto3_response(endpoint_prefix, operation_model, self.params.value)
+        client._endpoint._get_response = get_response
+        return client
+
+
+# boto
+
+
+class FakeBotoResponse(object):
+    """
+    An HTTP response to a boto connection, carrying the result of the call
+    """
+
+    def __init__(self, status, reason, body, result=None):
+        self.status = status
+        self.reason = reason
+        self.body = body
+        self.result = result
+
+    def read(self):
+        return self.body
+
+    def getheader(self, name, default=None):
+        if name.lower() == 'content-length':
+            return str(len(self.body))
+        return default
+
+
+class BotoObject(object):
+    """
+    Stands in for the objects boto parses responses into
+    """
+
+    def __init__(self, **attributes):
+        self.__dict__.update(attributes)
+
+    def __repr__(self):
+        return '{0}({1})'.format(self.__class__.__name__, getattr(self, 'name', getattr(self, 'stack_name', '')))
+
+
+class FakeResultSet(list):
+
+    def __init__(self, items=(), next_token=None):
+        super(FakeResultSet, self).__init__(items)
+        self.next_token = next_token
+
+
+def to_snake_case(name):
+    return re.sub('([a-z0-9])([A-Z])', r'\1_\2', re.sub('(.)([A-Z][a-z]+)', r'\1_\2', name)).lower()
+
+
+def to_boto_object(description, cls=BotoObject, **attributes):
+    """
+    Convert a boto3 description to a boto object, eg StackName to stack_name
+    """
+    attributes.update((to_snake_case(key), value) for key, value in description.items())
+    return cls(**attributes)
+
+
+def to_boto_dict(value):
+    """
+    Convert a boto3 result to the dict boto parses json style responses
+    into, with snake case keys and booleans as strings
+    """
+    if isinstance(value, dict):
+        return dict((to_snake_case(key), to_boto_dict(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return [to_boto_dict(item) for item in value]
+    if isinstance(value, bool):
+        return str(value).lower()
+    return value
+
+
+class FakeBotoConnection(boto.connection.AWSQueryConnection):
+    """
+    A boto query api connection to a FakeAWS. Requests are made through
+    make_request, so they are instrumented like those of a real connection.
+    """
+    service_name = None
+    ResponseError = BotoServerError
+
+    def __init__(self, fake_aws):
+        # Nothing is sent over the network, so there are no
+        # credentials or connections to set up
+        self.fake_aws = fake_aws
+
+    def make_request(self, action, params=None, path='/', verb='GET'):
+        return self.fake_aws.boto_response(self.service_name, action, params or {})
+
+    def call(self, action, **params):
+        response = self.make_request(action, dict((key, value) for key, value in params.items() if value is not None))
+        if response.status >= 300:
+            raise self.ResponseError(response.status, response.reason, response.read())
+        return response.result
+
+
+class FakeStack(BotoObject):
+
+    def list_resources(self, next_token=None):
+        return self.connection.list_stack_resources(self.stack_id, next_token)
+
+
+class FakeCloudFormationConnection(FakeBotoConnection):
+    service_name = 'cloudformation'
+
+    def create_stack(self, stack_name, template_body=None, parameters=None, capabilities=None, tags=None, **kwargs):
+        return self.call('CreateStack',
+                         StackName=stack_name,
+                         TemplateBody=template_body,
+                         Parameters=[{'ParameterKey': key, 'ParameterValue': value}
+                                     for key, value in parameters or []],
+                         Capabilities=capabilities,
+                         Tags=[{'Key': key, 'Value': value} for key, value in sorted((tags or {}).items())],
+                         )['StackId']
+
+    def delete_stack(self, stack_name_or_id):
+        self.call('DeleteStack', StackName=stack_name_or_id)
+        return True
+
+    def describe_stacks(self, stack_name_or_id=None, next_token=None):
+        result = self.call('DescribeStacks', StackName=stack_name_or_id, NextToken=next_token)
+        return FakeResultSet([to_boto_object(stack, FakeStack, connection=self) for stack in result['Stacks']],
+                             result.get('NextToken'))
+
+    def describe_stack_events(self, stack_name_or_id=None, next_token=None):
+        result = self.call('DescribeStackEvents', StackName=stack_name_or_id, NextToken=next_token)
+        return FakeResultSet([to_boto_object(event) for event in result['StackEvents']], result.get('NextToken'))
+
+    def list_stack_resources(self, stack_name_or_id, next_token=None):
+        result = self.call('ListStackResources', StackName=stack_name_or_id, NextToken=next_token)
+        return FakeResultSet([to_boto_object(resource, last_updated_time=resource['LastUpdatedTimestamp'])
+                              for resource in result['StackResourceSummaries']], result.get('NextToken'))
+
+
+class FakeIAMConnection(FakeBotoConnection):
+    service_name = 'iam'
+
+    def call_json(self, action, **params):
+        key = to_snake_case(action)
+        return {'{0}_response'.format(key): {
+            '{0}_result'.format(key): to_boto_dict(self.call(action, **params)),
+            'response_metadata': {'request_id': 'fake'},
+        }}
+
+    def list_server_certs(self, path_prefix='/', marker=None, max_items=None):
+        return self.call_json('ListServerCertificates', PathPrefix=path_prefix, Marker=marker, MaxItems=max_items)
+
+    def get_server_certificate(self, cert_name):
+        return self.call_json('GetServerCertificate', ServerCertificateName=cert_name)
+
+    def upload_server_cert(self, cert_name, cert_body, private_key, cert_chain=None, path=None):
+        return self.call_json('UploadServerCertificate',
+                              ServerCertificateName=cert_name,
+                              CertificateBody=cert_body,
+                              PrivateKey=private_key,
+                              CertificateChain=cert_chain,
+                              Path=path)
+
+    def delete_server_cert(self, cert_name):
+        return self.call_json('DeleteServerCertificate', ServerCertificateName=cert_name)
+
+
+class FakeELBConnection(FakeBotoConnection):
+    service_name = 'elasticloadbalancing'
+
+    def get_all_load_balancers(self, load_balancer_names=None, marker=None):
+        if isinstance(load_balancer_names, basestring):
+            load_balancer_names = [load_balancer_names]
+        result = self.call('DescribeLoadBalancers', LoadBalancerNames=load_balancer_names, Marker=marker)
+        load_balancers = FakeResultSet(next_token=result.get('NextMarker'))
+        for description in result['LoadBalancerDescriptions']:
+            load_balancer = BotoObject(
+                name=description['LoadBalancerName'],
+                dns_name=description['DNSName'],
+                canonical_hosted_zone_name=description['CanonicalHostedZoneName'],
+                canonical_hosted_zone_name_id=description['CanonicalHostedZoneNameID'],
+                scheme=description['Scheme'],
+                subnets=description['Subnets'],
+                instances=[BotoObject(id=instance['InstanceId']) for instance in description['Instances']],
+                created_time=description['CreatedTime'],
+            )
+            load_balancer.listeners = [
+                boto.ec2.elb.listener.Listener(load_balancer,
+                                               listener_description['Listener']['LoadBalancerPort'],
+                                               listener_description['Listener']['InstancePort'],
+                                               listener_description['Listener']['Protocol'],
+                                               listener_description['Listener'].get('SSLCertificateId'),
+                                               listener_description['Listener'].get('InstanceProtocol'))
+                for listener_description in description['ListenerDescriptions']]
+            load_balancers.append(load_balancer)
+        return load_balancers
+
+    def set_lb_listener_SSL_certificate(self, lb_name, lb_port, ssl_certificate_id):
+        self.call('SetLoadBalancerListenerSSLCertificate',
+                  LoadBalancerName=lb_name,
+                  LoadBalancerPort=lb_port,
+                  SSLCertificateId=ssl_certificate_id)
+        return True
+
+
+class FakeAutoScaleConnection(FakeBotoConnection):
+    service_name = 'autoscaling'
+
+    def get_all_groups(self, names=None, max_records=None, next_token=None):
+        result = self.call('DescribeAutoScalingGroups',
+                           AutoScalingGroupNames=names, MaxRecords=max_records, NextToken=next_token)
+        return FakeResultSet([BotoObject(
+            name=group['AutoScalingGroupName'],
+            arn=group['AutoScalingGroupARN'],
+            launch_config_name=group['LaunchConfigurationName'],
+            min_size=group['MinSize'],
+            max_size=group['MaxSize'],
+            desired_capacity=group['DesiredCapacity'],
+            default_cooldown=group['DefaultCooldown'],
+            availability_zones=group['AvailabilityZones'],
+            load_balancers=group['LoadBalancerNames'],
+            health_check_type=group['HealthCheckType'],
+            health_check_period=group['HealthCheckGracePeriod'],
+            instances=[to_boto_object(instance) for instance in group['Instances']],
+            tags=[to_boto_object(tag) for tag in group['Tags']],
+            created_time=group['CreatedTime'],
+        ) for group in result['AutoScalingGroups']], result.get('NextToken'))
+
+    def create_or_update_tags(self, tags):
+        self.call('CreateOrUpdateTags', Tags=[{
+            'ResourceId': tag.resource_id,
+            'ResourceType': 'auto-scaling-group',
+            'Key': tag.key,
+            'Value': tag.value,
+            'PropagateAtLaunch': bool(tag.propagate_at_launch),
+        } for tag in tags])
+        return True
+
+
+class FakeRoute53Connection(boto.connection.AWSAuthConnection):
+    """
+    A boto Route53 connection to a FakeAWS. Route53 is a rest api, so the
+    requests are routed by their method and path like the real connection.
+    """
+    service_name = 'route53'
+    Version = '2013-04-01'
+    ResponseError = DNSServerError
+
+    def __init__(self, fake_aws):
+        self.fake_aws = fake_aws
+
+    def make_request(self, method, path, headers=None, data='', params=None):
+        url = urlparse.urlparse(path)
+        parts = url.path.strip('/').split('/')[1:]
+        query = dict(urlparse.parse_qsl(url.query))
+        query.update(params or {})
+        if parts == ['hostedzone']:
+            return self.fake_aws.boto_response('route53', 'ListHostedZones', {'Marker': query.get('marker')})
+        if len(parts) == 2 and parts[0] == 'hostedzone':
+            return self.fake_aws.boto_response('route53', 'GetHostedZone', {'Id': parts[1]})
+        if len(parts) == 3 and parts[2] == 'rrset' and method == 'POST':
+            return self.fake_aws.boto_response('route53', 'ChangeResourceRecordSets',
+                                               {'HostedZoneId': parts[1], 'ChangeBatch': parse_change_batch(data)})
+        if len(parts) == 3 and parts[2] == 'rrset':
+            return self.fake_aws.boto_response('route53', 'ListResourceRecordSets', {
+                'HostedZoneId': parts[1],
+                'StartRecordName': query.get('name'),
+                'StartRecordType': query.get('type'),
+                'MaxItems': query.get('maxitems'),
+            })
+        return FakeBotoResponse(404, 'Not Found', FakeAWSError('NotFound', path, 404).to_xml())
+
+    def request(self, method, path, data=''):
+        response = self.make_request(method, '/{0}/{1}'.format(self.Version, path), data=data)
+        if response.status >= 300:
+            raise self.ResponseError(response.status, response.reason, response.read())
+        return response.result
+
+    def get_all_hosted_zones(self, start_marker=None, zone_list=None):
+        return {'ListHostedZonesResponse': self.request('GET', 'hostedzone')}
+
+    def get_hosted_zone(self, hosted_zone_id):
+        return {'GetHostedZoneResponse': self.request('GET', 'hostedzone/{0}'.format(hosted_zone_id))}
+
+    def get_hosted_zone_by_name(self, hosted_zone_name):
+        if hosted_zone_name[-1] != '.':
+            hosted_zone_name += '.'
+        for zone in self.get_all_hosted_zones()['ListHostedZonesResponse']['HostedZones']:
+            if zone['Name'] == hosted_zone_name:
+                return self.get_hosted_zone(zone['Id'].split('/')[-1])
+
+    def get_all_rrsets(self, hosted_zone_id, type=None, name=None, identifier=None, maxitems=None):
+        return FakeRecordSets(self, hosted_zone_id, type, name, maxitems)
+
+    def change_rrsets(self, hosted_zone_id, xml_body):
+        return {'ChangeResourceRecordSetsResponse': self.request(
+            'POST', 'hostedzone/{0}/rrset'.format(hosted_zone_id), data=xml_body)}
+
+
+class FakeRecordSets(object):
+    """
+    The records of a zone, fetched a page at a time as they are iterated
+    over like boto's ResourceRecordSets
+    """
+
+    def __init__(self, connection, hosted_zone_id, record_type=None, name=None, maxitems=None):
+        self.connection = connection
+        self.hosted_zone_id = hosted_zone_id
+        self.record_type = record_type
+        self.name = name
+        self.maxitems = maxitems
+
+    def get_page(self, name, record_type):
+        query = dict((key, value) for key, value in [('type', record_type), ('name', name),
+                                                     ('maxitems', self.maxitems)] if value)
+        return self.connection.request('GET', 'hostedzone/{0}/rrset?{1}'.format(self.hosted_zone_id,
+                                                                                urllib.urlencode(query)))
+
+    def __iter__(self):
+        name, record_type = self.name, self.record_type
+        while True:
+            result = self.get_page(name, record_type)
+            for record_set in result['ResourceRecordSets']:
+                alias_target = record_set.get('AliasTarget', {})
+                yield boto.route53.record.Record(
+                    name=record_set['Name'],
+                    type=record_set['Type'],
+                    ttl=record_set.get('TTL'),
+                    resource_records=[record['Value'] for record in record_set.get('ResourceRecords', [])],
+                    alias_hosted_zone_id=alias_target.get('HostedZoneId'),
+                    alias_dns_name=alias_target.get('DNSName'),
+                    identifier=record_set.get('SetIdentifier'),
+                    weight=record_set.get('Weight'),
+                    alias_evaluate_target_health=alias_target.get('EvaluateTargetHealth'))
+            if not result['IsTruncated']:
+                return
+            name, record_type = result['NextRecordName'], result['NextRecordType']
+
+
+def parse_change_batch(xml_body):
+    """
+    Parse the ChangeResourceRecordSetsRequest boto sends into the
+    ChangeBatch parameter of the boto3 call
+    """
+    root = ElementTree.fromstring(xml_body)
+    for element in root.iter():
+        element.tag = element.tag.split('}')[-1]
+    changes = []
+    for change in root.iter('Change'):
+        record_set_element = change.find('ResourceRecordSet')
+        record_set = {
+            'Name': record_set_element.findtext('Name'),
+            'Type': record_set_element.findtext('Type'),
+            'TTL': record_set_element.findtext('TTL'),
+            'SetIdentifier': record_set_element.findtext('SetIdentifier'),
+            'Weight': record_set_element.findtext('Weight'),
+            'ResourceRecords': [{'Value': value.text} for value in record_set_element.iter('Value')],
+        }
+        alias_target = record_set_element.find('AliasTarget')
+        if alias_target is not None:
+            record_set['AliasTarget'] = {
+                'HostedZoneId': alias_target.findtext('HostedZoneId'),
+                'DNSName': alias_target.findtext('DNSName'),
+                'EvaluateTargetHealth': alias_target.findtext('EvaluateTargetHealth') == 'true',
+            }
+            del record_set['TTL']
+        changes.append({'Action': change.findtext('Action'), 'ResourceRecordSet': record_set})
+    return {'Changes': changes}
+
+
+# The fake connection classes by the boto module they stand in for
+FAKE_BOTO_CONNECTIONS = {
+    'boto.cloudformation': FakeCloudFormationConnection,
+    'boto.ec2.autoscale': FakeAutoScaleConnection,
+    'boto.ec2.elb': FakeELBConnection,
+    'boto.iam': FakeIAMConnection,
+    'boto.route53': FakeRoute53Connection,
+}
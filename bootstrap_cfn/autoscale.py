@@ -1,12 +1,21 @@
+import json
 import logging
+import os
+import time
 
 import boto.ec2.autoscale
 
-import boto3
+from botocore.exceptions import BotoCoreError, ClientError
 
-from bootstrap_cfn import utils
+from bootstrap_cfn import cloudformation, utils
 
-from bootstrap_cfn.errors import AutoscalingGroupNotFound, AutoscalingInstanceCountError
+from bootstrap_cfn.errors import AutoscalingGroupNotFound, AutoscalingInstanceCountError, BootstrapCfnError
+from bootstrap_cfn.tracing import SLEEP, TRACER
+
+
+# Autoscaling group names keyed by (profile, region, stack name), resolved
+# once and reused for the rest of the task
+AUTOSCALING_GROUP_NAMES = {}
 
 
 class Autoscale:
@@ -16,13 +25,87 @@ class Autoscale:
         self.aws_profile_name = aws_profile_name
         self.aws_region_name = aws_region_name
         self.conn_asg = utils.connect_to_aws(boto.ec2.autoscale, self)
+        self.session = None
+        self.clients = {}
+
+    def get_client(self, service_name):
+        """
+        Get the boto3 client for a service. One session and one client per
+        service are created for the lifetime of this object, so connections
+        are reused between calls.
+
+        Args:
+            service_name(string): The name of the AWS service, eg 'autoscaling'
+
+        Returns:
+            The boto3 client
+        """
+        if service_name not in self.clients:
+            if self.session is None:
+                self.session = utils.get_boto3_session(self)
+            self.clients[service_name] = utils.get_boto3_client(self.session, service_name)
+        return self.clients[service_name]
 
     def set_autoscaling_group(self, name):
-        for grp in self.get_all_autoscaling_groups():
-            for tag in grp.tags:
-                if tag.key == 'aws:cloudformation:stack-name':
-                    if str(tag.value) == str(name):
-                        self.group = grp
+        """
+        Set the autoscaling group created by a stack
+
+        Args:
+            name(string): The name of the stack
+        """
+        group_name = self.get_autoscaling_group_name(name)
+        if group_name:
+            groups = self.conn_asg.get_all_groups(names=[group_name])
+            if groups:
+                self.group = groups[0]
+
+    def get_autoscaling_group_name(self, stack_name):
+        """
+        Get the name of the autoscaling group created by a stack, without
+        listing every group in the region. The name is taken from the
+        stack's AWS::AutoScaling::AutoScalingGroup resource, or failing
+        that a tag filter on the stack name, and cached.
+
+        Args:
+            stack_name(string): The name of the stack
+
+        Returns:
+            (string): The autoscaling group name, None if not found
+        """
+        logger = logging.getLogger("bootstrap-cfn")
+        cache_key = (self.aws_profile_name, self.aws_region_name, str(stack_name))
+        if cache_key in AUTOSCALING_GROUP_NAMES:
+            return AUTOSCALING_GROUP_NAMES[cache_key]
+
+        group_name = None
+        try:
+            # List the resources with this object's session, for its profile, region and role
+            resources = cloudformation.get_stack_resource_index(
+                stack_name,
+                client=self.get_client('cloudformation'),
+                aws_profile_name=self.aws_profile_name,
+                aws_region_name=self.aws_region_name).get_by_type('AWS::AutoScaling::AutoScalingGroup')
+            if resources:
+                group_name = resources[0]['PhysicalResourceId']
+        except (ClientError, BotoCoreError) as e:
+            logger.warning("get_autoscaling_group_name: Could not get resources for stack {}, "
+                           "falling back to tag lookup: {}".format(stack_name, e))
+        if not group_name:
+            client = self.get_client('autoscaling')
+            tags = client.describe_tags(Filters=[
+                {'Name': 'key', 'Values': ['aws:cloudformation:stack-name']},
+                {'Name': 'value', 'Values': [str(stack_name)]}
+            ]).get('Tags', [])
+            group_names = [tag['ResourceId'] for tag in tags
+                           if tag.get('ResourceType') == 'auto-scaling-group']
+            if group_names:
+                group_name = group_names[0]
+
+        if group_name:
+            logger.info("get_autoscaling_group_name: Found group {} for stack {}"
+                        .format(group_name, stack_name))
+            AUTOSCALING_GROUP_NAMES[cache_key] = group_name
+        return group_name
 
     def set_tag(self, key, value):
         if self.group:
@@ -54,18 +137,44 @@ class Autoscale:
             all_asgs += response
         return all_asgs
 
-    def cycle_instances(self, termination_delay=None):
+    @TRACER.traced('cycle_instances')
+    def cycle_instances(self, termination_delay=None, max_surge=1, max_unavailable=0, skip_unchanged=False,
+                        resume=False, checkpoint_file=None):
         """
         Cycle all the instances in an autoscaling group, waiting for the
         specified delay before terminating each instance that was replaced
 
+        Instances are replaced in waves. Each wave launches up to max_surge
+        extra instances above the current capacity and replaces up to
+        max_unavailable instances in place, then retires the surged
+        instances once everything is healthy. The defaults replace the
+        instances strictly one at a time.
+
+        Progress is written to a checkpoint file after every step, and removed
+        once all the instances have been cycled. If the cycle is interrupted,
+        running again with resume picks up where it stopped.
+
         Args:
             termination_delay(int): The delay in seconds between the new instance becoming
                 healthy and in-service, and the termination of the old one its replacing.
+            max_surge(int): The maximum number of instances to launch above the
+                current capacity in each wave.
+            max_unavailable(int): The maximum number of instances that can be out
+                of service at once in each wave.
+            skip_unchanged(bool): True to only replace the instances that are not
+                running the group's current launch configuration or template.
+            resume(bool): True to continue from the checkpoint of an interrupted cycle.
+            checkpoint_file(string): The path of the checkpoint file, defaults to
+                one named after the group in the current directory.
         """
 
         logger = logging.getLogger("bootstrap-cfn")
-        client = boto3.client('autoscaling')
+        client = self.get_client('autoscaling')
+
+        if max_surge < 0 or max_unavailable < 0 or max_surge + max_unavailable < 1:
+            raise BootstrapCfnError("cycle_instances: max_surge ({}) and max_unavailable ({}) must be "
+                                    "non-negative and allow at least one instance per wave"
+                                    .format(max_surge, max_unavailable))
 
         # Use the type of health check the ASG is using to determine a sensible default for termination
         # delay. The ELB check is more nuanced and should know what a healthy service really looks like.
@@ -75,59 +184,194 @@ class Autoscale:
         if not termination_delay and self.group.health_check_type != "ELB":
             termination_delay = 360
 
-        # Get a list of the current instances
-        current_instance_ids = [instance.get('InstanceId') for instance in self.get_healthy_instances()]
-        logger.info("cycle_instances: Found {} healthy instances,\n{}"
-                    .format(len(current_instance_ids), self.get_instances_list()))
-
-        # save the number of instances before starting the upgrade
-        num_instances = len(current_instance_ids)
+        if not checkpoint_file:
+            checkpoint_file = self.get_cycle_checkpoint_file()
+        checkpoint = self.load_cycle_checkpoint(checkpoint_file) if resume else None
+
+        # Capacity requested by an interrupted wave on top of the original capacity
+        excess_capacity = 0
+        if checkpoint:
+            current_instance_ids = checkpoint['original_instance_ids']
+            cycle_instance_ids = checkpoint['cycle_instance_ids']
+            num_instances = checkpoint['capacity']
+            group = self.describe_autoscaling_group()
+            group_instance_ids = [instance.get('InstanceId') for instance in group.get('Instances', [])]
+            remaining_instance_ids = [instance_id for instance_id in cycle_instance_ids
+                                      if instance_id not in checkpoint['replaced_instance_ids'] and
+                                      instance_id in group_instance_ids]
+            excess_capacity = max(group.get('DesiredCapacity', num_instances) - num_instances, 0)
+            logger.info("cycle_instances: Resuming from checkpoint {}, {} of {} instances replaced, "
+                        "{} to replace, capacity {} over the original {}"
+                        .format(checkpoint_file, len(cycle_instance_ids) - len(remaining_instance_ids),
+                                len(cycle_instance_ids), len(remaining_instance_ids), excess_capacity, num_instances))
+        else:
+            # Get a list of the current instances
+            instances = self.get_instances()
+            current_instance_ids = [instance.get('InstanceId') for instance in self.get_healthy_instances(instances)]
+            logger.info("cycle_instances: Found {} healthy instances,\n{}"
+                        .format(len(current_instance_ids), self.get_instances_list(instances=instances)))
+
+            # save the number of instances before starting the upgrade
+            num_instances = len(current_instance_ids)
+
+            # Leave alone the instances that are already up to date
+            cycle_instance_ids = current_instance_ids
+            if skip_unchanged:
+                stale_instance_ids = self.get_stale_instance_ids()
+                cycle_instance_ids = [instance_id for instance_id in current_instance_ids
+                                      if instance_id in stale_instance_ids]
+                logger.info("cycle_instances: Skipping {} instances already using the current launch configuration, "
+                            "{} to replace".format(num_instances - len(cycle_instance_ids), len(cycle_instance_ids)))
+            remaining_instance_ids = list(cycle_instance_ids)
+            checkpoint = {
+                'group': self.group.name,
+                'capacity': num_instances,
+                'original_instance_ids': current_instance_ids,
+                'cycle_instance_ids': cycle_instance_ids,
+                'replaced_instance_ids': []
+            }
+            self.save_cycle_checkpoint(checkpoint_file, checkpoint)
+
+        # We cannot surge above the maximum size of the group
+        if remaining_instance_ids and self.group.max_size is not None and num_instances + max_surge > self.group.max_size:
+            max_surge = max(self.group.max_size - num_instances, 0)
+            logger.warning("cycle_instances: Limiting max_surge to {} by the group maximum size {}"
+                           .format(max_surge, self.group.max_size))
+            if max_surge + max_unavailable < 1:
+                raise BootstrapCfnError("cycle_instances: Group {} is at its maximum size {}, "
+                                        "set max_unavailable to cycle its instances"
+                                        .format(self.group.name, self.group.max_size))
 
         # get the ASG HealthCheckGracePeriod
         health_check_grace_period = self.group.health_check_period
         logger.info("ASG HealthCheckGracePeriod: %s" % health_check_grace_period)
 
-        # Iterate through the current instances, replacing current instances with new ones
-        for current_instance_id in current_instance_ids:
-            # Set the desired instances +1 and wait for it to be created
-            logger.info("cycle_instances: Creating new instance...")
-            self.set_autoscaling_desired_capacity(len(current_instance_ids) + 1)
-            self.wait_for_instances(len(current_instance_ids) + 1)
-
-            # wait for the same time as the "HealthCheckGracePeriod" in the ASG
-            logger.info("Waiting %ss - HealthCheckGracePeriod" % health_check_grace_period)
-            utils.sleep_countdown(health_check_grace_period)
-            logger.info("End of waiting period")
+        # Iterate through the current instances, replacing current instances with new ones in waves
+        while remaining_instance_ids:
+            # Retire instances for any capacity left over by an interrupted wave first
+            surge = min(max(max_surge, excess_capacity), len(remaining_instance_ids))
+            unavailable = min(max_unavailable, len(remaining_instance_ids) - surge)
+            surge_instance_ids = remaining_instance_ids[:surge]
+            replace_instance_ids = remaining_instance_ids[surge:surge + unavailable]
+            remaining_instance_ids = remaining_instance_ids[surge + unavailable:]
+            expected_instances = num_instances + max(surge, excess_capacity)
+            excess_capacity = max(excess_capacity - surge, 0)
+
+            # Terminate the in-place replacements without decrementing the capacity,
+            # the autoscaling group will launch new instances in their place
+            for replace_instance_id in replace_instance_ids:
+                logger.info("cycle_instances: Replacing instance {} in place..."
+                            .format(replace_instance_id))
+                client.terminate_instance_in_auto_scaling_group(
+                    InstanceId=replace_instance_id,
+                    ShouldDecrementDesiredCapacity=False
+                )
+                checkpoint['replaced_instance_ids'].append(replace_instance_id)
+                self.save_cycle_checkpoint(checkpoint_file, checkpoint)
+
+            # Set the desired instances +surge and wait for them to be created
+            if surge:
+                logger.info("cycle_instances: Creating {} new instances...".format(surge))
+                self.set_autoscaling_desired_capacity(expected_instances)
+
+            # Wait for the new instances to be in service and healthy behind every load balancer,
+            # allowing up to the "HealthCheckGracePeriod" in the ASG on top of the usual wait
+            logger.info("Waiting up to %ss extra - HealthCheckGracePeriod" % health_check_grace_period)
+            with TRACER.span('wait_for_instances', expected_instances=expected_instances):
+                self.wait_for_instances(expected_instances, grace_period=health_check_grace_period,
+                                        replaced_instance_ids=replace_instance_ids)
 
             # check if the number of healthy instances is = to the number of expected instances, where
-            # expected instances is num_instances + 1
+            # expected instances is num_instances + surge, and that the in-place replacements have gone
             new_curr_inst_ids = [instance.get('InstanceId') for instance in self.get_healthy_instances()]
             logger.info("new instance list %r" % new_curr_inst_ids)
-            if len(new_curr_inst_ids) != num_instances + 1:
+            if len(new_curr_inst_ids) != expected_instances or set(replace_instance_ids) & set(new_curr_inst_ids):
                 logger.error("Expected %s instances, found %s." %
-                             (num_instances + 1, len(new_curr_inst_ids)))
-                raise AutoscalingInstanceCountError(self.group.name, num_instances + 1, new_curr_inst_ids)
+                             (expected_instances, len(new_curr_inst_ids)))
+                logger.error("cycle_instances: Run again with resume to continue from checkpoint {}"
+                             .format(checkpoint_file))
+                raise AutoscalingInstanceCountError(self.group.name, expected_instances, new_curr_inst_ids)
             else:
                 logger.info("Expected %s instances, found %s." %
-                            (num_instances + 1, len(new_curr_inst_ids)))
-
-            # If we have a delay before termination defined, delay before terminating the current instance
-            logger.info("cycle_instances: Terminating recycled instance {} after {} seconds..."
-                        .format(current_instance_id, termination_delay))
-            if termination_delay:
-                logger.info("Waiting %ss - termination_delay" % termination_delay)
-                utils.sleep_countdown(termination_delay)
-                logger.info("End of waiting period")
-            client.terminate_instance_in_auto_scaling_group(
-                InstanceId=current_instance_id,
-                ShouldDecrementDesiredCapacity=True
-            )
+                            (expected_instances, len(new_curr_inst_ids)))
+
+            # If we have a delay before termination defined, delay before terminating the current instances
+            if surge_instance_ids:
+                logger.info("cycle_instances: Terminating recycled instances {} after {} seconds..."
+                            .format(surge_instance_ids, termination_delay))
+                if termination_delay:
+                    logger.info("Waiting %ss - termination_delay" % termination_delay)
+                    with TRACER.span('termination delay', SLEEP):
+                        utils.sleep_countdown(termination_delay)
+                    logger.info("End of waiting period")
+            for surge_instance_id in surge_instance_ids:
+                client.terminate_instance_in_auto_scaling_group(
+                    InstanceId=surge_instance_id,
+                    ShouldDecrementDesiredCapacity=True
+                )
+                checkpoint['replaced_instance_ids'].append(surge_instance_id)
+                self.save_cycle_checkpoint(checkpoint_file, checkpoint)
+
+        # Return any capacity left over by an interrupted wave
+        if excess_capacity:
+            self.set_autoscaling_desired_capacity(num_instances)
+        self.clear_cycle_checkpoint(checkpoint_file)
+
         new_instance_ids = [instance.get('InstanceId') for instance in self.get_healthy_instances()]
         logger.info("cycle_instances: {} instances recycled, {}"
-                    .format(len(current_instance_ids), current_instance_ids))
+                    .format(len(cycle_instance_ids), cycle_instance_ids))
+        if len(cycle_instance_ids) != len(current_instance_ids):
+            logger.info("cycle_instances: {} instances skipped as unchanged"
+                        .format(len(current_instance_ids) - len(cycle_instance_ids)))
         logger.info("cycle_instances: {} instances created, {}"
                     .format(len(new_instance_ids), new_instance_ids))
 
+    def get_cycle_checkpoint_file(self):
+        """
+        Get the default path of the cycle_instances checkpoint for the group
+        """
+        return os.path.join(os.getcwd(), "cycle_instances-{}.checkpoint.json".format(self.group.name))
+
+    def load_cycle_checkpoint(self, checkpoint_file):
+        """
+        Load the cycle_instances checkpoint of the group
+
+        Args:
+            checkpoint_file(string): The path of the checkpoint file
+
+        Returns:
+            (dict): The checkpoint, None if there is no checkpoint for the group
+        """
+        logger = logging.getLogger("bootstrap-cfn")
+        if not os.path.exists(checkpoint_file):
+            logger.warning("cycle_instances: No checkpoint found at {}, starting from scratch"
+                           .format(checkpoint_file))
+            return None
+        with open(checkpoint_file) as f:
+            checkpoint = json.load(f)
+        if checkpoint.get('group') != self.group.name:
+            raise BootstrapCfnError("cycle_instances: Checkpoint {} is for group {}, not {}"
+                                    .format(checkpoint_file, checkpoint.get('group'), self.group.name))
+        return checkpoint
+
+    def save_cycle_checkpoint(self, checkpoint_file, checkpoint):
+        """
+        Write the cycle_instances checkpoint, replacing the file atomically so
+        an interruption cannot leave it half written
+
+        Args:
+            checkpoint_file(string): The path of the checkpoint file
+            checkpoint(dict): The state of the cycle
+        """
+        tmp_file = "{}.tmp".format(checkpoint_file)
+        with open(tmp_file, 'w') as f:
+            json.dump(checkpoint, f, indent=4)
+        os.rename(tmp_file, checkpoint_file)
+
+    def clear_cycle_checkpoint(self, checkpoint_file):
+        if os.path.exists(checkpoint_file):
+            os.remove(checkpoint_file)
+
     def set_autoscaling_desired_capacity(self, capacity):
         """
         Set the desired instances count on an autoscaling group
@@ -136,7 +380,7 @@ class Autoscale:
             capacity(int): The target size of the instances in the
                 autoscaling group.
         """
-        client = boto3.client('autoscaling')
+        client = self.get_client('autoscaling')
         logging.getLogger("bootstrap-cfn").info("set_autoscaling_desired_capacity: Setting capacity to {}"
                                                 .format(capacity))
         client.set_desired_capacity(
@@ -145,62 +389,172 @@ class Autoscale:
             HonorCooldown=False
         )
 
-    def wait_for_instances(self, expected_instance_count, retry_delay=30, retry_max=10):
+    def wait_for_instances(self, expected_instance_count, retry_delay=30, retry_max=10, grace_period=0, min_delay=2,
+                           replaced_instance_ids=None):
         """
         Wait for the autoscaling group to register a specified number of healthy,
-        in-service instances.
+        in-service instances, that are also in service on every load balancer
+        attached to the group, and for the instances being replaced to be out
+        of service. The checks start every min_delay seconds and back off to
+        every retry_delay seconds.
 
         Args:
             expected_instance_count(int): The target size of the instances in the
                 autoscaling group.
-            retry_delay(int): The time in seconds between checks on the number of
-                instances.
-            retry_max(int): The maximum number of retries on checking the instance
-                count before failing.
+            retry_delay(int): The maximum time in seconds between checks on the
+                number of instances.
+            retry_max(int): The number of retry_delay periods to wait for before
+                failing.
+            grace_period(int): Extra time in seconds to allow on top of
+                retry_delay * retry_max, eg the group's HealthCheckGracePeriod.
+            min_delay(int): The time in seconds between the first checks.
+            replaced_instance_ids(list): The ids of instances terminated to be
+                replaced, which must no longer be healthy and in service.
         Exceptions:
             AutoscalingInstanceCountError: On target instance count not reached in
-                retry_delay * retry_count time.
+                retry_delay * retry_max + grace_period time.
         """
         logger = logging.getLogger("bootstrap-cfn")
-        instances = self.get_healthy_instances()
-        count = 0
-        while (len(instances) != expected_instance_count and count < retry_max):
-            count += 1
-            logger.info("cycle_instances: Waiting {} seconds for instances (attempt {}/{})..."
-                        .format(retry_delay, count, retry_max))
-            if count == retry_max:
-                logger.critical("wait_for_instances:Failed to find {} healthy instances,\n{}"
-                                .format(expected_instance_count, self.get_instances_list()))
-                raise AutoscalingInstanceCountError(self.group.name, expected_instance_count, instances)
-            utils.sleep_countdown(retry_delay)
-            instances = self.get_healthy_instances()
-        logger.info("wait_for_instances: Found {} instances,\n{}"
-                    .format(len(instances), self.get_instances_list()))
-
-    def get_healthy_instances(self):
-        instances = [instance for instance in self.get_instances()
+        timeout = retry_delay * retry_max + grace_period
+        start_time = time.time()
+        ready = {'instances': [], 'all_instances': []}
+        replaced_instance_ids = set(replaced_instance_ids or [])
+
+        def instances_ready():
+            ready['all_instances'] = self.get_instances()
+            ready['instances'] = self.get_ready_instances(ready['all_instances'])
+            # An instance terminated in place stays healthy until the group gets to it
+            remaining_instance_ids = replaced_instance_ids & set(
+                instance.get('InstanceId') for instance in self.get_healthy_instances(ready['all_instances']))
+            if len(ready['instances']) == expected_instance_count and not remaining_instance_ids:
+                return True
+            logger.info("wait_for_instances: Found {}/{} ready instances, {} replaced instances still in service "
+                        "after {:.0f} of {} seconds..."
+                        .format(len(ready['instances']), expected_instance_count, len(remaining_instance_ids),
+                                time.time() - start_time, timeout))
+            return False
+
+        if not utils.poll(instances_ready, timeout, min_interval=min_delay, max_interval=retry_delay):
+            logger.critical("wait_for_instances:Failed to find {} healthy instances,\n{}"
+                            .format(expected_instance_count, self.get_instances_list(instances=ready['all_instances'])))
+            raise AutoscalingInstanceCountError(self.group.name, expected_instance_count, ready['instances'])
+        logger.info("wait_for_instances: Found {} instances after {:.0f} seconds,\n{}"
+                    .format(len(ready['instances']), time.time() - start_time,
+                            self.get_instances_list(instances=ready['all_instances'])))
+
+    def get_ready_instances(self, instances=None):
+        """
+        Get the healthy instances in the group that are also in service on
+        every load balancer attached to the group
+
+        Args:
+            instances(list): The group's instances if they have just been
+                described, otherwise they are fetched
+
+        Returns:
+            (list): The ready instances
+        """
+        instances = self.get_healthy_instances(instances)
+        load_balancer_names = self.group.load_balancers or []
+        if not instances or not load_balancer_names:
+            return instances
+        elb_client = self.get_client('elb')
+        in_service_ids = set(instance.get('InstanceId') for instance in instances)
+        for load_balancer_name in load_balancer_names:
+            instance_states = elb_client.describe_instance_health(
+                LoadBalancerName=load_balancer_name).get('InstanceStates', [])
+            in_service_ids &= set(state.get('InstanceId') for state in instance_states
+                                  if state.get('State') == 'InService')
+        return [instance for instance in instances if instance.get('InstanceId') in in_service_ids]
+
+    def get_healthy_instances(self, instances=None):
+        if instances is None:
+            instances = self.get_instances()
+        instances = [instance for instance in instances
                      if instance.get('LifecycleState') == 'InService' and
                      instance.get('HealthStatus') == 'Healthy']
         return instances
 
-    def get_instances(self):
+    def describe_autoscaling_group(self):
         """
-        Get all instances in an autoscaling group
+        Get the full description of the autoscaling group
         """
-        client = boto3.client('autoscaling')
+        client = self.get_client('autoscaling')
         groups = client.describe_auto_scaling_groups(AutoScalingGroupNames=[self.group.name]).get('AutoScalingGroups')
         if not len(groups) > 0:
             logging.getLogger("bootstrap-cfn").critical("cycle_instances: Could not describe autoscaling group")
             raise AutoscalingGroupNotFound
-        instances = [instance for instance in groups[0].get('Instances')]
+        return groups[0]
+
+    def get_instances(self):
+        """
+        Get all instances in an autoscaling group
+        """
+        instances = [instance for instance in self.describe_autoscaling_group().get('Instances')]
         return instances
 
-    def get_instances_list(self, order_by='HealthStatus'):
+    def get_stale_instance_ids(self):
+        """
+        Get the instances that were not launched from the group's current
+        launch configuration, or current launch template version
+
+        Returns:
+            (list): The ids of the out of date instances
+        """
+        group = self.describe_autoscaling_group()
+        launch_configuration_name = group.get('LaunchConfigurationName')
+        launch_template_version = self.get_launch_template_version(group.get('LaunchTemplate'))
+        stale_instance_ids = []
+        for instance in group.get('Instances', []):
+            if launch_configuration_name:
+                is_stale = instance.get('LaunchConfigurationName') != launch_configuration_name
+            elif launch_template_version:
+                instance_template = instance.get('LaunchTemplate') or {}
+                is_stale = ((instance_template.get('LaunchTemplateId'), str(instance_template.get('Version'))) !=
+                            launch_template_version)
+            else:
+                is_stale = True
+            if is_stale:
+                stale_instance_ids.append(instance.get('InstanceId'))
+        return stale_instance_ids
+
+    def get_launch_template_version(self, launch_template):
+        """
+        Resolve a group's launch template specification to a concrete version
+
+        Args:
+            launch_template(dict): The LaunchTemplate of the group description
+
+        Returns:
+            (tuple): The launch template id and version number, None if
+                the group has no launch template
+        """
+        if not launch_template:
+            return None
+        template_id = launch_template.get('LaunchTemplateId')
+        version = launch_template.get('Version', '$Default')
+        if version in ('$Latest', '$Default'):
+            client = self.get_client('ec2')
+            if template_id:
+                template = client.describe_launch_templates(LaunchTemplateIds=[template_id])['LaunchTemplates'][0]
+            else:
+                template = client.describe_launch_templates(
+                    LaunchTemplateNames=[launch_template.get('LaunchTemplateName')])['LaunchTemplates'][0]
+            template_id = template['LaunchTemplateId']
+            if version == '$Latest':
+                version = template['LatestVersionNumber']
+            else:
+                version = template['DefaultVersionNumber']
+        return (template_id, str(version))
+
+    def get_instances_list(self, order_by='HealthStatus', instances=None):
         """
         Get an ordered list of instances in the auto-scaling group
 
         Args:
             order_by(string): Key to order the instances by
+            instances(list): The group's instances if they have just been
+                described, otherwise they are fetched
 
         Returns:
             (string): List of instances with health and lifecycle state
@@ -208,7 +562,7 @@ class Autoscale:
         instances = [{'InstanceId': instance.get('InstanceId'),
                       'LifecycleState': instance.get('LifecycleState'),
                       'HealthStatus': instance.get('HealthStatus')}
-                     for instance in self.get_instances()]
+                     for instance in (self.get_instances() if instances is None else instances)]
         sorted_instances = sorted(instances, key=lambda instance: instance[order_by])
         output = []
         for sorted_instance in sorted_instances:
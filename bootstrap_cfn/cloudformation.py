@@ -5,6 +5,22 @@ import boto3
 
 from bootstrap_cfn import utils
 
+# Every stack status except DELETE_COMPLETE, so the stacks describe_stacks returns
+ACTIVE_STACK_STATUSES = [
+    'CREATE_IN_PROGRESS', 'CREATE_FAILED', 'CREATE_COMPLETE',
+    'ROLLBACK_IN_PROGRESS', 'ROLLBACK_FAILED', 'ROLLBACK_COMPLETE',
+    'DELETE_IN_PROGRESS', 'DELETE_FAILED',
+    'UPDATE_IN_PROGRESS', 'UPDATE_COMPLETE_CLEANUP_IN_PROGRESS', 'UPDATE_COMPLETE',
+    'UPDATE_ROLLBACK_IN_PROGRESS', 'UPDATE_ROLLBACK_FAILED',
+    'UPDATE_ROLLBACK_COMPLETE_CLEANUP_IN_PROGRESS', 'UPDATE_ROLLBACK_COMPLETE',
+]
+
+# Cache of stack indexes for this run, keyed on their stack status filter
+STACK_INDEXES = {}
+
+# Cache of stack resource indexes for this run, keyed on (profile, region, stack name or id)
+STACK_RESOURCE_INDEXES = {}
+
 
 class Cloudformation:
 
@@ -18,6 +34,7 @@ class Cloudformation:
         self.conn_cfn = utils.connect_to_aws(boto.cloudformation, self)
 
     def create(self, stack_name, template_body, tags):
+        clear_caches(stack_name)
         stack = self.conn_cfn.create_stack(stack_name=stack_name,
                                            template_body=template_body,
                                            capabilities=['CAPABILITY_IAM'],
@@ -25,14 +42,28 @@ class Cloudformation:
         return stack
 
     def delete(self, stack_name):
+        clear_caches(stack_name)
         stack = self.conn_cfn.delete_stack(stack_name)
         return stack
 
     def stack_done(self, stack_id):
+        """
+        Check if the stack has finished creating, from its latest event
+        of its own. The events of nested stacks, which are also stacks,
+        are in the stack's events and are skipped.
+
+        Args:
+            stack_id(string): The name or id of the stack
+
+        Returns:
+            (bool): True if the stack is created, failed or rolled back
+        """
         stack_events = self.conn_cfn.describe_stack_events(stack_id)
-        if stack_events[0].resource_type == 'AWS::CloudFormation::Stack'\
-                and stack_events[0].resource_status in ['CREATE_COMPLETE', 'CREATE_FAILED', 'ROLLBACK_COMPLETE']:
-            return True
+        for stack_event in stack_events:
+            if stack_event.resource_type == 'AWS::CloudFormation::Stack' and \
+                    (stack_event.physical_resource_id == stack_event.stack_id or
+                     stack_event.logical_resource_id == stack_event.stack_name):
+                return stack_event.resource_status in ['CREATE_COMPLETE', 'CREATE_FAILED', 'ROLLBACK_COMPLETE']
         return False
 
     def wait_for_stack_done(self, stack_id, timeout=3600, interval=30):
@@ -85,6 +116,134 @@ class Cloudformation:
         return resources
 
 
+class StackResourceIndex(object):
+    """
+    An index of the resources in a stack by resource type and logical id,
+    built from a paginated list_stack_resources call. The resources of
+    nested stacks are indexed along with the stack's own, but a logical id
+    used in both refers to the stack's own resource.
+    """
+
+    def __init__(self, resource_summaries):
+        """
+        Args:
+            resource_summaries(list): The StackResourceSummaries returned by list_stack_resources,
+                the stack's own before those of its nested stacks
+        """
+        self.resources = list(resource_summaries)
+        self.by_logical_id = {}
+        self.by_type = {}
+        for resource in self.resources:
+            self.by_logical_id.setdefault(resource['LogicalResourceId'], resource)
+            self.by_type.setdefault(resource['ResourceType'], []).append(resource)
+
+    @classmethod
+    def from_client(cls, client, stack_name_or_id):
+        """
+        List all the resources in a stack and its nested stacks
+
+        Args:
+            client: The boto3 cloudformation client
+            stack_name_or_id (string): Name or id used to identify the stack
+
+        Returns:
+            (StackResourceIndex): The index of the stacks resources
+        """
+        request = {'StackName': stack_name_or_id}
+        resource_summaries = []
+        while True:
+            response = client.list_stack_resources(**request)
+            resource_summaries.extend(response.get('StackResourceSummaries', []))
+            if not response.get('NextToken'):
+                break
+            request['NextToken'] = response['NextToken']
+        for resource in list(resource_summaries):
+            if resource['ResourceType'] == 'AWS::CloudFormation::Stack' and resource.get('PhysicalResourceId'):
+                resource_summaries.extend(cls.from_client(client, resource['PhysicalResourceId']).resources)
+        return cls(resource_summaries)
+
+    def get_by_type(self, resource_type=None):
+        """
+        Get the resources of a type
+
+        Args:
+            resource_type(string): The resource type identifier, if None
+                all the resources are returned
+
+        Returns:
+            (list): The resource summaries
+        """
+        if resource_type is None:
+            return list(self.resources)
+        return list(self.by_type.get(resource_type, []))
+
+    def get_physical_resource_id(self, logical_resource_id):
+        """
+        Get the physical id of a resource
+
+        Args:
+            logical_resource_id(string): The logical id of the resource in the template
+
+        Returns:
+            (string): The physical id, None if the resource was not found
+        """
+        resource = self.by_logical_id.get(logical_resource_id)
+        if resource is None:
+            return None
+        return resource.get('PhysicalResourceId')
+
+
+def get_stack_resource_index(stack_name_or_id,
+                             refresh=False,
+                             client=None,
+                             aws_profile_name=None,
+                             aws_region_name=None):
+    """
+    Get the index of a stacks resources. The index is cached for the rest
+    of the run, by profile, region and stack, so repeated lookups cost no
+    further api calls.
+
+    Args:
+        stack_name_or_id (string): Name or id used to identify the stack
+        refresh(bool): Rebuild the index even if it is cached
+        client: The boto3 cloudformation client to list the resources with,
+            if None a client of the default session is used
+        aws_profile_name(string): The profile of the client
+        aws_region_name(string): The region of the client
+
+    Returns:
+        (StackResourceIndex): The stack resource index
+    """
+    if client is None:
+        if boto3.DEFAULT_SESSION is None:
+            boto3.setup_default_session()
+        aws_profile_name = boto3.DEFAULT_SESSION.profile_name
+        aws_region_name = boto3.DEFAULT_SESSION._session.get_config_variable('region')
+    key = (aws_profile_name, aws_region_name, stack_name_or_id)
+    if refresh or key not in STACK_RESOURCE_INDEXES:
+        if client is None:
+            client = utils.setup_boto3_client(boto3.client('cloudformation'))
+        STACK_RESOURCE_INDEXES[key] = StackResourceIndex.from_client(client, stack_name_or_id)
+    return STACK_RESOURCE_INDEXES[key]
+
+
+def clear_caches(stack_name_or_id=None):
+    """
+    Forget the cached stack listings, and the resources of a stack
+    or of every stack, after stacks are created or deleted
+
+    Args:
+        stack_name_or_id (string): Name or id of the stack whose resources
+            to forget, if None the resources of every stack are forgotten
+    """
+    STACK_INDEXES.clear()
+    if stack_name_or_id is None:
+        STACK_RESOURCE_INDEXES.clear()
+    else:
+        for key in [key for key in STACK_RESOURCE_INDEXES if key[2] == stack_name_or_id]:
+            STACK_RESOURCE_INDEXES.pop(key)
+
+
 def get_resource_type(stack_name_or_id,
                       resource_type=None):
     """
@@ -96,26 +255,135 @@ def get_resource_type(stack_name_or_id,
 
     Returns:
         resources: Set of stack resources containing only
-            the resource type for this stack
+            the resource type for this stack, empty if resource_type is None
+    """
+    if resource_type is None:
+        return []
+    return get_stack_resource_index(stack_name_or_id).get_by_type(resource_type)
+
+
+def get_physical_resource_id(stack_name_or_id, logical_resource_id):
+    """
+    Get the physical id of a stack resource from its logical id
+
+    Args:
+        stack_name_or_id (string): Name or id used to identify the stack
+        logical_resource_id(string): The logical id of the resource in the template
+
+    Returns:
+        (string): The physical id, None if the resource was not found
+    """
+    return get_stack_resource_index(stack_name_or_id).get_physical_resource_id(logical_resource_id)
+
+
+class StackIndex(object):
+    """
+    An index of the stack summaries in an account, built from
+    a paginated list_stacks call
+    """
+
+    def __init__(self, stack_summaries):
+        """
+        Args:
+            stack_summaries(list): The StackSummaries returned by list_stacks
+        """
+        self.stacks = list(stack_summaries)
+        self.by_name = dict((stack['StackName'], stack) for stack in self.stacks)
+
+    @classmethod
+    def from_client(cls, client, stack_statuses=None):
+        """
+        List all the stacks in the account
+
+        Args:
+            client: The boto3 cloudformation client
+            stack_statuses(list): Only list stacks with these statuses,
+                defaults to every status except DELETE_COMPLETE
+
+        Returns:
+            (StackIndex): The index of the stacks found
+        """
+        if stack_statuses is None:
+            stack_statuses = ACTIVE_STACK_STATUSES
+        request = {'StackStatusFilter': list(stack_statuses)}
+        stack_summaries = []
+        while True:
+            response = client.list_stacks(**request)
+            stack_summaries.extend(response.get('StackSummaries', []))
+            if not response.get('NextToken'):
+                break
+            request['NextToken'] = response['NextToken']
+        return cls(stack_summaries)
+
+    def get(self, stack_name):
+        """
+        Get the summary of a stack by its exact name
+
+        Args:
+            stack_name(string): The name of the stack
+
+        Returns:
+            (dict): The stack summary, None if it was not found
+        """
+        return self.by_name.get(stack_name)
+
+    def find(self, search_term=None, prefix=None):
+        """
+        Find stacks by a substring of their stack id, and so their name,
+        and/or a prefix of their name
+
+        Args:
+            search_term(string): A substring of the stack id
+            prefix(string): The start of the stack name
+
+        Returns:
+            (list): The matching stack summaries
+        """
+        return [stack for stack in self.stacks
+                if (search_term is None or search_term in stack['StackId']) and
+                (prefix is None or stack['StackName'].startswith(prefix))]
+
+
+def get_stack_index(stack_statuses=None, refresh=False):
+    """
+    Get the index of stacks in the account. The index is cached for the
+    rest of the run so repeated searches cost no further api calls.
+
+    Args:
+        stack_statuses(list): Only index stacks with these statuses,
+            defaults to every status except DELETE_COMPLETE
+        refresh(bool): Rebuild the index even if it is cached
+
+    Returns:
+        (StackIndex): The stack index
     """
-    client = boto3.client('cloudformation')
-    all_resources = client.describe_stack_resources(StackName=stack_name_or_id)
-    resources = [resource for resource in all_resources['StackResources'] if resource['ResourceType'] == resource_type]
-    return resources
+    if stack_statuses is None:
+        stack_statuses = ACTIVE_STACK_STATUSES
+    key = tuple(sorted(stack_statuses))
+    if refresh or key not in STACK_INDEXES:
+        client = utils.setup_boto3_client(boto3.client('cloudformation'))
+        STACK_INDEXES[key] = StackIndex.from_client(client, stack_statuses)
+    return STACK_INDEXES[key]
 
 
-def get_stack_ids_by_name(stack_name_search_term):
+def get_stack_ids_by_name(stack_name_search_term,
+                          prefix=False,
+                          stack_statuses=None):
     """
     Collect up a set of specific stacks matching a search term
 
     Args:
         stack_name_search_term (string): Search term used to identify the stack
+        prefix(bool): Match the search term to the start of the stack name
+            rather than anywhere in the stack id
+        stack_statuses(list): Only match stacks with these statuses,
+            defaults to every status except DELETE_COMPLETE
 
     Returns:
-        stack_ids: Set of stack ids containing only
+        stack_ids: Set of stack summaries containing only
             the stacks matching the search term.
     """
-    client = boto3.client('cloudformation')
-    all_stacks = client.describe_stacks()
-    stacks = [stack for stack in all_stacks['Stacks'] if stack_name_search_term in stack['StackId']]
-    return stacks
+    stack_index = get_stack_index(stack_statuses)
+    if prefix:
+        return stack_index.find(prefix=stack_name_search_term)
+    return stack_index.find(search_term=stack_name_search_term)
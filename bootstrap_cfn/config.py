@@ -6,7 +6,7 @@ import textwrap
 
 from fabric.colors import green
 
-from troposphere import Base64, FindInMap, GetAZs, GetAtt, Join, Output, Ref, Tags, Template
+from troposphere import Base64, FindInMap, GetAZs, GetAtt, Join, Output, Parameter, Ref, Tags, Template
 from troposphere.autoscaling import AutoScalingGroup, BlockDeviceMapping, \
     EBSBlockDevice, LaunchConfiguration, Tag
 from troposphere.ec2 import InternetGateway, Route, RouteTable, SecurityGroup, \
@@ -24,6 +24,7 @@ from troposphere.s3 import Bucket, BucketPolicy
 import yaml
 
 from bootstrap_cfn import errors, mime_packer, utils
+from bootstrap_cfn.tracing import TRACER
 
 
 class ProjectConfig:
@@ -116,41 +117,154 @@ class ConfigParser(object):
         # Some things possibly used in user data templates
         self.environment = environment
         self.application = application
+        # The name of a long-lived network stack whose VPC, subnets and
+        # route table the stack uses instead of creating its own
+        self.network_stack = (self.data.get('vpc') or {}).get('network_stack')
+        self.shared_network = None
 
+    @TRACER.traced('ConfigParser.process')
     def process(self):
-        template = self.base_template()
+        template, _ = self.build_template()
+        with TRACER.span('render'):
+            return self.render(template)
 
-        vpc = self.vpc()
-        map(template.add_resource, vpc)
+    @TRACER.traced('ConfigParser.process_nested')
+    def process_nested(self):
+        """
+        Generate a parent template with nested child stacks for the
+        network, IAM, data, compute and edge resources, to be uploaded to
+        the S3 bucket set in the nested_stacks config
+
+        Returns:
+            (string): The parent template
+            (dict): The child templates by their S3 key
+        """
+        from bootstrap_cfn import nested
+        template, sections = self.build_template()
+        template_keys = dict((child_stack, self.get_nested_template_key(child_stack))
+                             for child_stack in nested.NESTED_STACKS)
+        template_urls = dict((child_stack, "https://s3.amazonaws.com/{0}/{1}".format(
+            self.data['nested_stacks']['bucket'], key)) for child_stack, key in template_keys.items())
+        with TRACER.span('split'):
+            parent, children = nested.split_template(template, sections, template_urls)
+        with TRACER.span('render'):
+            return self.render(parent), dict((template_keys[child_stack], self.render(child))
+                                             for child_stack, child in children.items())
+
+    def get_nested_template_key(self, child_stack):
+        """
+        Get the S3 key the template of a nested child stack is uploaded to
+
+        Args:
+            child_stack(string): The name of the child stack, eg 'Network'
+        """
+        key_prefix = self.data['nested_stacks'].get('key_prefix', 'cloudformation')
+        return '{0}/{1}/{2}.json'.format(key_prefix.strip('/'), self.stack_name, child_stack)
+
+    def build_template(self):
+        """
+        Generate the template from the config
 
-        iam = self.iam()
-        map(template.add_resource, iam)
+        Returns:
+            (dict): The template
+            (dict): The section of the config that made each resource, by logical id
+        """
+        sections = {}
 
-        ec2 = self.ec2()
-        map(template.add_resource, ec2)
+        def add_section(name, build):
+            with TRACER.span(name):
+                existing_resources = set(template.resources)
+                build()
+                sections.update((logical_id, name) for logical_id in template.resources
+                                if logical_id not in existing_resources)
+
+        with TRACER.span('base_template'):
+            template = self.base_template()
+
+        if self.network_stack:
+            with TRACER.span('shared network'):
+                self.import_network(template)
+        else:
+            add_section('vpc', lambda: map(template.add_resource, self.vpc()))
+
+        add_section('iam', lambda: map(template.add_resource, self.iam()))
+
+        add_section('ec2', lambda: map(template.add_resource, self.ec2()))
 
         if 'elb' in self.data:
-            self.elb(template)
+            add_section('elb', lambda: self.elb(template))
 
         if 'rds' in self.data:
-            self.rds(template)
+            add_section('rds', lambda: self.rds(template))
 
         if 'elasticache' in self.data:
-            self.elasticache(template)
+            add_section('elasticache', lambda: self.elasticache(template))
 
         if 's3' in self.data:
-            self.s3(template)
+            add_section('s3', lambda: self.s3(template))
+
+        with TRACER.span('render'):
+            template = json.loads(template.to_json())
+            if 'includes' in self.data:
+                for inc_path in self.data['includes']:
+                    inc = json.load(open(inc_path))
+                    template = utils.dict_merge(template, inc)
+        return template, sections
 
-        template = json.loads(template.to_json())
-        if 'includes' in self.data:
-            for inc_path in self.data['includes']:
-                inc = json.load(open(inc_path))
-                template = utils.dict_merge(template, inc)
+    @staticmethod
+    def render(template):
         return json.dumps(
             template, sort_keys=True, indent=4, separators=(',', ': '))
 
-    def base_template(self):
+    @TRACER.traced('ConfigParser.process_network')
+    def process_network(self):
+        """
+        Generate the template of the shared network stack named in the vpc
+        config, holding the VPC, subnets, internet gateway and route table
+        that the app stacks import
+
+        Returns:
+            (string): The template
+        """
+        template = Template()
+        template.add_mapping("SubnetConfig", self.subnet_config())
+        map(template.add_resource, self.vpc())
+        return self.render(json.loads(template.to_json()))
+
+    def get_shared_network(self):
+        """
+        Get the network resources of the shared network stack, looking
+        them up the first time
+
+        Returns:
+            (dict): The network resources, see vpc.get_shared_network
+        """
+        from bootstrap_cfn import vpc
+        if self.shared_network is None:
+            self.shared_network = vpc.get_shared_network(self.network_stack)
+        return self.shared_network
+
+    def import_network(self, template):
+        """
+        Import the VPC, subnets and route table of the shared network stack
+        as parameters of the template, named as the resources they replace
+        so they are referred to the same way
+
+        Args:
+            template:
+                The troposphere.Template object
+        """
         from bootstrap_cfn import vpc
+        network = self.get_shared_network()
+        for logical_id, parameter_type in vpc.SHARED_NETWORK_PARAMETERS:
+            template.add_parameter(Parameter(
+                logical_id,
+                Type=parameter_type,
+                Default=network[logical_id],
+                Description="{0} of the network stack {1}".format(logical_id, self.network_stack),
+            ))
+
+    def base_template(self):
         t = Template()
 
         # Get the OS specific data
@@ -159,21 +273,34 @@ class ConfigParser(object):
             os_data.get('region'): {"AMI": os_data.get('ami')},
         })
 
+        if self.network_stack:
+            logging.info('bootstrap-cfn::base_template: Using the VPC of network stack %s' % self.network_stack)
+            t.add_mapping("SubnetConfig", {
+                "VPC": {
+                    "CIDR": self.get_shared_network()['CIDR']
+                }
+            })
+        else:
+            t.add_mapping("SubnetConfig", self.subnet_config())
+
+        return t
+
+    def subnet_config(self):
+        """
+        Get the address blocks of the VPC and its subnets, from the vpc
+        config or else the first free block in the account
+
+        Returns:
+            (dict): The SubnetConfig mapping
+        """
+        from bootstrap_cfn import vpc
         if 'vpc' in self.data:
-            logging.info('bootstrap-cfn::base_template: Using configuration VPC address settings')
+            logging.info('bootstrap-cfn::subnet_config: Using configuration VPC address settings')
             vpc_data = self.data.get('vpc', {})
             vpc_cidr = vpc_data.get('CIDR', '10.0.0.0/16')
             subneta_cidr = vpc_data.get('SubnetA', '10.0.0.0/20')
             subnetb_cidr = vpc_data.get('SubnetB', '10.0.16.0/20')
             subnetc_cidr = vpc_data.get('SubnetC', '10.0.32.0/20')
-            t.add_mapping("SubnetConfig", {
-                "VPC": {
-                    "CIDR": vpc_cidr,
-                    "SubnetA": subneta_cidr,
-                    "SubnetB": subnetb_cidr,
-                    "SubnetC": subnetc_cidr
-                }
-            })
         else:
             default_vpc_cidr_prefix = 24
             default_vpc_subnet_prefix = 28
@@ -186,29 +313,27 @@ class ConfigParser(object):
                     subnet_prefix=default_vpc_subnet_prefix)
             )
             if available_cidr_block and len(subnet_cidr_blocks) > (default_vpc_subnet_count - 1):
-                logging.info('bootstrap-cfn::base_template: Using dynamic VPC address settings')
+                logging.info('bootstrap-cfn::subnet_config: Using dynamic VPC address settings')
                 vpc_cidr = available_cidr_block
                 subneta_cidr = subnet_cidr_blocks[0]
                 subnetb_cidr = subnet_cidr_blocks[1]
                 subnetc_cidr = subnet_cidr_blocks[2]
             else:
                 # Fallback to default
-                logging.info('bootstrap-cfn::base_template: Using static fallback VPC address settings')
+                logging.info('bootstrap-cfn::subnet_config: Using static fallback VPC address settings')
                 vpc_cidr = "10.0.0.0/24"
                 subneta_cidr = "10.0.0.0/20"
                 subnetb_cidr = "10.0.16.0/20"
                 subnetc_cidr = "10.0.32.0/20"
 
-            t.add_mapping("SubnetConfig", {
-                "VPC": {
-                    "CIDR": vpc_cidr,
-                    "SubnetA": subneta_cidr,
-                    "SubnetB": subnetb_cidr,
-                    "SubnetC": subnetc_cidr
-                }
-            })
-
-        return t
+        return {
+            "VPC": {
+                "CIDR": vpc_cidr,
+                "SubnetA": subneta_cidr,
+                "SubnetB": subnetb_cidr,
+                "SubnetC": subnetc_cidr
+            }
+        }
 
     def vpc(self):
 
@@ -1139,14 +1264,15 @@ class ConfigParser(object):
             LaunchConfigurationName=Ref(launch_config),
             HealthCheckGracePeriod=health_check_grace_period,
             HealthCheckType=health_check_type,
+        )
+        # The gateway of a shared network stack is attached already
+        if not self.network_stack:
             # should be equivalent to DependsOn=["AttachGateway"],
             # but if not, ensure the tests have been updated too
-            DependsOn=[
+            scaling_group.DependsOn = [
                 v.title
                 for v in self.vpc()
                 if 'AWS::EC2::VPCGatewayAttachment' == v.resource['Type']]
-
-        )
         resources.append(scaling_group)
 
         return resources
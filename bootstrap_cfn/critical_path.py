@@ -0,0 +1,281 @@
+from bootstrap_cfn import errors
+
+# Typical seconds CloudFormation takes to create each resource type, used
+# to weigh the resources when none are given
+TYPICAL_CREATE_SECONDS = {
+    'AWS::AutoScaling::AutoScalingGroup': 120,
+    'AWS::AutoScaling::LaunchConfiguration': 5,
+    'AWS::CloudFormation::Stack': 300,
+    'AWS::EC2::InternetGateway': 20,
+    'AWS::EC2::Route': 20,
+    'AWS::EC2::RouteTable': 10,
+    'AWS::EC2::SecurityGroup': 10,
+    'AWS::EC2::SecurityGroupIngress': 5,
+    'AWS::EC2::Subnet': 10,
+    'AWS::EC2::SubnetRouteTableAssociation': 10,
+    'AWS::EC2::VPC': 20,
+    'AWS::EC2::VPCGatewayAttachment': 20,
+    'AWS::ElastiCache::ReplicationGroup': 600,
+    'AWS::ElastiCache::SubnetGroup': 5,
+    'AWS::ElasticLoadBalancing::LoadBalancer': 60,
+    'AWS::IAM::InstanceProfile': 120,
+    'AWS::IAM::Policy': 15,
+    'AWS::IAM::Role': 15,
+    'AWS::RDS::DBInstance': 600,
+    'AWS::RDS::DBSubnetGroup': 5,
+    'AWS::Route53::RecordSetGroup': 60,
+    'AWS::S3::Bucket': 20,
+    'AWS::S3::BucketPolicy': 5,
+}
+DEFAULT_CREATE_SECONDS = 30
+
+# The kinds of dependency between resources
+DEPENDS_ON = 'DependsOn'
+REF = 'Ref'
+GET_ATT = 'GetAtt'
+
+
+def find_references(value, resource_names):
+    """
+    Find the resources a value refers to with Ref or Fn::GetAtt
+
+    Args:
+        value: A resource or part of one
+        resource_names(set): The logical ids of the resources in the template
+
+    Returns:
+        (dict): The kind of reference, REF or GET_ATT, by logical id
+    """
+    references = {}
+    if isinstance(value, list):
+        for item in value:
+            references.update(find_references(item, resource_names))
+    elif isinstance(value, dict):
+        for key, item in value.items():
+            if key == 'Ref' and item in resource_names:
+                references.setdefault(item, REF)
+            elif key == 'Fn::GetAtt':
+                name = item[0] if isinstance(item, list) else item.split('.')[0]
+                if name in resource_names:
+                    references[name] = GET_ATT
+            else:
+                references.update(find_references(item, resource_names))
+    return references
+
+
+def build_graph(template):
+    """
+    Build the graph of the dependencies between the resources of a template
+
+    Args:
+        template(dict): The template
+
+    Returns:
+        (dict): The dependencies of each resource by logical id, each a dict
+            of the kinds of dependency, DEPENDS_ON, REF or GET_ATT, by the
+            logical id of the resource depended on
+    """
+    resources = template.get('Resources', {})
+    resource_names = set(resources)
+    graph = {}
+    for logical_id, resource in resources.items():
+        dependencies = {}
+        for name, kind in find_references(dict((key, item) for key, item in resource.items()
+                                               if key != 'DependsOn'), resource_names).items():
+            dependencies.setdefault(name, set()).add(kind)
+        depends_on = resource.get('DependsOn', [])
+        for name in depends_on if isinstance(depends_on, list) else [depends_on]:
+            if name in resource_names:
+                dependencies.setdefault(name, set()).add(DEPENDS_ON)
+        graph[logical_id] = dependencies
+    return graph
+
+
+def get_durations(template, durations=None):
+    """
+    Get the seconds each resource of a template typically takes to create
+
+    Args:
+        template(dict): The template
+        durations(dict): Seconds by resource type, overriding the typical ones
+
+    Returns:
+        (dict): The seconds by logical id
+    """
+    type_durations = dict(TYPICAL_CREATE_SECONDS, **(durations or {}))
+    return dict((logical_id, float(type_durations.get(resource['Type'], DEFAULT_CREATE_SECONDS)))
+                for logical_id, resource in template.get('Resources', {}).items())
+
+
+def sort_topologically(graph):
+    """
+    Returns:
+        (list): The logical ids, each after the resources it depends on
+
+    Raises:
+        CfnConfigError: The resources depend on each other in a cycle
+    """
+    ordered = []
+    remaining = dict((logical_id, set(dependencies)) for logical_id, dependencies in graph.items())
+    while remaining:
+        ready = sorted(logical_id for logical_id, dependencies in remaining.items() if not dependencies)
+        if not ready:
+            raise errors.CfnConfigError("The resources depend on each other in a cycle: {0}".format(
+                ', '.join(sorted(remaining))))
+        for logical_id in ready:
+            del remaining[logical_id]
+        for dependencies in remaining.values():
+            dependencies.difference_update(ready)
+        ordered.extend(ready)
+    return ordered
+
+
+def schedule(graph, durations, order, skip_edge=None):
+    """
+    Work out when each resource finishes when every resource starts as
+    soon as the resources it depends on are created
+
+    Args:
+        skip_edge(tuple): A (resource, dependency) edge to leave out
+
+    Returns:
+        (dict): The seconds each resource starts at, by logical id
+        (dict): The seconds each resource finishes at, by logical id
+    """
+    start_times = {}
+    finish_times = {}
+    for logical_id in order:
+        start_times[logical_id] = max([finish_times[dependency] for dependency in graph[logical_id]
+                                       if (logical_id, dependency) != skip_edge] or [0.0])
+        finish_times[logical_id] = start_times[logical_id] + durations[logical_id]
+    return start_times, finish_times
+
+
+class CriticalPathAnalysis(object):
+    """
+    The critical path of a template, the chain of resources that decides
+    how long the stack takes to create, and the DependsOn edges that hold
+    resources back without them referring to the resource they wait for
+    """
+
+    def __init__(self, template, durations=None):
+        """
+        Args:
+            template(dict): The template
+            durations(dict): Seconds to create each resource type, overriding the typical ones
+        """
+        self.resource_types = dict((logical_id, resource['Type'])
+                                   for logical_id, resource in template.get('Resources', {}).items())
+        self.graph = build_graph(template)
+        self.durations = get_durations(template, durations)
+        self.order = sort_topologically(self.graph)
+        self.start_times, self.finish_times = schedule(self.graph, self.durations, self.order)
+        self.total_seconds = max(self.finish_times.values() or [0.0])
+        self.critical_path = self.get_critical_path()
+        self.slack = self.get_slack()
+        self.serialized = self.get_serialized()
+
+    def get_critical_path(self):
+        """
+        Returns:
+            (list): The logical ids of the chain of resources that finishes last, in creation order
+        """
+        if not self.finish_times:
+            return []
+        path = [max(sorted(self.finish_times), key=lambda logical_id: self.finish_times[logical_id])]
+        while self.graph[path[-1]]:
+            path.append(max(sorted(self.graph[path[-1]]), key=lambda logical_id: self.finish_times[logical_id]))
+        return list(reversed(path))
+
+    def get_slack(self):
+        """
+        Returns:
+            (dict): The seconds each resource could be delayed without delaying the stack
+        """
+        latest_finish_times = {}
+        for logical_id in reversed(self.order):
+            latest_finish_times[logical_id] = min(
+                [latest_finish_times[dependent] - self.durations[dependent]
+                 for dependent, dependencies in self.graph.items() if logical_id in dependencies] or
+                [self.total_seconds])
+        return dict((logical_id, latest_finish_times[logical_id] - self.finish_times[logical_id])
+                    for logical_id in self.order)
+
+    def get_serialized(self):
+        """
+        Find the DependsOn edges that are not also references and hold back
+        the resource they are on
+
+        Returns:
+            (list): Dicts of the resource, the resource it depends on, the
+                seconds the resource is held back and the seconds the stack
+                would be created sooner without the edge, most costly first
+        """
+        serialized = []
+        for logical_id in self.order:
+            for dependency, kinds in sorted(self.graph[logical_id].items()):
+                if kinds != set([DEPENDS_ON]):
+                    continue
+                start_time = max([self.finish_times[other] for other in self.graph[logical_id]
+                                  if other != dependency] or [0.0])
+                delay = self.finish_times[dependency] - start_time
+                if delay <= 0:
+                    continue
+                _, finish_times = schedule(self.graph, self.durations, self.order,
+                                           skip_edge=(logical_id, dependency))
+                serialized.append({
+                    'resource': logical_id,
+                    'depends_on': dependency,
+                    'delay': delay,
+                    'saving': self.total_seconds - max(finish_times.values()),
+                })
+        return sorted(serialized, key=lambda edge: (-edge['saving'], -edge['delay'], edge['resource']))
+
+    def to_dict(self):
+        return {
+            'total_seconds': self.total_seconds,
+            'critical_path': [{
+                'resource': logical_id,
+                'type': self.resource_types[logical_id],
+                'start': self.start_times[logical_id],
+                'finish': self.finish_times[logical_id],
+            } for logical_id in self.critical_path],
+            'serialized': self.serialized,
+            'slack': self.slack,
+        }
+
+    def format_report(self):
+        """
+        Returns:
+            (string): The critical path and the serialized resources, as text
+        """
+        lines = ["Critical path, {0:.0f}s to create {1} resources:".format(self.total_seconds, len(self.order))]
+        for logical_id in self.critical_path:
+            lines.append("    {0:<40} {1:<45} {2:>6.0f}s {3:>6.0f}s".format(
+                logical_id, self.resource_types[logical_id], self.start_times[logical_id],
+                self.finish_times[logical_id]))
+        if self.serialized:
+            lines.append("DependsOn edges holding resources back:")
+            for edge in self.serialized:
+                lines.append("    {0} on {1}: delays it {2:.0f}s, the stack {3:.0f}s".format(
+                    edge['resource'], edge['depends_on'], edge['delay'], edge['saving']))
+        return '\n'.join(lines)
+
+
+def analyze_template(template, durations=None):
+    """
+    Find the critical path of a template and the resources serialized by
+    DependsOn, weighing each resource with the typical time to create its
+    type
+
+    Args:
+        template(dict): The template
+        durations(dict): Seconds to create each resource type, overriding the typical ones
+
+    Returns:
+        (CriticalPathAnalysis): The analysis
+
+    Raises:
+        CfnConfigError: The resources depend on each other in a cycle
+    """
+    return CriticalPathAnalysis(template, durations)
@@ -1,7 +1,5 @@
 import logging
 
-import time
-
 import boto.ec2.elb
 
 from boto.exception import BotoServerError
@@ -12,6 +10,11 @@ from bootstrap_cfn import cloudformation, iam, utils
 
 from bootstrap_cfn.errors import BootstrapCfnError, CloudResourceNotFoundError
 
+from bootstrap_cfn.retry import RETRY_POLICY
+
+# The error codes returned while a newly uploaded certificate is not yet visible
+CERTIFICATE_EVENTUAL_CONSISTENCY_ERROR_CODES = ['CertificateNotFound']
+
 
 class ELB:
 
@@ -31,17 +34,18 @@ class ELB:
             aws_profile_name, aws_region_name
         )
 
-    def set_ssl_certificates(self, cert_names, stack_name, max_retries=1, retry_delay=10):
+    def set_ssl_certificates(self, cert_names, stack_name, max_attempts=None):
         """
         Look for SSL listeners on all the load balancers connected to
         this stack, then set update the certificate to that of the config.
-        We can retry with delay, default is to only try once.
+        A newly uploaded certificate can take a while to be visible to the
+        ELB, so we retry by the retry policy while it is not found.
 
         Args:
             ssl_config (dictionary): Certification names to corresponding data
             stack_name (string): Name of the stack
-            max_retries(int): The number of retries to carry out on the operation
-            retry_delay(int): The retry delay of the operation
+            max_attempts(int): The number of attempts at setting each certificate,
+                defaults to iam.CERTIFICATE_MAX_ATTEMPTS
 
         Returns:
             list: The list of the certificates that were replaced
@@ -87,29 +91,27 @@ class ELB:
                                 if 'HTTPS' in listener.get_tuple():
                                     previous_cert_arn = listener[4]
                             # Set the current certificate on the listener to the new one
-                            retries = 0
-                            while retries < max_retries:
-                                retries += 1
-                                try:
-                                    self.conn_elb.set_lb_listener_SSL_certificate(load_balancer.name,
-                                                                                  in_port,
-                                                                                  cert_arn)
-                                    if previous_cert_arn:
-                                        previous_cert_name = previous_cert_arn.split('/')[1].split("-%s" % stack_name)[0]
-                                        replaced_certificates.append(previous_cert_name)
-
-                                    logging.info("update_certs:Successfully set ssl cert to '%s', "
-                                                 " replacing cert '%s'"
-                                                 % (cert_arn, previous_cert_name))
-
-                                    break
-                                except BotoServerError as e:
-                                    logging.warning("update_certs: Cannot set ssl certs, reason '%s', "
-                                                    "waiting %s seconds on retry %s/%s"
-                                                    % (e.error_message, retry_delay, retries, max_retries))
-                                    # Only sleep if we're going to try again
-                                    if retries < max_retries:
-                                        time.sleep(retry_delay)
+                            try:
+                                RETRY_POLICY.run(
+                                    lambda: self.conn_elb.set_lb_listener_SSL_certificate(load_balancer.name,
+                                                                                          in_port,
+                                                                                          cert_arn),
+                                    'elasticloadbalancing', 'SetLoadBalancerListenerSSLCertificate',
+                                    retryable_codes=CERTIFICATE_EVENTUAL_CONSISTENCY_ERROR_CODES,
+                                    max_attempts=max_attempts or iam.CERTIFICATE_MAX_ATTEMPTS,
+                                    base_delay=iam.CERTIFICATE_BASE_DELAY,
+                                    only_codes=True)
+                                previous_cert_name = None
+                                if previous_cert_arn:
+                                    previous_cert_name = previous_cert_arn.split('/')[1].split("-%s" % stack_name)[0]
+                                    replaced_certificates.append(previous_cert_name)
+
+                                logging.info("update_certs:Successfully set ssl cert to '%s', "
+                                             " replacing cert '%s'"
+                                             % (cert_arn, previous_cert_name))
+                            except BotoServerError as e:
+                                logging.warning("update_certs: Cannot set ssl certs, reason '%s'"
+                                                % (e.error_message))
             else:
                 # Throw key error. There being no load balancers to update is not
                 # necessarily a problem but since the caller expected there to be let
@@ -119,6 +121,28 @@ class ELB:
 
         return replaced_certificates
 
+    def get_ssl_certificate_arns(self, stack_name):
+        """
+        Get the arns of the certificates set on the HTTPS listeners of
+        the load balancers in a stack
+
+        Args:
+            stack_name (string): Name of the stack
+
+        Returns:
+            list: The certificate arns currently in use
+        """
+        load_balancer_resources = self.cfn.get_stack_load_balancers(stack_name)
+        found_load_balancer_names = [lb["PhysicalResourceId"] for lb in load_balancer_resources]
+        if not found_load_balancer_names:
+            return []
+        cert_arns = set()
+        for load_balancer in self.conn_elb.get_all_load_balancers(load_balancer_names=found_load_balancer_names):
+            for listener in load_balancer.listeners:
+                if 'HTTPS' in listener.get_tuple():
+                    cert_arns.add(listener[4])
+        return list(cert_arns)
+
     def list_domain_names(self, stack_name):
         """
         Return a list of dicts, each containing the ELB name and corresponding DNS Name for
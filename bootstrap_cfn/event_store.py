@@ -0,0 +1,242 @@
+import calendar
+import os
+import sqlite3
+
+# The default path of the event store, a SQLite database
+DEFAULT_EVENT_STORE = os.path.join('~', '.bootstrap-cfn', 'events.sqlite')
+
+# The operations whose durations are worked out from the events
+OPERATIONS = ['CREATE', 'UPDATE', 'DELETE']
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS events (
+        event_id TEXT PRIMARY KEY,
+        stack_id TEXT NOT NULL,
+        stack_name TEXT NOT NULL,
+        logical_id TEXT NOT NULL,
+        physical_id TEXT,
+        resource_type TEXT NOT NULL,
+        status TEXT NOT NULL,
+        reason TEXT,
+        timestamp REAL NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS events_resource ON events (stack_name, resource_type, logical_id)",
+    """CREATE TABLE IF NOT EXISTS durations (
+        stack_id TEXT NOT NULL,
+        stack_name TEXT NOT NULL,
+        logical_id TEXT NOT NULL,
+        resource_type TEXT NOT NULL,
+        operation TEXT NOT NULL,
+        started REAL NOT NULL,
+        finished REAL NOT NULL,
+        seconds REAL NOT NULL,
+        PRIMARY KEY (stack_id, logical_id, started)
+    )""",
+    "CREATE INDEX IF NOT EXISTS durations_resource_type ON durations (operation, resource_type)",
+]
+
+
+def to_seconds(timestamp):
+    """
+    Args:
+        timestamp(datetime): A naive UTC time, as boto gives event times
+
+    Returns:
+        (float): The seconds since the epoch
+    """
+    return calendar.timegm(timestamp.utctimetuple()) + timestamp.microsecond / 1000000.0
+
+
+def percentile(values, fraction):
+    """
+    Get a percentile of some values, interpolating between the closest two
+
+    Args:
+        values(list): The values
+        fraction(float): The percentile as a fraction, eg 0.95
+
+    Returns:
+        (float): The percentile, or None if there are no values
+    """
+    values = sorted(values)
+    if not values:
+        return None
+    position = (len(values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def get_durations(events):
+    """
+    Work out how long each operation on a resource took from its events
+
+    Args:
+        events(list): (status, timestamp) tuples of the events of a resource,
+            in time order
+
+    Returns:
+        (list): (operation, started, finished) tuples of the operations that
+            completed. An operation starts at its first IN_PROGRESS event.
+    """
+    durations = []
+    started = {}
+    for status, timestamp in events:
+        for operation in OPERATIONS:
+            if status == operation + '_IN_PROGRESS':
+                started.setdefault(operation, timestamp)
+            elif status == operation + '_COMPLETE' and operation in started:
+                durations.append((operation, started.pop(operation), timestamp))
+            elif status == operation + '_FAILED':
+                started.pop(operation, None)
+    return durations
+
+
+class EventStore(object):
+    """
+    Keeps the stack events seen by tail in a local SQLite database, with
+    the time each resource took to create, update or delete, so the
+    typical durations of each resource type can be looked up. The
+    database is only created once there are events to keep.
+    """
+
+    def __init__(self, path=DEFAULT_EVENT_STORE):
+        """
+        Args:
+            path(string): The path of the database
+        """
+        self.path = os.path.expanduser(path)
+        self.connection = None
+
+    def connect(self):
+        if self.connection is None:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            self.connection = sqlite3.connect(self.path)
+            with self.connection:
+                for statement in SCHEMA:
+                    self.connection.execute(statement)
+        return self.connection
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def add_events(self, events):
+        """
+        Keep stack events, and work out the durations of the operations on
+        their resources. Events kept already are ignored. The events of the
+        stack itself are kept but have no durations worked out.
+
+        Args:
+            events(list): boto StackEvents
+
+        Returns:
+            (int): The number of events that were not kept already
+        """
+        events = list(events)
+        if not events:
+            return 0
+        connection = self.connect()
+        added = 0
+        resources = set()
+        with connection:
+            for event in events:
+                cursor = connection.execute(
+                    "INSERT OR IGNORE INTO events VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (event.event_id, event.stack_id, event.stack_name, event.logical_resource_id,
+                     event.physical_resource_id, event.resource_type, event.resource_status,
+                     event.resource_status_reason, to_seconds(event.timestamp)))
+                added += cursor.rowcount
+                if event.physical_resource_id != event.stack_id:
+                    resources.add((event.stack_id, event.stack_name, event.logical_resource_id, event.resource_type))
+            for stack_id, stack_name, logical_id, resource_type in sorted(resources):
+                self.update_durations(stack_id, stack_name, logical_id, resource_type)
+        return added
+
+    def update_durations(self, stack_id, stack_name, logical_id, resource_type):
+        """
+        Work out the durations of the operations on a resource again from
+        all its events kept
+        """
+        events = self.connection.execute(
+            "SELECT status, timestamp FROM events WHERE stack_id = ? AND logical_id = ? ORDER BY timestamp, rowid",
+            (stack_id, logical_id)).fetchall()
+        self.connection.execute("DELETE FROM durations WHERE stack_id = ? AND logical_id = ?",
+                                (stack_id, logical_id))
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO durations VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [(stack_id, stack_name, logical_id, resource_type, operation, started, finished, finished - started)
+             for operation, started, finished in get_durations(events)])
+
+    def get_percentiles(self, operation='CREATE'):
+        """
+        Get the p50 and p95 durations of an operation on each resource type,
+        across all the stacks whose events were kept
+
+        Args:
+            operation(string): CREATE, UPDATE or DELETE
+
+        Returns:
+            (dict): Dicts of the count, p50, p95 and total seconds, by resource type
+        """
+        if self.connection is None and not os.path.exists(self.path):
+            return {}
+        seconds = {}
+        for resource_type, duration in self.connect().execute(
+                "SELECT resource_type, seconds FROM durations WHERE operation = ?", (operation,)):
+            seconds.setdefault(resource_type, []).append(duration)
+        return dict((resource_type, {
+            'count': len(durations),
+            'p50': percentile(durations, 0.5),
+            'p95': percentile(durations, 0.95),
+            'total': sum(durations),
+        }) for resource_type, durations in seconds.items())
+
+
+def format_percentiles(percentiles):
+    """
+    Returns:
+        (string): A table of the durations of each resource type, the
+            resource types taking the most time in total first
+    """
+    header = ('Resource type', 'Count', 'p50 s', 'p95 s', 'Total s')
+    rows = [header] + [
+        (resource_type, str(stats['count']), '%.0f' % stats['p50'], '%.0f' % stats['p95'], '%.0f' % stats['total'])
+        for resource_type, stats in sorted(percentiles.items(), key=lambda item: (-item[1]['total'], item[0]))]
+    widths = [max(len(row[column]) for row in rows) for column in range(len(header))]
+    lines = []
+    for index, row in enumerate(rows):
+        lines.append('  '.join(value.ljust(widths[column]) if column == 0 else value.rjust(widths[column])
+                               for column, value in enumerate(row)))
+        if index == 0:
+            lines.append('  '.join('-' * width for width in widths))
+    return '\n'.join(lines)
+
+
+def get_eta(in_progress, history, now):
+    """
+    Estimate when the resources in progress finish from the p50 durations
+    of their types
+
+    Args:
+        in_progress(dict): (operation, resource type, start seconds) tuples
+            of the resources in progress, by logical id
+        history(dict): The durations of each resource type, from
+            EventStore.get_percentiles, by operation
+        now(float): The seconds since the epoch
+
+    Returns:
+        (tuple): The seconds until the last of them is expected to finish
+            and its logical id, or None if none of their types have history
+    """
+    estimates = []
+    for logical_id, (operation, resource_type, started) in in_progress.items():
+        percentiles = history.get(operation, {})
+        if resource_type in percentiles:
+            estimates.append((max(percentiles[resource_type]['p50'] - (now - started), 0), logical_id))
+    if not estimates:
+        return None
+    return max(sorted(estimates))
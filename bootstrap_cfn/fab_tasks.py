@@ -1,5 +1,7 @@
 #!/usr/bin/env python
 
+import functools
+import json
 import logging
 import os
 import re
@@ -9,22 +11,33 @@ import uuid
 import boto.exception
 import boto3
 
-from fabric.api import env, task
+from fabric.api import env
+from fabric.api import task as fabric_task
 from fabric.colors import green, red
 from fabric.utils import abort
 
+import yaml
+
+from bootstrap_cfn import utils
 from bootstrap_cfn.autoscale import Autoscale
-from bootstrap_cfn.cloudformation import Cloudformation
+from bootstrap_cfn.cloudformation import Cloudformation, get_stack_index
 from bootstrap_cfn.config import ConfigParser, ProjectConfig
+from bootstrap_cfn.critical_path import analyze_template
 from bootstrap_cfn.elb import ELB
 from bootstrap_cfn.errors import (ActiveTagExistConflictError, BootstrapCfnError,
                                   CfnConfigError, CloudResourceNotFoundError, DNSRecordNotFoundError,
                                   PublicELBNotFoundError, StackRecordNotFoundError, TagRecordExistConflictError,
                                   TagRecordNotFoundError, UpdateDNSRecordError, ZoneIDNotFoundError)
+from bootstrap_cfn.event_store import DEFAULT_EVENT_STORE, EventStore, format_percentiles
 from bootstrap_cfn.iam import IAM
+from bootstrap_cfn.metrics import API_CALL_STATS
+from bootstrap_cfn.nested import upload_templates
+from bootstrap_cfn.profiling import PROFILER
 from bootstrap_cfn.r53 import R53
+from bootstrap_cfn.retry import RETRY_POLICY
+from bootstrap_cfn.tracing import TRACER
 from bootstrap_cfn.utils import tail
-from bootstrap_cfn.vpc import VPC
+from bootstrap_cfn.vpc import VPC, VpcPeeringMesh
 
 
 # Default fab config. Set via the tasks below or --set
@@ -35,11 +48,21 @@ env.setdefault('config')
 env.setdefault('stack_passwords')
 env.setdefault('blocking', True)
 env.setdefault('aws_region', 'eu-west-1')
+env.setdefault('api_stats', True)
+env.setdefault('api_stats_json')
+env.setdefault('api_stats_prometheus')
+env.setdefault('trace')
+env.setdefault('profile')
+env.setdefault('event_store', DEFAULT_EVENT_STORE)
 
 # GLOBAL VARIABLES
 TIMEOUT = 3600
 RETRY_INTERVAL = 10
 
+# Statuses of pool stacks that were not created and never will be, these
+# are deleted and replaced when the pool is filled
+FAILED_POOL_STACK_STATUSES = ['CREATE_FAILED', 'ROLLBACK_FAILED', 'ROLLBACK_COMPLETE']
+
 # This is needed because pkgutil wont pick up modules
 # imported in a fabfile.
 path = env.real_fabfile or os.getcwd()
@@ -50,6 +73,142 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("bootstrap-cfn")
 logging.getLogger("requests").setLevel(logging.WARNING)
 
+# The number of tasks running, tasks calling other tasks are nested
+task_depth = 0
+
+
+def task(func):
+    """
+    Declare a fab task that accounts for the AWS api calls made while
+    it runs, reporting them when the outermost task finishes
+
+    If env.trace is set to a path, the time spent in each task is traced
+    along with its phases, AWS calls and sleeps, and the trace of all the
+    tasks run so far is written there as a Chrome trace event file.
+
+    If env.profile is set to a path, the CPU time of the tasks is profiled
+    and written there, see the profile task.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        global task_depth
+        if task_depth == 0:
+            API_CALL_STATS.reset(func.__name__)
+            RETRY_POLICY.stats.reset()
+            if env.trace and not TRACER.enabled:
+                TRACER.start()
+            if env.profile and not PROFILER.enabled:
+                PROFILER.start()
+        task_depth += 1
+        try:
+            with TRACER.span(func.__name__, args=list(args), kwargs=kwargs), PROFILER.profiled():
+                return func(*args, **kwargs)
+        finally:
+            task_depth -= 1
+            if task_depth == 0:
+                report_api_calls()
+                write_trace()
+                write_profile()
+    return fabric_task(wrapper)
+
+
+def report_api_calls():
+    """
+    Print a summary of the AWS api calls made by the task, and write them
+    to the files set in env.api_stats_json and env.api_stats_prometheus
+    """
+    if not API_CALL_STATS.calls:
+        return
+    if str(env.api_stats).lower() not in ['false', '0', 'no', 'none']:
+        print
+        print "AWS api calls made by {0}:".format(API_CALL_STATS.task_name)
+        print API_CALL_STATS.format_table()
+        retry_totals = RETRY_POLICY.stats.get_totals()
+        if retry_totals:
+            print "Retries: {0}".format(', '.join(
+                "{0} {1} ({2:.1f}s waiting)".format(total['retries'], category, total['delay'])
+                for category, total in sorted(retry_totals.items())))
+    try:
+        if env.api_stats_json:
+            API_CALL_STATS.write_json(env.api_stats_json)
+        if env.api_stats_prometheus:
+            API_CALL_STATS.write_prometheus(env.api_stats_prometheus)
+    except (IOError, OSError) as e:
+        logger.warning("report_api_calls: Could not write the api call stats: {0}".format(e))
+
+
+def write_trace():
+    """
+    Write the trace of the tasks run so far to the file set in env.trace
+    """
+    if not (env.trace and TRACER.enabled):
+        return
+    try:
+        TRACER.write(env.trace)
+    except (IOError, OSError) as e:
+        logger.warning("write_trace: Could not write the trace: {0}".format(e))
+
+
+def write_profile():
+    """
+    Write the profile of the tasks run so far to the file set in env.profile
+    """
+    if not (env.profile and PROFILER.enabled):
+        return
+    try:
+        PROFILER.write(env.profile)
+    except (IOError, OSError) as e:
+        logger.warning("write_profile: Could not write the profile: {0}".format(e))
+
+
+def get_event_store():
+    """
+    Returns:
+        (EventStore): The store of the stack events set in env.event_store,
+            or None if it is turned off
+    """
+    if str(env.event_store).lower() in ['false', '0', 'no', 'none', '']:
+        return None
+    return EventStore(env.event_store)
+
+
+@task
+def resource_durations(operation='CREATE'):
+    """
+    Show how long each resource type takes, from the stack events seen
+    by the tasks so far
+
+    The events tailed while creating, updating and deleting stacks are
+    kept in env.event_store, ~/.bootstrap-cfn/events.sqlite by default.
+    The p50 and p95 durations of each resource type are shown across all
+    the stacks, the resource types taking the most time in total first.
+
+    Args:
+        operation: CREATE, UPDATE or DELETE
+    """
+    event_store = get_event_store()
+    percentiles = event_store.get_percentiles(operation.upper()) if event_store else {}
+    if not percentiles:
+        print "No {0} durations kept in the event store".format(operation.upper())
+        return percentiles
+    print format_percentiles(percentiles)
+    return percentiles
+
+
+@task
+def profile(out='bootstrap_cfn.prof'):
+    """
+    Profile the CPU time of the tasks that follow
+
+    The profile of all the tasks run after this one is written to out as
+    pstats, to be read with python -m pstats or snakeviz, and as collapsed
+    stacks to out.collapsed, to be drawn with flamegraph.pl or speedscope.
+
+    Args:
+        out: The path to write the pstats to
+    """
+    env.profile = out
+
 
 @task
 def aws(profile_name):
@@ -67,6 +226,7 @@ def aws(profile_name):
     # Setup boto so we actually use this environment
     boto3.setup_default_session(profile_name=env.aws,
                                 region_name=env.aws_region)
+    utils.instrument_boto3_session(boto3.DEFAULT_SESSION)
 
 
 @task
@@ -489,10 +649,11 @@ def get_basic_config():
     Returns the basic unparsed configuration file for the project
     """
     _validate_fabric_env()
-    project_config = ProjectConfig(
-        env.config,
-        env.environment,
-        passwords=env.stack_passwords)
+    with TRACER.span('load config', config=env.config):
+        project_config = ProjectConfig(
+            env.config,
+            env.environment,
+            passwords=env.stack_passwords)
     return project_config.config
 
 
@@ -557,7 +718,7 @@ def cfn_delete(force=False, pre_delete_callbacks=None):
         if not env.blocking:
             print 'Running in non blocking mode. Exiting.'
             sys.exit(0)
-        tail(cfn, stack_name)
+        tail(cfn, stack_name, get_event_store())
 
         if cfn.stack_missing(stack_name):
             print green("Stack successfully deleted")
@@ -603,24 +764,78 @@ def cfn_create(test=False):
     Using the configuration files, a full cloudformation
     specification will be generated and used to create a
     stack on AWS.
+
+    If nested_stacks is set in the config, the stack is created as a
+    parent stack with nested child stacks, whose templates are uploaded
+    to the S3 bucket set there first.
     """
-    stack_name = get_stack_name(new=True)
+    with TRACER.span('get_stack_name'):
+        stack_name = get_stack_name(new=True)
     cfn_config = get_config()
 
     cfn = get_connection(Cloudformation)
     if test:
-        print cfn_config.process()
+        if 'nested_stacks' in cfn_config.data:
+            template, child_templates = cfn_config.process_nested()
+            print template
+            for key, child_template in sorted(child_templates.items()):
+                print "\n{0}:".format(key)
+                print child_template
+        else:
+            print cfn_config.process()
         return
+    stack = start_stack_create(cfn, stack_name, cfn_config)
+
+    print green("\nSTACK {0} CREATING...\n").format(stack_name)
+    if not env.blocking:
+        print 'Running in non blocking mode. Exiting.'
+        sys.exit(0)
+
+    tail(cfn, stack_name, get_event_store())
+    stack_evt = cfn.get_last_stack_event(stack)
+
+    if stack_evt.resource_status == 'CREATE_COMPLETE':
+        print green('Successfully built stack {0}.'.format(stack))
+    else:
+        # So delete the SSL cert that we uploaded
+        if 'ssl' in cfn_config.data:
+            get_connection(IAM).delete_ssl_certificate(cfn_config.ssl(), stack_name)
+        abort('Failed to create stack: {0}'.format(stack))
+    return True
+
+
+def start_stack_create(cfn, stack_name, cfn_config):
+    """
+    Upload the SSL certificates and nested templates a stack needs and
+    start creating it, without waiting for it to be created. If the stack
+    can not be created it is deleted and the task aborted.
+
+    Args:
+        cfn(Cloudformation): The connection to cloudformation
+        stack_name(string): The name of the stack
+        cfn_config(ConfigParser): The config of the stack
+
+    Returns:
+        The id of the stack
+    """
     # Upload any SSL certs that we may need for the stack.
     if 'ssl' in cfn_config.data:
         print green("Uploading SSL certificates to stack")
         iam = get_connection(IAM)
-        iam.upload_ssl_certificate(cfn_config.ssl(), stack_name)
+        with TRACER.span('upload_ssl_certificate'):
+            iam.upload_ssl_certificate(cfn_config.ssl(), stack_name)
     # Useful for debug
     # print cfn_config.process()
     # Inject security groups in stack template and create stacks.
     try:
-        stack = cfn.create(stack_name, cfn_config.process(), tags=get_cloudformation_tags())
+        if 'nested_stacks' in cfn_config.data:
+            template, child_templates = cfn_config.process_nested()
+            with TRACER.span('upload nested templates'):
+                upload_templates(cfn_config.data['nested_stacks']['bucket'], child_templates)
+        else:
+            template = cfn_config.process()
+        with TRACER.span('create stack'):
+            return cfn.create(stack_name, template, tags=get_cloudformation_tags())
     except Exception:
         # cleanup ssl certificates if any
         if 'ssl' in cfn_config.data:
@@ -630,22 +845,223 @@ def cfn_create(test=False):
         cfn_delete(True)
         abort(red("Failed to create: {error}".format(error=traceback.format_exc())))
 
-    print green("\nSTACK {0} CREATING...\n").format(stack_name)
+
+def get_pool_tag(slot):
+    """
+    Returns:
+        (string): The tag of a slot of the stack pool, eg pool0
+    """
+    return 'pool{0}'.format(slot)
+
+
+def get_pool_stacks(r53_conn, zone_name, zone_id, size):
+    """
+    Look up the stacks in the pool from their TXT records
+
+    Args:
+        size(int): The number of slots in the pool
+
+    Returns:
+        (list): (tag, stack name) tuples of the slots of the pool, the stack
+            name None for empty slots
+    """
+    pool_stacks = []
+    for slot in range(int(size)):
+        pool_tag = get_pool_tag(slot)
+        stack_suffix = r53_conn.get_record(zone_name, zone_id, get_tag_record_name(pool_tag), 'TXT')
+        stack_name = "{0}-{1}".format(get_legacy_name(), stack_suffix) if stack_suffix else None
+        pool_stacks.append((pool_tag, stack_name))
+    return pool_stacks
+
+
+def remove_pool_stack(cfn, r53_conn, zone_name, zone_id, pool_tag, stack_name, stack):
+    """
+    Empty a slot of the stack pool whose stack failed to create or no
+    longer exists, deleting the stack and its SSL certificates without
+    waiting for them
+
+    Args:
+        pool_tag(string): The tag of the slot
+        stack_name(string): The name of the stack in the slot
+        stack(dict): The summary of the stack, None if it does not exist
+    """
+    logger.warning("fab_tasks::remove_pool_stack: Removing stack '%s' from tag '%s', its status is %s",
+                   stack_name, pool_tag, stack['StackStatus'] if stack else 'DELETE_COMPLETE')
+    r53_conn.delete_dns_record(zone_id,
+                               "{0}.{1}".format(get_tag_record_name(pool_tag), zone_name),
+                               'TXT',
+                               '"{0}"'.format(stack_name.split('-')[-1]))
+    if stack is None:
+        return
+    cfn.delete(stack_name)
+    cfn_config = get_config()
+    if 'ssl' in cfn_config.data:
+        get_connection(IAM).delete_ssl_certificate(cfn_config.ssl(), stack_name)
+
+
+@task
+def fill_stack_pool(size=2):
+    """
+    Start creating stacks to fill the pool of pre-created stacks.
+
+    The pool of an application and environment has size slots, tagged
+    pool0, pool1 and so on, and a stack is created for each empty slot.
+    A stack that failed to create, or was deleted, is removed from its
+    slot and replaced. Only the CloudFormation stack creation is left
+    running, the config is processed and any SSL certificates and nested
+    templates uploaded before this returns. The stacks can be claimed
+    with claim_stack once they are created.
+
+    Args:
+        size: The number of stacks to keep in the pool
+    """
+    r53_conn = get_connection(R53)
+    zone_name = get_zone_name()
+    zone_id = get_zone_id()
+    cfn = get_connection(Cloudformation)
+    stack_index = get_stack_index(refresh=True)
+    saved_env = dict((key, env[key]) for key in ['tag', 'stack_name'] if key in env)
+    created = []
+    try:
+        for pool_tag, stack_name in get_pool_stacks(r53_conn, zone_name, zone_id, size):
+            env.tag = pool_tag
+            if stack_name is not None:
+                stack = stack_index.get(stack_name)
+                if stack and stack['StackStatus'] not in FAILED_POOL_STACK_STATUSES:
+                    continue
+                env.stack_name = stack_name
+                remove_pool_stack(cfn, r53_conn, zone_name, zone_id, pool_tag, stack_name, stack)
+            env.pop('stack_name', None)
+            stack_name = set_stack_name()
+            start_stack_create(cfn, stack_name, get_config())
+            print green("POOL STACK {0} CREATING AS {1}...".format(stack_name, pool_tag))
+            created.append(stack_name)
+    finally:
+        env.pop('tag', None)
+        env.pop('stack_name', None)
+        env.update(saved_env)
+    return created
+
+
+@task
+def claim_stack(tag, size=2):
+    """
+    Tag a stack from the pool of pre-created stacks, and refill the pool.
+
+    A created stack in the pool has its TXT record moved to the tag, so
+    it can be made active with set_active_stack straight away. The pool
+    is then refilled with fill_stack_pool, which processes the config and
+    uploads any SSL certificates for the new stack before returning, only
+    its CloudFormation stack creation is left running.
+
+    Args:
+        tag: The tag to give the stack
+        size: The number of stacks to keep in the pool
+    """
+    if tag == 'active':
+        raise ActiveTagExistConflictError()
+    r53_conn = get_connection(R53)
+    zone_name = get_zone_name()
+    zone_id = get_zone_id()
+    if r53_conn.hastag(zone_name, zone_id, get_tag_record_name(tag)):
+        raise TagRecordExistConflictError(tag)
+    stack_index = get_stack_index(refresh=True)
+    for pool_tag, stack_name in get_pool_stacks(r53_conn, zone_name, zone_id, size):
+        stack = stack_index.get(stack_name) if stack_name else None
+        if stack and stack['StackStatus'] == 'CREATE_COMPLETE':
+            break
+    else:
+        abort(red("No stack in the pool of {0} has been created yet".format(get_legacy_name())))
+    stack_suffix = stack_name.split('-')[-1]
+    logger.info("fab_tasks::claim_stack: Moving stack '%s' from tag '%s' to tag '%s'...",
+                stack_name, pool_tag, tag)
+    try:
+        r53_conn.move_txt_record(zone_id,
+                                 "{0}.{1}".format(get_tag_record_name(pool_tag), zone_name),
+                                 "{0}.{1}".format(get_tag_record_name(tag), zone_name),
+                                 '"{0}"'.format(stack_suffix))
+    except Exception:
+        raise UpdateDNSRecordError
+    print green("Stack {0} is tagged {1}".format(stack_name, tag))
+    fill_stack_pool(size)
+    return stack_name
+
+
+@task
+def cfn_create_network(test=False):
+    """
+    Create the shared network stack named by network_stack in the vpc config.
+
+    The network stack holds the VPC, subnets, internet gateway and route
+    table, and is created once. Stacks created with the same config then
+    use its network instead of creating their own. Nothing is done if the
+    network stack exists already.
+    """
+    Parser = env.get('cloudformation_parser', ConfigParser)
+    data = get_basic_config()
+    network_stack_name = (data.get('vpc') or {}).get('network_stack')
+    if not network_stack_name:
+        abort(red("No network_stack set in the vpc config"))
+    cfn_config = Parser(data, network_stack_name, environment=env.environment, application=env.application)
+    if test:
+        print cfn_config.process_network()
+        return
+
+    cfn = get_connection(Cloudformation)
+    if not cfn.stack_missing(network_stack_name):
+        print green("Network stack {0} already exists".format(network_stack_name))
+        return True
+    with TRACER.span('create stack'):
+        stack = cfn.create(network_stack_name, cfn_config.process_network(), tags=get_cloudformation_tags())
+
+    print green("\nNETWORK STACK {0} CREATING...\n").format(network_stack_name)
     if not env.blocking:
         print 'Running in non blocking mode. Exiting.'
         sys.exit(0)
 
-    tail(cfn, stack_name)
+    tail(cfn, network_stack_name, get_event_store())
     stack_evt = cfn.get_last_stack_event(stack)
+    if stack_evt.resource_status != 'CREATE_COMPLETE':
+        abort('Failed to create network stack: {0}'.format(stack))
+    print green('Successfully built network stack {0}.'.format(stack))
+    return True
 
-    if stack_evt.resource_status == 'CREATE_COMPLETE':
-        print green('Successfully built stack {0}.'.format(stack))
+
+@task
+def critical_path(template=None, durations=None):
+    """
+    Report the chain of resources that decides how long the stack takes
+    to create, and the DependsOn edges that hold resources back.
+
+    The template is rendered from the config, without looking up or
+    creating a stack, unless the path of a rendered template is given.
+    Each resource is weighed by the typical time to create its type, or
+    the p50 time from the events kept in the event store, if any.
+
+    Args:
+        template: The path of a rendered template to analyze
+        durations: The path of a YAML file of seconds to create each
+            resource type, overriding the typical ones
+    """
+    if template:
+        with open(template) as template_file:
+            template_data = json.load(template_file)
     else:
-        # So delete the SSL cert that we uploaded
-        if 'ssl' in cfn_config.data:
-            iam.delete_ssl_certificate(cfn_config.ssl(), stack_name)
-        abort('Failed to create stack: {0}'.format(stack))
-    return True
+        Parser = env.get('cloudformation_parser', ConfigParser)
+        cfn_config = Parser(get_basic_config(), get_legacy_name(),
+                            environment=env.environment, application=env.application)
+        template_data = json.loads(cfn_config.process())
+    type_durations = {}
+    event_store = get_event_store()
+    if event_store is not None:
+        type_durations.update((resource_type, percentiles['p50'])
+                              for resource_type, percentiles in event_store.get_percentiles().items())
+    if durations:
+        with open(durations) as durations_file:
+            type_durations.update(yaml.safe_load(durations_file))
+    analysis = analyze_template(template_data, type_durations)
+    print analysis.format_report()
+    return analysis
 
 
 @task
@@ -676,21 +1092,42 @@ def update_certs():
             logger.info("Setting load balancer certificates...")
             elb = get_connection(ELB)
             replaced_certs = elb.set_ssl_certificates(updated_count,
-                                                      stack_name,
-                                                      max_retries=3,
-                                                      retry_delay=10)
+                                                      stack_name)
             for cert_name in replaced_certs:
                 logger.info("Deleting replaced certificate '%s'..."
                             % (cert_name))
                 iam.delete_certificate(cert_name,
-                                       stack_name,
-                                       max_retries=3,
-                                       retry_delay=10)
+                                       stack_name)
     else:
         logger.error("No certificates updated so skipping "
                      "ELB certificate update...")
 
 
+@task
+def cleanup_certs(dry_run=False):
+    """
+    Delete stale ssl certificates
+
+    Removes the timestamped certificates left behind for this stack by
+    update_certs, keeping the newest certificate for each name and any
+    certificate still set on the stack's ELB listeners.
+
+    Args:
+        dry_run(bool): True to only list the certificates that would
+            be deleted
+    """
+    stack_name = get_stack_name()
+    iam = get_connection(IAM)
+    elb = get_connection(ELB)
+    in_use_arns = elb.get_ssl_certificate_arns(stack_name)
+    stale_certs = iam.delete_stale_certificates(stack_name,
+                                                in_use_arns=in_use_arns,
+                                                dry_run=str(dry_run).lower() in ("yes", "true", "t", "1"))
+    logger.info("Found %s stale certificates for stack '%s'"
+                % (len(stale_certs), stack_name))
+    return stale_certs
+
+
 def get_cloudformation_tags():
     """
     Get a top-level set of tags for the stack, these will propagate
@@ -721,11 +1158,11 @@ def enable_vpc_peering():
     """
     Enables vpc peering to stacks named in the cloudformation config.
     """
-    # peer vpc
+    # peer vpc, the vpc of a shared network stack is peered once for all its stacks
     cfg = get_config()
     vpc_cfg = cfg.data.get('vpc', False)
     if vpc_cfg:
-        vpc_obj = VPC(cfg.data, get_stack_name())
+        vpc_obj = VPC(cfg.data, cfg.network_stack or get_stack_name())
         vpc_obj.enable_peering()
 
 
@@ -734,14 +1171,48 @@ def disable_vpc_peering():
     """
     Disables vpc peering to stacks named in the cloudformation config.
     """
-    # peer vpc
+    # peer vpc, the vpc of a shared network stack is peered once for all its stacks
     cfg = get_config()
     vpc_cfg = cfg.data.get('vpc', False)
     if vpc_cfg:
-        vpc_obj = VPC(cfg.data, get_stack_name())
+        vpc_obj = VPC(cfg.data, cfg.network_stack or get_stack_name())
         vpc_obj.disable_peering()
 
 
+@task
+def enable_vpc_mesh(stacks=None, hub=None):
+    """
+    Peers a set of stacks with each other.
+
+    Every stack is peered with every other one, or with the hub stack only
+    if one is given, and routes are added between all their route tables.
+    Peerings and routes that already exist are skipped, so this can be run
+    again as stacks are added.
+
+    Args:
+        stacks(string): Semicolon separated search names of the stacks to peer,
+            defaults to this stack and the stacks listed under vpc: mesh: in
+            the cloudformation config
+        hub(string): The search name of the stack to peer every other stack to
+    """
+    if stacks:
+        stack_search_names = [name.strip() for name in stacks.split(';') if name.strip()]
+    else:
+        cfg = get_config()
+        stack_search_names = [get_stack_name()] + (cfg.data.get('vpc') or {}).get('mesh', [])
+    mesh = VpcPeeringMesh(stack_search_names, hub_stack_search_name=hub)
+    summary = mesh.apply()
+    for peering in summary['peerings']:
+        print "{0} <-> {1}: {2} {3} ({4:.1f}s)".format(peering['stack_name'], peering['peer_stack_name'],
+                                                       peering['action'], peering['peering_conn_id'],
+                                                       peering['duration'])
+    print green("{0} peerings created, {1} accepted, {2} skipped. "
+                "{3} routes created, {4} skipped in {5:.1f}s".format(
+                    summary['created'], summary['accepted'], summary['skipped'],
+                    summary['routes_created'], summary['routes_skipped'], summary['duration']))
+    return summary
+
+
 @task
 def set_autoscaling_desired_capacity(capacity, block=True):
     """
@@ -762,13 +1233,21 @@ def set_autoscaling_desired_capacity(capacity, block=True):
 
 
 @task
-def cycle_instances(delay=None):
+def cycle_instances(delay=None, max_surge=1, max_unavailable=0, skip_unchanged=False, resume=False):
     """
     Cycle the instances in the autoscaling group
 
     Args:
         delay(int): Number of seconds between new instance
             becoming healthy and killing the old one.
+        max_surge(int): Number of extra instances to launch
+            in each wave of replacements.
+        max_unavailable(int): Number of instances that can
+            be replaced in place in each wave.
+        skip_unchanged(bool): Only replace the instances not
+            running the current launch configuration.
+        resume(bool): Continue an interrupted cycle from its
+            checkpoint.
     """
     asg = get_connection(Autoscale)
     if not asg.group:
@@ -777,7 +1256,11 @@ def cycle_instances(delay=None):
         termination_delay = int(delay)
     else:
         termination_delay = None
-    asg.cycle_instances(termination_delay=termination_delay)
+    asg.cycle_instances(termination_delay=termination_delay,
+                        max_surge=int(max_surge),
+                        max_unavailable=int(max_unavailable),
+                        skip_unchanged=str(skip_unchanged).lower() in ("yes", "true", "t", "1"),
+                        resume=str(resume).lower() in ("yes", "true", "t", "1"))
 
 
 @task
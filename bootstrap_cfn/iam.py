@@ -1,5 +1,7 @@
 import logging
 
+import re
+
 import time
 
 from boto.connection import AWSQueryConnection
@@ -10,6 +12,88 @@ import boto.iam
 
 from bootstrap_cfn import utils
 
+from bootstrap_cfn.retry import RETRY_POLICY
+
+# New certificates commonly take 20 to 30 seconds to become visible to
+# ELB, and replaced ones as long to stop being in use, longer than the
+# default retries of the retry policy cover
+CERTIFICATE_MAX_ATTEMPTS = 6
+CERTIFICATE_BASE_DELAY = 2
+
+
+class ServerCertificateIndex(object):
+    """
+    In-memory inventory of the server certificates in an account, built
+    from a single paginated ListServerCertificates call. Only certificate
+    metadata is held here, the certificate bodies are fetched on demand.
+    """
+
+    def __init__(self, certificates=None):
+        self.by_name = {}
+        self.by_path = {}
+        self.by_suffix = {}
+        for certificate in certificates or []:
+            self.add(certificate)
+
+    @classmethod
+    def from_connection(cls, conn_iam, path_prefix='/'):
+        """
+        Build an index by paging through all the server certificates
+
+        Args:
+            conn_iam(IAMConnection): The boto IAM connection to use
+            path_prefix(string): Only index certificates under this path
+
+        Returns:
+            ServerCertificateIndex: The populated index
+        """
+        certificates = []
+        marker = None
+        while True:
+            response = conn_iam.list_server_certs(path_prefix=path_prefix, marker=marker)
+            result = response['list_server_certificates_response']['list_server_certificates_result']
+            certificates += result.get('server_certificate_metadata_list', [])
+            if str(result.get('is_truncated', 'false')).lower() != 'true':
+                break
+            marker = result.get('marker')
+        logging.info("IAM::ServerCertificateIndex: "
+                     "Indexed %s server certificates" % (len(certificates)))
+        return cls(certificates)
+
+    def add(self, certificate):
+        name = certificate['server_certificate_name']
+        self.remove(name)
+        self.by_name[name] = certificate
+        self.by_path.setdefault(certificate.get('path', '/'), []).append(certificate)
+        self.by_suffix.setdefault(name.split('-')[-1], []).append(certificate)
+
+    def remove(self, name):
+        certificate = self.by_name.pop(name, None)
+        if certificate:
+            self.by_path[certificate.get('path', '/')].remove(certificate)
+            self.by_suffix[name.split('-')[-1]].remove(certificate)
+        return certificate
+
+    def get(self, name):
+        return self.by_name.get(name)
+
+    def get_by_path(self, path):
+        return list(self.by_path.get(path, []))
+
+    def get_by_stack(self, stack_name):
+        """
+        Get the certificates uploaded for a stack, these are named
+        <cert_name>-<stack_name> or <cert_name>-<timestamp>-<stack_name>
+
+        Args:
+            stack_name(string): The name of the stack
+
+        Returns:
+            list: The metadata of all the certificates for the stack
+        """
+        return [certificate for certificate in self.by_suffix.get(stack_name.split('-')[-1], [])
+                if certificate['server_certificate_name'].endswith("-%s" % stack_name)]
+
 
 class IAM:
 
@@ -22,6 +106,36 @@ class IAM:
         self.aws_region_name = aws_region_name
 
         self.conn_iam = utils.connect_to_aws(boto.iam, self)
+        self.certificate_index = None
+
+    def get_certificate_index(self, refresh=False):
+        """
+        Get the server certificate inventory, building it on first use
+
+        Args:
+            refresh(bool): True to rebuild the index from AWS
+
+        Returns:
+            ServerCertificateIndex: The server certificate inventory
+        """
+        if refresh or self.certificate_index is None:
+            self.certificate_index = ServerCertificateIndex.from_connection(self.conn_iam)
+        return self.certificate_index
+
+    def has_remote_certificate(self, cert_name, stack_name):
+        """
+        Check the certificate inventory for a stack certificate without
+        fetching the certificate body
+
+        Args:
+            cert_name(string): The name of the certificate entry to look up
+            stack_name(string): The name of the stack
+
+        Returns:
+            exists(bool): True if remote AWS certificate exists, false otherwise
+        """
+        cert_id = "{0}-{1}".format(cert_name, stack_name)
+        return self.get_certificate_index().get(cert_id) is not None
 
     def upload_ssl_certificate(self, ssl_config, stack_name):
         for cert_name, ssl_data in ssl_config.items():
@@ -98,6 +212,10 @@ class IAM:
             logging.info("IAM::get_remote_certificate: "
                          "Looking for certificate '%s'.."
                          % (cert_id))
+            if not self.has_remote_certificate(cert_name, stack_name):
+                logging.info("IAM::get_remote_certificate: "
+                             "Certificate '%s' not in inventory" % (cert_id))
+                return None
 
             # Fetch the remote AWS certificate configuration data
             # Fetching the response could throw an exception
@@ -146,24 +264,9 @@ class IAM:
 
         try:
             cert_id = "{0}-{1}".format(cert_name, stack_name)
-            logging.info("IAM::get_remote_certificate: "
-                         "Looking for certificate '%s'.."
-                         % (cert_id))
-
-            # Fetch the remote AWS certificate configuration data
-            # Fetching the response could throw an exception
-            remote_cert_response = self.conn_iam.get_server_certificate(cert_id)
-            remote_cert_result = remote_cert_response['get_server_certificate_response']['get_server_certificate_result']
-            remote_cert_certificate = remote_cert_result["server_certificate"]
-
-            remote_cert_data = {
-                "cert": remote_cert_certificate.get("certificate_body",
-                                                    None),
-                "chain": remote_cert_certificate.get("certificate_chain",
-                                                     None),
-                "key": remote_cert_certificate.get("certificate_key",
-                                                   None),
-            }
+            remote_cert_data = self.get_remote_certificate(cert_name, stack_name)
+            if not remote_cert_data:
+                return False
             # Compare the local cert and chain certificates to remote
             if self.compare_certificate_data(ssl_data, remote_cert_data):
                 logging.info("IAM::get_remote_certificate: "
@@ -260,11 +363,15 @@ class IAM:
         cert_id = "{0}-{1}".format(cert_name, stack_name)
 
         try:
-            if force or not self.get_remote_certificate(cert_name,
+            if force or not self.has_remote_certificate(cert_name,
                                                         stack_name):
-                self.conn_iam.upload_server_cert(cert_id, cert_body,
-                                                 private_key,
-                                                 cert_chain)
+                response = self.conn_iam.upload_server_cert(cert_id, cert_body,
+                                                            private_key,
+                                                            cert_chain)
+                # Keep the inventory in step with AWS, with the name and ARN of the new certificate
+                if self.certificate_index is not None:
+                    result = response['upload_server_certificate_response']['upload_server_certificate_result']
+                    self.certificate_index.add(result['server_certificate_metadata'])
                 logging.info("IAM::upload_certificate: "
                              "Uploading certificate '%s'.."
                              % (cert_name))
@@ -285,16 +392,17 @@ class IAM:
 
         return False
 
-    def delete_certificate(self, cert_name, stack_name, max_retries=1, retry_delay=10):
+    def delete_certificate(self, cert_name, stack_name, max_attempts=None):
         """
-        Delete a certificate from AWS, we can retry with delay, default is to only
-        try once.
+        Delete a certificate from AWS. A certificate that was just replaced
+        on a load balancer can still be reported as in use for a while, so
+        we retry by the retry policy while it is.
 
         Args:
                 cert_name(string): The name of the certificate entry to look up
                 stack_name(string): The name of the stack
-                max_retries(int): The number of retries to carry out on the operation
-                retry_delay(int): The retry delay of the operation
+                max_attempts(int): The number of attempts at deleting the certificate,
+                    defaults to CERTIFICATE_MAX_ATTEMPTS
 
         Returns:
             success(bool): True if a certificate is deleted, False otherwise
@@ -303,35 +411,35 @@ class IAM:
         # Try to delete cert, but handle any problems on
         # individual deletes and
         # continue to delete other certs
-        retries = 0
-        while retries < max_retries:
-            retries += 1
-            try:
-                if self.get_remote_certificate(cert_name,
-                                               stack_name):
-                    try:
-                        self.conn_iam.delete_server_cert(cert_id)
-                        logging.info("IAM::delete_certificate: "
-                                     "Deleting certificate '%s'.."
-                                     % (cert_name))
-                        return True
-                    except BotoServerError as e:
-                        logging.warning("IAM::delete_certificate: Cannot delete ssl cert, reason '%s', "
-                                        "waiting %s seconds on retry %s/%s"
-                                        % (e.error_message, retry_delay, retries, max_retries))
-                        # Only sleep if we're going to try again
-                        if retries < max_retries:
-                            time.sleep(retry_delay)
-                else:
+        try:
+            if self.has_remote_certificate(cert_name,
+                                           stack_name):
+                try:
+                    RETRY_POLICY.run(lambda: self.conn_iam.delete_server_cert(cert_id),
+                                     'iam', 'DeleteServerCertificate',
+                                     retryable_codes=['DeleteConflict'],
+                                     max_attempts=max_attempts or CERTIFICATE_MAX_ATTEMPTS,
+                                     base_delay=CERTIFICATE_BASE_DELAY,
+                                     only_codes=True)
+                    if self.certificate_index:
+                        self.certificate_index.remove(cert_id)
                     logging.info("IAM::delete_certificate: "
-                                 "Certificate '%s' does not exist, "
-                                 "not deleting." % (cert_name))
-            except AWSQueryConnection.ResponseError as error:
-                logging.warn("IAM::delete_certificate: "
-                             "Could not find expected certificate '%s': "
-                             "Error %s - %s" % (cert_id,
-                                                error.status,
-                                                error.reason))
+                                 "Deleting certificate '%s'.."
+                                 % (cert_name))
+                    return True
+                except BotoServerError as e:
+                    logging.warning("IAM::delete_certificate: Cannot delete ssl cert, reason '%s'"
+                                    % (e.error_message))
+            else:
+                logging.info("IAM::delete_certificate: "
+                             "Certificate '%s' does not exist, "
+                             "not deleting." % (cert_name))
+        except AWSQueryConnection.ResponseError as error:
+            logging.warn("IAM::delete_certificate: "
+                         "Could not find expected certificate '%s': "
+                         "Error %s - %s" % (cert_id,
+                                            error.status,
+                                            error.reason))
         return False
 
     def get_arn_for_cert(self, cert_name):
@@ -347,6 +455,16 @@ class IAM:
         """
         cert_arn = None
 
+        certificate = self.get_certificate_index().get(cert_name)
+        if certificate:
+            cert_arn = certificate['arn']
+            logging.info("IAM::get_arn_for_cert: "
+                         "Found arn '%s' for certificate '%s'"
+                         % (cert_arn, cert_name))
+            return cert_arn
+
+        # Newly uploaded certificates may not be listed yet, so fall
+        # back to looking the certificate up directly
         try:
             cert = self.conn_iam.get_server_certificate(cert_name)
             cert_arn = cert.arn
@@ -360,3 +478,52 @@ class IAM:
                          % (cert_name))
 
         return cert_arn
+
+    def delete_stale_certificates(self, stack_name, in_use_arns=None, dry_run=False):
+        """
+        Delete the timestamped certificates left behind for a stack by
+        update_ssl_certificates. The newest certificate for each name and
+        any certificate still in use are kept.
+
+        Args:
+            stack_name(string): The name of the stack
+            in_use_arns(list): The arns of certificates that must not be
+                deleted, eg those set on the stack load balancers
+            dry_run(bool): True to only report the certificates that
+                would be deleted
+
+        Returns:
+            list: The names of the stale certificates
+        """
+        in_use_arns = set(in_use_arns or [])
+        timestamped_cert_regex = re.compile(r"^(?P<cert_name>.+)-(?P<timestamp>\d+(\.\d+)?)-%s$"
+                                            % re.escape(stack_name))
+        timestamped_certs = {}
+        for certificate in self.get_certificate_index().get_by_stack(stack_name):
+            match = timestamped_cert_regex.match(certificate['server_certificate_name'])
+            if match:
+                timestamped_certs.setdefault(match.group('cert_name'), []).append(
+                    (float(match.group('timestamp')), certificate))
+
+        stale_certificates = []
+        for cert_name, certificates in timestamped_certs.items():
+            # Keep the most recently uploaded certificate
+            for timestamp, certificate in sorted(certificates)[:-1]:
+                if certificate['arn'] not in in_use_arns:
+                    stale_certificates.append(certificate['server_certificate_name'])
+
+        for stale_cert_id in sorted(stale_certificates):
+            if dry_run:
+                logging.info("IAM::delete_stale_certificates: "
+                             "Would delete certificate '%s'" % (stale_cert_id))
+                continue
+            try:
+                self.conn_iam.delete_server_cert(stale_cert_id)
+                self.get_certificate_index().remove(stale_cert_id)
+                logging.info("IAM::delete_stale_certificates: "
+                             "Deleted certificate '%s'" % (stale_cert_id))
+            except BotoServerError as e:
+                logging.warning("IAM::delete_stale_certificates: "
+                                "Cannot delete certificate '%s', reason '%s'"
+                                % (stale_cert_id, e.error_message))
+        return sorted(stale_certificates)
@@ -0,0 +1,195 @@
+import json
+import os
+import tempfile
+import threading
+
+# The upper bounds in seconds of the api call latency histogram buckets
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+
+
+class ApiCallStats(object):
+    """
+    Accounts for the AWS api calls made, for each (service, operation).
+    Every attempt at a call counts as a call, and the attempts after the
+    first are also counted as retries.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self, task_name=None):
+        """
+        Forget all the calls recorded
+
+        Args:
+            task_name(string): The name of the task the next calls are made by
+        """
+        with self.lock:
+            self.task_name = task_name
+            # (service_name, operation_name): stats dictionary
+            self.operations = {}
+
+    def record(self,
+               service_name,
+               operation_name,
+               latency,
+               attempt=1,
+               error_code=None,
+               request_bytes=0,
+               response_bytes=0):
+        """
+        Record an api call
+
+        Args:
+            service_name(string): The name of the service, eg 'ec2'
+            operation_name(string): The name of the operation, eg 'CreateRoute'
+            latency(float): The number of seconds the call took
+            attempt(int): The number of the attempt, starting at 1
+            error_code(string): The error code of the response, if any
+            request_bytes(int): The size of the request body
+            response_bytes(int): The size of the response body
+        """
+        with self.lock:
+            stats = self.operations.get((service_name, operation_name))
+            if stats is None:
+                stats = {
+                    'calls': 0,
+                    'retries': 0,
+                    'errors': 0,
+                    'latency_sum': 0.0,
+                    'latency_max': 0.0,
+                    'latency_buckets': [0] * len(LATENCY_BUCKETS),
+                    'request_bytes': 0,
+                    'response_bytes': 0,
+                }
+                self.operations[(service_name, operation_name)] = stats
+            stats['calls'] += 1
+            if attempt > 1:
+                stats['retries'] += 1
+            if error_code is not None:
+                stats['errors'] += 1
+            stats['latency_sum'] += latency
+            stats['latency_max'] = max(stats['latency_max'], latency)
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if latency <= bound:
+                    stats['latency_buckets'][index] += 1
+            stats['request_bytes'] += request_bytes or 0
+            stats['response_bytes'] += response_bytes or 0
+
+    @property
+    def calls(self):
+        with self.lock:
+            return sum(stats['calls'] for stats in self.operations.values())
+
+    def get_operations(self):
+        """
+        Returns:
+            (list): (service_name, operation_name, stats) tuples, sorted by
+                the total time spent on the operation
+        """
+        with self.lock:
+            operations = [(service_name, operation_name, dict(stats))
+                          for (service_name, operation_name), stats in self.operations.items()]
+        return sorted(operations, key=lambda operation: (-operation[2]['latency_sum'], operation[:2]))
+
+    def format_table(self):
+        """
+        Returns:
+            (string): A table of the calls made to each operation
+        """
+        header = ('Service', 'Operation', 'Calls', 'Retries', 'Errors',
+                  'Avg ms', 'Max ms', 'Total s', 'Sent', 'Received')
+        rows = []
+        totals = {'calls': 0, 'retries': 0, 'errors': 0, 'latency_sum': 0.0, 'request_bytes': 0, 'response_bytes': 0}
+        for service_name, operation_name, stats in self.get_operations():
+            rows.append((service_name, operation_name, stats['calls'], stats['retries'], stats['errors'],
+                         "%.0f" % (1000 * stats['latency_sum'] / stats['calls']),
+                         "%.0f" % (1000 * stats['latency_max']),
+                         "%.1f" % stats['latency_sum'],
+                         stats['request_bytes'], stats['response_bytes']))
+            for key in totals:
+                totals[key] += stats[key]
+        rows.append(('Total', '', totals['calls'], totals['retries'], totals['errors'], '', '',
+                     "%.1f" % totals['latency_sum'], totals['request_bytes'], totals['response_bytes']))
+        rows = [header] + [tuple(str(value) for value in row) for row in rows]
+        widths = [max(len(row[column]) for row in rows) for column in range(len(header))]
+        lines = []
+        for index, row in enumerate(rows):
+            lines.append('  '.join(value.ljust(widths[column]) if column < 2 else value.rjust(widths[column])
+                                   for column, value in enumerate(row)))
+            if index == 0 or index == len(rows) - 2:
+                lines.append('  '.join('-' * width for width in widths))
+        return '\n'.join(lines)
+
+    def to_dict(self):
+        """
+        Returns:
+            (dict): The task name and the stats of each operation
+        """
+        return {
+            'task': self.task_name,
+            'latency_buckets': LATENCY_BUCKETS,
+            'operations': [dict(stats, service=service_name, operation=operation_name)
+                           for service_name, operation_name, stats in self.get_operations()]
+        }
+
+    def to_prometheus(self):
+        """
+        Returns:
+            (string): The stats in the Prometheus text exposition format
+        """
+        metrics = [
+            ('calls', 'bootstrap_cfn_aws_api_calls_total', 'counter', 'AWS api calls made, including retries'),
+            ('retries', 'bootstrap_cfn_aws_api_retries_total', 'counter', 'AWS api calls that were retries'),
+            ('errors', 'bootstrap_cfn_aws_api_errors_total', 'counter', 'AWS api calls that returned an error'),
+            ('request_bytes', 'bootstrap_cfn_aws_api_request_bytes_total', 'counter', 'Bytes sent to AWS apis'),
+            ('response_bytes', 'bootstrap_cfn_aws_api_response_bytes_total', 'counter', 'Bytes received from AWS apis'),
+        ]
+        operations = self.get_operations()
+
+        def labels(service_name, operation_name, **extra):
+            values = [('task', self.task_name or ''), ('service', service_name), ('operation', operation_name)]
+            values.extend(sorted(extra.items()))
+            return ','.join('%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                            for key, value in values)
+
+        lines = []
+        for key, name, metric_type, description in metrics:
+            lines.append('# HELP %s %s' % (name, description))
+            lines.append('# TYPE %s %s' % (name, metric_type))
+            for service_name, operation_name, stats in operations:
+                lines.append('%s{%s} %s' % (name, labels(service_name, operation_name), stats[key]))
+
+        name = 'bootstrap_cfn_aws_api_call_duration_seconds'
+        lines.append('# HELP %s Latency of AWS api calls' % name)
+        lines.append('# TYPE %s histogram' % name)
+        for service_name, operation_name, stats in operations:
+            for bound, count in zip(LATENCY_BUCKETS, stats['latency_buckets']):
+                lines.append('%s_bucket{%s} %s' % (name, labels(service_name, operation_name, le=bound), count))
+            lines.append('%s_bucket{%s} %s' % (name, labels(service_name, operation_name, le='+Inf'), stats['calls']))
+            lines.append('%s_sum{%s} %s' % (name, labels(service_name, operation_name), stats['latency_sum']))
+            lines.append('%s_count{%s} %s' % (name, labels(service_name, operation_name), stats['calls']))
+        return '\n'.join(lines) + '\n'
+
+    def write_json(self, path):
+        write_file_atomically(path, json.dumps(self.to_dict(), indent=2, sort_keys=True))
+
+    def write_prometheus(self, path):
+        write_file_atomically(path, self.to_prometheus())
+
+
+def write_file_atomically(path, content):
+    """
+    Write a file by renaming a temporary file over it, so that readers
+    like the Prometheus textfile collector never see a partial file
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    file_descriptor, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    with os.fdopen(file_descriptor, 'w') as temp_file:
+        temp_file.write(content)
+    os.rename(temp_path, path)
+
+
+# The api call stats shared by every AWS connection and client
+API_CALL_STATS = ApiCallStats()
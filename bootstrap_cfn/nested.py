@@ -0,0 +1,284 @@
+import copy
+import logging
+import re
+
+import boto3
+
+from bootstrap_cfn import errors, utils
+
+logger = logging.getLogger('bootstrap_cfn')
+
+# The child stacks a template is split into
+NESTED_STACKS = ['Network', 'IAM', 'Data', 'Compute', 'Edge']
+
+# The child stack of the resources made by each section of ConfigParser
+SECTION_STACKS = {
+    'vpc': 'Network',
+    'iam': 'IAM',
+    'rds': 'Data',
+    'elasticache': 'Data',
+    'ec2': 'Compute',
+    'elb': 'Edge',
+    's3': 'Edge',
+}
+
+# The child stack of any other resources, eg from includes, by the start
+# of their resource type. Resources that match none go in Compute.
+RESOURCE_TYPE_STACKS = [
+    ('AWS::EC2::VPC', 'Network'),
+    ('AWS::EC2::Subnet', 'Network'),
+    ('AWS::EC2::InternetGateway', 'Network'),
+    ('AWS::EC2::Route', 'Network'),
+    ('AWS::IAM::', 'IAM'),
+    ('AWS::RDS::', 'Data'),
+    ('AWS::ElastiCache::', 'Data'),
+    ('AWS::ElasticLoadBalancing::', 'Edge'),
+    ('AWS::Route53::', 'Edge'),
+    ('AWS::S3::', 'Edge'),
+]
+DEFAULT_STACK = 'Compute'
+
+# The pseudo parameters that differ in a child stack, and the parameters
+# the parent passes them to its children as
+PARENT_PSEUDO_PARAMETERS = {
+    'AWS::StackName': 'ParentStackName',
+    'AWS::StackId': 'ParentStackId',
+}
+
+
+def get_child_stack(logical_id, resource, sections):
+    """
+    Get the child stack a resource goes in
+
+    Args:
+        logical_id(string): The logical id of the resource
+        resource(dict): The resource
+        sections(dict): The ConfigParser section that made each resource, by logical id
+
+    Returns:
+        (string): The name of the child stack
+    """
+    if sections.get(logical_id) in SECTION_STACKS:
+        return SECTION_STACKS[sections[logical_id]]
+    for type_prefix, child_stack in RESOURCE_TYPE_STACKS:
+        if resource['Type'].startswith(type_prefix):
+            return child_stack
+    return DEFAULT_STACK
+
+
+def get_stack_logical_id(child_stack):
+    return '{0}Stack'.format(child_stack)
+
+
+class TemplateSplitter(object):
+    """
+    Splits a template into a parent template and the templates of its
+    nested child stacks. A reference to a resource in another child stack
+    becomes a parameter of the child, passed from an output of the other
+    child, and a DependsOn on such a resource becomes a DependsOn between
+    the child stacks.
+    """
+
+    def __init__(self, template, sections):
+        """
+        Args:
+            template(dict): The template
+            sections(dict): The ConfigParser section that made each resource, by logical id
+        """
+        if 'Conditions' in template:
+            raise errors.CfnConfigError("Templates with conditions can not be split into nested stacks")
+        self.template = template
+        self.owners = dict((logical_id, get_child_stack(logical_id, resource, sections))
+                           for logical_id, resource in template.get('Resources', {}).items())
+        # The parameters of each child stack, by name, and the values the parent passes
+        self.parameters = dict((child_stack, {}) for child_stack in NESTED_STACKS)
+        # The outputs each child stack provides to the parent and the other child stacks
+        self.outputs = dict((child_stack, {}) for child_stack in NESTED_STACKS)
+        # The child stacks each child stack depends on
+        self.dependencies = dict((child_stack, set()) for child_stack in NESTED_STACKS)
+
+    def get_output(self, producer, name, value):
+        """
+        Make a child stack output a value
+
+        Returns:
+            (dict): The reference to the output in the parent
+        """
+        self.outputs[producer][name] = {'Value': value}
+        return {'Fn::GetAtt': [get_stack_logical_id(producer), 'Outputs.{0}'.format(name)]}
+
+    def localise(self, value, consumer):
+        """
+        Rewrite the references in a value for the child stack, or the
+        parent if consumer is None, that it is used in
+
+        Args:
+            value: A resource, output or part of one
+            consumer(string): The child stack the value is used in
+
+        Returns:
+            The value, referring to parameters for anything outside its stack
+        """
+        if isinstance(value, list):
+            return [self.localise(item, consumer) for item in value]
+        if not isinstance(value, dict):
+            return value
+        if value.keys() == ['Ref']:
+            name = value['Ref']
+            producer = self.owners.get(name)
+            if producer is not None and producer != consumer:
+                return self.import_value(consumer, producer, name, {'Ref': name})
+            if consumer is not None and name in self.template.get('Parameters', {}):
+                self.parameters[consumer][name] = {'Ref': name}
+            elif consumer is not None and name in PARENT_PSEUDO_PARAMETERS:
+                self.parameters[consumer][PARENT_PSEUDO_PARAMETERS[name]] = {'Ref': name}
+                return {'Ref': PARENT_PSEUDO_PARAMETERS[name]}
+            return value
+        if value.keys() == ['Fn::GetAtt']:
+            name, attribute = value['Fn::GetAtt']
+            producer = self.owners.get(name)
+            if producer is not None and producer != consumer:
+                return self.import_value(consumer, producer, re.sub('[^A-Za-z0-9]', '', name + attribute), value)
+            return value
+        return dict((key, self.localise(item, consumer)) for key, item in value.items())
+
+    def import_value(self, consumer, producer, name, value):
+        """
+        Pass a value from one child stack to another, or to the parent if
+        consumer is None
+
+        Returns:
+            (dict): The reference to the value in the consumer
+        """
+        output = self.get_output(producer, name, value)
+        if consumer is None:
+            return output
+        self.parameters[consumer][name] = output
+        self.dependencies[consumer].add(producer)
+        return {'Ref': name}
+
+    def split_resource(self, logical_id, resource):
+        """
+        Returns:
+            (dict): The resource, as it is in its child stack
+        """
+        child_stack = self.owners[logical_id]
+        resource = copy.deepcopy(resource)
+        depends_on = resource.pop('DependsOn', [])
+        if not isinstance(depends_on, list):
+            depends_on = [depends_on]
+        local_depends_on = []
+        for dependency in depends_on:
+            if self.owners.get(dependency, child_stack) == child_stack:
+                local_depends_on.append(dependency)
+            else:
+                self.dependencies[child_stack].add(self.owners[dependency])
+        resource = self.localise(resource, child_stack)
+        if local_depends_on:
+            resource['DependsOn'] = local_depends_on
+        return resource
+
+    def check_dependencies(self):
+        """
+        Raises:
+            CfnConfigError: The child stacks depend on each other in a cycle
+        """
+        checked = set()
+
+        def visit(child_stack, path):
+            if child_stack in path:
+                raise errors.CfnConfigError("The nested stacks depend on each other: {0}".format(
+                    ' -> '.join(path[path.index(child_stack):] + [child_stack])))
+            if child_stack in checked:
+                return
+            for dependency in sorted(self.dependencies[child_stack]):
+                visit(dependency, path + [child_stack])
+            checked.add(child_stack)
+
+        for child_stack in NESTED_STACKS:
+            visit(child_stack, [])
+
+    def split(self, template_urls):
+        """
+        Split the template
+
+        Args:
+            template_urls(dict): The S3 url each child template is uploaded to, by child stack
+
+        Returns:
+            (dict): The parent template
+            (dict): The templates of the child stacks that have resources, by child stack
+        """
+        resources = dict((child_stack, {}) for child_stack in NESTED_STACKS)
+        for logical_id, resource in self.template.get('Resources', {}).items():
+            resources[self.owners[logical_id]][logical_id] = self.split_resource(logical_id, resource)
+        outputs = dict((name, self.localise(output, None))
+                       for name, output in self.template.get('Outputs', {}).items())
+        self.check_dependencies()
+
+        parent = {'Resources': {}}
+        for key in ['AWSTemplateFormatVersion', 'Description', 'Mappings', 'Parameters']:
+            if key in self.template:
+                parent[key] = self.template[key]
+        if outputs:
+            parent['Outputs'] = outputs
+
+        children = {}
+        for child_stack in NESTED_STACKS:
+            if not resources[child_stack]:
+                continue
+            child = {'Resources': resources[child_stack]}
+            if 'Mappings' in self.template:
+                child['Mappings'] = self.template['Mappings']
+            if self.parameters[child_stack]:
+                child['Parameters'] = dict((name, {'Type': 'String'}) for name in self.parameters[child_stack])
+            if self.outputs[child_stack]:
+                child['Outputs'] = self.outputs[child_stack]
+            children[child_stack] = child
+
+            stack = {
+                'Type': 'AWS::CloudFormation::Stack',
+                'Properties': {'TemplateURL': template_urls[child_stack]},
+            }
+            if self.parameters[child_stack]:
+                stack['Properties']['Parameters'] = self.parameters[child_stack]
+            if self.dependencies[child_stack]:
+                stack['DependsOn'] = [get_stack_logical_id(dependency)
+                                      for dependency in sorted(self.dependencies[child_stack])]
+            parent['Resources'][get_stack_logical_id(child_stack)] = stack
+        return parent, children
+
+
+def split_template(template, sections, template_urls):
+    """
+    Split a template into a parent template with nested child stacks for
+    the network, IAM, data, compute and edge resources. Child stacks that
+    do not depend on each other are created in parallel.
+
+    Args:
+        template(dict): The template
+        sections(dict): The ConfigParser section that made each resource, by logical id
+        template_urls(dict): The S3 url each child template is uploaded to, by child stack
+
+    Returns:
+        (dict): The parent template
+        (dict): The templates of the child stacks, by child stack
+
+    Raises:
+        CfnConfigError: The template can not be split
+    """
+    return TemplateSplitter(template, sections).split(template_urls)
+
+
+def upload_templates(bucket, templates):
+    """
+    Upload the templates of nested stacks to S3
+
+    Args:
+        bucket(string): The S3 bucket
+        templates(dict): The template bodies by S3 key
+    """
+    s3_client = utils.setup_boto3_client(boto3.client('s3'))
+    for key, template_body in sorted(templates.items()):
+        logger.info("nested::upload_templates: Uploading s3://%s/%s" % (bucket, key))
+        s3_client.put_object(Bucket=bucket, Key=key, Body=template_body, ContentType='application/json')
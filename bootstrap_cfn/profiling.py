@@ -0,0 +1,140 @@
+import cProfile
+import marshal
+import os
+import pstats
+import sys
+import threading
+from contextlib import contextmanager
+
+from bootstrap_cfn.metrics import write_file_atomically
+
+# Paths through the call graph taking less than this many seconds are
+# left out of the collapsed stacks
+MIN_STACK_SECONDS = 0.0001
+
+
+class Profiler(object):
+    """
+    Profiles the CPU time spent in the tasks with cProfile, and writes it
+    as pstats and as collapsed stacks for flame graph tools. Nothing is
+    profiled until the profiler is started, and only the thread running
+    the tasks is profiled.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.enabled = False
+        self.profile = None
+        self.depth = 0
+
+    def start(self):
+        """
+        Forget the time profiled and start profiling again
+        """
+        with self.lock:
+            self.profile = cProfile.Profile()
+            self.depth = 0
+            self.enabled = True
+
+    def stop(self):
+        self.enabled = False
+
+    @contextmanager
+    def profiled(self):
+        """
+        A context manager profiling its block, adding to the time profiled
+        so far. Nested blocks are profiled once.
+        """
+        if not self.enabled:
+            yield
+            return
+        self.depth += 1
+        if self.depth == 1:
+            self.profile.enable()
+        try:
+            yield
+        finally:
+            self.depth -= 1
+            if self.depth == 0:
+                self.profile.disable()
+
+    def get_stats(self):
+        """
+        Returns:
+            (pstats.Stats): The time profiled so far
+        """
+        self.profile.create_stats()
+        return pstats.Stats(self.profile)
+
+    def write(self, path):
+        """
+        Write the time profiled so far as pstats to path, which can be
+        read with pstats or snakeviz, and as collapsed stacks to
+        path.collapsed, which can be drawn with flamegraph.pl or speedscope
+
+        Args:
+            path(string): The pstats file path
+        """
+        stats = self.get_stats()
+        write_file_atomically(path, marshal.dumps(stats.stats))
+        write_file_atomically(path + '.collapsed', '\n'.join(collapse_stacks(stats.stats)) + '\n')
+
+
+def format_function(function):
+    """
+    Name a function in a collapsed stack, eg 'get_config (bootstrap_cfn/fab_tasks.py:580)'
+
+    Args:
+        function(tuple): The (filename, line number, function name) key of the function in pstats
+    """
+    filename, line_number, function_name = function
+    if filename == '~':
+        return function_name
+    for directory in sorted(sys.path, key=len, reverse=True):
+        if directory and filename.startswith(directory.rstrip(os.sep) + os.sep):
+            filename = filename[len(directory.rstrip(os.sep)) + 1:]
+            break
+    return '{0} ({1}:{2})'.format(function_name, filename, line_number)
+
+
+def collapse_stacks(stats):
+    """
+    Work out the stacks the time was spent in from the callers recorded
+    by cProfile. cProfile only records which function called which, so the
+    time of a function called from more than one place is shared between
+    its callers by the time each of them spent calling it.
+
+    Args:
+        stats(dict): The stats of pstats.Stats, by function
+
+    Returns:
+        (list): Lines of semicolon separated stacks and the microseconds
+            spent in the last function of the stack
+    """
+    callees = {}
+    for function, (_, _, _, _, callers) in stats.items():
+        for caller, caller_stats in callers.items():
+            callees.setdefault(caller, []).append((function, caller_stats[3]))
+
+    counts = {}
+
+    def walk(function, stack, cumulative_time):
+        total_time, total_cumulative_time = stats[function][2], stats[function][3]
+        share = cumulative_time / total_cumulative_time if total_cumulative_time else 0
+        stack = stack + [format_function(function)]
+        key = ';'.join(stack)
+        counts[key] = counts.get(key, 0) + total_time * share
+        for callee, callee_cumulative_time in callees.get(function, []):
+            if callee_cumulative_time * share < MIN_STACK_SECONDS or format_function(callee) in stack:
+                continue
+            walk(callee, stack, callee_cumulative_time * share)
+
+    for function, (_, _, _, cumulative_time, callers) in stats.items():
+        if not callers:
+            walk(function, [], cumulative_time)
+    return ['{0} {1}'.format(stack, int(seconds * 1000000))
+            for stack, seconds in sorted(counts.items()) if int(seconds * 1000000) > 0]
+
+
+# The profiler shared by the tasks
+PROFILER = Profiler()
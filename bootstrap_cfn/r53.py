@@ -98,6 +98,25 @@ class R53(object):
             changes.commit()
         return True
 
+    def move_txt_record(self, zone_id, record_name, new_record_name, record_value):
+        """
+        Move a TXT record to a new name in one change batch, so it either
+        moves or is left as it is. The move fails if the new record exists
+        or the record has been moved or changed already.
+        Args:
+            zone_id: a string specifying the zone id
+            record_name: the full name of the record to move
+            new_record_name: the full name to move it to
+            record_value: the quoted value of the record
+        Returns:
+             True if the move was successful or raises an exception if not
+        """
+        changes = boto.route53.record.ResourceRecordSets(self.conn_r53, zone_id)
+        changes.add_change("CREATE", new_record_name, 'TXT', ttl=60).add_value(record_value)
+        changes.add_change("DELETE", record_name, 'TXT', ttl=60).add_value(record_value)
+        changes.commit()
+        return True
+
     def delete_record(self, zone_name, zone_id, elb_name, stack_id, stack_tag, txt_tag_record):
         '''
         Delete "active" or tagged Alias and TXT records if they exist
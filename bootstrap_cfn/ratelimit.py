@@ -0,0 +1,207 @@
+import logging
+
+import threading
+
+import time
+
+# The error codes AWS services return when requests are being throttled
+THROTTLING_ERROR_CODES = [
+    'Throttling',
+    'ThrottlingException',
+    'RequestLimitExceeded',
+    'PriorRequestNotComplete',
+    'TooManyRequestsException',
+    'RequestThrottled',
+]
+
+# The default requests per second allowed for each service, eg route53
+# allows 5 requests per second per account
+DEFAULT_SERVICE_RATES = {
+    'route53': 5,
+    'cloudformation': 5,
+    'iam': 5,
+    'elasticloadbalancing': 10,
+    'autoscaling': 10,
+    'ec2': 20,
+}
+# The requests per second of services not in DEFAULT_SERVICE_RATES
+DEFAULT_RATE = 10
+
+logger = logging.getLogger("bootstrap-cfn")
+
+
+class TokenBucket(object):
+    """
+    A token bucket allowing a number of requests per second, with bursts of
+    up to the bucket capacity. The rate halves every time a request is
+    throttled and then recovers towards its maximum as requests succeed.
+    """
+
+    def __init__(self, rate, capacity=None, min_rate=0.5):
+        """
+        Args:
+            rate(float): The maximum number of requests per second
+            capacity(float): The maximum burst of requests, defaults to rate
+            min_rate(float): The rate is never reduced below this
+        """
+        self.max_rate = float(rate)
+        self.rate = float(rate)
+        self.min_rate = min(float(min_rate), self.max_rate)
+        self.capacity = float(capacity or max(rate, 1))
+        self.tokens = self.capacity
+        self.last_refill = time.time()
+        self.lock = threading.Lock()
+
+    def refill(self):
+        now = time.time()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def acquire(self):
+        """
+        Take a token from the bucket, waiting until one is available
+
+        Returns:
+            (float): The number of seconds spent waiting
+        """
+        waited = 0
+        while True:
+            with self.lock:
+                self.refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+    def try_acquire(self):
+        """
+        Take a token from the bucket if one is available, without waiting
+
+        Returns:
+            (bool): True if a token was taken
+        """
+        with self.lock:
+            self.refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+    def throttled(self):
+        """
+        Slow down after a throttled request
+        """
+        with self.lock:
+            self.refill()
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = min(self.tokens, 0)
+
+    def succeeded(self):
+        """
+        Speed back up after a successful request
+        """
+        if self.rate < self.max_rate:
+            with self.lock:
+                self.refill()
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+class RateLimiter(object):
+    """
+    Rate limits AWS requests with a token bucket for each service and,
+    optionally, for individual operations of a service. A request has to
+    take a token from its service bucket and its operation bucket if there
+    is one.
+    """
+
+    def __init__(self, service_rates=None, default_rate=DEFAULT_RATE):
+        """
+        Args:
+            service_rates(dict): The requests per second allowed for each service
+            default_rate(float): The requests per second of any other service
+        """
+        self.service_rates = dict(DEFAULT_SERVICE_RATES if service_rates is None else service_rates)
+        self.default_rate = default_rate
+        self.operation_rates = {}
+        self.buckets = {}
+        self.lock = threading.Lock()
+        self.enabled = True
+
+    def set_rate(self, service_name, rate, operation_name=None):
+        """
+        Set the requests per second allowed for a service or one of its operations
+
+        Args:
+            service_name(string): The name of the service, eg 'route53'
+            rate(float): The requests per second
+            operation_name(string): The name of the operation, eg 'ChangeResourceRecordSets'
+        """
+        with self.lock:
+            if operation_name:
+                self.operation_rates[(service_name, operation_name)] = rate
+            else:
+                self.service_rates[service_name] = rate
+            self.buckets.pop((service_name, operation_name), None)
+
+    def get_buckets(self, service_name, operation_name=None):
+        """
+        Get the buckets a request has to take tokens from
+
+        Args:
+            service_name(string): The name of the service
+            operation_name(string): The name of the operation
+
+        Returns:
+            (list): The service bucket, and the operation bucket if it has one
+        """
+        with self.lock:
+            if service_name not in self.buckets:
+                self.buckets[service_name] = TokenBucket(self.service_rates.get(service_name, self.default_rate))
+            buckets = [self.buckets[service_name]]
+            key = (service_name, operation_name)
+            if key in self.operation_rates:
+                if key not in self.buckets:
+                    self.buckets[key] = TokenBucket(self.operation_rates[key])
+                buckets.append(self.buckets[key])
+            return buckets
+
+    def acquire(self, service_name, operation_name=None):
+        """
+        Wait until a request to a service operation is allowed
+
+        Args:
+            service_name(string): The name of the service
+            operation_name(string): The name of the operation
+
+        Returns:
+            (float): The number of seconds spent waiting
+        """
+        if not self.enabled:
+            return 0
+        return sum(bucket.acquire() for bucket in self.get_buckets(service_name, operation_name))
+
+    def record_response(self, service_name, operation_name=None, error_code=None):
+        """
+        Adapt the rates of a service operation to the response of a request
+
+        Args:
+            service_name(string): The name of the service
+            operation_name(string): The name of the operation
+            error_code(string): The error code of the response, if any
+        """
+        if not self.enabled:
+            return
+        if error_code in THROTTLING_ERROR_CODES:
+            logger.warning("RateLimiter::record_response: %s %s was throttled, slowing down"
+                           % (service_name, operation_name))
+            for bucket in self.get_buckets(service_name, operation_name):
+                bucket.throttled()
+        elif error_code is None:
+            for bucket in self.get_buckets(service_name, operation_name):
+                bucket.succeeded()
+
+
+# The rate limiter shared by every AWS connection and client
+RATE_LIMITER = RateLimiter()
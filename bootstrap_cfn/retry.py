@@ -0,0 +1,257 @@
+import httplib
+import logging
+import random
+import socket
+import threading
+import time
+
+from boto.exception import BotoServerError
+
+from botocore.exceptions import ClientError, EndpointConnectionError
+
+from bootstrap_cfn.ratelimit import THROTTLING_ERROR_CODES
+from bootstrap_cfn.tracing import SLEEP, TRACER
+
+# Error codes of failures on the AWS side that are worth trying again
+TRANSIENT_ERROR_CODES = [
+    'InternalError',
+    'InternalFailure',
+    'ServiceUnavailable',
+    'Unavailable',
+    'RequestTimeout',
+    'RequestTimeoutException',
+    'ConnectionError',
+]
+
+# The categories of retryable errors
+THROTTLING = 'throttling'
+TRANSIENT = 'transient'
+EVENTUAL_CONSISTENCY = 'eventual-consistency'
+
+logger = logging.getLogger("bootstrap-cfn")
+
+
+def get_error_code(exception):
+    """
+    Get the AWS error code of an exception
+
+    Args:
+        exception(Exception): An exception raised by a boto or boto3 call
+
+    Returns:
+        (string): The error code, 'ConnectionError' for network errors,
+            None if the exception did not come from AWS
+    """
+    if isinstance(exception, ClientError):
+        return exception.response.get('Error', {}).get('Code')
+    if isinstance(exception, BotoServerError):
+        return exception.error_code or str(exception.status)
+    if isinstance(exception, (EndpointConnectionError, socket.error, httplib.HTTPException)):
+        return 'ConnectionError'
+    return None
+
+
+class RetryStats(object):
+    """
+    Counts the retries made and the time spent waiting on them for each
+    service operation, by category of error
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            # (service_name, operation_name, category): [retries, seconds]
+            self.retries = {}
+
+    def record(self, service_name, operation_name, category, delay):
+        with self.lock:
+            entry = self.retries.setdefault((service_name, operation_name, category), [0, 0.0])
+            entry[0] += 1
+            entry[1] += delay
+
+    def get_totals(self):
+        """
+        Returns:
+            (dict): The retries and seconds waited for each error category, eg
+                {'throttling': {'retries': 3, 'delay': 4.2}}
+        """
+        totals = {}
+        with self.lock:
+            for (service_name, operation_name, category), (retries, delay) in self.retries.items():
+                total = totals.setdefault(category, {'retries': 0, 'delay': 0.0})
+                total['retries'] += retries
+                total['delay'] += delay
+        return totals
+
+
+class RetryPolicy(object):
+    """
+    The retry policy of all AWS calls. Throttling and transient errors are
+    retried, other error codes only where the caller says they are due to
+    eventual consistency. Calls through a client that already retries by
+    this policy retry only those error codes, so the attempts do not
+    multiply. Retries back off exponentially with full jitter, and are
+    counted in the policy stats.
+    """
+
+    def __init__(self, max_attempts=5, base_delay=0.5, max_delay=20, stats=None):
+        """
+        Args:
+            max_attempts(int): The number of attempts made at a call, including the first
+            base_delay(float): The maximum delay in seconds before the first retry
+            max_delay(float): The maximum delay in seconds before any retry
+            stats(RetryStats): Where to count the retries
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.stats = stats or RetryStats()
+
+    def classify(self, error_code, retryable_codes=None, only_codes=False):
+        """
+        Get the category of an error
+
+        Args:
+            error_code(string): The AWS error code, or HTTP status code
+            retryable_codes(list): The error codes the caller expects from
+                eventual consistency, eg a resource not found just after creating it
+            only_codes(bool): True to retry only the retryable_codes, when
+                the client making the call retries throttling and transient errors
+
+        Returns:
+            (string): THROTTLING, TRANSIENT or EVENTUAL_CONSISTENCY, None if
+                the error should not be retried
+        """
+        if error_code is None:
+            return None
+        if only_codes:
+            return EVENTUAL_CONSISTENCY if retryable_codes and error_code in retryable_codes else None
+        if error_code in THROTTLING_ERROR_CODES:
+            return THROTTLING
+        if error_code in TRANSIENT_ERROR_CODES or (error_code.isdigit() and int(error_code) >= 500):
+            return TRANSIENT
+        if retryable_codes and error_code in retryable_codes:
+            return EVENTUAL_CONSISTENCY
+        return None
+
+    def get_delay(self, attempt, base_delay=None):
+        """
+        Get a random delay before a retry, with an upper bound
+        doubling on each attempt
+
+        Args:
+            attempt(int): The number of the attempt that failed, starting at 1
+            base_delay(float): Overrides the policy base delay
+
+        Returns:
+            (float): The delay in seconds
+        """
+        if base_delay is None:
+            base_delay = self.base_delay
+        return random.uniform(0, min(self.max_delay, base_delay * 2 ** (attempt - 1)))
+
+    def get_retry_delay(self,
+                        service_name,
+                        operation_name,
+                        error_code,
+                        attempt,
+                        retryable_codes=None,
+                        max_attempts=None,
+                        base_delay=None,
+                        only_codes=False):
+        """
+        Decide whether to retry a failed attempt, counting the retry if so
+
+        Args:
+            service_name(string): The name of the service
+            operation_name(string): The name of the operation
+            error_code(string): The error code of the failed attempt
+            attempt(int): The number of the attempt that failed, starting at 1
+            retryable_codes(list): The error codes expected from eventual consistency
+            max_attempts(int): Overrides the policy max attempts
+            base_delay(float): Overrides the policy base delay
+            only_codes(bool): True to retry only the retryable_codes
+
+        Returns:
+            (float): The delay in seconds before retrying, None to give up
+        """
+        category = self.classify(error_code, retryable_codes, only_codes)
+        if category is None or attempt >= (max_attempts or self.max_attempts):
+            return None
+        delay = self.get_delay(attempt, base_delay)
+        self.stats.record(service_name, operation_name, category, delay)
+        logger.warning("RetryPolicy::get_retry_delay: %s %s failed with '%s' (%s), "
+                       "retry %s/%s in %.1fs"
+                       % (service_name, operation_name, error_code, category,
+                          attempt, (max_attempts or self.max_attempts) - 1, delay))
+        return delay
+
+    def run(self,
+            func,
+            service_name,
+            operation_name,
+            retryable_codes=None,
+            max_attempts=None,
+            base_delay=None,
+            only_codes=False):
+        """
+        Call a function, retrying it when it raises a retryable AWS error
+
+        Args:
+            func(callable): The function to call, it takes no arguments
+            service_name(string): The name of the service
+            operation_name(string): The name of the operation
+            retryable_codes(list): The error codes expected from eventual consistency
+            max_attempts(int): Overrides the policy max attempts
+            base_delay(float): Overrides the policy base delay
+            only_codes(bool): True to retry only the retryable_codes, for calls
+                through a connection or client that already retries by this policy
+
+        Returns:
+            The result of the function
+
+        Raises:
+            The last error once it is not retryable or the attempts are used up
+        """
+        attempt = 1
+        while True:
+            try:
+                return func()
+            except Exception as e:
+                delay = self.get_retry_delay(service_name, operation_name, get_error_code(e), attempt,
+                                             retryable_codes=retryable_codes,
+                                             max_attempts=max_attempts,
+                                             base_delay=base_delay,
+                                             only_codes=only_codes)
+                if delay is None:
+                    raise
+                with TRACER.span('retry delay', SLEEP):
+                    time.sleep(delay)
+                attempt += 1
+
+    def boto3_needs_retry(self, event_name, response=None, caught_exception=None, attempts=1, **kwargs):
+        """
+        A botocore needs-retry handler applying this policy to boto3 clients
+
+        Returns:
+            (float): The delay in seconds before retrying, None to give up
+        """
+        _, service_name, operation_name = event_name.split('.', 2)
+        if caught_exception is not None:
+            error_code = get_error_code(caught_exception)
+        elif response is not None and response[0].status_code >= 300:
+            error_code = response[1].get('Error', {}).get('Code') or str(response[0].status_code)
+        else:
+            return None
+        delay = self.get_retry_delay(service_name, operation_name, error_code, attempts)
+        if delay is not None:
+            # botocore sleeps for the delay as soon as this returns
+            TRACER.add_span('retry delay', time.time(), delay, SLEEP)
+        return delay
+
+
+# The retry policy shared by every AWS connection and client
+RETRY_POLICY = RetryPolicy()
@@ -0,0 +1,124 @@
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from bootstrap_cfn.metrics import write_file_atomically
+
+# The span categories
+PHASE = 'phase'
+AWS = 'aws'
+SLEEP = 'sleep'
+
+
+class Tracer(object):
+    """
+    Records spans of time spent in task phases, AWS calls and sleeps, and
+    writes them in the Chrome trace event format, to be opened in
+    chrome://tracing or Perfetto. Nothing is recorded until the tracer is
+    started.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.enabled = False
+        self.events = []
+        self.thread_names = {}
+        self.start_time = time.time()
+
+    def start(self):
+        """
+        Forget the spans recorded and start recording new ones
+        """
+        with self.lock:
+            self.events = []
+            self.thread_names = {}
+            self.start_time = time.time()
+            self.enabled = True
+
+    def stop(self):
+        self.enabled = False
+
+    def add_span(self, name, start_time, duration, category=PHASE, args=None):
+        """
+        Record a span that has ended
+
+        Args:
+            name(string): The name of the span, eg 'ec2 CreateRoute'
+            start_time(float): The time the span started at, from time.time()
+            duration(float): The number of seconds the span lasted
+            category(string): PHASE, AWS or SLEEP
+            args(dict): Details shown with the span in the trace viewer
+        """
+        if not self.enabled:
+            return
+        thread = threading.current_thread()
+        event = {
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': int((start_time - self.start_time) * 1000000),
+            'dur': int(duration * 1000000),
+            'pid': os.getpid(),
+            'tid': thread.ident,
+            'args': args or {},
+        }
+        with self.lock:
+            self.events.append(event)
+            self.thread_names[thread.ident] = thread.name
+
+    @contextmanager
+    def span(self, name, category=PHASE, **args):
+        """
+        A context manager recording the time spent in its block
+
+        Args:
+            name(string): The name of the span
+            category(string): PHASE, AWS or SLEEP
+            args: Details shown with the span in the trace viewer
+        """
+        if not self.enabled:
+            yield
+            return
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            self.add_span(name, start_time, time.time() - start_time, category, args)
+
+    def traced(self, name=None, category=PHASE):
+        """
+        A decorator recording the time spent in each call of a function
+
+        Args:
+            name(string): The name of the span, defaults to the function name
+            category(string): PHASE, AWS or SLEEP
+        """
+        def decorate(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(name or func.__name__, category):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def to_dict(self):
+        """
+        Returns:
+            (dict): The spans recorded, in the Chrome trace event format
+        """
+        with self.lock:
+            events = sorted(self.events, key=lambda event: (event['ts'], -event['dur']))
+            thread_names = dict(self.thread_names)
+        metadata = [{'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': ident, 'args': {'name': name}}
+                    for ident, name in sorted(thread_names.items())]
+        return {'traceEvents': metadata + events, 'displayTimeUnit': 'ms'}
+
+    def write(self, path):
+        write_file_atomically(path, json.dumps(self.to_dict(), default=str))
+
+
+# The tracer shared by the tasks and every AWS connection and client
+TRACER = Tracer()
@@ -1,14 +1,50 @@
+import httplib
+import logging
 import os
+import socket
+import sqlite3
 import sys
+import threading
 import time
+import urllib
 
 from copy import deepcopy
 
+import boto.connection
 import boto.exception
 import boto.provider
 import boto.sts
 
+import boto3
+
+import botocore.exceptions
+
 import bootstrap_cfn.errors as errors
+from bootstrap_cfn.event_store import OPERATIONS, get_eta, to_seconds
+from bootstrap_cfn.metrics import API_CALL_STATS
+from bootstrap_cfn.ratelimit import RATE_LIMITER
+from bootstrap_cfn.retry import RETRY_POLICY
+from bootstrap_cfn.tracing import AWS, SLEEP, TRACER
+
+try:
+    from botocore.config import Config as BotocoreConfig
+except ImportError:
+    # Client config, and so connection pool sizing, needs botocore >= 1.4
+    BotocoreConfig = None
+
+# The size of the connection pool of boto3 clients
+BOTO3_MAX_POOL_CONNECTIONS = 10
+
+# The boto3 service names of the boto connection modules
+BOTO_SERVICE_NAMES = {
+    'boto.cloudformation': 'cloudformation',
+    'boto.ec2': 'ec2',
+    'boto.ec2.autoscale': 'autoscaling',
+    'boto.ec2.elb': 'elasticloadbalancing',
+    'boto.iam': 'iam',
+    'boto.route53': 'route53',
+    'boto.sts': 'sts',
+}
 
 
 def timeout(timeout, interval):
@@ -22,11 +58,41 @@ def timeout(timeout, interval):
                 if attempts >= timeout / interval:
                     raise errors.CfnTimeoutError("Timeout in {0}".format(func.__name__))
                 attempts += 1
-                time.sleep(interval)
+                with TRACER.span('sleep', SLEEP):
+                    time.sleep(interval)
         return wrapper
     return decorate
 
 
+def poll(func, timeout, min_interval=1, max_interval=30, backoff=2):
+    """
+    Call a function until it returns a truthy value. The interval between
+    calls starts short and backs off up to a maximum.
+
+    Args:
+        func(callable): The function to call, it takes no arguments
+        timeout(int): The maximum number of seconds to keep polling for
+        min_interval(int): The number of seconds to wait after the first call
+        max_interval(int): The maximum number of seconds between calls
+        backoff(int): The factor to grow the interval by after each call
+
+    Returns:
+        The first truthy result, or None if the timeout was reached first
+    """
+    deadline = time.time() + timeout
+    interval = min_interval
+    while True:
+        result = func()
+        if result:
+            return result
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return None
+        with TRACER.span('poll interval', SLEEP):
+            time.sleep(min(interval, remaining))
+        interval = min(interval * backoff, max_interval)
+
+
 def connect_to_aws(module, instance):
     try:
         # Check if we have a AWS_ROLE_ARN_ID set, if so we will attempt
@@ -48,18 +114,330 @@ def connect_to_aws(module, instance):
                 aws_secret_access_key=role.credentials.secret_key,
                 security_token=role.credentials.session_token
             )
-            return conn
+            return instrument_boto_connection(conn, get_boto_service_name(module))
         conn = module.connect_to_region(
             region_name=instance.aws_region_name,
             profile_name=instance.aws_profile_name
         )
-        return conn
+        return instrument_boto_connection(conn, get_boto_service_name(module))
     except boto.exception.NoAuthHandlerFound:
         raise errors.NoCredentialsError()
     except boto.provider.ProfileNotFoundError as e:
         raise errors.ProfileNotFoundError(instance.aws_profile_name)
 
 
+def get_boto3_session(instance):
+    """
+    Get a boto3 session for the profile and region of an instance. Like
+    connect_to_aws, if AWS_ROLE_ARN_ID is set or we are on the
+    cross-account profile we assume that role.
+
+    Args:
+        instance: An object with aws_profile_name and aws_region_name attributes
+
+    Returns:
+        (boto3.session.Session): The session
+    """
+    try:
+        if (instance.aws_profile_name == 'cross-account' or
+                os.environ.get('AWS_ROLE_ARN_ID', False)):
+            sts = boto3.session.Session(
+                profile_name=instance.aws_profile_name,
+                region_name=instance.aws_region_name
+            ).client('sts')
+            role = sts.assume_role(
+                RoleArn=os.environ['AWS_ROLE_ARN_ID'],
+                RoleSessionName="AssumeRoleSession1"
+            )
+            return instrument_boto3_session(boto3.session.Session(
+                aws_access_key_id=role['Credentials']['AccessKeyId'],
+                aws_secret_access_key=role['Credentials']['SecretAccessKey'],
+                aws_session_token=role['Credentials']['SessionToken'],
+                region_name=instance.aws_region_name
+            ))
+        return instrument_boto3_session(boto3.session.Session(
+            profile_name=instance.aws_profile_name,
+            region_name=instance.aws_region_name
+        ))
+    except botocore.exceptions.ProfileNotFound:
+        raise errors.ProfileNotFoundError(instance.aws_profile_name)
+    except botocore.exceptions.NoCredentialsError:
+        raise errors.NoCredentialsError()
+
+
+def get_boto3_client(session, service_name):
+    """
+    Create a boto3 client from a session, with a connection pool sized for
+    reuse across many calls where botocore supports it
+
+    Args:
+        session(boto3.session.Session): The session to create the client from
+        service_name(string): The name of the AWS service, eg 'autoscaling'
+
+    Returns:
+        The boto3 client
+    """
+    if BotocoreConfig:
+        return setup_boto3_client(
+            session.client(service_name,
+                           config=BotocoreConfig(max_pool_connections=BOTO3_MAX_POOL_CONNECTIONS)))
+    return setup_boto3_client(session.client(service_name))
+
+
+def setup_boto3_client(client):
+    """
+    Make a boto3 client retry its calls by our retry policy rather
+    than the botocore defaults, and rate limit and account for them
+
+    Args:
+        client: The boto3 client
+
+    Returns:
+        The client
+    """
+    endpoint_prefix = client.meta.service_model.endpoint_prefix
+    # These are already registered if the client's session is instrumented
+    client.meta.events.register('request-created', _before_boto3_request,
+                                unique_id='bootstrap-cfn-before-request')
+    client.meta.events.register('needs-retry', _after_boto3_request,
+                                unique_id='bootstrap-cfn-after-request')
+    client.meta.events.unregister('needs-retry.%s' % endpoint_prefix,
+                                  unique_id='retry-config-%s' % endpoint_prefix)
+    client.meta.events.register('needs-retry.%s' % endpoint_prefix,
+                                RETRY_POLICY.boto3_needs_retry,
+                                unique_id='bootstrap-cfn-retry-%s' % endpoint_prefix)
+    return client
+
+
+def run_concurrently(func, items, max_workers=4):
+    """
+    Call a function on each item using a bounded pool of threads
+
+    Args:
+        func(callable): The function to call, it takes a single item
+        items(list): The items to call the function on
+        max_workers(int): The maximum number of calls to run at once
+
+    Returns:
+        (list): The results of each call, in the same order as items
+
+    Raises:
+        The first exception raised by any of the calls, once all the
+        running calls have finished. No further calls are started after
+        an exception.
+    """
+    items = list(items)
+    results = [None] * len(items)
+    errors_raised = []
+    lock = threading.Lock()
+    # Shared position in items, the workers take the next item from here
+    position = [0]
+
+    def worker():
+        while True:
+            with lock:
+                if errors_raised or position[0] >= len(items):
+                    return
+                index = position[0]
+                position[0] += 1
+            try:
+                results[index] = func(items[index])
+            except Exception:
+                with lock:
+                    errors_raised.append(sys.exc_info())
+
+    threads = [threading.Thread(target=worker) for _ in xrange(min(max(max_workers, 1), len(items)))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors_raised:
+        exc_type, exc_value, exc_traceback = errors_raised[0]
+        raise exc_type, exc_value, exc_traceback
+    return results
+
+
+def get_boto_service_name(module):
+    """
+    Get the boto3 name of the service of a boto connection module
+
+    Args:
+        module: The boto module, eg boto.ec2.elb
+
+    Returns:
+        (string): The service name, eg 'elasticloadbalancing'
+    """
+    return BOTO_SERVICE_NAMES.get(module.__name__, module.__name__.split('.')[-1])
+
+
+def get_boto_operation_name(conn, args, kwargs):
+    """
+    Get the name of the operation of a boto make_request call. Query
+    apis name their action, for the rest we use the method and the
+    last part of the path.
+    """
+    if isinstance(conn, boto.connection.AWSQueryConnection):
+        return kwargs.get('action', args[0] if args else None)
+    method = kwargs.get('method', args[0] if args else '')
+    path = kwargs.get('path', args[1] if len(args) > 1 else '')
+    return "{0} {1}".format(method, path.split('?')[0].rstrip('/').split('/')[-1]).strip()
+
+
+def get_boto_error_code(response):
+    """
+    Get the error code of a boto response, None if it succeeded. boto
+    caches the body of its responses, so reading it here still
+    leaves it for the caller.
+    """
+    status = getattr(response, 'status', None)
+    if not isinstance(status, int) or status < 300:
+        return None
+    body = response.read() or ''
+    for error_code in ['<Code>', '"Code": "', '"__type": "']:
+        if error_code in body:
+            return body.split(error_code, 1)[1].split('<', 1)[0].split('"', 1)[0]
+    return str(status)
+
+
+def instrument_boto_connection(conn, service_name):
+    """
+    Rate limit and account for the requests made through a boto
+    connection, and retry them by our retry policy
+
+    Args:
+        conn: The boto connection
+        service_name(string): The boto3 name of the service, eg 'route53'
+
+    Returns:
+        The connection
+    """
+    if conn is None:
+        return conn
+    make_request = conn.make_request
+
+    def instrumented_make_request(*args, **kwargs):
+        operation_name = get_boto_operation_name(conn, args, kwargs)
+        attempt = 1
+        while True:
+            trace_rate_limit_wait(RATE_LIMITER.acquire(service_name, operation_name))
+            start_time = time.time()
+            response = make_request(*args, **kwargs)
+            error_code = get_boto_error_code(response)
+            TRACER.add_span('{0} {1}'.format(service_name, operation_name), start_time, time.time() - start_time,
+                            AWS, {'attempt': attempt, 'error_code': error_code})
+            API_CALL_STATS.record(service_name, operation_name, time.time() - start_time,
+                                  attempt=attempt,
+                                  error_code=error_code,
+                                  request_bytes=get_boto_request_size(args, kwargs),
+                                  response_bytes=get_content_length(response))
+            RATE_LIMITER.record_response(service_name, operation_name, error_code)
+            delay = RETRY_POLICY.get_retry_delay(service_name, operation_name, error_code, attempt)
+            if delay is None:
+                return response
+            with TRACER.span('retry delay', SLEEP):
+                time.sleep(delay)
+            attempt += 1
+
+    conn.make_request = instrumented_make_request
+    return conn
+
+
+def trace_rate_limit_wait(waited):
+    """
+    Record the seconds a request just waited for the rate limiter as a span
+    """
+    if waited:
+        TRACER.add_span('rate limit', time.time() - waited, waited, SLEEP)
+
+
+def get_boto_request_size(args, kwargs):
+    """
+    Get the size of the body of a boto make_request call, the params of
+    query apis or the data of the rest
+    """
+    body = kwargs.get('params', kwargs.get('data'))
+    if body is None and len(args) > 1 and not isinstance(args[1], basestring):
+        body = args[1]
+    elif body is None and len(args) > 3:
+        body = args[3]
+    if isinstance(body, dict):
+        return len(urllib.urlencode(body))
+    return len(body or '')
+
+
+def get_content_length(response):
+    """
+    Get the size of the body of a boto or botocore response
+    """
+    headers = getattr(response, 'headers', None)
+    if hasattr(headers, 'get'):
+        content_length = headers.get('content-length')
+    elif hasattr(response, 'getheader'):
+        content_length = response.getheader('content-length')
+    else:
+        content_length = None
+    try:
+        return int(content_length)
+    except (TypeError, ValueError):
+        return 0
+
+
+# The start time and request size of the boto3 request each thread is making
+_boto3_request = threading.local()
+
+
+def _before_boto3_request(event_name, request=None, **kwargs):
+    _, service_name, operation_name = event_name.split('.', 2)
+    trace_rate_limit_wait(RATE_LIMITER.acquire(service_name, operation_name))
+    body = getattr(request, 'data', None)
+    _boto3_request.request_bytes = len(urllib.urlencode(body) if isinstance(body, dict) else body or '')
+    _boto3_request.start_time = time.time()
+
+
+def _after_boto3_request(event_name, response=None, attempts=1, **kwargs):
+    _, service_name, operation_name = event_name.split('.', 2)
+    error_code = None
+    if response is None:
+        error_code = 'ConnectionError'
+    elif response[0].status_code >= 300:
+        error_code = response[1].get('Error', {}).get('Code', str(response[0].status_code))
+    start_time = getattr(_boto3_request, 'start_time', None)
+    if start_time:
+        TRACER.add_span('{0} {1}'.format(service_name, operation_name), start_time, time.time() - start_time,
+                        AWS, {'attempt': attempts, 'error_code': error_code})
+    API_CALL_STATS.record(service_name, operation_name,
+                          time.time() - start_time if start_time else 0,
+                          attempt=attempts,
+                          error_code=error_code,
+                          request_bytes=getattr(_boto3_request, 'request_bytes', 0),
+                          response_bytes=get_content_length(response[0]) if response else 0)
+    RATE_LIMITER.record_response(service_name, operation_name, error_code)
+    # Leave the decision to retry to the other handlers
+    return None
+
+
+def instrument_boto3_session(session):
+    """
+    Rate limit and account for the requests of every client created from
+    a boto3 session, including each retry attempt
+
+    Args:
+        session(boto3.session.Session): The session
+
+    Returns:
+        The session
+    """
+    botocore_session = session._session
+    if getattr(botocore_session, 'bootstrap_cfn_instrumented', False) is not True:
+        botocore_session.register('request-created', _before_boto3_request,
+                                  unique_id='bootstrap-cfn-before-request')
+        botocore_session.register('needs-retry', _after_boto3_request,
+                                  unique_id='bootstrap-cfn-after-request')
+        botocore_session.bootstrap_cfn_instrumented = True
+    return session
+
+
 def dict_merge(target, *args):
     # Merge multiple dicts
     if len(args) > 1:
@@ -79,9 +457,18 @@ def dict_merge(target, *args):
     return target
 
 
-def tail(stack, stack_name):
+@TRACER.traced('tail')
+def tail(stack, stack_name, event_store=None):
     from fabric.colors import green, red, yellow
-    """Show and then tail the event log"""
+    """
+    Show and then tail the event log
+
+    Args:
+        stack(Cloudformation): The connection to cloudformation
+        stack_name(string): The name of the stack
+        event_store(EventStore): Keeps the events, and estimates when the
+            resources in progress finish from the events kept before
+    """
 
     def colorize(e):
         if e.endswith("_IN_PROGRESS"):
@@ -98,13 +485,51 @@ def tail(stack, stack_name):
         if e.resource_status_reason:
             print(e.resource_status_reason)
 
+    history = {}
+    in_progress = {}
+    if event_store is not None:
+        try:
+            history = dict((operation, event_store.get_percentiles(operation))
+                           for operation in OPERATIONS)
+        except (sqlite3.Error, OSError) as e:
+            logging.warning("utils::tail: Could not read the event store '%s': %s" % (event_store.path, e))
+            event_store = None
+    # Whether to go on keeping events, stopped after the first failure
+    keeping = {'events': True}
+
+    def track(events):
+        """
+        Keep new events and print when the resources in progress are
+        expected to finish
+        """
+        if not events or event_store is None:
+            return
+        if keeping['events']:
+            try:
+                event_store.add_events(events)
+            except (sqlite3.Error, OSError) as e:
+                logging.warning("utils::tail: Could not keep the events in '%s': %s" % (event_store.path, e))
+                keeping['events'] = False
+        for e in events:
+            if e.physical_resource_id == e.stack_id:
+                continue
+            operation = e.resource_status.split('_')[0]
+            if e.resource_status.endswith('_IN_PROGRESS'):
+                in_progress.setdefault(e.logical_resource_id, (operation, e.resource_type, to_seconds(e.timestamp)))
+            else:
+                in_progress.pop(e.logical_resource_id, None)
+        eta = get_eta(in_progress, history, time.time())
+        if eta is not None:
+            print("ETA %02d:%02d waiting for %s" % (divmod(int(eta[0]), 60) + (eta[1],)))
+
     # First dump the full list of events in chronological order and keep
     # track of the events we've seen already
     seen = set()
-    initial_events = get_events(stack, stack_name)
+    initial_events = list(get_events(stack, stack_name))
     for e in initial_events:
         tail_print(e)
         seen.add(e.event_id)
+    track(initial_events)
 
     # Now keep looping through and dump the new events
     while 1:
@@ -113,11 +538,19 @@ def tail(stack, stack_name):
         elif stack.stack_done(stack_name):
             break
         events = get_events(stack, stack_name)
+        new_events = []
         for e in events:
             if e.event_id not in seen:
                 tail_print(e)
+                new_events.append(e)
             seen.add(e.event_id)
-        time.sleep(2)
+        track(new_events)
+        with TRACER.span('sleep', SLEEP):
+            time.sleep(2)
+    if event_store is not None:
+        # Keep the last events, which came in after they were last looked at
+        track([e for e in get_events(stack, stack_name) if e.event_id not in seen])
+        event_store.close()
 
 
 def get_events(stack, stack_name):
@@ -127,13 +560,24 @@ def get_events(stack, stack_name):
     while 1 and not stack.stack_missing(stack_name):
         try:
             events = stack.conn_cfn.describe_stack_events(stack_name, next)
-        except:
+        except boto.exception.BotoServerError as e:
+            # Retryable errors have already been retried, what is left is
+            # usually the stack having been deleted as we tail it
+            if e.error_code != 'ValidationError':
+                logging.warning("utils::get_events: Could not get stack events for '%s': %s"
+                                % (stack_name, e.error_message))
+            break
+        except (socket.error, httplib.HTTPException) as e:
+            # Stop reading the events rather than failing the task waiting on the stack
+            logging.warning("utils::get_events: Could not connect to get stack events for '%s': %r"
+                            % (stack_name, e))
             break
         event_list.append(events)
         if events.next_token is None:
             break
         next = events.next_token
-        time.sleep(1)
+        with TRACER.span('sleep', SLEEP):
+            time.sleep(1)
     return reversed(sum(event_list, []))
 
 
@@ -149,5 +593,6 @@ def sleep_countdown(sleep_time):
         timeformat = '{:02d}:{:02d}'.format(mins, secs)
         sys.stdout.write("{}\r".format(timeformat))
         sys.stdout.flush()
-        time.sleep(1)
+        with TRACER.span('sleep', SLEEP):
+            time.sleep(1)
         sleep_time -= 1
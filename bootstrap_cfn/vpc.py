@@ -1,5 +1,7 @@
 import logging
 
+import threading
+
 import time
 
 import boto3
@@ -8,9 +10,210 @@ from botocore.exceptions import ClientError
 
 import netaddr
 
-from bootstrap_cfn import cloudformation
+from bootstrap_cfn import cloudformation, utils
+
+from bootstrap_cfn.errors import CfnTimeoutError, CloudResourceNotFoundError
+
+from bootstrap_cfn.retry import RETRY_POLICY
+
+# The error codes EC2 returns for a peering connection that was only
+# just created, until it becomes visible
+PEERING_EVENTUAL_CONSISTENCY_ERROR_CODES = ['InvalidVpcPeeringConnectionID.NotFound']
+# New peering connections commonly take several seconds to become visible,
+# longer than the default retries of the retry policy cover
+PEERING_MAX_ATTEMPTS = 8
+PEERING_BASE_DELAY = 1
+
+# The logical ids of the network resources of a shared network stack that
+# app stacks import as parameters, and the types of those parameters
+SHARED_NETWORK_PARAMETERS = [
+    ('VPC', 'AWS::EC2::VPC::Id'),
+    ('SubnetA', 'AWS::EC2::Subnet::Id'),
+    ('SubnetB', 'AWS::EC2::Subnet::Id'),
+    ('SubnetC', 'AWS::EC2::Subnet::Id'),
+    ('PublicRouteTable', 'String'),
+]
+
+
+class VpcTopologyIndex(object):
+    """
+    An in-memory index of the route tables, route table associations, tags
+    and cidr blocks of a set of VPC's.
+
+    VPC's are registered with add_vpcs and nothing is fetched until the first
+    lookup, at which point all the registered VPC's are loaded together with one
+    describe_vpcs and one filtered describe_route_tables call.
+    """
+
+    def __init__(self, vpc_ids=None, ec2_client=None):
+        """
+        Args:
+            vpc_ids(list): The ids of the vpcs to index
+            ec2_client: The boto3 ec2 client to use, one is created on
+                the first load if not given
+        """
+        self.ec2_client = ec2_client
+        # vpc_id: {'cidr_blocks': [<cidr_block>], 'route_table_ids': [<route_table_id>]}
+        self.vpcs = {}
+        # route_table_id: <route table description>
+        self.route_tables = {}
+        self.pending_vpc_ids = set()
+        self.add_vpcs(vpc_ids or [])
+
+    def add_vpcs(self, vpc_ids):
+        """
+        Register vpcs to be loaded on the next lookup
+
+        Args:
+            vpc_ids(list): The ids of the vpcs to index
+        """
+        self.pending_vpc_ids.update(
+            vpc_id for vpc_id in vpc_ids if vpc_id and vpc_id not in self.vpcs)
+
+    def load(self):
+        """
+        Load all the registered vpcs that are not yet in the index
+        """
+        if not self.pending_vpc_ids:
+            return
+        vpc_ids = sorted(self.pending_vpc_ids)
+        if self.ec2_client is None:
+            self.ec2_client = utils.setup_boto3_client(boto3.client('ec2'))
+
+        for vpc_id in vpc_ids:
+            self.vpcs[vpc_id] = {'cidr_blocks': [], 'route_table_ids': []}
+
+        for vpc in self.ec2_client.describe_vpcs(VpcIds=vpc_ids).get('Vpcs', []):
+            cidr_blocks = [vpc['CidrBlock']]
+            for association in vpc.get('CidrBlockAssociationSet', []):
+                if (association['CidrBlock'] not in cidr_blocks and
+                        association.get('CidrBlockState', {}).get('State', 'associated') == 'associated'):
+                    cidr_blocks.append(association['CidrBlock'])
+            self.vpcs[vpc['VpcId']]['cidr_blocks'] = cidr_blocks
+
+        request = {'Filters': [{'Name': 'vpc-id', 'Values': vpc_ids}]}
+        while True:
+            response = self.ec2_client.describe_route_tables(**request)
+            for route_table in response.get('RouteTables', []):
+                self.route_tables[route_table['RouteTableId']] = route_table
+                self.vpcs[route_table['VpcId']]['route_table_ids'].append(route_table['RouteTableId'])
+            if not response.get('NextToken'):
+                break
+            request['NextToken'] = response['NextToken']
+
+        self.pending_vpc_ids.clear()
+
+    def get_vpc_cidr_blocks(self, vpc_id):
+        """
+        Get a vpcs cidr blocks
+
+        Args:
+            vpc_id(string): The vpc id to get the cidrs for
+
+        Returns:
+            (list): The cidr blocks of the VPC
+        """
+        self.add_vpcs([vpc_id])
+        self.load()
+        return list(self.vpcs[vpc_id]['cidr_blocks'])
 
-from bootstrap_cfn.errors import CloudResourceNotFoundError
+    def get_route_table(self, route_table_id):
+        """
+        Get an indexed route table description
+
+        Args:
+            route_table_id(string): The id of the route table
+
+        Returns:
+            (dict): The route table description, None if it is not indexed
+        """
+        self.load()
+        return self.route_tables.get(route_table_id)
+
+    def get_routes(self, route_table_id):
+        """
+        Get the routes of an indexed route table by destination
+
+        Args:
+            route_table_id(string): The id of the route table
+
+        Returns:
+            (dict): The route descriptions keyed on their destination
+                cidr block, None if the route table is not indexed
+        """
+        route_table = self.get_route_table(route_table_id)
+        if route_table is None:
+            return None
+        return dict((route['DestinationCidrBlock'], route)
+                    for route in route_table.get('Routes', []) if 'DestinationCidrBlock' in route)
+
+    def add_route(self, route_table_id, cidr_block, peering_conn_id):
+        """
+        Record a route created through a peering connection
+
+        Args:
+            route_table_id(string): The id of the route table
+            cidr_block(string): The destination cidr block of the route
+            peering_conn_id(string): The id of the peering connection
+        """
+        route_table = self.route_tables.get(route_table_id)
+        if route_table is not None:
+            self.remove_route(route_table_id, cidr_block)
+            route_table.setdefault('Routes', []).append({
+                'DestinationCidrBlock': cidr_block,
+                'VpcPeeringConnectionId': peering_conn_id,
+                'State': 'active'
+            })
+
+    def remove_route(self, route_table_id, cidr_block):
+        """
+        Record a route being deleted
+
+        Args:
+            route_table_id(string): The id of the route table
+            cidr_block(string): The destination cidr block of the route
+        """
+        route_table = self.route_tables.get(route_table_id)
+        if route_table is not None:
+            route_table['Routes'] = [route for route in route_table.get('Routes', [])
+                                     if route.get('DestinationCidrBlock') != cidr_block]
+
+    def get_route_table_ids(self,
+                            vpc_id,
+                            logical_id_filter=None,
+                            min_subnet_associations=None,
+                            is_main=None):
+        """
+        Get a filtered set of route table ids for a vpc. A route table
+        is returned if it matches any of the filters given.
+
+        Args:
+            vpc_id(string): The vpc id to get the route tables for
+            logical_id_filter(string): The cloudformation logical id of the route table
+            min_subnet_associations(int): The minimum number of subnets the route
+                table is associated with
+            is_main(bool): Match the main route table of the vpc
+
+        Returns:
+            (list): The matching route table ids
+        """
+        self.add_vpcs([vpc_id])
+        self.load()
+        route_table_ids = []
+        for route_table_id in self.vpcs[vpc_id]['route_table_ids']:
+            route_table = self.route_tables[route_table_id]
+            if not logical_id_filter and not min_subnet_associations and not is_main:
+                route_table_ids.append(route_table_id)
+                continue
+
+            associations = route_table.get('Associations', [])
+            tags = dict((tag['Key'], tag['Value']) for tag in route_table.get('Tags', []))
+            subnet_associations = [association for association in associations if association.get('SubnetId')]
+            if ((logical_id_filter and tags.get('aws:cloudformation:logical-id') == logical_id_filter) or
+                    (min_subnet_associations and len(subnet_associations) >= min_subnet_associations) or
+                    (is_main and any(association.get('Main') for association in associations))):
+                route_table_ids.append(route_table_id)
+        return route_table_ids
 
 
 class VPC:
@@ -36,6 +239,14 @@ class VPC:
     # Stacks vpc id
     vpc_id = None
 
+    # Index of the route tables and cidr blocks of this and the peering stacks vpcs
+    topology_index = None
+    # Cache of stack name to vpc id lookups
+    stack_vpc_ids = None
+
+    # The maximum number of route changes to make at once
+    route_workers = 4
+
     logger = None
 
     def __init__(self, config_data, stack_name):
@@ -48,6 +259,8 @@ class VPC:
         """
         # Setup logging
         self.setup_logging()
+        self.stack_vpc_ids = {}
+        self.topology_index = VpcTopologyIndex()
         self.peering_config = self.parse_config(config_data, stack_name)
 
     def disable_peering(self,
@@ -109,11 +322,11 @@ class VPC:
         self.logger.info("VPC::peer_to_stack: Creating peering connection '%s'"
                          % (vpc_peering_connection.id))
 
-        # Have the peer target stack accept the peering
-        ec2_client = boto3.client('ec2')
-        ec2_client.accept_vpc_peering_connection(
-            VpcPeeringConnectionId=vpc_peering_connection.id
-        )
+        # Have the peer target stack accept the peering, the new connection
+        # may not be visible to it straight away
+        ec2_client = self.get_ec2_client()
+        self.call_ec2(ec2_client.accept_vpc_peering_connection, 'AcceptVpcPeeringConnection',
+                      VpcPeeringConnectionId=vpc_peering_connection.id)
         self.logger.info("VPC::peer_to_stack: Accepting peering connection '%s'"
                          % (vpc_peering_connection.id))
         # wait for required state
@@ -164,26 +377,12 @@ class VPC:
             peering_stack_config(dict): The configuration of the peering connection
                 to setup
         """
-        source_route_tables = peering_stack_config.get('source_routes')
-        for route_table_key, route_table_config in source_route_tables.iteritems():
-            cidr_blocks = route_table_config.get('cidr_blocks')
-            for cidr_block in cidr_blocks:
-                self.create_route_vpc_to_vpc_peer(
-                    vpc_id=peering_conn.requester_vpc_info['VpcId'],
-                    target_vpc_cidr=cidr_block,
-                    peering_conn_id=peering_conn.id,
-                    route_table_ids=[route_table_config['route_table_id']]
-                )
-        target_route_tables = peering_stack_config.get('target_routes')
-        for route_table_key, route_table_config in target_route_tables.iteritems():
-            cidr_blocks = route_table_config.get('cidr_blocks')
-            for cidr_block in cidr_blocks:
-                self.create_route_vpc_to_vpc_peer(
-                    vpc_id=peering_conn.accepter_vpc_info['VpcId'],
-                    target_vpc_cidr=cidr_block,
-                    peering_conn_id=peering_conn.id,
-                    route_table_ids=[route_table_config['route_table_id']],
-                )
+        routes = []
+        for route_set in ['source_routes', 'target_routes']:
+            for route_table_config in peering_stack_config.get(route_set, {}).values():
+                for cidr_block in route_table_config.get('cidr_blocks'):
+                    routes.append((route_table_config['route_table_id'], cidr_block))
+        self.create_routes(routes, peering_conn.id)
 
     def delete_peering_routes(self, peering_config):
         """
@@ -193,13 +392,13 @@ class VPC:
         Args:
             peering_config(dict): The config of the peering connection
         """
+        routes = []
         for route_set in ['source_routes', 'target_routes']:
             route_configs = peering_config.get(route_set, {}).values()
             for route_config in route_configs:
-                self.delete_routes_from_tables(
-                    route_table_id=route_config['route_table_id'],
-                    cidr_blocks=route_config['cidr_blocks']
-                )
+                for cidr_block in route_config['cidr_blocks']:
+                    routes.append((route_config['route_table_id'], cidr_block))
+        self.delete_routes(routes)
 
     def delete_peering_connections(
         self,
@@ -247,7 +446,7 @@ class VPC:
         Returns:
             (list): The VPCPeeringConnections belonging to the specified stack
         """
-        ec2_client = boto3.client('ec2')
+        ec2_client = self.get_ec2_client()
         ec2_resource = boto3.resource('ec2')
         peering_connections = []
         peering_connection_filter = [{'Name': 'requester-vpc-info.vpc-id', 'Values': [self.vpc_id]}]
@@ -280,6 +479,8 @@ class VPC:
             (string): The PhysicalResourceId of the vpc, None if there are multiple
                 or no vpcs found
         """
+        if stack_name in self.stack_vpc_ids:
+            return self.stack_vpc_ids[stack_name]
         vpcs = cloudformation.get_resource_type(stack_name, resource_type='AWS::EC2::VPC')
         if len(vpcs) > 1:
             self.logger.error("VPC::get_stack_vpc: Unique vpc not found for stack '%s'"
@@ -289,7 +490,8 @@ class VPC:
             self.logger.error("VPC::get_stack_vpc: No vpc found for stack '%s'"
                               % (stack_name))
             return None
-        return vpcs[0]['PhysicalResourceId']
+        self.stack_vpc_ids[stack_name] = vpcs[0]['PhysicalResourceId']
+        return self.stack_vpc_ids[stack_name]
 
     def get_stack_name_by_match(
             self,
@@ -331,37 +533,20 @@ class VPC:
         Get a filtered set of route table ids for a supplied vpc
 
         Args:
-            (string): The vpc id to get the default route
-                table for
+            vpc_id(string): The vpc id to get the route tables for
+            logical_id_filter(string): The cloudformation logical id of the route table
+            min_subnet_associations(int): The minimum number of subnets the route
+                table is associated with
+            is_main(bool): Match the main route table of the vpc
 
         Returns:
-            (list): The default route table id, None if
-                it wasnt found
+            (list): The matching route table ids
         """
-        route_table_ids = []
-        ec2_resource = boto3.resource('ec2')
-        vpc = ec2_resource.Vpc(vpc_id)
-        for route_table in list(vpc.route_tables.all()):
-            if not logical_id_filter and not min_subnet_associations and not is_main:
-                route_table_ids.append(route_table.id)
-            else:
-                if logical_id_filter:
-                    filtered_tables = [
-                        entry['Key'] for entry in route_table.tags if (
-                            entry['Key'] == 'aws:cloudformation:logical-id' and entry['Value'] == logical_id_filter)
-                    ]
-                    if len(filtered_tables) > 0:
-                        route_table_ids.append(route_table.id)
-
-                if min_subnet_associations:
-                    if (route_table.association > min_subnet_associations):
-                        route_table_ids.append(route_table.id)
-
-                if is_main:
-                    for association in list(route_table.associations.all()):
-                        if association.main is True:
-                            route_table_ids.append(route_table.id)
-        return route_table_ids
+        return self.topology_index.get_route_table_ids(
+            vpc_id,
+            logical_id_filter=logical_id_filter,
+            min_subnet_associations=min_subnet_associations,
+            is_main=is_main)
 
     def get_vpc_cidr_blocks(
             self,
@@ -374,9 +559,7 @@ class VPC:
         Returns:
             (list): The cidr range of the VPC
         """
-        ec2_resource = boto3.resource('ec2')
-        vpc = ec2_resource.Vpc(vpc_id)
-        return [vpc.cidr_block]
+        return self.topology_index.get_vpc_cidr_blocks(vpc_id)
 
     def create_route_vpc_to_vpc_peer(self,
                                      vpc_id,
@@ -394,63 +577,185 @@ class VPC:
             route_table_ids(list): The list of route table ids
                 to setup the route on. If None, setup on all route tables.
         """
-        ec2_client = boto3.client('ec2')
-        for route_table_id in route_table_ids:
+        if route_table_ids is None:
+            route_table_ids = self.get_vpc_route_table_ids(vpc_id)
+        self.create_routes([(route_table_id, target_vpc_cidr) for route_table_id in route_table_ids],
+                           peering_conn_id)
+
+    def delete_routes_from_tables(
+            self,
+            route_table_id,
+            cidr_blocks):
+        """
+        Delete a specified cidr from all route_tables in a VPC
+
+        Args:
+            route_table_id(string): The route table id to delete the
+                cidr blocks from
+            cidr_blocks(list): The list of cidrs to remove from the
+                route table
+        """
+        self.delete_routes([(route_table_id, cidr_block) for cidr_block in cidr_blocks])
+
+    def create_routes(self, routes, peering_conn_id=None):
+        """
+        Create routes through peering connections. Routes that already
+        exist are skipped and the rest are created concurrently.
+
+        Args:
+            routes(list): (route_table_id, cidr_block) tuples of the routes to create,
+                or (route_table_id, cidr_block, peering_conn_id) tuples to route
+                through different peering connections
+            peering_conn_id(string): The id of the peering connection
+
+        Returns:
+            (list): The (route_table_id, cidr_block, peering_conn_id) tuples of
+                the routes that were created
+        """
+        routes = [tuple(route) if len(route) == 3 else tuple(route) + (peering_conn_id,)
+                  for route in routes]
+        routes_to_create = []
+        for route_table_id, cidr_block, peering_conn_id in self.unique_routes(routes):
+            existing_routes = self.topology_index.get_routes(route_table_id)
+            existing_route = (existing_routes or {}).get(cidr_block)
+            if existing_route is None:
+                routes_to_create.append((route_table_id, cidr_block, peering_conn_id))
+            elif existing_route.get('VpcPeeringConnectionId') != peering_conn_id:
+                self.logger.warn("vpc::create_routes: Adding routes to vpc, "
+                                 "route '%s' already exists in table '%s',"
+                                 " skipping creation"
+                                 % (cidr_block, route_table_id))
+
+        ec2_client = self.get_ec2_client()
+
+        def create_route(route):
+            route_table_id, cidr_block, peering_conn_id = route
             try:
-                self.logger.info("VPC::create_route_vpc_to_vpc_peer: Creating route in '%s'"
+                self.logger.info("VPC::create_routes: Creating route in '%s'"
                                  " range '%s' through peering connection '%s'"
-                                 % (route_table_id, target_vpc_cidr, peering_conn_id))
-                ec2_client.create_route(
+                                 % (route_table_id, cidr_block, peering_conn_id))
+                self.call_ec2(
+                    ec2_client.create_route, 'CreateRoute',
                     RouteTableId=route_table_id,
-                    DestinationCidrBlock=target_vpc_cidr,
+                    DestinationCidrBlock=cidr_block,
                     VpcPeeringConnectionId=peering_conn_id
                 )
+                return True
             except ClientError as e:
                 if e.response['Error']['Code'] == 'RouteAlreadyExists':
                     msg = (
-                        "vpc::route_vpc_to_vpc_peer: Adding routes to vpc, "
+                        "vpc::create_routes: Adding routes to vpc, "
                         "route '%s' already exists in table '%s',"
                         " skipping creation"
-                        % (target_vpc_cidr, route_table_id))
+                        % (cidr_block, route_table_id))
                     self.logger.warn(msg)
+                    return False
                 else:
                     raise e
 
-    def delete_routes_from_tables(
-            self,
-            route_table_id,
-            cidr_blocks):
+        created = utils.run_concurrently(create_route, routes_to_create, max_workers=self.route_workers)
+        created_routes = [route for route, was_created in zip(routes_to_create, created) if was_created]
+        for route_table_id, cidr_block, peering_conn_id in created_routes:
+            self.topology_index.add_route(route_table_id, cidr_block, peering_conn_id)
+        return created_routes
+
+    def delete_routes(self, routes):
         """
-        Delete a specified cidr from all route_tables in a VPC
+        Delete routes from route tables. Routes that are known not to
+        exist are skipped and the rest are deleted concurrently.
 
         Args:
-            route_table_id(string): The route table id to delete the
-                cidr blocks from
-            cidr_blocks(list): The list of cidrs to remove from the
-                route table
+            routes(list): (route_table_id, cidr_block) tuples of the routes to delete
         """
-        ec2_client = boto3.client('ec2')
-        for cidr_block in cidr_blocks:
+        routes_to_delete = []
+        for route_table_id, cidr_block in self.unique_routes(routes):
+            existing_routes = self.topology_index.get_routes(route_table_id)
+            if existing_routes is not None and cidr_block not in existing_routes:
+                self.logger.warn("vpc::delete_routes: No route '%s' "
+                                 " found in table '%s'"
+                                 % (cidr_block, route_table_id))
+            else:
+                routes_to_delete.append((route_table_id, cidr_block))
+
+        ec2_client = self.get_ec2_client()
+
+        def delete_route(route):
+            route_table_id, cidr_block = route
             try:
-                ec2_client.delete_route(
+                self.call_ec2(
+                    ec2_client.delete_route, 'DeleteRoute',
                     RouteTableId=route_table_id,
                     DestinationCidrBlock=cidr_block
                 )
                 self.logger.info(
-                    "vpc::delete_routes_from_tables: "
+                    "vpc::delete_routes: "
                     "Deleted cidr block '%s' from route '%s'"
                     % (cidr_block, route_table_id)
                 )
             except ClientError as e:
                 if e.response['Error']['Code'] == 'InvalidRoute.NotFound':
                     msg = (
-                        "vpc::delete_routes_from_tables: No route '%s' "
+                        "vpc::delete_routes: No route '%s' "
                         " found in table '%s'"
                         % (cidr_block, route_table_id))
                     self.logger.warn(msg)
                 else:
                     raise e
 
+        utils.run_concurrently(delete_route, routes_to_delete, max_workers=self.route_workers)
+        for route_table_id, cidr_block in routes_to_delete:
+            self.topology_index.remove_route(route_table_id, cidr_block)
+
+    def unique_routes(self, routes):
+        """
+        Remove duplicate routes, keeping their order
+
+        Args:
+            routes(list): Route tuples
+
+        Returns:
+            (list): The routes without duplicates
+        """
+        seen = set()
+        unique_routes = []
+        for route in routes:
+            if route not in seen:
+                seen.add(route)
+                unique_routes.append(route)
+        return unique_routes
+
+    def call_ec2(self, method, operation_name, **kwargs):
+        """
+        Call an EC2 client method that may refer to a peering connection
+        that was only just created, retrying until it is visible. Only the
+        peering errors are retried here, throttling and transient errors are
+        already retried by the client.
+
+        Args:
+            method(callable): The boto3 client method to call
+            operation_name(string): The name of the EC2 operation, eg 'CreateRoute'
+            kwargs: The arguments of the call
+
+        Returns:
+            The response of the call
+        """
+        return RETRY_POLICY.run(lambda: method(**kwargs), 'ec2', operation_name,
+                                retryable_codes=PEERING_EVENTUAL_CONSISTENCY_ERROR_CODES,
+                                max_attempts=PEERING_MAX_ATTEMPTS,
+                                base_delay=PEERING_BASE_DELAY,
+                                only_codes=True)
+
+    def get_ec2_client(self):
+        """
+        Get the boto3 ec2 client shared with the topology index
+
+        Returns:
+            The boto3 ec2 client
+        """
+        if self.topology_index.ec2_client is None:
+            self.topology_index.ec2_client = utils.setup_boto3_client(boto3.client('ec2'))
+        return self.topology_index.ec2_client
+
     def setup_logging(self):
         logging.getLogger('boto3').setLevel(logging.CRITICAL)
         logging.getLogger('botocore').setLevel(logging.CRITICAL)
@@ -475,78 +780,322 @@ class VPC:
         peering_config = self.vpc_config.get('peering', {})
         parsed_peering_config = {}
 
-        for peering_stack_search_name, peering_stack_config_entry in peering_config.iteritems():
+        # Resolve all the peering stacks and their vpcs first so that the
+        # topology of every vpc involved is loaded together on the first lookup
+        peering_stacks = {}
+        for peering_stack_search_name in peering_config:
             # Make sure we match to one and only one stack
             found_stacks = self.get_stack_name_by_match(peering_stack_search_name, min_results=1, max_results=1)
-
-            if found_stacks:
-                peering_stack_name = found_stacks[0]['StackName']
-                peering_stack_vpc_id = self.get_stack_vpc_id(peering_stack_name)
-                self.logger.info("vpc::parse_config: Found stack '%s' with vpc '%s'"
-                                 % (peering_stack_search_name, peering_stack_vpc_id))
-                # Setup layout for stack peering config
-                parsed_peering_config[peering_stack_search_name] = {}
-                parsed_peering_config[peering_stack_search_name]['source_routes'] = {}
-                parsed_peering_config[peering_stack_search_name]['target_routes'] = {}
-                parsed_peering_config[peering_stack_search_name]['stack_name'] = peering_stack_name
-                parsed_peering_config[peering_stack_search_name]['vpc_id'] = peering_stack_vpc_id
-
-                # Expand all wildcards recursively
-                # If the entry is wildcarded then peer the vpcs cidr blocks to all route_tables
-                if peering_config[peering_stack_search_name] == '*':
-                    self.logger.info("vpc::parse_config: Found stack wildcard, matching all routes and addresses...")
-                    peering_config[peering_stack_search_name] = {}
-                    peering_config[peering_stack_search_name]['source_routes'] = '*'
-                    peering_config[peering_stack_search_name]['target_routes'] = '*'
-
-                # If the route set is wildcarded then apply the cidr_blocks to all route tables
-                # source_routes: '*'
-                route_config_dictionary = {
-                    'source_routes': {'route_tables_vpc_id': self.vpc_id, 'cidr_blocks_vpc_id': peering_stack_vpc_id},
-                    'target_routes': {'route_tables_vpc_id': peering_stack_vpc_id, 'cidr_blocks_vpc_id': self.vpc_id}
-                }
-
-                for route_set, routes_vpc_config in route_config_dictionary.iteritems():
-                    route_tables_vpc_id = routes_vpc_config['route_tables_vpc_id']
-                    cidr_blocks_vpc_id = routes_vpc_config['cidr_blocks_vpc_id']
-                    if peering_config[peering_stack_search_name][route_set] == '*':
-                        self.logger.info("vpc::parse_config: Found %s wildcard, matching all %s routes and addresses..."
-                                         % (route_set, route_set))
-                        all_vpc_cidr_blocks = self.get_vpc_cidr_blocks(cidr_blocks_vpc_id)
-                        for vpc_route_table_id in self.get_vpc_route_table_ids(route_tables_vpc_id):
-                            parsed_peering_config[peering_stack_search_name][route_set][vpc_route_table_id] = {}
-                            parsed_peering_config[peering_stack_search_name][route_set][vpc_route_table_id]['route_table_id'] = vpc_route_table_id
-                            parsed_peering_config[peering_stack_search_name][route_set][vpc_route_table_id]['cidr_blocks'] = all_vpc_cidr_blocks
-                    else:
-                        for route_table_name, route_table_config in peering_config[peering_stack_search_name].get(route_set, {}).iteritems():
-                            if route_table_config['cidr_blocks'] == '*':
-                                self.logger.info("vpc::parse_config: Found cidr block wildcard, using '%s' for route table %s..."
-                                                 % (cidr_blocks_vpc_id, route_table_name))
-                                cidr_blocks = self.get_vpc_cidr_blocks(cidr_blocks_vpc_id)
-                            else:
-                                cidr_blocks = route_table_config['cidr_blocks']
-
-                            if route_table_name == '*':
-                                self.logger.info("vpc::parse_config: Found route table wildcard, "
-                                                 "applying cidr blocks to all %s route tables..."
-                                                 % (route_set))
-                                for vpc_route_table_id in self.get_vpc_route_table_ids(route_tables_vpc_id):
-                                    parsed_peering_config[peering_stack_search_name][route_set][vpc_route_table_id] = {}
-                                    parsed_peering_config[peering_stack_search_name][route_set][vpc_route_table_id]['route_table_id'] = vpc_route_table_id
-                                    parsed_peering_config[peering_stack_search_name][route_set][vpc_route_table_id]['cidr_blocks'] = cidr_blocks
-                            else:
-                                parsed_peering_config[peering_stack_search_name][route_set][route_table_name] = {}
-                                parsed_peering_config[peering_stack_search_name][route_set][route_table_name]['route_table_id'] = (
-                                    self.get_vpc_route_table_ids(peering_stack_vpc_id, route_table_name)[0]
-                                )
-                                parsed_peering_config[peering_stack_search_name][route_set][route_table_name]['cidr_blocks'] = cidr_blocks
-            else:
+            if not found_stacks:
                 self.logger.error("vpc::setup_config: Not stack found that matches search term '%s'"
                                   % (peering_stack_search_name))
                 raise CloudResourceNotFoundError
+            peering_stack_name = found_stacks[0]['StackName']
+            peering_stacks[peering_stack_search_name] = (peering_stack_name, self.get_stack_vpc_id(peering_stack_name))
+        self.topology_index.add_vpcs([self.vpc_id] + [vpc_id for _, vpc_id in peering_stacks.values()])
+
+        for peering_stack_search_name, peering_stack_config_entry in peering_config.iteritems():
+            peering_stack_name, peering_stack_vpc_id = peering_stacks[peering_stack_search_name]
+            self.logger.info("vpc::parse_config: Found stack '%s' with vpc '%s'"
+                             % (peering_stack_search_name, peering_stack_vpc_id))
+            # Setup layout for stack peering config
+            parsed_peering_config[peering_stack_search_name] = {}
+            parsed_peering_config[peering_stack_search_name]['source_routes'] = {}
+            parsed_peering_config[peering_stack_search_name]['target_routes'] = {}
+            parsed_peering_config[peering_stack_search_name]['stack_name'] = peering_stack_name
+            parsed_peering_config[peering_stack_search_name]['vpc_id'] = peering_stack_vpc_id
+
+            # Expand all wildcards recursively
+            # If the entry is wildcarded then peer the vpcs cidr blocks to all route_tables
+            if peering_config[peering_stack_search_name] == '*':
+                self.logger.info("vpc::parse_config: Found stack wildcard, matching all routes and addresses...")
+                peering_config[peering_stack_search_name] = {}
+                peering_config[peering_stack_search_name]['source_routes'] = '*'
+                peering_config[peering_stack_search_name]['target_routes'] = '*'
+
+            # If the route set is wildcarded then apply the cidr_blocks to all route tables
+            # source_routes: '*'
+            route_config_dictionary = {
+                'source_routes': {'route_tables_vpc_id': self.vpc_id, 'cidr_blocks_vpc_id': peering_stack_vpc_id},
+                'target_routes': {'route_tables_vpc_id': peering_stack_vpc_id, 'cidr_blocks_vpc_id': self.vpc_id}
+            }
+
+            for route_set, routes_vpc_config in route_config_dictionary.iteritems():
+                route_tables_vpc_id = routes_vpc_config['route_tables_vpc_id']
+                cidr_blocks_vpc_id = routes_vpc_config['cidr_blocks_vpc_id']
+                if peering_config[peering_stack_search_name][route_set] == '*':
+                    self.logger.info("vpc::parse_config: Found %s wildcard, matching all %s routes and addresses..."
+                                     % (route_set, route_set))
+                    all_vpc_cidr_blocks = self.get_vpc_cidr_blocks(cidr_blocks_vpc_id)
+                    for vpc_route_table_id in self.get_vpc_route_table_ids(route_tables_vpc_id):
+                        parsed_peering_config[peering_stack_search_name][route_set][vpc_route_table_id] = {}
+                        parsed_peering_config[peering_stack_search_name][route_set][vpc_route_table_id]['route_table_id'] = vpc_route_table_id
+                        parsed_peering_config[peering_stack_search_name][route_set][vpc_route_table_id]['cidr_blocks'] = all_vpc_cidr_blocks
+                else:
+                    for route_table_name, route_table_config in peering_config[peering_stack_search_name].get(route_set, {}).iteritems():
+                        if route_table_config['cidr_blocks'] == '*':
+                            self.logger.info("vpc::parse_config: Found cidr block wildcard, using '%s' for route table %s..."
+                                             % (cidr_blocks_vpc_id, route_table_name))
+                            cidr_blocks = self.get_vpc_cidr_blocks(cidr_blocks_vpc_id)
+                        else:
+                            cidr_blocks = route_table_config['cidr_blocks']
+
+                        if route_table_name == '*':
+                            self.logger.info("vpc::parse_config: Found route table wildcard, "
+                                             "applying cidr blocks to all %s route tables..."
+                                             % (route_set))
+                            for vpc_route_table_id in self.get_vpc_route_table_ids(route_tables_vpc_id):
+                                parsed_peering_config[peering_stack_search_name][route_set][vpc_route_table_id] = {}
+                                parsed_peering_config[peering_stack_search_name][route_set][vpc_route_table_id]['route_table_id'] = vpc_route_table_id
+                                parsed_peering_config[peering_stack_search_name][route_set][vpc_route_table_id]['cidr_blocks'] = cidr_blocks
+                        else:
+                            parsed_peering_config[peering_stack_search_name][route_set][route_table_name] = {}
+                            parsed_peering_config[peering_stack_search_name][route_set][route_table_name]['route_table_id'] = (
+                                self.get_vpc_route_table_ids(peering_stack_vpc_id, route_table_name)[0]
+                            )
+                            parsed_peering_config[peering_stack_search_name][route_set][route_table_name]['cidr_blocks'] = cidr_blocks
 
         return parsed_peering_config
 
+
+class VpcPeeringMesh(VPC):
+    """
+    Peers a set of stacks VPC's with each other. Every stack is peered
+    with every other stack or, when a hub stack is given, every stack
+    is peered with the hub only. The peering connections are created and
+    accepted in parallel and routes are added between all the route tables
+    and cidr blocks of each peered pair. Connections and routes that already
+    exist are reused, so the mesh can be applied again safely.
+    """
+    # Peering connection states we reuse rather than create a new connection
+    reusable_status_codes = ['pending-acceptance', 'provisioning', 'active']
+    # The maximum number of peering connections to set up at once
+    peering_workers = 4
+    # The number of seconds to wait for a peering connection to become active
+    peering_timeout = 120
+
+    def __init__(self, stack_search_names, hub_stack_search_name=None):
+        """
+        Args:
+            stack_search_names(list): The search names of the stacks to peer,
+                each must match one and only one stack
+            hub_stack_search_name(string): The search name of the stack to peer
+                all the others to, if not set all the stacks are peered to each other
+        """
+        self.setup_logging()
+        self.stack_vpc_ids = {}
+        self.topology_index = VpcTopologyIndex()
+        self.progress_lock = threading.Lock()
+
+        self.stack_names = []
+        for stack_search_name in stack_search_names:
+            stack_name = self.find_stack_name(stack_search_name)
+            if stack_name not in self.stack_names:
+                self.stack_names.append(stack_name)
+        self.hub_stack_name = None
+        if hub_stack_search_name:
+            self.hub_stack_name = self.find_stack_name(hub_stack_search_name)
+            if self.hub_stack_name not in self.stack_names:
+                self.stack_names.insert(0, self.hub_stack_name)
+
+        for stack_name in self.stack_names:
+            if not self.get_stack_vpc_id(stack_name):
+                raise CloudResourceNotFoundError("VpcPeeringMesh: No unique vpc found for stack '%s'"
+                                                 % (stack_name))
+        self.topology_index.add_vpcs(self.stack_vpc_ids.values())
+
+    def find_stack_name(self, stack_search_name):
+        """
+        Get the name of the one stack that matches a search name
+
+        Args:
+            stack_search_name(string): The search name of the stack
+
+        Returns:
+            (string): The name of the stack
+        """
+        found_stacks = self.get_stack_name_by_match(stack_search_name, min_results=1, max_results=1)
+        if not found_stacks:
+            raise CloudResourceNotFoundError("VpcPeeringMesh: No unique stack found that matches search term '%s'"
+                                             % (stack_search_name))
+        return found_stacks[0]['StackName']
+
+    def get_stack_pairs(self):
+        """
+        Get the pairs of stacks that should be peered
+
+        Returns:
+            (list): (stack_name, peer_stack_name) tuples
+        """
+        if self.hub_stack_name:
+            return [(self.hub_stack_name, stack_name)
+                    for stack_name in self.stack_names if stack_name != self.hub_stack_name]
+        return [(stack_name, peer_stack_name)
+                for index, stack_name in enumerate(self.stack_names)
+                for peer_stack_name in self.stack_names[index + 1:]]
+
+    def get_existing_peering_connections(self):
+        """
+        Get the reusable peering connections between the vpcs of the mesh
+
+        Returns:
+            (dict): The peering connection descriptions keyed on a frozenset
+                of the requester and accepter vpc ids
+        """
+        vpc_ids = sorted(set(self.stack_vpc_ids.values()))
+        response = self.get_ec2_client().describe_vpc_peering_connections(Filters=[
+            {'Name': 'requester-vpc-info.vpc-id', 'Values': vpc_ids},
+            {'Name': 'accepter-vpc-info.vpc-id', 'Values': vpc_ids},
+            {'Name': 'status-code', 'Values': self.reusable_status_codes}
+        ])
+        peering_connections = {}
+        for peering_connection in response.get('VpcPeeringConnections', []):
+            vpc_pair = frozenset([peering_connection['RequesterVpcInfo']['VpcId'],
+                                  peering_connection['AccepterVpcInfo']['VpcId']])
+            # Prefer an active connection if there are several
+            existing = peering_connections.get(vpc_pair)
+            if existing is None or peering_connection['Status']['Code'] == 'active':
+                peering_connections[vpc_pair] = peering_connection
+        return peering_connections
+
+    def plan(self):
+        """
+        Work out the peering connections the mesh needs
+
+        Returns:
+            (list): A dictionary for each pair of stacks to peer, with the
+                stack names, vpc ids and the id and status of any existing
+                peering connection between them
+        """
+        existing_connections = self.get_existing_peering_connections()
+        peerings = []
+        for stack_name, peer_stack_name in self.get_stack_pairs():
+            vpc_id = self.stack_vpc_ids[stack_name]
+            peer_vpc_id = self.stack_vpc_ids[peer_stack_name]
+            existing_connection = existing_connections.get(frozenset([vpc_id, peer_vpc_id]), {})
+            peerings.append({
+                'stack_name': stack_name,
+                'peer_stack_name': peer_stack_name,
+                'vpc_id': vpc_id,
+                'peer_vpc_id': peer_vpc_id,
+                'peering_conn_id': existing_connection.get('VpcPeeringConnectionId'),
+                'status': existing_connection.get('Status', {}).get('Code')
+            })
+        return peerings
+
+    def get_peering_routes(self, peering):
+        """
+        Get the routes each side of a peering needs to reach the other
+
+        Args:
+            peering(dict): The peering, as returned by plan
+
+        Returns:
+            (list): (route_table_id, cidr_block, peering_conn_id) tuples
+        """
+        routes = []
+        for route_tables_vpc_id, cidr_blocks_vpc_id in [(peering['vpc_id'], peering['peer_vpc_id']),
+                                                        (peering['peer_vpc_id'], peering['vpc_id'])]:
+            cidr_blocks = self.get_vpc_cidr_blocks(cidr_blocks_vpc_id)
+            for route_table_id in self.get_vpc_route_table_ids(route_tables_vpc_id):
+                for cidr_block in cidr_blocks:
+                    routes.append((route_table_id, cidr_block, peering['peering_conn_id']))
+        return routes
+
+    def connect(self, peering):
+        """
+        Make sure there is an active peering connection for a pair of stacks,
+        creating and accepting one as needed.
+
+        Args:
+            peering(dict): The peering, as returned by plan. Its peering_conn_id,
+                status, action and duration are updated.
+
+        Returns:
+            (dict): The updated peering
+        """
+        start_time = time.time()
+        ec2_client = self.get_ec2_client()
+        if peering['status'] == 'active':
+            peering['action'] = 'skipped'
+        else:
+            if not peering['peering_conn_id']:
+                response = self.call_ec2(ec2_client.create_vpc_peering_connection, 'CreateVpcPeeringConnection',
+                                         VpcId=peering['vpc_id'],
+                                         PeerVpcId=peering['peer_vpc_id'])
+                peering['peering_conn_id'] = response['VpcPeeringConnection']['VpcPeeringConnectionId']
+                peering['action'] = 'created'
+            else:
+                peering['action'] = 'accepted'
+            if peering['status'] in [None, 'pending-acceptance']:
+                self.call_ec2(ec2_client.accept_vpc_peering_connection, 'AcceptVpcPeeringConnection',
+                              VpcPeeringConnectionId=peering['peering_conn_id'])
+            if not utils.poll(lambda: self.peering_connection_active(peering['peering_conn_id']),
+                              timeout=self.peering_timeout, max_interval=5):
+                raise CfnTimeoutError("VpcPeeringMesh: Peering connection '%s' between '%s' and '%s' is not active"
+                                      % (peering['peering_conn_id'], peering['stack_name'], peering['peer_stack_name']))
+            peering['status'] = 'active'
+        peering['duration'] = time.time() - start_time
+
+        with self.progress_lock:
+            self.peerings_done += 1
+            self.logger.info("VpcPeeringMesh::connect: [%s/%s] %s peering '%s' between '%s' and '%s' in %.1fs"
+                             % (self.peerings_done, self.peerings_total, peering['action'].capitalize(),
+                                peering['peering_conn_id'], peering['stack_name'], peering['peer_stack_name'],
+                                peering['duration']))
+        return peering
+
+    def peering_connection_active(self, peering_conn_id):
+        """
+        Check if a peering connection is active
+
+        Args:
+            peering_conn_id(string): The id of the peering connection
+
+        Returns:
+            (bool): True if the peering connection is active
+        """
+        response = self.call_ec2(self.get_ec2_client().describe_vpc_peering_connections,
+                                 'DescribeVpcPeeringConnections',
+                                 VpcPeeringConnectionIds=[peering_conn_id])
+        return any(peering_connection['Status']['Code'] == 'active'
+                   for peering_connection in response.get('VpcPeeringConnections', []))
+
+    def apply(self):
+        """
+        Create the peering connections and routes of the mesh
+
+        Returns:
+            (dict): A summary of the peerings and routes, with the keys
+                peerings, created, accepted, skipped, routes_created,
+                routes_skipped and duration
+        """
+        start_time = time.time()
+        peerings = self.plan()
+        self.peerings_done = 0
+        self.peerings_total = len(peerings)
+        utils.run_concurrently(self.connect, peerings, max_workers=self.peering_workers)
+
+        routes = self.unique_routes([route for peering in peerings
+                                     for route in self.get_peering_routes(peering)])
+        self.logger.info("VpcPeeringMesh::apply: Creating peering routes...")
+        created_routes = self.create_routes(routes)
+
+        summary = {
+            'peerings': peerings,
+            'created': len([p for p in peerings if p['action'] == 'created']),
+            'accepted': len([p for p in peerings if p['action'] == 'accepted']),
+            'skipped': len([p for p in peerings if p['action'] == 'skipped']),
+            'routes_created': len(created_routes),
+            'routes_skipped': len(routes) - len(created_routes),
+            'duration': time.time() - start_time
+        }
+        self.logger.info("VpcPeeringMesh::apply: %s peerings created, %s accepted, %s skipped, "
+                         "%s routes created, %s skipped in %.1fs"
+                         % (summary['created'], summary['accepted'], summary['skipped'],
+                            summary['routes_created'], summary['routes_skipped'], summary['duration']))
+        return summary
+
 # Setup the logging
 logger = logging.getLogger('vpc_available_addresses')
 logger.setLevel(logging.INFO)
@@ -561,7 +1110,7 @@ def get_available_addresses():
     Returns:
         (list): List of available IPNetworks in CIDR notation
     """
-    ec2_client = boto3.client('ec2')
+    ec2_client = utils.setup_boto3_client(boto3.client('ec2'))
     vpcs = ec2_client.describe_vpcs().get('Vpcs', [])
     vpc_cidr_mappings = {}
     for vpc in vpcs:
@@ -606,3 +1155,33 @@ def get_available_cidr_block(cidr_prefix, subnet_prefix=28):
                 logger.info("get_available_cidr_blocks: Could not subnet CIDR '%s'"
                             % (available_address_cidr))
     return None, None
+
+
+def get_shared_network(network_stack_name):
+    """
+    Get the network resources of a shared network stack, for app stacks
+    to use instead of creating their own
+
+    Args:
+        network_stack_name(string): The name of the network stack
+
+    Returns:
+        (dict): The physical ids of the resources in SHARED_NETWORK_PARAMETERS
+            by their logical ids, and the cidr block of the VPC as 'CIDR'
+
+    Raises:
+        CloudResourceNotFoundError: The network stack or one of its resources was not found
+    """
+    network = {}
+    for logical_id, _ in SHARED_NETWORK_PARAMETERS:
+        physical_id = cloudformation.get_physical_resource_id(network_stack_name, logical_id)
+        if not physical_id:
+            raise CloudResourceNotFoundError("Could not find {0} in the network stack {1}"
+                                             .format(logical_id, network_stack_name))
+        network[logical_id] = physical_id
+    ec2_client = utils.setup_boto3_client(boto3.client('ec2'))
+    vpcs = ec2_client.describe_vpcs(VpcIds=[network['VPC']]).get('Vpcs', [])
+    network['CIDR'] = vpcs[0]['CidrBlock']
+    logger.info("get_shared_network: Found vpc '%s' with cidr block '%s' in network stack '%s'"
+                % (network['VPC'], network['CIDR'], network_stack_name))
+    return network
@@ -11,7 +11,7 @@ setup(
     author_email='tools@digital.justice.gov.uk',
     description='MOJDS cloudformation bootstrap tool',
     long_description="",
-    packages=find_packages(exclude=["tests"]),
+    packages=find_packages(exclude=["tests", "benchmarks"]),
     include_package_data=True,
     package_data={'bootstrap_cfn': ['config_defaults.yaml', 'stacks/*']},
     zip_safe=False,
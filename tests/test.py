@@ -169,6 +169,7 @@ class CfnTestCase(unittest.TestCase):
         rs = mock.PropertyMock(return_value='CREATE_COMPLETE_LOL')
         type(stack_evt_mock).resource_type = rt
         type(stack_evt_mock).resource_status = rs
+        stack_evt_mock.logical_resource_id = stack_evt_mock.stack_name = self.stack_name
         mock_config = {'describe_stack_events.return_value': [stack_evt_mock]}
 
         cf_mock = mock.Mock()
@@ -188,6 +189,7 @@ class CfnTestCase(unittest.TestCase):
         rs = mock.PropertyMock(return_value='CREATE_COMPLETE')
         type(stack_evt_mock).resource_type = rt
         type(stack_evt_mock).resource_status = rs
+        stack_evt_mock.logical_resource_id = stack_evt_mock.stack_name = self.stack_name
         mock_config = {'describe_stack_events.return_value': [stack_evt_mock]}
 
         cf_mock = mock.Mock()
@@ -206,6 +208,7 @@ class CfnTestCase(unittest.TestCase):
         rs = mock.PropertyMock(return_value='CREATE_COMPLETE')
         type(stack_evt_mock).resource_type = rt
         type(stack_evt_mock).resource_status = rs
+        stack_evt_mock.logical_resource_id = stack_evt_mock.stack_name = self.stack_name
         mock_config = {'describe_stack_events.return_value': [stack_evt_mock]}
 
         cf_mock = mock.Mock()
@@ -224,6 +227,7 @@ class CfnTestCase(unittest.TestCase):
         rs = mock.PropertyMock(return_value='CREATE_COMPLETE_FAKE')
         type(stack_evt_mock).resource_type = rt
         type(stack_evt_mock).resource_status = rs
+        stack_evt_mock.logical_resource_id = stack_evt_mock.stack_name = self.stack_name
 
         cf_mock = mock.Mock()
         cf_connect_result = mock.Mock(name='cf_connect')
@@ -235,6 +239,28 @@ class CfnTestCase(unittest.TestCase):
         self.assertFalse(cloudformation.Cloudformation(
             self.env.aws_profile).stack_done(self.stack_name))
 
+    def test_stack_not_done_with_nested_stack_done(self):
+        stack_id = 'arn:aws:cloudformation:eu-west-1:123456789012:stack/{0}/1'.format(self.stack_name)
+        nested_evt_mock = mock.Mock(resource_type='AWS::CloudFormation::Stack', resource_status='CREATE_COMPLETE',
+                                    logical_resource_id='NetworkStack', stack_name=self.stack_name,
+                                    stack_id=stack_id, physical_resource_id=stack_id.replace('/1', '-Network/2'))
+        stack_evt_mock = mock.Mock(resource_type='AWS::CloudFormation::Stack', resource_status='CREATE_IN_PROGRESS',
+                                   logical_resource_id=self.stack_name, stack_name=self.stack_name,
+                                   stack_id=stack_id, physical_resource_id=stack_id)
+
+        cf_mock = mock.Mock()
+        cf_connect_result = mock.Mock(name='cf_connect')
+        cf_mock.return_value = cf_connect_result
+        # The latest events come first
+        cf_connect_result.describe_stack_events.return_value = [nested_evt_mock, stack_evt_mock]
+        boto.cloudformation.connect_to_region = cf_mock
+
+        cfn = cloudformation.Cloudformation(self.env.aws_profile)
+        self.assertFalse(cfn.stack_done(self.stack_name))
+        stack_evt_mock.resource_status = 'CREATE_COMPLETE'
+        cf_connect_result.describe_stack_events.return_value = [stack_evt_mock, nested_evt_mock]
+        self.assertTrue(cfn.stack_done(self.stack_name))
+
     def test_ssl_upload(self):
         iam_mock = mock.Mock()
         iam_connect_result = mock.Mock(name='iam_connect')
@@ -1,3 +1,4 @@
+import json
 import os
 import tempfile
 import unittest
@@ -6,9 +7,12 @@ import boto.ec2.autoscale
 from boto.ec2.autoscale.group import AutoScalingGroup
 from boto.resultset import ResultSet
 
+from botocore.exceptions import NoRegionError
+
 import mock
 
-from bootstrap_cfn import autoscale
+from bootstrap_cfn import autoscale, cloudformation
+from bootstrap_cfn.errors import AutoscalingInstanceCountError, BootstrapCfnError
 
 
 def get_all_groups(names=None, max_records=None, next_token=None):
@@ -26,11 +30,51 @@ def get_all_groups(names=None, max_records=None, next_token=None):
         asg = AutoScalingGroup()
         asg.name = 'test{0}'.format(i)
         asg.tags = tags
+        if names and asg.name not in names:
+            continue
         groups.append(asg)
         groups.next_token = None
     return groups
 
 
+class FakeGroupInstances(object):
+    """
+    Keeps track of the instances in a fake autoscaling group as its
+    capacity is changed and instances are terminated
+    """
+
+    def __init__(self, instance_ids):
+        self.instance_ids = list(instance_ids)
+        self.capacity = len(instance_ids)
+        self.launched = 0
+
+    def launch(self):
+        self.launched += 1
+        self.instance_ids.append('i-new{0}'.format(self.launched))
+
+    def set_capacity(self, capacity):
+        self.capacity = capacity
+        while len(self.instance_ids) < capacity:
+            self.launch()
+        while len(self.instance_ids) > capacity:
+            self.instance_ids.pop()
+
+    def terminate(self, InstanceId, ShouldDecrementDesiredCapacity):
+        self.instance_ids.remove(InstanceId)
+        if ShouldDecrementDesiredCapacity:
+            self.capacity -= 1
+        else:
+            self.launch()
+
+    def get_instances(self):
+        return [{'InstanceId': instance_id, 'LifecycleState': 'InService', 'HealthStatus': 'Healthy'}
+                for instance_id in self.instance_ids]
+
+    def describe(self):
+        return {'DesiredCapacity': self.capacity,
+                'Instances': self.get_instances()}
+
+
 class TestAutoscale(unittest.TestCase):
 
     def setUp(self):
@@ -44,17 +88,61 @@ class TestAutoscale(unittest.TestCase):
     def test_loaded(self):
         pass
 
-    def test_set_autoscaling_group(self):
+    @mock.patch('boto3.session.Session')
+    @mock.patch('bootstrap_cfn.cloudformation.StackResourceIndex.from_client')
+    def test_set_autoscaling_group(self, mock_from_client, mock_session):
+        autoscale.AUTOSCALING_GROUP_NAMES.clear()
+        cloudformation.clear_caches()
+        self.addCleanup(cloudformation.clear_caches)
+        client = mock_session.return_value.client.return_value
         with mock.patch('boto.ec2.autoscale.connect_to_region') as conn:
 
             conn.return_value.get_all_groups = get_all_groups
 
-            # Test successfully found stack
+            # Test successfully found stack from its resources, listed with the profile's session
+            mock_from_client.return_value = cloudformation.StackResourceIndex([
+                {'LogicalResourceId': 'ScalingGroup', 'PhysicalResourceId': 'test1',
+                 'ResourceType': 'AWS::AutoScaling::AutoScalingGroup'}])
             a = autoscale.Autoscale(self.env.aws_profile)
             a.set_autoscaling_group('test1')
             self.assertEquals(a.group.name, 'test1')
+            mock_from_client.assert_called_once_with(client, 'test1')
+            mock_session.assert_called_once_with(profile_name=self.env.aws_profile, region_name='eu-west-1')
+            self.assertFalse(client.describe_tags.called)
+
+            # Test the group name is cached
+            a = autoscale.Autoscale(self.env.aws_profile)
+            a.set_autoscaling_group('test1')
+            self.assertEquals(a.group.name, 'test1')
+            self.assertEquals(mock_from_client.call_count, 1)
+
+            # Test found stack from the stack name tag
+            mock_from_client.return_value = cloudformation.StackResourceIndex([])
+            client.describe_tags.return_value = {
+                'Tags': [{'ResourceId': 'test2', 'ResourceType': 'auto-scaling-group',
+                          'Key': 'aws:cloudformation:stack-name', 'Value': 'test2'}]
+            }
+            a = autoscale.Autoscale(self.env.aws_profile)
+            a.set_autoscaling_group('test2')
+            self.assertEquals(a.group.name, 'test2')
+            client.describe_tags.assert_called_once_with(Filters=[
+                {'Name': 'key', 'Values': ['aws:cloudformation:stack-name']},
+                {'Name': 'value', 'Values': ['test2']}
+            ])
+
+            # Test falling back to the tags when the resources cannot be listed
+            mock_from_client.side_effect = NoRegionError()
+            client.describe_tags.return_value = {
+                'Tags': [{'ResourceId': 'test1', 'ResourceType': 'auto-scaling-group',
+                          'Key': 'aws:cloudformation:stack-name', 'Value': 'test3'}]
+            }
+            a = autoscale.Autoscale(self.env.aws_profile)
+            a.set_autoscaling_group('test3')
+            self.assertEquals(a.group.name, 'test1')
+            mock_from_client.side_effect = None
 
             # Test no found stack
+            client.describe_tags.return_value = {'Tags': []}
             a = autoscale.Autoscale(self.env.aws_profile)
             a.set_autoscaling_group('test')
             self.assertIsNone(a.group)
@@ -65,3 +153,233 @@ class TestAutoscale(unittest.TestCase):
             # Test if no stack found, don't continue
             a = autoscale.Autoscale(self.env.aws_profile)
             self.assertIsNone(a.set_tag('test_key', 'test_value'))
+
+    def cycle_autoscale(self, mock_session, instance_ids, max_size=None):
+        with mock.patch('boto.ec2.autoscale.connect_to_region'):
+            a = autoscale.Autoscale(self.env.aws_profile)
+        a.group = AutoScalingGroup()
+        a.group.name = 'test1'
+        a.group.health_check_type = 'ELB'
+        a.group.health_check_period = 0
+        a.group.max_size = max_size
+        fake_group = FakeGroupInstances(instance_ids)
+        a.set_autoscaling_desired_capacity = mock.Mock(side_effect=fake_group.set_capacity)
+        a.wait_for_instances = mock.Mock()
+        a.get_instances_list = mock.Mock(return_value='')
+        a.get_instances = fake_group.get_instances
+        a.describe_autoscaling_group = fake_group.describe
+        a.get_cycle_checkpoint_file = mock.Mock(return_value=os.path.join(self.work_dir, 'checkpoint.json'))
+        mock_session.return_value.client.return_value.terminate_instance_in_auto_scaling_group.side_effect = fake_group.terminate
+        return a, fake_group
+
+    def get_terminations(self, mock_session):
+        terminations = mock_session.return_value.client.return_value.terminate_instance_in_auto_scaling_group.call_args_list
+        return [(c[1]['InstanceId'], c[1]['ShouldDecrementDesiredCapacity']) for c in terminations]
+
+    @mock.patch('bootstrap_cfn.utils.sleep_countdown')
+    @mock.patch('boto3.session.Session')
+    def test_cycle_instances_one_at_a_time(self, mock_session, mock_sleep):
+        a, fake_group = self.cycle_autoscale(mock_session, ['i-1', 'i-2', 'i-3'])
+        a.cycle_instances()
+        self.assertEqual([c[0][0] for c in a.set_autoscaling_desired_capacity.call_args_list], [4, 4, 4])
+        self.assertEqual(self.get_terminations(mock_session),
+                         [('i-1', True), ('i-2', True), ('i-3', True)])
+        self.assertEqual(fake_group.instance_ids, ['i-new1', 'i-new2', 'i-new3'])
+
+    @mock.patch('bootstrap_cfn.utils.sleep_countdown')
+    @mock.patch('boto3.session.Session')
+    def test_cycle_instances_waves(self, mock_session, mock_sleep):
+        a, fake_group = self.cycle_autoscale(mock_session, ['i-1', 'i-2', 'i-3', 'i-4', 'i-5'])
+        a.cycle_instances(max_surge=2, max_unavailable=1)
+        # Surge by two and replace one in place in the first wave, surge the last two in the second
+        self.assertEqual([c[0][0] for c in a.set_autoscaling_desired_capacity.call_args_list], [7, 7])
+        self.assertEqual([c[0][0] for c in a.wait_for_instances.call_args_list], [7, 7])
+        self.assertEqual([c[1]['replaced_instance_ids'] for c in a.wait_for_instances.call_args_list], [['i-3'], []])
+        self.assertEqual(self.get_terminations(mock_session),
+                         [('i-3', False), ('i-1', True), ('i-2', True), ('i-4', True), ('i-5', True)])
+        self.assertEqual(len(fake_group.instance_ids), 5)
+        self.assertFalse(set(['i-1', 'i-2', 'i-3', 'i-4', 'i-5']) & set(fake_group.instance_ids))
+
+    @mock.patch('bootstrap_cfn.utils.sleep_countdown')
+    @mock.patch('boto3.session.Session')
+    def test_cycle_instances_max_size(self, mock_session, mock_sleep):
+        a, fake_group = self.cycle_autoscale(mock_session, ['i-1', 'i-2'], max_size=2)
+        a.cycle_instances(max_surge=2, max_unavailable=1)
+        # No room to surge so replace in place one at a time
+        self.assertFalse(a.set_autoscaling_desired_capacity.called)
+        self.assertEqual(self.get_terminations(mock_session),
+                         [('i-1', False), ('i-2', False)])
+
+        a, fake_group = self.cycle_autoscale(mock_session, ['i-1', 'i-2'], max_size=2)
+        self.assertRaises(BootstrapCfnError, a.cycle_instances)
+
+    @mock.patch('bootstrap_cfn.utils.sleep_countdown')
+    @mock.patch('boto3.session.Session')
+    def test_cycle_instances_count_error(self, mock_session, mock_sleep):
+        a, fake_group = self.cycle_autoscale(mock_session, ['i-1', 'i-2'])
+        # New instances never become healthy
+        a.set_autoscaling_desired_capacity.side_effect = None
+        self.assertRaises(AutoscalingInstanceCountError, a.cycle_instances, max_surge=2)
+        self.assertFalse(mock_session.return_value.client.return_value.terminate_instance_in_auto_scaling_group.called)
+        self.assertRaises(BootstrapCfnError, a.cycle_instances, max_surge=0, max_unavailable=0)
+
+    @mock.patch('time.sleep')
+    @mock.patch('boto3.session.Session')
+    def test_wait_for_instances_elb_health(self, mock_session, mock_sleep):
+        with mock.patch('boto.ec2.autoscale.connect_to_region'):
+            a = autoscale.Autoscale(self.env.aws_profile)
+        a.group = AutoScalingGroup()
+        a.group.name = 'test1'
+        a.group.load_balancers = ['elb1', 'elb2']
+        a.get_instances_list = mock.Mock(return_value='')
+        a.get_instances = mock.Mock(return_value=[])
+        a.get_healthy_instances = mock.Mock(return_value=[{'InstanceId': 'i-1'}, {'InstanceId': 'i-2'}])
+        # i-2 is only in service on the second load balancer from the second check
+        mock_session.return_value.client.return_value.describe_instance_health.side_effect = [
+            {'InstanceStates': [{'InstanceId': 'i-1', 'State': 'InService'},
+                                {'InstanceId': 'i-2', 'State': 'InService'}]},
+            {'InstanceStates': [{'InstanceId': 'i-1', 'State': 'InService'},
+                                {'InstanceId': 'i-2', 'State': 'OutOfService'}]},
+            {'InstanceStates': [{'InstanceId': 'i-1', 'State': 'InService'},
+                                {'InstanceId': 'i-2', 'State': 'InService'}]},
+            {'InstanceStates': [{'InstanceId': 'i-1', 'State': 'InService'},
+                                {'InstanceId': 'i-2', 'State': 'InService'}]},
+        ]
+        a.wait_for_instances(2, min_delay=2)
+        mock_session.assert_called_once_with(profile_name=self.env.aws_profile, region_name='eu-west-1')
+        self.assertEqual([c[0][0] for c in mock_session.return_value.client.call_args_list], ['elb'])
+        self.assertEqual(mock_session.return_value.client.return_value.describe_instance_health.call_count, 4)
+        # Moved on after a short wait rather than a full retry delay
+        self.assertEqual([c[0][0] for c in mock_sleep.call_args_list], [2])
+
+    @mock.patch('time.sleep')
+    @mock.patch('boto3.session.Session')
+    def test_wait_for_instances_replaced(self, mock_session, mock_sleep):
+        with mock.patch('boto.ec2.autoscale.connect_to_region'):
+            a = autoscale.Autoscale(self.env.aws_profile)
+        a.group = AutoScalingGroup()
+        a.group.name = 'test1'
+        a.get_instances_list = mock.Mock(return_value='')
+        # The instance replaced in place is still in service at the first check
+        a.get_instances = mock.Mock(side_effect=[
+            [{'InstanceId': 'i-1', 'LifecycleState': 'InService', 'HealthStatus': 'Healthy'},
+             {'InstanceId': 'i-2', 'LifecycleState': 'InService', 'HealthStatus': 'Healthy'}],
+            [{'InstanceId': 'i-1', 'LifecycleState': 'Terminating', 'HealthStatus': 'Healthy'},
+             {'InstanceId': 'i-2', 'LifecycleState': 'InService', 'HealthStatus': 'Healthy'},
+             {'InstanceId': 'i-new1', 'LifecycleState': 'InService', 'HealthStatus': 'Healthy'}],
+        ])
+        a.wait_for_instances(2, min_delay=2, replaced_instance_ids=['i-1'])
+        self.assertEqual(a.get_instances.call_count, 2)
+        self.assertEqual([c[0][0] for c in mock_sleep.call_args_list], [2])
+
+    @mock.patch('time.sleep')
+    @mock.patch('boto3.session.Session')
+    def test_wait_for_instances_timeout(self, mock_session, mock_sleep):
+        with mock.patch('boto.ec2.autoscale.connect_to_region'):
+            a = autoscale.Autoscale(self.env.aws_profile)
+        a.group = AutoScalingGroup()
+        a.group.name = 'test1'
+        a.get_instances_list = mock.Mock(return_value='')
+        a.get_instances = mock.Mock(return_value=[])
+        a.get_healthy_instances = mock.Mock(return_value=[{'InstanceId': 'i-1'}])
+        with mock.patch('time.time', side_effect=xrange(0, 1000, 10)):
+            self.assertRaises(AutoscalingInstanceCountError,
+                              a.wait_for_instances, 2, retry_delay=30, retry_max=2)
+        self.assertFalse(mock_session.called)
+
+    @mock.patch('bootstrap_cfn.utils.sleep_countdown')
+    @mock.patch('boto3.session.Session')
+    def test_cycle_instances_skip_unchanged(self, mock_session, mock_sleep):
+        a, fake_group = self.cycle_autoscale(mock_session, ['i-1', 'i-2', 'i-3'], max_size=3)
+        a.describe_autoscaling_group = mock.Mock(return_value={
+            'LaunchConfigurationName': 'lc-new',
+            'Instances': [{'InstanceId': 'i-1', 'LaunchConfigurationName': 'lc-new'},
+                          {'InstanceId': 'i-2', 'LaunchConfigurationName': 'lc-old'},
+                          {'InstanceId': 'i-3', 'LaunchConfigurationName': 'lc-new'}]
+        })
+        a.cycle_instances(max_surge=0, max_unavailable=1, skip_unchanged=True)
+        self.assertEqual(self.get_terminations(mock_session), [('i-2', False)])
+
+        # Nothing to do when every instance is up to date
+        a.describe_autoscaling_group.return_value['Instances'][1]['LaunchConfigurationName'] = 'lc-new'
+        mock_session.return_value.client.return_value.terminate_instance_in_auto_scaling_group.reset_mock()
+        a.cycle_instances(skip_unchanged=True)
+        self.assertFalse(mock_session.return_value.client.return_value.terminate_instance_in_auto_scaling_group.called)
+
+    @mock.patch('boto3.session.Session')
+    def test_get_stale_instance_ids_launch_template(self, mock_session):
+        with mock.patch('boto.ec2.autoscale.connect_to_region'):
+            a = autoscale.Autoscale(self.env.aws_profile)
+        a.group = AutoScalingGroup()
+        a.group.name = 'test1'
+        a.describe_autoscaling_group = mock.Mock(return_value={
+            'LaunchTemplate': {'LaunchTemplateId': 'lt-1', 'Version': '$Latest'},
+            'Instances': [{'InstanceId': 'i-1', 'LaunchTemplate': {'LaunchTemplateId': 'lt-1', 'Version': '3'}},
+                          {'InstanceId': 'i-2', 'LaunchTemplate': {'LaunchTemplateId': 'lt-1', 'Version': '2'}},
+                          {'InstanceId': 'i-3', 'LaunchConfigurationName': 'lc-old'}]
+        })
+        mock_session.return_value.client.return_value.describe_launch_templates.return_value = {
+            'LaunchTemplates': [{'LaunchTemplateId': 'lt-1', 'LatestVersionNumber': 3, 'DefaultVersionNumber': 1}]
+        }
+        self.assertEqual(a.get_stale_instance_ids(), ['i-2', 'i-3'])
+        mock_session.return_value.client.return_value.describe_launch_templates.assert_called_once_with(LaunchTemplateIds=['lt-1'])
+
+    @mock.patch('bootstrap_cfn.utils.sleep_countdown')
+    @mock.patch('boto3.session.Session')
+    def test_cycle_instances_resume(self, mock_session, mock_sleep):
+        a, fake_group = self.cycle_autoscale(mock_session, ['i-1', 'i-2', 'i-3', 'i-4'])
+        checkpoint_file = a.get_cycle_checkpoint_file()
+
+        # Interrupt the second wave after its new instances were requested
+        a.wait_for_instances.side_effect = [None, KeyboardInterrupt]
+        self.assertRaises(KeyboardInterrupt, a.cycle_instances, max_surge=2)
+        self.assertEqual(fake_group.capacity, 6)
+        with open(checkpoint_file) as f:
+            checkpoint = json.load(f)
+        self.assertEqual(checkpoint, {'group': 'test1',
+                                      'capacity': 4,
+                                      'original_instance_ids': ['i-1', 'i-2', 'i-3', 'i-4'],
+                                      'cycle_instance_ids': ['i-1', 'i-2', 'i-3', 'i-4'],
+                                      'replaced_instance_ids': ['i-1', 'i-2']})
+
+        # Resuming finishes the interrupted wave without launching more instances
+        a.wait_for_instances.side_effect = None
+        a.set_autoscaling_desired_capacity.reset_mock()
+        mock_session.return_value.client.return_value.terminate_instance_in_auto_scaling_group.reset_mock()
+        a.cycle_instances(max_surge=1, resume=True)
+        self.assertEqual([c[0][0] for c in a.set_autoscaling_desired_capacity.call_args_list], [6])
+        self.assertEqual([c[0][0] for c in a.wait_for_instances.call_args_list][-1], 6)
+        self.assertEqual(self.get_terminations(mock_session), [('i-3', True), ('i-4', True)])
+        self.assertEqual(fake_group.capacity, 4)
+        self.assertEqual(sorted(fake_group.instance_ids), ['i-new1', 'i-new2', 'i-new3', 'i-new4'])
+        self.assertFalse(os.path.exists(checkpoint_file))
+
+    @mock.patch('bootstrap_cfn.utils.sleep_countdown')
+    @mock.patch('boto3.session.Session')
+    def test_cycle_instances_resume_without_checkpoint(self, mock_session, mock_sleep):
+        a, fake_group = self.cycle_autoscale(mock_session, ['i-1', 'i-2'])
+        a.cycle_instances(resume=True)
+        self.assertEqual(self.get_terminations(mock_session), [('i-1', True), ('i-2', True)])
+        self.assertFalse(os.path.exists(a.get_cycle_checkpoint_file()))
+
+    @mock.patch('boto3.session.Session')
+    def test_client_reuse(self, mock_session):
+        with mock.patch('boto.ec2.autoscale.connect_to_region'):
+            a = autoscale.Autoscale('the-profile-name', 'eu-central-1')
+        a.group = AutoScalingGroup()
+        a.group.name = 'test1'
+        client = mock_session.return_value.client.return_value
+        client.describe_auto_scaling_groups.return_value = {'AutoScalingGroups': [{'Instances': [
+            {'InstanceId': 'i-1', 'LifecycleState': 'InService', 'HealthStatus': 'Healthy'},
+            {'InstanceId': 'i-2', 'LifecycleState': 'Pending', 'HealthStatus': 'Healthy'}]}]}
+        instances = a.get_instances()
+        self.assertEqual(len(a.get_healthy_instances()), 1)
+        a.set_autoscaling_desired_capacity(2)
+        # One session and client for the profile and region given
+        mock_session.assert_called_once_with(profile_name='the-profile-name', region_name='eu-central-1')
+        self.assertEqual(mock_session.return_value.client.call_count, 1)
+        self.assertEqual(client.describe_auto_scaling_groups.call_count, 2)
+        # Listing instances we have already described makes no calls
+        self.assertEqual(a.get_instances_list(instances=instances),
+                         "i-1 (Healthy) - InService\ni-2 (Healthy) - Pending")
+        self.assertEqual(client.describe_auto_scaling_groups.call_count, 2)
@@ -0,0 +1,48 @@
+import unittest
+
+from benchmarks import call_budget, task_benchmark
+
+
+class TestCallBudget(unittest.TestCase):
+
+    def test_check_budget(self):
+        operations = ['route53 ListHostedZones', 'route53 GetHostedZone', 'route53 ListHostedZones']
+        self.assertEqual(call_budget.check_budget(operations, {'route53': 3, 'total': 3}), [])
+        exceeded = call_budget.check_budget(operations, {'route53 ListHostedZones': 1, 'total': 2, 'ec2': 0})
+        self.assertEqual(exceeded, [('route53 ListHostedZones', 1, 2), ('total', 2, 3)])
+
+    def test_make_budget_keeps_operations(self):
+        operations = ['route53 ListHostedZones', 'route53 GetHostedZone', 'ec2 DescribeVpcs']
+        budget = call_budget.make_budget(operations, {'route53 GetHostedZone': 5, 'route53': 9})
+        self.assertEqual(budget, {'total': 3, 'route53': 2, 'ec2': 1, 'route53 GetHostedZone': 1})
+
+    def test_failure_shows_diff_of_calls(self):
+        budgets = {'set_active_stack': {
+            'budget': {'route53': 2},
+            'operations': ['route53 ListHostedZones', 'route53 ListResourceRecordSets'],
+        }}
+        operations = ['route53 ListHostedZones', 'route53 GetHostedZone', 'route53 GetHostedZone',
+                      'route53 ListResourceRecordSets']
+        with self.assertRaises(AssertionError) as context:
+            call_budget.assert_within_budget('set_active_stack', operations, budgets)
+        message = str(context.exception)
+        self.assertIn('route53: 4 calls, the budget is 2', message)
+        self.assertIn('\n+route53 GetHostedZone x2\n', message)
+        self.assertIn('\n route53 ListResourceRecordSets', message)
+
+
+class TestTaskCallBudgets(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.budgets = call_budget.load_budgets()
+        cls.task_operations = call_budget.record_task_operations()
+
+    def test_tasks_within_budget(self):
+        self.assertEqual(sorted(self.budgets), sorted(task_benchmark.STEPS))
+        for task_name in task_benchmark.STEPS:
+            call_budget.assert_within_budget(task_name, self.task_operations[task_name], self.budgets)
+
+    def test_set_active_stack_looks_up_zone_once_per_record(self):
+        operations = self.task_operations['set_active_stack']
+        self.assertLessEqual(operations.count('route53 ListHostedZones'), 3)
@@ -0,0 +1,166 @@
+import unittest
+
+import mock
+
+from bootstrap_cfn import cloudformation
+
+
+def stack_summary(name, status='CREATE_COMPLETE'):
+    return {
+        'StackName': name,
+        'StackId': 'arn:aws:cloudformation:eu-west-1:123456789012:stack/{0}/abc-123'.format(name),
+        'StackStatus': status
+    }
+
+
+class TestStackIndex(unittest.TestCase):
+
+    def setUp(self):
+        cloudformation.STACK_INDEXES.clear()
+        self.client = mock.MagicMock()
+        self.client.list_stacks.side_effect = [
+            {'StackSummaries': [stack_summary('app-dev-a1'), stack_summary('app-prod-b2')],
+             'NextToken': 'page2'},
+            {'StackSummaries': [stack_summary('shared-dev-c3')]}
+        ]
+
+    def tearDown(self):
+        cloudformation.STACK_INDEXES.clear()
+
+    def test_from_client_paginates(self):
+        index = cloudformation.StackIndex.from_client(self.client)
+        self.assertEqual(len(index.stacks), 3)
+        self.assertEqual(index.get('shared-dev-c3')['StackStatus'], 'CREATE_COMPLETE')
+        self.assertIsNone(index.get('missing'))
+        self.client.list_stacks.assert_called_with(
+            StackStatusFilter=cloudformation.ACTIVE_STACK_STATUSES, NextToken='page2')
+
+    @mock.patch('bootstrap_cfn.cloudformation.boto3.client')
+    def test_get_stack_ids_by_name_cached(self, mock_client):
+        mock_client.return_value = self.client
+        self.assertEqual([s['StackName'] for s in cloudformation.get_stack_ids_by_name('dev')],
+                         ['app-dev-a1', 'shared-dev-c3'])
+        self.assertEqual([s['StackName'] for s in cloudformation.get_stack_ids_by_name('app', prefix=True)],
+                         ['app-dev-a1', 'app-prod-b2'])
+        self.assertEqual(cloudformation.get_stack_ids_by_name('shared', prefix=True)[0]['StackName'],
+                         'shared-dev-c3')
+        self.assertEqual(cloudformation.get_stack_ids_by_name('missing'), [])
+        self.assertEqual(self.client.list_stacks.call_count, 2)
+
+    @mock.patch('bootstrap_cfn.cloudformation.boto3.client')
+    def test_status_filter(self, mock_client):
+        mock_client.return_value = self.client
+        cloudformation.get_stack_ids_by_name('dev', stack_statuses=['CREATE_COMPLETE'])
+        self.client.list_stacks.assert_any_call(StackStatusFilter=['CREATE_COMPLETE'])
+
+
+class TestStackResourceIndex(unittest.TestCase):
+
+    def setUp(self):
+        cloudformation.clear_caches()
+        self.client = mock.MagicMock()
+        self.client.list_stack_resources.side_effect = [
+            {'StackResourceSummaries': [
+                {'LogicalResourceId': 'VPC', 'PhysicalResourceId': 'vpc-123',
+                 'ResourceType': 'AWS::EC2::VPC'},
+                {'LogicalResourceId': 'ELBtestdevexternal', 'PhysicalResourceId': 'elb-external',
+                 'ResourceType': 'AWS::ElasticLoadBalancing::LoadBalancer'}
+            ], 'NextToken': 'page2'},
+            {'StackResourceSummaries': [
+                {'LogicalResourceId': 'ELBtestdevinternal', 'PhysicalResourceId': 'elb-internal',
+                 'ResourceType': 'AWS::ElasticLoadBalancing::LoadBalancer'}
+            ]}
+        ]
+
+    def tearDown(self):
+        cloudformation.clear_caches()
+
+    @mock.patch('bootstrap_cfn.cloudformation.boto3.client')
+    def test_lookups_cached(self, mock_client):
+        mock_client.return_value = self.client
+        load_balancers = cloudformation.get_resource_type('test-stack', 'AWS::ElasticLoadBalancing::LoadBalancer')
+        self.assertEqual([lb['PhysicalResourceId'] for lb in load_balancers], ['elb-external', 'elb-internal'])
+        self.assertEqual(cloudformation.get_resource_type('test-stack', 'AWS::EC2::VPC')[0]['PhysicalResourceId'],
+                         'vpc-123')
+        self.assertEqual(cloudformation.get_resource_type('test-stack', 'AWS::EC2::Subnet'), [])
+        self.assertEqual(cloudformation.get_resource_type('test-stack'), [])
+        self.assertEqual(cloudformation.get_physical_resource_id('test-stack', 'ELBtestdevinternal'), 'elb-internal')
+        self.assertIsNone(cloudformation.get_physical_resource_id('test-stack', 'Missing'))
+
+        self.assertEqual(self.client.list_stack_resources.call_count, 2)
+        self.client.list_stack_resources.assert_called_with(StackName='test-stack', NextToken='page2')
+
+    def test_profile_indexes(self):
+        client = mock.MagicMock()
+        client.list_stack_resources.return_value = {'StackResourceSummaries': [
+            {'LogicalResourceId': 'VPC', 'PhysicalResourceId': 'vpc-456', 'ResourceType': 'AWS::EC2::VPC'}]}
+        index = cloudformation.get_stack_resource_index('test-stack', client=client,
+                                                        aws_profile_name='other', aws_region_name='eu-west-2')
+        self.assertEqual(index.get_physical_resource_id('VPC'), 'vpc-456')
+        # Cached for the profile and region only
+        cloudformation.get_stack_resource_index('test-stack', client=client,
+                                                aws_profile_name='other', aws_region_name='eu-west-2')
+        self.assertEqual(client.list_stack_resources.call_count, 1)
+        self.assertEqual(cloudformation.STACK_RESOURCE_INDEXES.keys(), [('other', 'eu-west-2', 'test-stack')])
+        with mock.patch('bootstrap_cfn.cloudformation.boto3.client', return_value=self.client):
+            self.assertEqual(cloudformation.get_physical_resource_id('test-stack', 'VPC'), 'vpc-123')
+        cloudformation.clear_caches('test-stack')
+        self.assertEqual(cloudformation.STACK_RESOURCE_INDEXES, {})
+
+    def test_method_uses_connection(self):
+        resource = mock.Mock(resource_type='AWS::ElasticLoadBalancing::LoadBalancer', physical_resource_id='elb-1')
+        with mock.patch('boto.cloudformation.connect_to_region') as connect_to_region:
+            cf = cloudformation.Cloudformation('profile')
+        connect_to_region.return_value.describe_stacks.return_value[0].list_resources.return_value = [
+            resource, mock.Mock(resource_type='AWS::EC2::VPC')]
+        load_balancers = cf.get_resource_type('test-stack', 'AWS::ElasticLoadBalancing::LoadBalancer')
+        self.assertEqual([lb.physical_resource_id for lb in load_balancers], ['elb-1'])
+        connect_to_region.return_value.describe_stacks.assert_called_once_with('test-stack')
+        self.assertEqual(len(cf.get_resource_type('test-stack')), 2)
+
+    def test_nested_stacks(self):
+        stack_id = 'arn:aws:cloudformation:eu-west-1:123:stack/test-stack-NetworkStack-1/abc'
+        self.client.list_stack_resources.side_effect = [
+            {'StackResourceSummaries': [
+                {'LogicalResourceId': 'NetworkStack', 'PhysicalResourceId': stack_id,
+                 'ResourceType': 'AWS::CloudFormation::Stack'}
+            ]},
+            {'StackResourceSummaries': [
+                {'LogicalResourceId': 'VPC', 'PhysicalResourceId': 'vpc-123',
+                 'ResourceType': 'AWS::EC2::VPC'}
+            ]}
+        ]
+        index = cloudformation.StackResourceIndex.from_client(self.client, 'test-stack')
+        self.assertEqual(index.get_physical_resource_id('VPC'), 'vpc-123')
+        self.assertEqual(index.get_physical_resource_id('NetworkStack'), stack_id)
+        self.client.list_stack_resources.assert_called_with(StackName=stack_id)
+
+    def test_nested_stacks_reuse_logical_ids(self):
+        stack_id = 'arn:aws:cloudformation:eu-west-1:123:stack/test-stack-NetworkStack-1/abc'
+        self.client.list_stack_resources.side_effect = [
+            {'StackResourceSummaries': [
+                {'LogicalResourceId': 'NetworkStack', 'PhysicalResourceId': stack_id,
+                 'ResourceType': 'AWS::CloudFormation::Stack'},
+                {'LogicalResourceId': 'BaseHostSG', 'PhysicalResourceId': 'sg-parent',
+                 'ResourceType': 'AWS::EC2::SecurityGroup'}
+            ]},
+            {'StackResourceSummaries': [
+                {'LogicalResourceId': 'BaseHostSG', 'PhysicalResourceId': 'sg-child',
+                 'ResourceType': 'AWS::EC2::SecurityGroup'},
+                {'LogicalResourceId': 'VPC', 'PhysicalResourceId': 'vpc-123',
+                 'ResourceType': 'AWS::EC2::VPC'}
+            ]}
+        ]
+        index = cloudformation.StackResourceIndex.from_client(self.client, 'test-stack')
+        # The stack's own resource is not replaced by the nested one
+        self.assertEqual(index.get_physical_resource_id('BaseHostSG'), 'sg-parent')
+        self.assertEqual(index.get_physical_resource_id('VPC'), 'vpc-123')
+        self.assertEqual([sg['PhysicalResourceId'] for sg in index.get_by_type('AWS::EC2::SecurityGroup')],
+                         ['sg-parent', 'sg-child'])
+
+    @mock.patch('bootstrap_cfn.cloudformation.boto3.client')
+    def test_clear_caches(self, mock_client):
+        mock_client.return_value = self.client
+        cloudformation.get_resource_type('test-stack', 'AWS::EC2::VPC')
+        cloudformation.clear_caches('test-stack')
+        self.assertNotIn('test-stack', [key[2] for key in cloudformation.STACK_RESOURCE_INDEXES])
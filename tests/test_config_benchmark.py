@@ -0,0 +1,43 @@
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+import yaml
+
+from benchmarks import config_benchmark
+
+
+class TestConfigBenchmark(unittest.TestCase):
+
+    def test_generate_project_config(self):
+        config = config_benchmark.generate_project_config(3, 25, 4)['bench']
+        self.assertEqual(len(config['elb']), 3)
+        self.assertEqual(sum(len(rules) for rules in config['ec2']['security_groups'].values()), 25)
+        self.assertEqual(len(config['s3']['buckets']), 4)
+        self.assertNotIn('includes', config)
+
+    @mock.patch('bootstrap_cfn.vpc.boto3')
+    def test_run_once(self, boto3_mock):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        config_path = config_benchmark.write_scale_files(directory, 'small')
+        with open(config_path) as config_file:
+            self.assertIn('includes', yaml.safe_load(config_file)['bench'])
+
+        timings = config_benchmark.run_once(config_path)
+        for section in config_benchmark.SECTIONS:
+            self.assertGreater(timings[section], 0, section)
+        self.assertGreater(timings['template_bytes'], 0)
+        # The CIDR lookup is stubbed, AWS is never called
+        self.assertFalse(boto3_mock.mock_calls)
+
+    def test_compare(self):
+        baseline = {'small': {'ec2': 0.010, 'vpc': 0.001, 'total': 0.100, 'peak_memory_kb': 1000}}
+        results = {
+            'small': {'ec2': 0.020, 'vpc': 0.004, 'total': 0.120, 'peak_memory_kb': 2000},
+            'large': {'ec2': 1.0},
+        }
+        self.assertEqual(config_benchmark.compare(results, baseline, tolerance=0.5),
+                         [('small', 'ec2', 0.010, 0.020), ('small', 'peak_memory_kb', 1000, 2000)])
@@ -0,0 +1,139 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import patch
+
+from testfixtures import compare
+
+from bootstrap_cfn import critical_path, errors, fab_tasks
+from bootstrap_cfn.config import ConfigParser, ProjectConfig
+
+
+def make_template():
+    return {'Resources': {
+        'VPC': {'Type': 'AWS::EC2::VPC', 'Properties': {}},
+        'AttachGateway': {'Type': 'AWS::EC2::VPCGatewayAttachment', 'Properties': {'VpcId': {'Ref': 'VPC'}}},
+        'BaseHostRole': {'Type': 'AWS::IAM::Role', 'Properties': {}},
+        'InstanceProfile': {'Type': 'AWS::IAM::InstanceProfile', 'Properties': {'Roles': [{'Ref': 'BaseHostRole'}]}},
+        'DatabaseSG': {'Type': 'AWS::EC2::SecurityGroup', 'DependsOn': ['AttachGateway'],
+                       'Properties': {'VpcId': {'Ref': 'VPC'}}},
+        'RDSInstance': {'Type': 'AWS::RDS::DBInstance', 'DependsOn': [],
+                        'Properties': {'VPCSecurityGroups': [{'Fn::GetAtt': ['DatabaseSG', 'GroupId']}]}},
+        'ScalingGroup': {'Type': 'AWS::AutoScaling::AutoScalingGroup', 'DependsOn': 'AttachGateway',
+                         'Properties': {'Profile': {'Ref': 'InstanceProfile'}, 'Region': {'Ref': 'AWS::Region'}}},
+    }}
+
+
+class TestBuildGraph(unittest.TestCase):
+
+    def test_build_graph(self):
+        graph = critical_path.build_graph(make_template())
+        compare(graph['RDSInstance'], {'DatabaseSG': set([critical_path.GET_ATT])})
+        compare(graph['DatabaseSG'], {'AttachGateway': set([critical_path.DEPENDS_ON]),
+                                      'VPC': set([critical_path.REF])})
+        # References to pseudo parameters are not dependencies
+        compare(graph['ScalingGroup'], {'AttachGateway': set([critical_path.DEPENDS_ON]),
+                                        'InstanceProfile': set([critical_path.REF])})
+        compare(graph['VPC'], {})
+
+    def test_cycle(self):
+        template = {'Resources': {
+            'BaseHostRole': {'Type': 'AWS::IAM::Role', 'Properties': {'Group': {'Ref': 'ScalingGroup'}}},
+            'ScalingGroup': {'Type': 'AWS::AutoScaling::AutoScalingGroup', 'DependsOn': 'BaseHostRole'},
+        }}
+        with self.assertRaises(errors.CfnConfigError):
+            critical_path.analyze_template(template)
+
+
+class TestAnalyzeTemplate(unittest.TestCase):
+
+    def test_critical_path(self):
+        analysis = critical_path.analyze_template(make_template())
+        compare(analysis.critical_path, ['VPC', 'AttachGateway', 'DatabaseSG', 'RDSInstance'])
+        compare(analysis.total_seconds, 20 + 20 + 10 + 600.0)
+        compare(analysis.start_times['RDSInstance'], 50.0)
+        # The scaling group waits for the instance profile, and could finish 395s later
+        compare(analysis.start_times['ScalingGroup'], 135.0)
+        compare(analysis.slack['ScalingGroup'], 650 - 255.0)
+        compare(analysis.slack['DatabaseSG'], 0.0)
+
+    def test_serialized(self):
+        analysis = critical_path.analyze_template(make_template())
+        compare(analysis.serialized, [{
+            # Without the edge the security group starts once the VPC is created
+            'resource': 'DatabaseSG',
+            'depends_on': 'AttachGateway',
+            'delay': 20.0,
+            'saving': 20.0,
+        }])
+
+    def test_durations(self):
+        analysis = critical_path.analyze_template(make_template(), {'AWS::RDS::DBInstance': 5,
+                                                                    'AWS::IAM::InstanceProfile': 300})
+        compare(analysis.critical_path, ['BaseHostRole', 'InstanceProfile', 'ScalingGroup'])
+        compare(analysis.total_seconds, 15 + 300 + 120.0)
+        compare(analysis.serialized[0]['resource'], 'DatabaseSG')
+        compare(analysis.serialized[0]['saving'], 0.0)
+
+    def test_unknown_resource_type(self):
+        analysis = critical_path.analyze_template({'Resources': {'Queue': {'Type': 'AWS::SQS::Queue'}}})
+        compare(analysis.total_seconds, float(critical_path.DEFAULT_CREATE_SECONDS))
+
+    def test_sample_project(self):
+        project_config = ProjectConfig(
+            'tests/sample-project.yaml',
+            'dev',
+            'tests/sample-project-passwords.yaml')
+        template = json.loads(ConfigParser(project_config.config, 'my-stack-name').process())
+        analysis = critical_path.analyze_template(template)
+        compare(analysis.critical_path[-1], 'RDSInstance')
+        self.assertIn(('DatabaseSG', 'AttachGateway'),
+                      [(edge['resource'], edge['depends_on']) for edge in analysis.serialized])
+        report = analysis.format_report()
+        self.assertIn('RDSInstance', report)
+        self.assertIn('DatabaseSG on AttachGateway', report)
+
+
+class TestCriticalPathTask(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    @patch('bootstrap_cfn.fab_tasks.report_api_calls')
+    def test_template_file(self, report_api_calls_function):
+        template_path = os.path.join(self.directory, 'template.json')
+        with open(template_path, 'w') as template_file:
+            json.dump(make_template(), template_file)
+        durations_path = os.path.join(self.directory, 'durations.yaml')
+        with open(durations_path, 'w') as durations_file:
+            durations_file.write('AWS::RDS::DBInstance: 900\n')
+        with patch.dict(fab_tasks.env, {'event_store': None}):
+            analysis = fab_tasks.critical_path(template=template_path, durations=durations_path)
+        compare(analysis.total_seconds, 950.0)
+
+    @patch('bootstrap_cfn.fab_tasks.report_api_calls')
+    @patch('bootstrap_cfn.fab_tasks.EventStore')
+    def test_event_store_durations(self, event_store_class, report_api_calls_function):
+        event_store_class.return_value.get_percentiles.return_value = {'AWS::RDS::DBInstance': {'p50': 100.0}}
+        template_path = os.path.join(self.directory, 'template.json')
+        with open(template_path, 'w') as template_file:
+            json.dump(make_template(), template_file)
+        with patch.dict(fab_tasks.env, {'event_store': 'events.sqlite'}):
+            analysis = fab_tasks.critical_path(template=template_path)
+        compare(analysis.critical_path, ['BaseHostRole', 'InstanceProfile', 'ScalingGroup'])
+
+    @patch('bootstrap_cfn.fab_tasks.report_api_calls')
+    @patch('bootstrap_cfn.fab_tasks.get_basic_config')
+    def test_config(self, get_basic_config_function, report_api_calls_function):
+        project_config = ProjectConfig(
+            'tests/sample-project.yaml',
+            'dev',
+            'tests/sample-project-passwords.yaml')
+        get_basic_config_function.return_value = project_config.config
+        with patch.dict(fab_tasks.env, {'application': 'test', 'environment': 'dev', 'event_store': None}):
+            analysis = fab_tasks.critical_path()
+        compare(analysis.critical_path[-1], 'RDSInstance')
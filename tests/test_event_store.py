@@ -0,0 +1,156 @@
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import MagicMock, patch
+
+from testfixtures import compare
+
+from bootstrap_cfn import event_store, fab_tasks, utils
+
+STACK_ID = 'arn:aws:cloudformation:eu-west-1:123456789012:stack/app-dev-12345678/1'
+
+
+def make_event(event_id, logical_id, resource_type, status, seconds, stack_id=STACK_ID):
+    event = MagicMock()
+    event.event_id = '{0}-{1}'.format(stack_id.split('/')[-1], event_id)
+    event.stack_id = stack_id
+    event.stack_name = stack_id.split('/')[1]
+    event.logical_resource_id = logical_id
+    event.physical_resource_id = stack_id if resource_type == 'AWS::CloudFormation::Stack' else logical_id.lower()
+    event.resource_type = resource_type
+    event.resource_status = status
+    event.resource_status_reason = None
+    event.timestamp = datetime.datetime(2016, 1, 1) + datetime.timedelta(seconds=seconds)
+    return event
+
+
+def make_events(stack_id=STACK_ID, rds_seconds=600):
+    return [
+        make_event('1', 'app-dev-12345678', 'AWS::CloudFormation::Stack', 'CREATE_IN_PROGRESS', 0, stack_id),
+        make_event('2', 'VPC', 'AWS::EC2::VPC', 'CREATE_IN_PROGRESS', 1, stack_id),
+        make_event('3', 'VPC', 'AWS::EC2::VPC', 'CREATE_IN_PROGRESS', 2, stack_id),
+        make_event('4', 'VPC', 'AWS::EC2::VPC', 'CREATE_COMPLETE', 21, stack_id),
+        make_event('5', 'RDSInstance', 'AWS::RDS::DBInstance', 'CREATE_IN_PROGRESS', 21, stack_id),
+        make_event('6', 'RDSInstance', 'AWS::RDS::DBInstance', 'CREATE_COMPLETE', 21 + rds_seconds, stack_id),
+        make_event('7', 'app-dev-12345678', 'AWS::CloudFormation::Stack', 'CREATE_COMPLETE', 22 + rds_seconds, stack_id),
+    ]
+
+
+class TestEventStore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.event_store = event_store.EventStore(os.path.join(self.directory, 'store', 'events.sqlite'))
+        self.addCleanup(self.event_store.close)
+
+    def test_get_durations(self):
+        compare(event_store.get_durations([
+            ('CREATE_IN_PROGRESS', 0), ('CREATE_IN_PROGRESS', 1), ('CREATE_COMPLETE', 5),
+            ('UPDATE_IN_PROGRESS', 10), ('UPDATE_FAILED', 12),
+            ('DELETE_IN_PROGRESS', 20), ('DELETE_COMPLETE', 23),
+        ]), [('CREATE', 0, 5), ('DELETE', 20, 23)])
+
+    def test_percentile(self):
+        compare(event_store.percentile([10, 30, 20, 40], 0.5), 25.0)
+        compare(event_store.percentile(range(101), 0.95), 95.0)
+        compare(event_store.percentile([7], 0.95), 7.0)
+        self.assertIsNone(event_store.percentile([], 0.5))
+
+    def test_no_store(self):
+        compare(self.event_store.get_percentiles(), {})
+        compare(self.event_store.add_events([]), 0)
+        self.assertFalse(os.path.exists(self.event_store.path))
+
+    def test_percentiles(self):
+        compare(self.event_store.add_events(make_events()), 7)
+        # Events kept already are ignored
+        compare(self.event_store.add_events(make_events()[:3]), 0)
+        self.event_store.add_events(make_events(STACK_ID.replace('/1', '/2'), rds_seconds=500))
+        self.event_store.add_events(make_events(STACK_ID.replace('/1', '/3'), rds_seconds=400))
+        percentiles = self.event_store.get_percentiles()
+        compare(percentiles, {
+            'AWS::EC2::VPC': {'count': 3, 'p50': 20.0, 'p95': 20.0, 'total': 60.0},
+            'AWS::RDS::DBInstance': {'count': 3, 'p50': 500.0, 'p95': 590.0, 'total': 1500.0},
+        })
+        compare(self.event_store.get_percentiles('DELETE'), {})
+        lines = event_store.format_percentiles(percentiles).splitlines()
+        self.assertTrue(lines[2].startswith('AWS::RDS::DBInstance'))
+
+    def test_durations_across_calls(self):
+        events = make_events()
+        self.event_store.add_events(events[:5])
+        compare(self.event_store.get_percentiles().keys(), ['AWS::EC2::VPC'])
+        self.event_store.add_events(events[5:])
+        compare(self.event_store.get_percentiles()['AWS::RDS::DBInstance']['p50'], 600.0)
+
+    def test_get_eta(self):
+        history = {'CREATE': {'AWS::RDS::DBInstance': {'p50': 600.0}, 'AWS::EC2::VPC': {'p50': 20.0}}}
+        in_progress = {
+            'VPC': ('CREATE', 'AWS::EC2::VPC', 1000.0),
+            'RDSInstance': ('CREATE', 'AWS::RDS::DBInstance', 1010.0),
+            'Queue': ('CREATE', 'AWS::SQS::Queue', 1000.0),
+        }
+        compare(event_store.get_eta(in_progress, history, 1100.0), (510.0, 'RDSInstance'))
+        compare(event_store.get_eta(in_progress, history, 2000.0), (0, 'VPC'))
+        self.assertIsNone(event_store.get_eta({'Queue': ('CREATE', 'AWS::SQS::Queue', 1000.0)}, history, 1100.0))
+
+
+class TestTail(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'events.sqlite')
+        previous_store = event_store.EventStore(self.path)
+        previous_store.add_events(make_events(STACK_ID.replace('/1', '/0')))
+        previous_store.close()
+
+    @patch('bootstrap_cfn.utils.time')
+    @patch('bootstrap_cfn.utils.get_events')
+    def test_tail_keeps_events(self, get_events_function, time_function):
+        events = make_events()
+        # The last events come in after the stack is done
+        get_events_function.side_effect = [events[:5], events[:6], events]
+        time_function.time.return_value = event_store.to_seconds(events[4].timestamp) + 100
+        stack = MagicMock()
+        stack.stack_missing.return_value = False
+        stack.stack_done.side_effect = [False, True]
+        with patch('sys.stdout') as stdout:
+            utils.tail(stack, 'app-dev-12345678', event_store.EventStore(self.path))
+        output = ''.join(call[0][0] for call in stdout.write.call_args_list)
+        self.assertIn('ETA 08:20 waiting for RDSInstance', output)
+
+        percentiles = event_store.EventStore(self.path).get_percentiles()
+        compare(percentiles['AWS::RDS::DBInstance']['count'], 2)
+
+    @patch('bootstrap_cfn.utils.logging')
+    @patch('bootstrap_cfn.utils.time')
+    @patch('bootstrap_cfn.utils.get_events')
+    def test_tail_store_cannot_be_created(self, get_events_function, time_function, logging_module):
+        events = make_events()
+        get_events_function.side_effect = [events[:5], events, events]
+        time_function.time.return_value = event_store.to_seconds(events[4].timestamp) + 100
+        stack = MagicMock()
+        stack.stack_missing.return_value = False
+        stack.stack_done.side_effect = [False, True]
+        # The directory of the store is taken by a file
+        blocked_path = os.path.join(self.directory, 'events.sqlite', 'store', 'events.sqlite')
+        with patch('sys.stdout') as stdout:
+            utils.tail(stack, 'app-dev-12345678', event_store.EventStore(blocked_path))
+        output = ''.join(call[0][0] for call in stdout.write.call_args_list)
+        compare(output.count('AWS::RDS::DBInstance'), 2)
+        # Keeping the events is given up after the first failure
+        compare(logging_module.warning.call_count, 1)
+        self.assertFalse(os.path.exists(blocked_path))
+
+    @patch('bootstrap_cfn.fab_tasks.report_api_calls')
+    def test_resource_durations(self, report_api_calls_function):
+        with patch.dict(fab_tasks.env, {'event_store': self.path}), patch('sys.stdout'):
+            compare(sorted(fab_tasks.resource_durations()), ['AWS::EC2::VPC', 'AWS::RDS::DBInstance'])
+            compare(fab_tasks.resource_durations('delete'), {})
+        with patch.dict(fab_tasks.env, {'event_store': 'none'}):
+            self.assertIsNone(fab_tasks.get_event_store())
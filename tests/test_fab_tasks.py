@@ -63,7 +63,16 @@ class TestFabTasks(unittest.TestCase):
         iam_mock = Mock()
         iam_connect_result = Mock(name='iam_connect')
         iam_mock.return_value = iam_connect_result
-        mock_config = {'delete_ssl_certificate.return_value': True}
+        list_server_certs_response = {
+            'list_server_certificates_response': {
+                'list_server_certificates_result': {
+                    'is_truncated': 'false',
+                    'server_certificate_metadata_list': []
+                }
+            }
+        }
+        mock_config = {'delete_ssl_certificate.return_value': True,
+                       'list_server_certs.return_value': list_server_certs_response}
         iam_connect_result.configure_mock(**mock_config)
         boto.iam.connect_to_region = iam_mock
         i = iam.IAM("profile_name")
@@ -448,7 +457,159 @@ class TestFabTasks(unittest.TestCase):
         r53_connect_result.configure_mock(**mock_config)
         boto.route53.connect_to_region = r53_mock
         r = r53.R53("profile_name")
-        fab_tasks.get_connection = Mock(return_value=r)
-
-        zone_id = fab_tasks.get_zone_id()
+        with patch('bootstrap_cfn.fab_tasks.get_connection', return_value=r):
+            zone_id = fab_tasks.get_zone_id()
         self.assertEqual(zone_id, "Z1GDM6HEODZI69")
+
+    @patch('bootstrap_cfn.utils.get_events', return_value=[])
+    @patch('bootstrap_cfn.config.ConfigParser.process_network', return_value="test")
+    @patch('bootstrap_cfn.fab_tasks.get_cloudformation_tags', return_value="test")
+    @patch('bootstrap_cfn.fab_tasks.get_connection')
+    @patch('bootstrap_cfn.fab_tasks.get_basic_config')
+    def test_cfn_create_network(self, get_basic_config_function, get_connection_function,
+                                get_cloudformation_tags_function, process_network_function,
+                                get_events_function):
+        '''
+        Check the shared network stack is created from the network template
+        '''
+        basic_config = yaml.load(set_up_basic_config())
+        basic_config['vpc'] = {'network_stack': 'network-dev'}
+        get_basic_config_function.return_value = basic_config
+        cfn = self.cfn_mock()
+        get_connection_function.return_value = cfn
+        self.assertTrue(fab_tasks.cfn_create_network())
+        cfn.conn_cfn.create_stack.assert_called_once_with(
+            stack_name='network-dev', template_body='test', capabilities=['CAPABILITY_IAM'], tags='test')
+
+    @patch('bootstrap_cfn.fab_tasks.get_connection')
+    @patch('bootstrap_cfn.fab_tasks.get_basic_config')
+    def test_cfn_create_network_exists(self, get_basic_config_function, get_connection_function):
+        '''
+        Check an existing shared network stack is left alone
+        '''
+        basic_config = yaml.load(set_up_basic_config())
+        basic_config['vpc'] = {'network_stack': 'cfn_mock-dev-12345678'}
+        get_basic_config_function.return_value = basic_config
+        cfn = self.cfn_mock()
+        get_connection_function.return_value = cfn
+        self.assertTrue(fab_tasks.cfn_create_network())
+        self.assertFalse(cfn.conn_cfn.create_stack.called)
+
+    @patch('bootstrap_cfn.utils.get_events', return_value=[])
+    @patch('bootstrap_cfn.fab_tasks.upload_templates')
+    @patch('bootstrap_cfn.config.ConfigParser.process_nested', return_value=("parent", {"a/Network.json": "network"}))
+    @patch('bootstrap_cfn.fab_tasks.get_cloudformation_tags', return_value="test")
+    @patch('bootstrap_cfn.fab_tasks.get_connection')
+    @patch('bootstrap_cfn.fab_tasks.get_config')
+    @patch('bootstrap_cfn.fab_tasks.get_stack_name', return_value="unittest-test-12345678")
+    def test_cfn_create_nested(self, get_stack_name_function, get_config_function, get_connection_function,
+                               get_cloudformation_tags_function, process_nested_function, upload_templates_function,
+                               get_events_function):
+        '''
+        Check the child templates are uploaded before the parent stack is created
+        '''
+        basic_config = yaml.load(set_up_basic_config())
+        basic_config.pop('ssl')
+        basic_config['nested_stacks'] = {'bucket': 'templates'}
+        get_config_function.return_value = config.ConfigParser(basic_config, "unittest_stack_name", "dev", "test")
+        cfn = self.cfn_mock()
+        get_connection_function.return_value = cfn
+        self.assertTrue(fab_tasks.cfn_create(False))
+        upload_templates_function.assert_called_once_with('templates', {"a/Network.json": "network"})
+        cfn.conn_cfn.create_stack.assert_called_once_with(
+            stack_name='unittest-test-12345678', template_body='parent', capabilities=['CAPABILITY_IAM'], tags='test')
+
+
+class TestStackPool(unittest.TestCase):
+
+    def setUp(self):
+        # The TXT records of the stack tags, by record name
+        self.records = {'stack.pool0.unittest-dev': 'aaaaaaaa', 'stack.pool1.unittest-dev': 'bbbbbbbb'}
+        self.r53_conn = Mock()
+        self.r53_conn.get_record.side_effect = lambda zone_name, zone_id, record_name, record_type: \
+            self.records.get(record_name)
+        self.r53_conn.hastag.side_effect = lambda zone_name, zone_id, record_name: self.records.get(record_name)
+        self.cfn = Mock()
+        for target, value in [('get_zone_name', 'dsd.io'), ('get_zone_id', 'ASDAKSLDK'),
+                              ('get_legacy_name', 'unittest-dev'), ('get_cloudformation_tags', 'test'),
+                              ('report_api_calls', None)]:
+            patch('bootstrap_cfn.fab_tasks.{0}'.format(target), return_value=value).start()
+        patch('bootstrap_cfn.fab_tasks.get_connection',
+              side_effect=lambda klass: self.r53_conn if klass is r53.R53 else self.cfn).start()
+        self.get_config = patch('bootstrap_cfn.fab_tasks.get_config').start()
+        self.get_config.return_value.data = {}
+        self.get_config.return_value.process.return_value = 'template'
+        self.get_stack_index = patch('bootstrap_cfn.fab_tasks.get_stack_index').start()
+        self.get_stack_index.return_value = cloudformation.StackIndex([
+            {'StackName': 'unittest-dev-aaaaaaaa', 'StackId': 'a', 'StackStatus': 'CREATE_IN_PROGRESS'},
+            {'StackName': 'unittest-dev-bbbbbbbb', 'StackId': 'b', 'StackStatus': 'CREATE_COMPLETE'},
+        ])
+        patch.dict(fab_tasks.env, {'tag': 'blue'}).start()
+        fab_tasks.env.pop('stack_name', None)
+        self.addCleanup(patch.stopall)
+
+    def test_fill_stack_pool(self):
+        created = fab_tasks.fill_stack_pool(3)
+        self.assertEqual(len(created), 1)
+        # The new stack is tagged with the empty slot
+        record_name, record_value = self.r53_conn.update_dns_record.call_args[0][1:4:2]
+        self.assertEqual(record_name, 'stack.pool2.unittest-dev.dsd.io')
+        self.assertEqual(created, ['unittest-dev-{0}'.format(record_value.strip('"'))])
+        self.cfn.create.assert_called_once_with(created[0], 'template', tags='test')
+        # The tag set before is kept
+        self.assertEqual(fab_tasks.env.tag, 'blue')
+        self.assertNotIn('stack_name', fab_tasks.env)
+
+    def test_fill_stack_pool_replaces_failed_stacks(self):
+        # The stack in the first slot rolled back, the one in the second was deleted
+        self.get_stack_index.return_value.by_name['unittest-dev-aaaaaaaa']['StackStatus'] = 'ROLLBACK_COMPLETE'
+        self.get_stack_index.return_value.by_name.pop('unittest-dev-bbbbbbbb')
+        self.get_config.return_value.data = {'ssl': {'cert1': {}}}
+        iam_conn = Mock()
+        fab_tasks.get_connection.side_effect = lambda klass: \
+            self.r53_conn if klass is r53.R53 else iam_conn if klass is iam.IAM else self.cfn
+        with patch('bootstrap_cfn.fab_tasks.start_stack_create') as start_stack_create, \
+                patch('bootstrap_cfn.fab_tasks.set_stack_name', side_effect=['unittest-dev-cccccccc',
+                                                                             'unittest-dev-dddddddd']):
+            created = fab_tasks.fill_stack_pool(2)
+        self.get_stack_index.assert_called_once_with(refresh=True)
+        self.assertEqual(created, ['unittest-dev-cccccccc', 'unittest-dev-dddddddd'])
+        self.assertEqual([c[0][1:] for c in self.r53_conn.delete_dns_record.call_args_list],
+                         [('stack.pool0.unittest-dev.dsd.io', 'TXT', '"aaaaaaaa"'),
+                          ('stack.pool1.unittest-dev.dsd.io', 'TXT', '"bbbbbbbb"')])
+        # Only the stack that still exists is deleted, with its certificates
+        self.cfn.delete.assert_called_once_with('unittest-dev-aaaaaaaa')
+        iam_conn.delete_ssl_certificate.assert_called_once_with(self.get_config.return_value.ssl(),
+                                                                'unittest-dev-aaaaaaaa')
+        self.assertEqual(start_stack_create.call_count, 2)
+        self.assertEqual(fab_tasks.env.tag, 'blue')
+        self.assertNotIn('stack_name', fab_tasks.env)
+
+    def test_claim_stack(self):
+        self.records['stack.pool1.unittest-dev'] = None
+        with patch('bootstrap_cfn.fab_tasks.set_stack_name', return_value='unittest-dev-cccccccc') as set_stack_name:
+            self.get_stack_index.return_value.by_name['unittest-dev-aaaaaaaa']['StackStatus'] = 'CREATE_COMPLETE'
+            self.assertEqual(fab_tasks.claim_stack('green'), 'unittest-dev-aaaaaaaa')
+        self.r53_conn.move_txt_record.assert_called_once_with(
+            'ASDAKSLDK', 'stack.pool0.unittest-dev.dsd.io', 'stack.green.unittest-dev.dsd.io', '"aaaaaaaa"')
+        # The pool is refilled, without waiting for the stack to be created
+        self.assertEqual(set_stack_name.call_count, 1)
+        self.cfn.create.assert_called_once_with('unittest-dev-cccccccc', 'template', tags='test')
+
+    def test_claim_stack_skips_stacks_being_created(self):
+        with patch('bootstrap_cfn.fab_tasks.fill_stack_pool') as fill_stack_pool:
+            self.assertEqual(fab_tasks.claim_stack('green', size=2), 'unittest-dev-bbbbbbbb')
+        fill_stack_pool.assert_called_once_with(2)
+
+    def test_claim_stack_none_created(self):
+        self.records.pop('stack.pool1.unittest-dev')
+        with self.assertRaises(SystemExit):
+            fab_tasks.claim_stack('green')
+        self.assertFalse(self.r53_conn.move_txt_record.called)
+
+    def test_claim_stack_tag_exists(self):
+        self.records['stack.green.unittest-dev'] = 'dddddddd'
+        with self.assertRaises(errors.TagRecordExistConflictError):
+            fab_tasks.claim_stack('green')
+        with self.assertRaises(errors.ActiveTagExistConflictError):
+            fab_tasks.claim_stack('active')
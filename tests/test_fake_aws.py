@@ -0,0 +1,119 @@
+import json
+import threading
+import time
+import unittest
+
+import boto.iam
+import boto.route53.exception
+
+import boto3
+
+import botocore.exceptions
+
+import mock
+
+from benchmarks import fake_aws, task_benchmark
+
+from bootstrap_cfn import cloudformation, utils
+from bootstrap_cfn.r53 import R53
+
+
+class TestFakeClock(unittest.TestCase):
+
+    def test_sleeps_move_time_on(self):
+        clock = fake_aws.FakeClock()
+        with clock.patch():
+            start_time = time.time()
+            time.sleep(600)
+            self.assertGreaterEqual(time.time() - start_time, 600)
+        self.assertLess(time.time() - start_time, 600)
+
+    def test_threads_overlap(self):
+        clock = fake_aws.FakeClock()
+        with clock.patch():
+            threads = [threading.Thread(target=time.sleep, args=(60,)) for _ in range(3)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertGreaterEqual(clock.elapsed(), 60)
+            self.assertLess(clock.elapsed(), 120)
+
+
+class TestFakeAWS(unittest.TestCase):
+
+    def setUp(self):
+        self.instance = mock.Mock(aws_profile_name='bench', aws_region_name='eu-west-1')
+
+    def test_boto3_client_error(self):
+        fake = fake_aws.FakeAWS()
+        with fake.patch():
+            client = utils.setup_boto3_client(boto3.client('ec2'))
+            with self.assertRaises(botocore.exceptions.ClientError) as context:
+                client.describe_vpcs(VpcIds=['vpc-missing'])
+        self.assertEqual(context.exception.response['Error']['Code'], 'InvalidVpcID.NotFound')
+        self.assertEqual(fake.calls, [('ec2', 'DescribeVpcs', 'InvalidVpcID.NotFound')])
+
+    def test_throttled_calls_are_retried(self):
+        fake = fake_aws.FakeAWS(request_rates={'route53': 1})
+        fake.add_hosted_zone('example.com')
+        with fake.patch():
+            r53 = R53('bench')
+            for _ in range(3):
+                self.assertTrue(r53.get_hosted_zone_id('example.com'))
+        error_codes = [error_code for _, _, error_code in fake.calls]
+        self.assertIn('Throttling', error_codes)
+        self.assertEqual(len([code for code in error_codes if code is None]), 6)
+
+    def test_route53_records(self):
+        fake = fake_aws.FakeAWS()
+        zone_id = fake.add_hosted_zone('example.com')
+        with fake.patch():
+            r53 = R53('bench')
+            r53.update_dns_record(zone_id, 'stack.active.app-dev.example.com', 'TXT', '"abcd1234"')
+            self.assertEqual(r53.get_record('example.com', zone_id, 'stack.active.app-dev', 'TXT'), 'abcd1234')
+            self.assertIsNone(r53.get_record('example.com', zone_id, 'stack.blue.app-dev', 'TXT'))
+            with self.assertRaises(boto.route53.exception.DNSServerError):
+                r53.delete_dns_record(zone_id, 'stack.active.app-dev.example.com', 'TXT', '"other"')
+
+    def test_certificates_become_visible(self):
+        fake = fake_aws.FakeAWS(consistency_delay=10)
+        with fake.patch():
+            conn = fake.connect_to_aws(boto.iam, self.instance)
+            conn.upload_server_cert('cert-app-dev-abcd1234', 'body', 'key')
+            with self.assertRaises(boto.exception.BotoServerError) as context:
+                conn.get_server_certificate('cert-app-dev-abcd1234')
+            self.assertEqual(context.exception.error_code, 'NoSuchEntity')
+            time.sleep(10)
+            result = conn.get_server_certificate('cert-app-dev-abcd1234')
+        certificate = result['get_server_certificate_response']['get_server_certificate_result']['server_certificate']
+        self.assertEqual(certificate['certificate_body'], 'body')
+
+    def test_stack_created_over_time(self):
+        fake = fake_aws.FakeAWS(stack_create_seconds=100)
+        template = {'Resources': {
+            'VPC': {'Type': 'AWS::EC2::VPC', 'Properties': {'CidrBlock': '10.1.0.0/16'}},
+            'RouteTable': {'Type': 'AWS::EC2::RouteTable', 'Properties': {'VpcId': {'Ref': 'VPC'}}},
+        }}
+        with fake.patch():
+            cfn = cloudformation.Cloudformation('bench')
+            stack_id = cfn.create('app-dev-abcd1234', json.dumps(template), tags={'Env': 'dev'})
+            self.assertFalse(cfn.stack_done(stack_id))
+            time.sleep(100)
+            self.assertTrue(cfn.stack_done(stack_id))
+            vpc_id = cloudformation.get_physical_resource_id('app-dev-abcd1234', 'VPC')
+        self.assertEqual(fake.vpcs[vpc_id]['CidrBlock'], '10.1.0.0/16')
+        route_tables = [route_table for route_table in fake.route_tables.values() if route_table['VpcId'] == vpc_id]
+        self.assertEqual(len(route_tables), 2)
+
+
+class TestTaskBenchmark(unittest.TestCase):
+
+    def test_run_profile(self):
+        results = task_benchmark.run_profile('realistic', seed=1)
+        self.assertEqual(sorted(results), sorted(task_benchmark.STEPS))
+        # The stacks take the simulated stack creation time, not real time
+        self.assertGreaterEqual(results['cfn_create app']['seconds'], 600)
+        self.assertLess(results['cfn_create app']['real_seconds'], 60)
+        for step in task_benchmark.STEPS:
+            self.assertGreater(results[step]['calls'], 0, step)
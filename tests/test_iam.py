@@ -139,14 +139,14 @@ class TestIAM(unittest.TestCase):
                          )
 
     @patch("boto.iam.IAMConnection.upload_server_cert")
-    @patch("bootstrap_cfn.iam.IAM.get_remote_certificate")
+    @patch("bootstrap_cfn.iam.IAM.has_remote_certificate")
     def test_upload_certificate_not_exists(self,
-                                           mock_get_remote_certificate,
+                                           mock_has_remote_certificate,
                                            mock_upload_server_cert):
         """
         Test that we can upload a certificate if it doesnt exist remotely
         """
-        mock_get_remote_certificate.return_value = False
+        mock_has_remote_certificate.return_value = False
         mock_upload_server_cert.return_value = self.successful_response
         cert_name = "cert1"
         stack_name = "test_stack"
@@ -154,7 +154,7 @@ class TestIAM(unittest.TestCase):
         success = self.mock_iam.upload_certificate(cert_name,
                                                    stack_name,
                                                    ssl_data)
-        mock_get_remote_certificate.assert_called_once_with(cert_name,
+        mock_has_remote_certificate.assert_called_once_with(cert_name,
                                                             stack_name)
         self.assertTrue(success,
                         "TestIAM::test_upload_certificate_exists: "
@@ -162,14 +162,14 @@ class TestIAM(unittest.TestCase):
                         )
 
     @patch("boto.iam.IAMConnection.upload_server_cert")
-    @patch("bootstrap_cfn.iam.IAM.get_remote_certificate")
+    @patch("bootstrap_cfn.iam.IAM.has_remote_certificate")
     def test_upload_certificate_exists(self,
-                                       mock_get_remote_certificate,
+                                       mock_has_remote_certificate,
                                        mock_upload_server_cert):
         """
         Test that we cannot upload a certificate if it exists remotely
         """
-        mock_get_remote_certificate.return_value = True
+        mock_has_remote_certificate.return_value = True
         mock_upload_server_cert.return_value = self.unsuccessful_response
         cert_name = "cert1"
         stack_name = "test_stack"
@@ -177,7 +177,7 @@ class TestIAM(unittest.TestCase):
         success = self.mock_iam.upload_certificate(cert_name,
                                                    stack_name,
                                                    ssl_data)
-        mock_get_remote_certificate.assert_called_once_with(cert_name,
+        mock_has_remote_certificate.assert_called_once_with(cert_name,
                                                             stack_name)
         self.assertFalse(success,
                          "TestIAM::test_upload_certificate_exists: "
@@ -185,42 +185,56 @@ class TestIAM(unittest.TestCase):
                          )
 
     @patch("boto.iam.IAMConnection.delete_server_cert")
-    @patch("bootstrap_cfn.iam.IAM.get_remote_certificate")
+    @patch("bootstrap_cfn.iam.IAM.has_remote_certificate")
     def test_delete_certificate_exists(self,
-                                       mock_get_remote_certificate,
+                                       mock_has_remote_certificate,
                                        mock_delete_server_cert):
         """
         Test that we can delete a certificate if it exists
         """
-        mock_get_remote_certificate.return_value = True
+        mock_has_remote_certificate.return_value = True
         mock_delete_server_cert.return_value = self.successful_response
         cert_name = "cert1"
         stack_name = "test_stack"
 
         success = self.mock_iam.delete_certificate(cert_name,
                                                    stack_name)
-        mock_get_remote_certificate.assert_called_once_with(cert_name,
+        mock_has_remote_certificate.assert_called_once_with(cert_name,
                                                             stack_name)
         self.assertTrue(success,
                         "TestIAM::test_delete_certificate_exists: "
                         "Should only be able to delete an existent cert "
                         )
 
+    @patch("bootstrap_cfn.iam.RETRY_POLICY")
+    @patch("bootstrap_cfn.iam.IAM.has_remote_certificate")
+    def test_delete_certificate_retries_for_certificates(self,
+                                                         mock_has_remote_certificate,
+                                                         mock_retry_policy):
+        """
+        Test a certificate still in use is retried for longer than other calls
+        """
+        mock_has_remote_certificate.return_value = True
+        self.assertTrue(self.mock_iam.delete_certificate("cert1", "test_stack"))
+        kwargs = mock_retry_policy.run.call_args[1]
+        self.assertEqual(kwargs['max_attempts'], iam.CERTIFICATE_MAX_ATTEMPTS)
+        self.assertEqual(kwargs['base_delay'], iam.CERTIFICATE_BASE_DELAY)
+
     @patch("boto.iam.IAMConnection.delete_server_cert")
-    @patch("bootstrap_cfn.iam.IAM.get_remote_certificate")
+    @patch("bootstrap_cfn.iam.IAM.has_remote_certificate")
     def test_delete_certificate_not_exists(self,
-                                           mock_get_remote_certificate,
+                                           mock_has_remote_certificate,
                                            mock_delete_server_cert):
         """
         Test we get false on trying to delete a non-existent certificate
         """
-        mock_get_remote_certificate.return_value = None
+        mock_has_remote_certificate.return_value = None
         mock_delete_server_cert.return_value = self.unsuccessful_response
         cert_name = "cert1"
         stack_name = "test_stack"
         success = self.mock_iam.delete_certificate(cert_name,
                                                    stack_name)
-        mock_get_remote_certificate.assert_called_once_with(cert_name,
+        mock_has_remote_certificate.assert_called_once_with(cert_name,
                                                             stack_name)
         self.assertFalse(success,
                          "TestIAM::test_delete_certificate_not_exists: "
@@ -272,3 +286,102 @@ class TestIAM(unittest.TestCase):
         self.assertFalse(certs_equal,
                          "Local and remote certificates should not be equal"
                          )
+
+    def list_server_certs_response(self, names, is_truncated='false', marker=None):
+        return {
+            "list_server_certificates_response": {
+                "list_server_certificates_result": {
+                    "is_truncated": is_truncated,
+                    "marker": marker,
+                    "server_certificate_metadata_list": [
+                        {
+                            "server_certificate_name": name,
+                            "path": "/",
+                            "arn": "arn:aws:iam::123456789012:server-certificate/%s" % name
+                        } for name in names
+                    ]
+                }
+            }
+        }
+
+    def test_certificate_index_pagination(self):
+        """
+        Test that the certificate index pages through all the certificates once
+        """
+        self.mock_iam.conn_iam.list_server_certs.side_effect = [
+            self.list_server_certs_response(["cert1-app-dev-1234abcd"], 'true', 'page2'),
+            self.list_server_certs_response(["cert2-app-dev-1234abcd", "cert1-other-dev-5678abcd"])
+        ]
+        index = self.mock_iam.get_certificate_index()
+        self.assertEqual(self.mock_iam.conn_iam.list_server_certs.call_count, 2)
+        self.mock_iam.conn_iam.list_server_certs.assert_called_with(path_prefix='/', marker='page2')
+        self.assertEqual(sorted(index.by_name.keys()),
+                         ["cert1-app-dev-1234abcd", "cert1-other-dev-5678abcd", "cert2-app-dev-1234abcd"])
+        self.assertEqual(sorted(c['server_certificate_name'] for c in index.get_by_stack("app-dev-1234abcd")),
+                         ["cert1-app-dev-1234abcd", "cert2-app-dev-1234abcd"])
+        self.assertEqual(len(index.get_by_path("/")), 3)
+
+        # Lookups are answered from memory
+        self.assertTrue(self.mock_iam.has_remote_certificate("cert2", "app-dev-1234abcd"))
+        self.assertFalse(self.mock_iam.has_remote_certificate("cert3", "app-dev-1234abcd"))
+        self.assertEqual(self.mock_iam.get_arn_for_cert("cert1-app-dev-1234abcd"),
+                         "arn:aws:iam::123456789012:server-certificate/cert1-app-dev-1234abcd")
+        self.assertEqual(self.mock_iam.conn_iam.list_server_certs.call_count, 2)
+        self.assertFalse(self.mock_iam.conn_iam.get_server_certificate.called)
+
+    def test_upload_certificate_adds_to_index(self):
+        """
+        Test that an uploaded certificate is added to the index rather than
+        the index being built again
+        """
+        self.mock_iam.conn_iam.list_server_certs.return_value = self.list_server_certs_response([])
+        self.mock_iam.conn_iam.upload_server_cert.return_value = {
+            "upload_server_certificate_response": {
+                "upload_server_certificate_result": {
+                    "server_certificate_metadata": {
+                        "server_certificate_name": "cert1-app-dev-1234abcd",
+                        "path": "/",
+                        "arn": "arn:aws:iam::123456789012:server-certificate/cert1-app-dev-1234abcd"
+                    }
+                }
+            }
+        }
+        self.assertTrue(self.mock_iam.upload_certificate("cert1", "app-dev-1234abcd", self.test_certs["test_cert_1"]))
+        self.assertTrue(self.mock_iam.has_remote_certificate("cert1", "app-dev-1234abcd"))
+        self.assertEqual(self.mock_iam.get_arn_for_cert("cert1-app-dev-1234abcd"),
+                         "arn:aws:iam::123456789012:server-certificate/cert1-app-dev-1234abcd")
+        self.assertEqual(self.mock_iam.conn_iam.list_server_certs.call_count, 1)
+
+    def test_get_remote_certificate_not_in_index(self):
+        """
+        Test that we do not fetch the certificate body of an unknown certificate
+        """
+        self.mock_iam.conn_iam.list_server_certs.return_value = self.list_server_certs_response([])
+        self.assertIsNone(self.mock_iam.get_remote_certificate("cert1", "test_stack"))
+        self.assertFalse(self.mock_iam.conn_iam.get_server_certificate.called)
+
+    def test_delete_stale_certificates(self):
+        """
+        Test that we delete all but the newest and in-use timestamped certificates
+        """
+        stack_name = "app-dev-1234abcd"
+        self.mock_iam.conn_iam.list_server_certs.return_value = self.list_server_certs_response([
+            "cert1-app-dev-1234abcd",
+            "cert1-1466000000.1-app-dev-1234abcd",
+            "cert1-1466000001.1-app-dev-1234abcd",
+            "cert1-1466000002.1-app-dev-1234abcd",
+            "cert1-1466000003.1-app-dev-1234abcd",
+            "cert2-1466000000.1-app-dev-1234abcd",
+            "cert1-1466000000.1-other-dev-5678abcd",
+        ])
+        in_use_arns = ["arn:aws:iam::123456789012:server-certificate/cert1-1466000001.1-app-dev-1234abcd"]
+
+        stale = self.mock_iam.delete_stale_certificates(stack_name, in_use_arns=in_use_arns, dry_run=True)
+        self.assertEqual(stale, ["cert1-1466000000.1-app-dev-1234abcd",
+                                 "cert1-1466000002.1-app-dev-1234abcd"])
+        self.assertFalse(self.mock_iam.conn_iam.delete_server_cert.called)
+
+        self.mock_iam.delete_stale_certificates(stack_name, in_use_arns=in_use_arns)
+        self.assertEqual(self.mock_iam.conn_iam.delete_server_cert.call_count, 2)
+        self.assertIsNone(self.mock_iam.get_certificate_index().get("cert1-1466000000.1-app-dev-1234abcd"))
+        self.assertEqual(self.mock_iam.conn_iam.list_server_certs.call_count, 1)
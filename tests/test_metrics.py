@@ -0,0 +1,113 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from bootstrap_cfn import fab_tasks, metrics
+
+
+class TestApiCallStats(unittest.TestCase):
+
+    def setUp(self):
+        self.stats = metrics.ApiCallStats()
+        self.stats.reset('cfn_create')
+        self.stats.record('ec2', 'CreateRoute', 0.2, request_bytes=100, response_bytes=300)
+        self.stats.record('ec2', 'CreateRoute', 0.7, attempt=2, error_code='Throttling',
+                          request_bytes=100, response_bytes=200)
+        self.stats.record('route53', 'ListHostedZones', 0.04)
+
+    def test_record(self):
+        self.assertEqual(self.stats.calls, 3)
+        operations = self.stats.get_operations()
+        self.assertEqual([operation[:2] for operation in operations],
+                         [('ec2', 'CreateRoute'), ('route53', 'ListHostedZones')])
+        stats = operations[0][2]
+        self.assertEqual(stats['calls'], 2)
+        self.assertEqual(stats['retries'], 1)
+        self.assertEqual(stats['errors'], 1)
+        self.assertAlmostEqual(stats['latency_sum'], 0.9)
+        self.assertEqual(stats['latency_max'], 0.7)
+        self.assertEqual(stats['request_bytes'], 200)
+        self.assertEqual(stats['response_bytes'], 500)
+        # Cumulative buckets: 0.05, 0.1, 0.25, 0.5, 1, ...
+        self.assertEqual(stats['latency_buckets'][:5], [0, 0, 1, 1, 2])
+
+    def test_reset(self):
+        self.stats.reset('cfn_delete')
+        self.assertEqual(self.stats.calls, 0)
+        self.assertEqual(self.stats.task_name, 'cfn_delete')
+
+    def test_format_table(self):
+        lines = self.stats.format_table().splitlines()
+        self.assertTrue(lines[0].startswith('Service'))
+        self.assertTrue(lines[2].startswith('ec2      CreateRoute'))
+        self.assertEqual(lines[2].split()[2:], ['2', '1', '1', '450', '700', '0.9', '200', '500'])
+        self.assertEqual(lines[-1].split()[:5], ['Total', '3', '1', '1', '0.9'])
+
+    def test_to_prometheus(self):
+        text = self.stats.to_prometheus()
+        self.assertIn('# TYPE bootstrap_cfn_aws_api_calls_total counter', text)
+        self.assertIn('bootstrap_cfn_aws_api_calls_total'
+                      '{task="cfn_create",service="ec2",operation="CreateRoute"} 2', text)
+        self.assertIn('bootstrap_cfn_aws_api_call_duration_seconds_bucket'
+                      '{task="cfn_create",service="ec2",operation="CreateRoute",le="0.25"} 1', text)
+        self.assertIn('bootstrap_cfn_aws_api_call_duration_seconds_bucket'
+                      '{task="cfn_create",service="ec2",operation="CreateRoute",le="+Inf"} 2', text)
+        self.assertIn('bootstrap_cfn_aws_api_call_duration_seconds_count'
+                      '{task="cfn_create",service="route53",operation="ListHostedZones"} 1', text)
+
+    def test_write_files(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        json_path = os.path.join(directory, 'stats.json')
+        prometheus_path = os.path.join(directory, 'stats.prom')
+        self.stats.write_json(json_path)
+        self.stats.write_prometheus(prometheus_path)
+        with open(json_path) as json_file:
+            data = json.load(json_file)
+        self.assertEqual(data['task'], 'cfn_create')
+        self.assertEqual([operation['operation'] for operation in data['operations']],
+                         ['CreateRoute', 'ListHostedZones'])
+        with open(prometheus_path) as prometheus_file:
+            self.assertEqual(prometheus_file.read(), self.stats.to_prometheus())
+        self.assertEqual(sorted(os.listdir(directory)), ['stats.json', 'stats.prom'])
+
+
+class TestTaskReporting(unittest.TestCase):
+
+    def setUp(self):
+        self.stats = metrics.ApiCallStats()
+        mock.patch('bootstrap_cfn.fab_tasks.API_CALL_STATS', self.stats).start()
+        self.report = mock.patch('bootstrap_cfn.fab_tasks.report_api_calls').start()
+        self.addCleanup(mock.patch.stopall)
+
+    def test_outermost_task_reports(self):
+        @fab_tasks.task
+        def inner():
+            self.stats.record('iam', 'ListServerCertificates', 0.1)
+
+        @fab_tasks.task
+        def outer():
+            self.stats.record('cloudformation', 'DescribeStacks', 0.1)
+            inner()
+            return 'done'
+
+        self.stats.record('ec2', 'DescribeVpcs', 0.1)
+        self.assertEqual(outer(), 'done')
+        self.assertEqual(self.report.call_count, 1)
+        self.assertEqual(self.stats.task_name, 'outer')
+        self.assertEqual([operation[1] for operation in self.stats.get_operations()],
+                         ['DescribeStacks', 'ListServerCertificates'])
+
+    def test_task_reports_on_failure(self):
+        @fab_tasks.task
+        def failing():
+            raise ValueError('failed')
+
+        with self.assertRaises(ValueError):
+            failing()
+        self.assertEqual(self.report.call_count, 1)
+        self.assertEqual(fab_tasks.task_depth, 0)
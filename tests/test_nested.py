@@ -0,0 +1,128 @@
+import json
+import unittest
+
+from mock import patch
+
+from testfixtures import compare
+
+from bootstrap_cfn import errors, nested
+from bootstrap_cfn.config import ConfigParser, ProjectConfig
+
+
+def get_refs(value):
+    """
+    Get the names of everything a value refers to with Ref or Fn::GetAtt
+    """
+    if isinstance(value, list):
+        return set().union(*[get_refs(item) for item in value]) if value else set()
+    if not isinstance(value, dict):
+        return set()
+    if value.keys() == ['Ref']:
+        return set([value['Ref']])
+    if value.keys() == ['Fn::GetAtt']:
+        return set([value['Fn::GetAtt'][0]])
+    return get_refs(value.values())
+
+
+class TestSplitTemplate(unittest.TestCase):
+
+    def setUp(self):
+        self.template_urls = dict((child_stack, 'https://s3.amazonaws.com/templates/{0}.json'.format(child_stack))
+                                  for child_stack in nested.NESTED_STACKS)
+
+    def test_split(self):
+        template = {
+            'Parameters': {'KeyName': {'Type': 'String'}},
+            'Resources': {
+                'VPC': {'Type': 'AWS::EC2::VPC', 'Properties': {}},
+                'AttachGateway': {'Type': 'AWS::EC2::VPCGatewayAttachment', 'Properties': {'VpcId': {'Ref': 'VPC'}}},
+                'RDSInstance': {'Type': 'AWS::RDS::DBInstance', 'DependsOn': 'AttachGateway', 'Properties': {}},
+                'ScalingGroup': {'Type': 'AWS::AutoScaling::AutoScalingGroup', 'Properties': {
+                    'KeyName': {'Ref': 'KeyName'},
+                    'Tags': [{'Key': 'Name', 'Value': {'Ref': 'AWS::StackName'}}],
+                    'Host': {'Fn::GetAtt': ['RDSInstance', 'Endpoint.Address']},
+                }},
+            },
+            'Outputs': {
+                'dbport': {'Value': {'Fn::GetAtt': ['RDSInstance', 'Endpoint.Port']}},
+                'Engine': {'Value': 'redis'},
+            },
+        }
+        parent, children = nested.split_template(template, {'ScalingGroup': 'ec2'}, self.template_urls)
+
+        compare(sorted(children), ['Compute', 'Data', 'Network'])
+        compare(children['Network']['Resources']['AttachGateway'], template['Resources']['AttachGateway'])
+        self.assertNotIn('Outputs', children['Network'])
+        # The DependsOn on another child stack's resource is a DependsOn between the child stacks
+        self.assertNotIn('DependsOn', children['Data']['Resources']['RDSInstance'])
+        compare(parent['Resources']['DataStack']['DependsOn'], ['NetworkStack'])
+        compare(children['Compute']['Resources']['ScalingGroup']['Properties'], {
+            'KeyName': {'Ref': 'KeyName'},
+            'Tags': [{'Key': 'Name', 'Value': {'Ref': 'ParentStackName'}}],
+            'Host': {'Ref': 'RDSInstanceEndpointAddress'},
+        })
+        compare(parent['Resources']['ComputeStack'], {
+            'Type': 'AWS::CloudFormation::Stack',
+            'Properties': {
+                'TemplateURL': 'https://s3.amazonaws.com/templates/Compute.json',
+                'Parameters': {
+                    'KeyName': {'Ref': 'KeyName'},
+                    'ParentStackName': {'Ref': 'AWS::StackName'},
+                    'RDSInstanceEndpointAddress': {'Fn::GetAtt': ['DataStack', 'Outputs.RDSInstanceEndpointAddress']},
+                },
+            },
+            'DependsOn': ['DataStack'],
+        })
+        compare(parent['Outputs'], {
+            'dbport': {'Value': {'Fn::GetAtt': ['DataStack', 'Outputs.RDSInstanceEndpointPort']}},
+            'Engine': {'Value': 'redis'},
+        })
+        compare(parent['Parameters'], template['Parameters'])
+
+    def test_cycle(self):
+        template = {'Resources': {
+            'BaseHostRole': {'Type': 'AWS::IAM::Role', 'Properties': {'Group': {'Ref': 'ScalingGroup'}}},
+            'ScalingGroup': {'Type': 'AWS::AutoScaling::AutoScalingGroup', 'Properties': {'Role': {'Ref': 'BaseHostRole'}}},
+        }}
+        with self.assertRaises(errors.CfnConfigError):
+            nested.split_template(template, {}, self.template_urls)
+
+
+class TestProcessNested(unittest.TestCase):
+
+    def test_process_nested(self):
+        project_config = ProjectConfig(
+            'tests/sample-project.yaml',
+            'dev',
+            'tests/sample-project-passwords.yaml')
+        project_config.config['nested_stacks'] = {'bucket': 'templates'}
+        flat_config = ConfigParser(json.loads(json.dumps(project_config.config)), 'my-stack-name')
+        flat_template = json.loads(flat_config.process())
+        config = ConfigParser(project_config.config, 'my-stack-name')
+
+        parent, children = config.process_nested()
+        parent = json.loads(parent)
+        children = dict((key, json.loads(child)) for key, child in children.items())
+
+        compare(sorted(children), ['cloudformation/my-stack-name/{0}.json'.format(child_stack)
+                                   for child_stack in ['Compute', 'Data', 'Edge', 'IAM', 'Network']])
+        compare(parent['Resources']['NetworkStack']['Properties']['TemplateURL'],
+                'https://s3.amazonaws.com/templates/cloudformation/my-stack-name/Network.json')
+        # Every resource is in one child stack and every reference can be resolved there
+        child_resources = [child['Resources'] for child in children.values()]
+        compare(sorted(sum([resources.keys() for resources in child_resources], [])),
+                sorted(flat_template['Resources']))
+        for child in children.values():
+            names = set(child['Resources']) | set(child.get('Parameters', {})) | set(['AWS::Region', 'AWS::AccountId'])
+            self.assertEqual(get_refs(child['Resources'].values()) - names, set())
+        compare(sorted(parent['Outputs']), sorted(flat_template['Outputs']))
+        # The data and IAM stacks do not wait for each other
+        compare(parent['Resources']['DataStack']['DependsOn'], ['NetworkStack'])
+        self.assertNotIn('DependsOn', parent['Resources']['IAMStack'])
+        self.assertIn('DatabaseSG', children['cloudformation/my-stack-name/Data.json']['Resources'])
+
+    @patch('bootstrap_cfn.nested.boto3.client')
+    def test_upload_templates(self, mock_client):
+        nested.upload_templates('templates', {'a/Network.json': '{}'})
+        mock_client.return_value.put_object.assert_called_once_with(
+            Bucket='templates', Key='a/Network.json', Body='{}', ContentType='application/json')
@@ -0,0 +1,105 @@
+import os
+import pstats
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from bootstrap_cfn import fab_tasks, profiling
+
+
+def render(count):
+    return [str(i) for i in range(count)]
+
+
+def generate(count):
+    return render(count) + render(count)
+
+
+class TestProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.profiler = profiling.Profiler()
+
+    def test_disabled_profiles_nothing(self):
+        with self.profiler.profiled():
+            pass
+        self.assertIsNone(self.profiler.profile)
+
+    def test_profiled_blocks_add_up(self):
+        self.profiler.start()
+        with self.profiler.profiled():
+            with self.profiler.profiled():
+                generate(10)
+        generate(10)
+        with self.profiler.profiled():
+            render(10)
+        functions = dict((function[2], function_stats) for function, function_stats
+                         in self.profiler.get_stats().stats.items())
+        self.assertEqual(functions['render'][1], 3)
+        self.assertEqual(functions['generate'][1], 1)
+
+    def test_format_function(self):
+        self.assertEqual(profiling.format_function(('~', 0, "<method 'join' of 'str' objects>")),
+                         "<method 'join' of 'str' objects>")
+        filename = os.path.join(os.path.dirname(profiling.__file__), 'config.py')
+        with mock.patch('sys.path', [os.path.dirname(os.path.dirname(filename))]):
+            self.assertEqual(profiling.format_function((filename, 20, 'process')),
+                             'process ({0}:20)'.format(os.path.join('bootstrap_cfn', 'config.py')))
+
+    def test_collapse_stacks_shares_time_between_callers(self):
+        task = ('fab_tasks.py', 1, 'cfn_create')
+        config = ('fab_tasks.py', 2, 'get_config')
+        render = ('config.py', 3, 'render')
+        stats = {
+            # (calls, primitive calls, time, cumulative time, callers)
+            task: (1, 1, 0.1, 1.0, {}),
+            config: (1, 1, 0.1, 0.5, {task: (1, 1, 0.1, 0.5)}),
+            render: (2, 2, 0.6, 0.6, {task: (1, 1, 0.4, 0.4), config: (1, 1, 0.2, 0.2)}),
+        }
+        lines = profiling.collapse_stacks(stats)
+        self.assertEqual(lines, [
+            'cfn_create (fab_tasks.py:1) 100000',
+            'cfn_create (fab_tasks.py:1);get_config (fab_tasks.py:2) 100000',
+            'cfn_create (fab_tasks.py:1);get_config (fab_tasks.py:2);render (config.py:3) 200000',
+            'cfn_create (fab_tasks.py:1);render (config.py:3) 400000',
+        ])
+
+
+class TestTaskProfiling(unittest.TestCase):
+
+    def setUp(self):
+        self.profiler = profiling.Profiler()
+        mock.patch('bootstrap_cfn.fab_tasks.PROFILER', self.profiler).start()
+        mock.patch('bootstrap_cfn.fab_tasks.report_api_calls').start()
+        mock.patch.dict(fab_tasks.env, {'profile': None}).start()
+        self.addCleanup(mock.patch.stopall)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_profile_following_tasks(self):
+        path = os.path.join(self.directory, 'cfn_create.prof')
+
+        @fab_tasks.task
+        def cfn_create(test=False):
+            generate(50000)
+
+        fab_tasks.profile(out=path)
+        cfn_create(test=True)
+        functions = [function[2] for function in pstats.Stats(path).stats]
+        self.assertIn('cfn_create', functions)
+        self.assertIn('render', functions)
+        with open(path + '.collapsed') as collapsed_file:
+            stacks = [line.rsplit(' ', 1)[0].split(';') for line in collapsed_file]
+        frames = [[frame.split(' ', 1)[0] for frame in stack] for stack in stacks]
+        self.assertIn(['cfn_create', 'generate', 'render'], [stack[-3:] for stack in frames])
+
+    def test_task_without_profile(self):
+        @fab_tasks.task
+        def cfn_create():
+            pass
+
+        cfn_create()
+        self.assertFalse(self.profiler.enabled)
+        self.assertEqual(os.listdir(self.directory), [])
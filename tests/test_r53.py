@@ -117,3 +117,18 @@ class BootstrapCfnR53TestCase(unittest.TestCase):
         r = r53.R53(self.env.aws_profile)
         x = r.get_record("dsd.io", "ASDAKSLDK", "recordname", 'TXT')
         self.assertTrue(x)
+
+    def test_move_txt_record(self):
+        r53_mock = mock.Mock()
+        r53_connect_result = mock.Mock(name='cf_connect')
+        r53_mock.return_value = r53_connect_result
+        boto.route53.connect_to_region = r53_mock
+        r = r53.R53(self.env.aws_profile)
+        x = r.move_txt_record('ASDAKSLDK', 'stack.pool0.app-dev.dsd.io', 'stack.green.app-dev.dsd.io', '"12345678"')
+        self.assertTrue(x)
+        # One change batch creates the new record and deletes the old one
+        r53_connect_result.change_rrsets.assert_called_once_with('ASDAKSLDK', mock.ANY)
+        xml = r53_connect_result.change_rrsets.call_args[0][1]
+        self.assertLess(xml.index('<Action>CREATE</Action>'), xml.index('stack.green.app-dev.dsd.io'))
+        self.assertLess(xml.index('stack.green.app-dev.dsd.io'), xml.index('<Action>DELETE</Action>'))
+        self.assertLess(xml.index('<Action>DELETE</Action>'), xml.index('stack.pool0.app-dev.dsd.io'))
@@ -0,0 +1,124 @@
+import unittest
+
+import boto.cloudformation
+import boto.connection
+
+import mock
+
+from bootstrap_cfn import ratelimit, utils
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch('bootstrap_cfn.ratelimit.time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_acquire_waits_for_tokens(self):
+        bucket = ratelimit.TokenBucket(5)
+        for _ in range(5):
+            self.assertEqual(bucket.acquire(), 0)
+        self.assertAlmostEqual(bucket.acquire(), 0.2)
+        self.assertAlmostEqual(sum(self.clock.sleeps), 0.2)
+
+    def test_try_acquire_does_not_wait(self):
+        bucket = ratelimit.TokenBucket(2)
+        self.assertTrue(bucket.try_acquire())
+        self.assertTrue(bucket.try_acquire())
+        self.assertFalse(bucket.try_acquire())
+        self.clock.now += 0.5
+        self.assertTrue(bucket.try_acquire())
+        self.assertEqual(self.clock.sleeps, [])
+
+    def test_throttled_halves_rate_and_recovers(self):
+        bucket = ratelimit.TokenBucket(4, min_rate=1)
+        bucket.throttled()
+        self.assertEqual(bucket.rate, 2)
+        bucket.throttled()
+        bucket.throttled()
+        self.assertEqual(bucket.rate, 1)
+        for _ in range(100):
+            bucket.succeeded()
+        self.assertEqual(bucket.rate, 4)
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def test_operation_buckets(self):
+        limiter = ratelimit.RateLimiter({'route53': 5})
+        limiter.set_rate('route53', 1, operation_name='ChangeResourceRecordSets')
+        self.assertEqual(len(limiter.get_buckets('route53', 'ListHostedZones')), 1)
+        buckets = limiter.get_buckets('route53', 'ChangeResourceRecordSets')
+        self.assertEqual([bucket.max_rate for bucket in buckets], [5, 1])
+        self.assertEqual(limiter.get_buckets('ec2')[0].max_rate, ratelimit.DEFAULT_RATE)
+
+    def test_record_response(self):
+        limiter = ratelimit.RateLimiter({'ec2': 20})
+        limiter.record_response('ec2', 'CreateRoute', 'RequestLimitExceeded')
+        self.assertEqual(limiter.get_buckets('ec2')[0].rate, 10)
+        limiter.record_response('ec2', 'CreateRoute', 'InvalidRoute.NotFound')
+        self.assertEqual(limiter.get_buckets('ec2')[0].rate, 10)
+        limiter.record_response('ec2', 'CreateRoute')
+        self.assertEqual(limiter.get_buckets('ec2')[0].rate, 11)
+
+
+class TestInstrumentation(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch('bootstrap_cfn.utils.RATE_LIMITER')
+        self.limiter = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch('bootstrap_cfn.utils.RETRY_POLICY')
+        patcher.start().get_retry_delay.return_value = None
+        self.addCleanup(patcher.stop)
+
+    def test_boto_connection(self):
+        conn = mock.Mock(spec=boto.connection.AWSQueryConnection)
+        response = mock.Mock(status=400)
+        response.read.return_value = '<ErrorResponse><Error><Code>Throttling</Code></Error></ErrorResponse>'
+        conn.make_request.return_value = response
+        conn = utils.instrument_boto_connection(conn, utils.get_boto_service_name(boto.cloudformation))
+
+        self.assertEqual(conn.make_request('DescribeStacks', {}), response)
+        self.limiter.acquire.assert_called_once_with('cloudformation', 'DescribeStacks')
+        self.limiter.record_response.assert_called_once_with('cloudformation', 'DescribeStacks', 'Throttling')
+
+    def test_boto_rest_connection(self):
+        conn = mock.Mock(spec=boto.connection.AWSAuthConnection)
+        conn.make_request.return_value = mock.Mock(status=200)
+        conn = utils.instrument_boto_connection(conn, 'route53')
+        conn.make_request('POST', '/2013-04-01/hostedzone/Z1/rrset', {}, 'body')
+        self.limiter.acquire.assert_called_once_with('route53', 'POST rrset')
+        self.limiter.record_response.assert_called_once_with('route53', 'POST rrset', None)
+
+    def test_boto3_handlers(self):
+        utils._before_boto3_request(event_name='request-created.ec2.CreateRoute')
+        self.limiter.acquire.assert_called_once_with('ec2', 'CreateRoute')
+        http_response = mock.Mock(status_code=400)
+        self.assertIsNone(utils._after_boto3_request(
+            event_name='needs-retry.ec2.CreateRoute',
+            response=(http_response, {'Error': {'Code': 'RequestLimitExceeded'}})))
+        self.limiter.record_response.assert_called_once_with('ec2', 'CreateRoute', 'RequestLimitExceeded')
+
+    def test_instrument_boto3_session_once(self):
+        session = mock.Mock()
+        session._session.bootstrap_cfn_instrumented = False
+        utils.instrument_boto3_session(session)
+        utils.instrument_boto3_session(session)
+        self.assertEqual(session._session.register.call_count, 2)
@@ -0,0 +1,139 @@
+import httplib
+import socket
+import unittest
+
+import boto.connection
+from boto.exception import BotoServerError
+
+import boto3
+
+from botocore.exceptions import ClientError
+
+import mock
+
+from bootstrap_cfn import retry, utils
+
+
+def client_error(code):
+    return ClientError({'Error': {'Code': code, 'Message': code}}, 'Operation')
+
+
+class TestRetryPolicy(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch('bootstrap_cfn.retry.time')
+        self.mock_time = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.policy = retry.RetryPolicy(max_attempts=3, base_delay=1, max_delay=3)
+
+    def test_classify(self):
+        self.assertEqual(self.policy.classify('Throttling'), retry.THROTTLING)
+        self.assertEqual(self.policy.classify('RequestLimitExceeded'), retry.THROTTLING)
+        self.assertEqual(self.policy.classify('ServiceUnavailable'), retry.TRANSIENT)
+        self.assertEqual(self.policy.classify('503'), retry.TRANSIENT)
+        self.assertEqual(self.policy.classify('DeleteConflict', ['DeleteConflict']), retry.EVENTUAL_CONSISTENCY)
+        self.assertIsNone(self.policy.classify('DeleteConflict'))
+        self.assertIsNone(self.policy.classify('ValidationError'))
+        self.assertIsNone(self.policy.classify(None))
+
+    def test_get_delay_bounds(self):
+        for attempt, bound in [(1, 1), (2, 2), (3, 3), (10, 3)]:
+            for _ in range(20):
+                delay = self.policy.get_delay(attempt)
+                self.assertTrue(0 <= delay <= bound)
+
+    def test_get_error_code(self):
+        self.assertEqual(retry.get_error_code(client_error('Throttling')), 'Throttling')
+        self.assertEqual(retry.get_error_code(BotoServerError(400, 'Bad Request', {'Error': {}})), '400')
+        self.assertIsNone(retry.get_error_code(ValueError()))
+
+    def test_run_retries_and_counts(self):
+        func = mock.Mock(side_effect=[client_error('Throttling'), client_error('DeleteConflict'), 'done'])
+        self.assertEqual(self.policy.run(func, 'iam', 'DeleteServerCertificate',
+                                         retryable_codes=['DeleteConflict']), 'done')
+        self.assertEqual(self.mock_time.sleep.call_count, 2)
+        totals = self.policy.stats.get_totals()
+        self.assertEqual(totals[retry.THROTTLING]['retries'], 1)
+        self.assertEqual(totals[retry.EVENTUAL_CONSISTENCY]['retries'], 1)
+
+    def test_run_gives_up(self):
+        func = mock.Mock(side_effect=client_error('Throttling'))
+        self.assertRaises(ClientError, self.policy.run, func, 'ec2', 'CreateRoute')
+        self.assertEqual(func.call_count, 3)
+
+        func = mock.Mock(side_effect=client_error('ValidationError'))
+        self.assertRaises(ClientError, self.policy.run, func, 'ec2', 'CreateRoute')
+        self.assertEqual(func.call_count, 1)
+
+    def test_run_only_codes(self):
+        func = mock.Mock(side_effect=[client_error('DeleteConflict'), client_error('Throttling')])
+        self.assertRaises(ClientError, self.policy.run, func, 'iam', 'DeleteServerCertificate',
+                          retryable_codes=['DeleteConflict'], only_codes=True)
+        self.assertEqual(func.call_count, 2)
+        self.assertIsNone(self.policy.classify('ServiceUnavailable', ['DeleteConflict'], only_codes=True))
+
+    def test_boto3_needs_retry(self):
+        http_response = mock.Mock(status_code=400)
+        delay = self.policy.boto3_needs_retry('needs-retry.ec2.CreateRoute',
+                                              response=(http_response, {'Error': {'Code': 'Throttling'}}),
+                                              attempts=1)
+        self.assertTrue(0 <= delay <= 1)
+        self.assertIsNone(self.policy.boto3_needs_retry('needs-retry.ec2.CreateRoute',
+                                                        response=(http_response, {'Error': {'Code': 'Throttling'}}),
+                                                        attempts=3))
+        self.assertIsNone(self.policy.boto3_needs_retry('needs-retry.ec2.CreateRoute',
+                                                        response=(mock.Mock(status_code=200), {}),
+                                                        attempts=1))
+
+
+class TestRetrySetup(unittest.TestCase):
+
+    def test_setup_boto3_client(self):
+        session = boto3.session.Session(aws_access_key_id='a', aws_secret_access_key='b', region_name='eu-west-1')
+        client = utils.setup_boto3_client(session.client('ec2'))
+        with mock.patch.object(retry.RETRY_POLICY, 'get_retry_delay', return_value=None) as mock_get_retry_delay:
+            responses = client.meta.events.emit('needs-retry.ec2.CreateRoute',
+                                                response=(mock.Mock(status_code=503), {}),
+                                                attempts=1, caught_exception=None,
+                                                endpoint=None, operation=None)
+        # Only our handler decides on retries
+        self.assertEqual([response for _, response in responses if response is not None], [])
+        mock_get_retry_delay.assert_called_once_with('ec2', 'CreateRoute', '503', 1)
+
+    @mock.patch('time.sleep')
+    @mock.patch('bootstrap_cfn.utils.RATE_LIMITER')
+    def test_throttling_not_retried_twice(self, mock_rate_limiter, mock_sleep):
+        policy = retry.RetryPolicy(max_attempts=5)
+        conn = mock.Mock(spec=boto.connection.AWSQueryConnection)
+        response = mock.Mock(status=400)
+        response.read.return_value = '<ErrorResponse><Error><Code>Throttling</Code></Error></ErrorResponse>'
+        conn.make_request.return_value = response
+        make_request = conn.make_request
+        with mock.patch('bootstrap_cfn.utils.RETRY_POLICY', policy):
+            conn = utils.instrument_boto_connection(conn, 'elasticloadbalancing')
+
+            def set_certificate():
+                conn.make_request('SetLoadBalancerListenerSSLCertificate', {})
+                raise BotoServerError(400, 'Bad Request', {'Error': {'Code': 'Throttling'}})
+
+            self.assertRaises(BotoServerError, policy.run, set_certificate,
+                              'elasticloadbalancing', 'SetLoadBalancerListenerSSLCertificate',
+                              retryable_codes=['CertificateNotFound'], max_attempts=8, only_codes=True)
+        # The connection retries the throttling, the outer call does not retry it again
+        self.assertEqual(make_request.call_count, 5)
+        self.assertEqual(policy.stats.get_totals()[retry.THROTTLING]['retries'], 4)
+
+    def test_get_events_stops_on_missing_stack(self):
+        stack = mock.Mock()
+        stack.stack_missing.return_value = False
+        stack.conn_cfn.describe_stack_events.side_effect = BotoServerError(
+            400, 'Bad Request', {'Error': {'Code': 'ValidationError'}})
+        self.assertEqual(list(utils.get_events(stack, 'test-stack')), [])
+
+    def test_get_events_stops_on_connection_error(self):
+        stack = mock.Mock()
+        stack.stack_missing.return_value = False
+        stack.conn_cfn.describe_stack_events.side_effect = socket.error(104, 'Connection reset by peer')
+        self.assertEqual(list(utils.get_events(stack, 'test-stack')), [])
+        stack.conn_cfn.describe_stack_events.side_effect = httplib.IncompleteRead('')
+        self.assertEqual(list(utils.get_events(stack, 'test-stack')), [])
@@ -0,0 +1,122 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import mock
+
+from bootstrap_cfn import fab_tasks, metrics, tracing, utils
+
+
+class TestTracer(unittest.TestCase):
+
+    def setUp(self):
+        self.tracer = tracing.Tracer()
+
+    def test_disabled_records_nothing(self):
+        with self.tracer.span('load config'):
+            pass
+        self.tracer.add_span('ec2 CreateRoute', 0, 1, tracing.AWS)
+        self.assertEqual(self.tracer.events, [])
+
+    def test_span(self):
+        self.tracer.start()
+        with self.assertRaises(ValueError):
+            with self.tracer.span('render', resources=3):
+                raise ValueError('failed')
+        event, = self.tracer.events
+        self.assertEqual(event['name'], 'render')
+        self.assertEqual(event['cat'], tracing.PHASE)
+        self.assertEqual(event['ph'], 'X')
+        self.assertEqual(event['args'], {'resources': 3})
+        self.assertEqual(event['tid'], threading.current_thread().ident)
+
+    def test_traced(self):
+        self.tracer.start()
+
+        @self.tracer.traced()
+        def render(value):
+            return value * 2
+
+        self.assertEqual(render(2), 4)
+        self.assertEqual(render.__name__, 'render')
+        self.assertEqual([event['name'] for event in self.tracer.events], ['render'])
+
+    def test_to_dict(self):
+        self.tracer.start()
+        start_time = self.tracer.start_time
+        self.tracer.add_span('retry delay', start_time + 2, 0.5, tracing.SLEEP)
+        self.tracer.add_span('cfn_create', start_time + 1, 3)
+        self.tracer.add_span('ec2 CreateRoute', start_time + 1, 0.25, tracing.AWS)
+        trace = self.tracer.to_dict()
+        metadata, events = trace['traceEvents'][0], trace['traceEvents'][1:]
+        self.assertEqual(metadata['ph'], 'M')
+        self.assertEqual(metadata['args'], {'name': threading.current_thread().name})
+        self.assertEqual([(event['name'], event['ts'], event['dur']) for event in events],
+                         [('cfn_create', 1000000, 3000000),
+                          ('ec2 CreateRoute', 1000000, 250000),
+                          ('retry delay', 2000000, 500000)])
+
+
+class TestInstrumentationTracing(unittest.TestCase):
+
+    def setUp(self):
+        self.tracer = tracing.Tracer()
+        self.tracer.start()
+        mock.patch('bootstrap_cfn.utils.TRACER', self.tracer).start()
+        mock.patch('bootstrap_cfn.utils.API_CALL_STATS', metrics.ApiCallStats()).start()
+        self.rate_limiter = mock.patch('bootstrap_cfn.utils.RATE_LIMITER').start()
+        self.addCleanup(mock.patch.stopall)
+
+    def test_boto3_request_span(self):
+        self.rate_limiter.acquire.return_value = 0.5
+        utils._before_boto3_request('request-created.ec2.CreateRoute', request=mock.Mock(data=''))
+        response = (mock.Mock(status_code=400, headers={}), {'Error': {'Code': 'RequestLimitExceeded'}})
+        utils._after_boto3_request('needs-retry.ec2.CreateRoute', response=response, attempts=2)
+        rate_limit, call = self.tracer.events
+        self.assertEqual((rate_limit['name'], rate_limit['cat'], rate_limit['dur']),
+                         ('rate limit', tracing.SLEEP, 500000))
+        self.assertEqual((call['name'], call['cat']), ('ec2 CreateRoute', tracing.AWS))
+        self.assertEqual(call['args'], {'attempt': 2, 'error_code': 'RequestLimitExceeded'})
+
+
+class TestTaskTracing(unittest.TestCase):
+
+    def setUp(self):
+        self.tracer = tracing.Tracer()
+        mock.patch('bootstrap_cfn.fab_tasks.TRACER', self.tracer).start()
+        mock.patch('bootstrap_cfn.fab_tasks.report_api_calls').start()
+        self.addCleanup(mock.patch.stopall)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_task_writes_trace(self):
+        path = os.path.join(self.directory, 'trace.json')
+
+        @fab_tasks.task
+        def set_stack_name():
+            with self.tracer.span('route53 ChangeResourceRecordSets', tracing.AWS):
+                pass
+
+        @fab_tasks.task
+        def cfn_create(test=False):
+            set_stack_name()
+
+        with mock.patch.dict(fab_tasks.env, {'trace': path}):
+            cfn_create(test=True)
+        with open(path) as trace_file:
+            events = json.load(trace_file)['traceEvents'][1:]
+        self.assertEqual([event['name'] for event in events],
+                         ['cfn_create', 'set_stack_name', 'route53 ChangeResourceRecordSets'])
+        self.assertEqual(events[0]['args'], {'args': [], 'kwargs': {'test': True}})
+
+    def test_task_without_trace(self):
+        @fab_tasks.task
+        def cfn_create():
+            pass
+
+        cfn_create()
+        self.assertFalse(self.tracer.enabled)
+        self.assertEqual(os.listdir(self.directory), [])
@@ -1,6 +1,8 @@
 import unittest
 
-from mock import patch
+from botocore.exceptions import ClientError
+
+from mock import MagicMock, patch
 
 from testfixtures.comparison import compare
 
@@ -359,3 +361,265 @@ class TestVPC(unittest.TestCase):
                              "TestVPC::test_init_stack_wildcard: "
                              "TODO: dicts not equal %s"
                              % (compare(expected_result, actual_result)))
+
+
+class TestVpcTopologyIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.ec2_client = MagicMock()
+        self.ec2_client.describe_vpcs.return_value = {
+            'Vpcs': [
+                {'VpcId': 'vpc_123', 'CidrBlock': '1.2.3.4/8'},
+                {'VpcId': 'peervpc_xyz', 'CidrBlock': '10.11.12.13/24'}
+            ]
+        }
+        self.ec2_client.describe_route_tables.return_value = {
+            'RouteTables': [
+                {'RouteTableId': 'rt_abc', 'VpcId': 'vpc_123',
+                 'Associations': [{'Main': True}],
+                 'Tags': [{'Key': 'aws:cloudformation:logical-id', 'Value': 'PublicRouteTable'}]},
+                {'RouteTableId': 'rt_def', 'VpcId': 'vpc_123',
+                 'Associations': [{'Main': False, 'SubnetId': 'subnet_a'},
+                                  {'Main': False, 'SubnetId': 'subnet_b'}],
+                 'Tags': []},
+                {'RouteTableId': 'rt_123', 'VpcId': 'peervpc_xyz',
+                 'Associations': [],
+                 'Tags': [{'Key': 'aws:cloudformation:logical-id', 'Value': 'PrivateRouteTable'}]}
+            ]
+        }
+
+    def test_lookups_load_once(self):
+        """
+        TestVpcTopologyIndex::test_lookups_load_once: Test that all lookups are answered from a single load
+        """
+        index = vpc.VpcTopologyIndex(['vpc_123', 'peervpc_xyz', None], ec2_client=self.ec2_client)
+        self.assertEqual(index.get_vpc_cidr_blocks('vpc_123'), ['1.2.3.4/8'])
+        self.assertEqual(index.get_vpc_cidr_blocks('peervpc_xyz'), ['10.11.12.13/24'])
+        self.assertEqual(index.get_route_table_ids('vpc_123'), ['rt_abc', 'rt_def'])
+        self.assertEqual(index.get_route_table_ids('peervpc_xyz'), ['rt_123'])
+        self.assertEqual(index.get_route_table_ids('vpc_123', 'PublicRouteTable'), ['rt_abc'])
+        self.assertEqual(index.get_route_table_ids('peervpc_xyz', 'PrivateRouteTable'), ['rt_123'])
+        self.assertEqual(index.get_route_table_ids('vpc_123', is_main=True), ['rt_abc'])
+        self.assertEqual(index.get_route_table_ids('vpc_123', min_subnet_associations=2), ['rt_def'])
+
+        self.ec2_client.describe_vpcs.assert_called_once_with(VpcIds=['peervpc_xyz', 'vpc_123'])
+        self.ec2_client.describe_route_tables.assert_called_once_with(
+            Filters=[{'Name': 'vpc-id', 'Values': ['peervpc_xyz', 'vpc_123']}])
+
+    @patch("bootstrap_cfn.vpc.boto3.client")
+    @patch("bootstrap_cfn.vpc.VPC.get_stack_vpc_id")
+    @patch("bootstrap_cfn.vpc.VPC.get_stack_name_by_match")
+    def test_parse_config_uses_index(self,
+                                     mock_get_stack_name_by_match,
+                                     mock_get_stack_vpc_id,
+                                     mock_client):
+        """
+        TestVpcTopologyIndex::test_parse_config_uses_index: Test that a wildcard config is parsed with one load of the vpcs
+        """
+        mock_client.return_value = self.ec2_client
+        mock_get_stack_name_by_match.return_value = [
+            {"StackName": "peer_stack_1-abc"}
+        ]
+        mock_get_stack_vpc_id.side_effect = [
+            "vpc_123",
+            "peervpc_xyz"
+        ]
+        config = {
+            "vpc": {
+                "peering": {
+                    "peer_stack_1": {
+                        "source_routes": "*",
+                        "target_routes": {
+                            "PrivateRouteTable": {"cidr_blocks": "*"}
+                        }
+                    }
+                }
+            }
+        }
+        test_vpc = vpc.VPC(config, "test_stack")
+
+        peering_config = test_vpc.peering_config["peer_stack_1"]
+        self.assertEqual(sorted(peering_config["source_routes"].keys()), ["rt_abc", "rt_def"])
+        self.assertEqual(peering_config["source_routes"]["rt_abc"]["cidr_blocks"], ["10.11.12.13/24"])
+        self.assertEqual(peering_config["target_routes"]["PrivateRouteTable"],
+                         {"route_table_id": "rt_123", "cidr_blocks": ["1.2.3.4/8"]})
+        self.assertEqual(self.ec2_client.describe_vpcs.call_count, 1)
+        self.assertEqual(self.ec2_client.describe_route_tables.call_count, 1)
+
+
+class TestVpcRoutes(unittest.TestCase):
+
+    def setUp(self):
+        self.ec2_client = MagicMock()
+        self.ec2_client.describe_vpcs.return_value = {
+            'Vpcs': [{'VpcId': 'vpc_123', 'CidrBlock': '1.2.3.4/8'}]
+        }
+        self.ec2_client.describe_route_tables.return_value = {
+            'RouteTables': [
+                {'RouteTableId': 'rt_abc', 'VpcId': 'vpc_123',
+                 'Routes': [{'DestinationCidrBlock': '10.0.0.0/16', 'VpcPeeringConnectionId': 'pcx_1'},
+                            {'DestinationCidrBlock': '1.0.0.0/8', 'GatewayId': 'local'}]},
+                {'RouteTableId': 'rt_def', 'VpcId': 'vpc_123', 'Routes': []}
+            ]
+        }
+        with patch("bootstrap_cfn.vpc.VPC.get_stack_vpc_id", return_value='vpc_123'):
+            self.test_vpc = vpc.VPC({}, "test_stack")
+        self.test_vpc.topology_index = vpc.VpcTopologyIndex(['vpc_123'], ec2_client=self.ec2_client)
+        patcher = patch("bootstrap_cfn.retry.time")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def client_error(self, code):
+        return ClientError({'Error': {'Code': code, 'Message': code}}, 'CreateRoute')
+
+    def test_create_routes_skips_existing(self):
+        """
+        TestVpcRoutes::test_create_routes_skips_existing: Test that only missing routes are created
+        """
+        self.ec2_client.create_route.side_effect = [None, self.client_error('RouteAlreadyExists')]
+        self.test_vpc.create_routes([('rt_abc', '10.0.0.0/16'),
+                                     ('rt_abc', '1.0.0.0/8'),
+                                     ('rt_abc', '10.1.0.0/16'),
+                                     ('rt_def', '10.0.0.0/16'),
+                                     ('rt_def', '10.0.0.0/16')],
+                                    'pcx_1')
+        created = sorted((call[1]['RouteTableId'], call[1]['DestinationCidrBlock'])
+                         for call in self.ec2_client.create_route.call_args_list)
+        self.assertEqual(created, [('rt_abc', '10.1.0.0/16'), ('rt_def', '10.0.0.0/16')])
+        self.assertEqual(self.ec2_client.describe_route_tables.call_count, 1)
+
+    def test_create_routes_retries_new_peering_connection(self):
+        """
+        TestVpcRoutes::test_create_routes_retries_new_peering_connection: Test that routes through a peering
+        connection that is not visible yet are retried
+        """
+        self.ec2_client.create_route.side_effect = [self.client_error('InvalidVpcPeeringConnectionID.NotFound'), None]
+        self.test_vpc.create_routes([('rt_def', '10.0.0.0/16')], 'pcx_1')
+        self.assertEqual(self.ec2_client.create_route.call_count, 2)
+        self.assertIn('10.0.0.0/16', self.test_vpc.topology_index.get_routes('rt_def'))
+
+    def test_create_routes_raises_other_errors(self):
+        """
+        TestVpcRoutes::test_create_routes_raises_other_errors: Test that unexpected errors are raised
+        """
+        self.ec2_client.create_route.side_effect = self.client_error('InvalidRouteTableID.NotFound')
+        self.assertRaises(ClientError, self.test_vpc.create_routes, [('rt_def', '10.0.0.0/16')], 'pcx_1')
+
+    def test_delete_routes_skips_missing(self):
+        """
+        TestVpcRoutes::test_delete_routes_skips_missing: Test that only existing routes are deleted
+        """
+        self.ec2_client.delete_route.side_effect = self.client_error('InvalidRoute.NotFound')
+        self.test_vpc.delete_peering_routes({
+            'source_routes': {'rt_abc': {'route_table_id': 'rt_abc', 'cidr_blocks': ['10.0.0.0/16', '10.1.0.0/16']}},
+            'target_routes': {'rt_unknown': {'route_table_id': 'rt_unknown', 'cidr_blocks': ['1.0.0.0/8']}}
+        })
+        deleted = sorted((call[1]['RouteTableId'], call[1]['DestinationCidrBlock'])
+                         for call in self.ec2_client.delete_route.call_args_list)
+        self.assertEqual(deleted, [('rt_abc', '10.0.0.0/16'), ('rt_unknown', '1.0.0.0/8')])
+
+
+class TestVpcPeeringMesh(unittest.TestCase):
+
+    def setUp(self):
+        self.vpc_ids = {'app-a': 'vpc_a', 'app-b': 'vpc_b', 'shared': 'vpc_s'}
+        self.ec2_client = MagicMock()
+        self.ec2_client.describe_vpcs.return_value = {
+            'Vpcs': [
+                {'VpcId': 'vpc_a', 'CidrBlock': '10.1.0.0/16'},
+                {'VpcId': 'vpc_b', 'CidrBlock': '10.2.0.0/16'},
+                {'VpcId': 'vpc_s', 'CidrBlock': '10.3.0.0/16'}
+            ]
+        }
+        self.ec2_client.describe_route_tables.return_value = {
+            'RouteTables': [
+                {'RouteTableId': 'rt_a', 'VpcId': 'vpc_a',
+                 'Routes': [{'DestinationCidrBlock': '10.3.0.0/16', 'VpcPeeringConnectionId': 'pcx_as'}]},
+                {'RouteTableId': 'rt_b', 'VpcId': 'vpc_b', 'Routes': []},
+                {'RouteTableId': 'rt_s', 'VpcId': 'vpc_s', 'Routes': []}
+            ]
+        }
+        self.ec2_client.describe_vpc_peering_connections.side_effect = self.describe_vpc_peering_connections
+        self.ec2_client.create_vpc_peering_connection.side_effect = self.create_vpc_peering_connection
+        # Create the child mocks up front, the worker threads would race to create them
+        self.ec2_client.accept_vpc_peering_connection.return_value = {}
+        self.ec2_client.create_route.return_value = {}
+
+        patchers = [
+            patch("bootstrap_cfn.vpc.boto3.client", return_value=self.ec2_client),
+            patch("bootstrap_cfn.cloudformation.get_stack_ids_by_name",
+                  side_effect=lambda name: [{'StackName': name}]),
+            patch("bootstrap_cfn.cloudformation.get_resource_type",
+                  side_effect=lambda name, resource_type: [{'PhysicalResourceId': self.vpc_ids[name]}])
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def describe_vpc_peering_connections(self, Filters=None, VpcPeeringConnectionIds=None):
+        if VpcPeeringConnectionIds:
+            return {'VpcPeeringConnections': [
+                {'VpcPeeringConnectionId': VpcPeeringConnectionIds[0], 'Status': {'Code': 'active'}}
+            ]}
+        return {'VpcPeeringConnections': [
+            {'VpcPeeringConnectionId': 'pcx_as', 'Status': {'Code': 'active'},
+             'RequesterVpcInfo': {'VpcId': 'vpc_a'}, 'AccepterVpcInfo': {'VpcId': 'vpc_s'}}
+        ]}
+
+    def create_vpc_peering_connection(self, VpcId, PeerVpcId):
+        return {'VpcPeeringConnection': {'VpcPeeringConnectionId': 'pcx_%s_%s' % (VpcId, PeerVpcId)}}
+
+    def test_full_mesh(self):
+        """
+        TestVpcPeeringMesh::test_full_mesh: Test that every pair of stacks is peered once
+        """
+        mesh = vpc.VpcPeeringMesh(['app-a', 'app-b', 'shared'])
+        self.assertEqual(mesh.get_stack_pairs(),
+                         [('app-a', 'app-b'), ('app-a', 'shared'), ('app-b', 'shared')])
+        summary = mesh.apply()
+
+        self.assertEqual((summary['created'], summary['skipped']), (2, 1))
+        self.assertEqual(self.ec2_client.create_vpc_peering_connection.call_count, 2)
+        self.assertEqual(self.ec2_client.accept_vpc_peering_connection.call_count, 2)
+        # Each pair needs a route each way, one of which already exists
+        self.assertEqual((summary['routes_created'], summary['routes_skipped']), (5, 1))
+        routes = sorted((call[1]['RouteTableId'], call[1]['DestinationCidrBlock'], call[1]['VpcPeeringConnectionId'])
+                        for call in self.ec2_client.create_route.call_args_list)
+        self.assertIn(('rt_s', '10.1.0.0/16', 'pcx_as'), routes)
+        self.assertIn(('rt_b', '10.1.0.0/16', 'pcx_vpc_a_vpc_b'), routes)
+        self.assertEqual(self.ec2_client.describe_route_tables.call_count, 1)
+
+    def test_hub(self):
+        """
+        TestVpcPeeringMesh::test_hub: Test that stacks are only peered to the hub
+        """
+        mesh = vpc.VpcPeeringMesh(['app-a', 'app-b'], hub_stack_search_name='shared')
+        self.assertEqual(mesh.get_stack_pairs(), [('shared', 'app-a'), ('shared', 'app-b')])
+        summary = mesh.apply()
+        self.assertEqual((summary['created'], summary['skipped']), (1, 1))
+        self.assertEqual((summary['routes_created'], summary['routes_skipped']), (3, 1))
+
+
+class TestSharedNetwork(unittest.TestCase):
+
+    @patch("bootstrap_cfn.vpc.boto3.client")
+    @patch("bootstrap_cfn.vpc.cloudformation.get_physical_resource_id")
+    def test_get_shared_network(self, mock_get_physical_resource_id, mock_client):
+        """
+        TestSharedNetwork::test_get_shared_network: Test the network resources are looked up from the network stack
+        """
+        mock_get_physical_resource_id.side_effect = lambda stack_name, logical_id: '{0}-{1}'.format(stack_name, logical_id)
+        mock_client.return_value.describe_vpcs.return_value = {'Vpcs': [{'VpcId': 'network-VPC', 'CidrBlock': '10.9.0.0/16'}]}
+        network = vpc.get_shared_network('network')
+        self.assertEqual(network, {
+            'VPC': 'network-VPC', 'SubnetA': 'network-SubnetA', 'SubnetB': 'network-SubnetB',
+            'SubnetC': 'network-SubnetC', 'PublicRouteTable': 'network-PublicRouteTable', 'CIDR': '10.9.0.0/16'})
+        mock_client.return_value.describe_vpcs.assert_called_once_with(VpcIds=['network-VPC'])
+
+    @patch("bootstrap_cfn.vpc.cloudformation.get_physical_resource_id", return_value=None)
+    def test_get_shared_network_missing(self, mock_get_physical_resource_id):
+        """
+        TestSharedNetwork::test_get_shared_network_missing: Test a network stack without a VPC is an error
+        """
+        with self.assertRaises(vpc.CloudResourceNotFoundError):
+            vpc.get_shared_network('network')
@@ -1635,5 +1635,51 @@ class TestConfigParser(unittest.TestCase):
         known = [{'DeviceName': '/dev/sda1', 'Ebs': {'VolumeSize': 20}}]
         self.assertEquals(known, config_output)
 
+    @patch('bootstrap_cfn.vpc.get_shared_network')
+    def test_process_with_shared_network(self, get_shared_network_function):
+        project_config = ProjectConfig(
+            'tests/sample-project.yaml',
+            'dev',
+            'tests/sample-project-passwords.yaml')
+        project_config.config['vpc'] = {'network_stack': 'network-dev'}
+        get_shared_network_function.return_value = {
+            'VPC': 'vpc-123', 'SubnetA': 'subnet-a', 'SubnetB': 'subnet-b', 'SubnetC': 'subnet-c',
+            'PublicRouteTable': 'rtb-123', 'CIDR': '10.9.0.0/16'}
+        config = ConfigParser(project_config.config, 'my-stack-name')
+
+        cfn_template = json.loads(config.process())
+
+        # The network resources are parameters instead, defaulting to those of the network stack
+        resource_names = cfn_template['Resources'].keys()
+        for name in ["AttachGateway", "InternetGateway", "PublicRoute", "PublicRouteTable", "SubnetA", "SubnetB",
+                     "SubnetC", "SubnetRouteTableAssociationA", "SubnetRouteTableAssociationB",
+                     "SubnetRouteTableAssociationC", "VPC"]:
+            self.assertNotIn(name, resource_names)
+        self.assertIn("ScalingGroup", resource_names)
+        compare(cfn_template['Parameters']['VPC'], {
+            'Type': 'AWS::EC2::VPC::Id',
+            'Default': 'vpc-123',
+            'Description': 'VPC of the network stack network-dev',
+        })
+        compare(sorted(cfn_template['Parameters']), ['PublicRouteTable', 'SubnetA', 'SubnetB', 'SubnetC', 'VPC'])
+        self.assertNotIn('DependsOn', cfn_template['Resources']['ScalingGroup'])
+        self.assertEqual(cfn_template['Resources']['DatabaseSG']['DependsOn'], [])
+        self.assertNotIn('DependsOn', cfn_template['Resources']['ELBtestdevexternal'])
+        compare(cfn_template['Mappings']['SubnetConfig'], {'VPC': {'CIDR': '10.9.0.0/16'}})
+        get_shared_network_function.assert_called_once_with('network-dev')
+
+    def test_process_network(self):
+        project_config = ProjectConfig('tests/sample-project.yaml', 'dev')
+        project_config.config['vpc']['network_stack'] = 'network-dev'
+        config = ConfigParser(project_config.config, 'network-dev')
+
+        cfn_template = json.loads(config.process_network())
+
+        compare(sorted(cfn_template['Resources'].keys()), [
+            "AttachGateway", "InternetGateway", "PublicRoute", "PublicRouteTable", "SubnetA", "SubnetB",
+            "SubnetC", "SubnetRouteTableAssociationA", "SubnetRouteTableAssociationB",
+            "SubnetRouteTableAssociationC", "VPC"])
+        compare(cfn_template['Mappings']['SubnetConfig']['VPC']['CIDR'], '10.0.0.0/16')
+
 if __name__ == '__main__':
     unittest.main()